@@ -1380,6 +1380,14 @@ class Global(APIBase):
         return {'status': doneCode,
                 'io_tune_policies_dict': io_tune_policies_dict}
 
+    @api.logged(on="api.host")
+    def getMigrationQueue(self):
+        """
+        Report the outgoing migrations running and waiting on this host.
+        """
+        queue = migration.SourceThread.ongoingMigrations.info()
+        return response.success(queue=queue)
+
     @api.logged(on="api.host")
     def hostdevListByCaps(self, caps=None):
         devices = hostdev.list_by_caps(caps)
@@ -1610,6 +1618,9 @@ class Global(APIBase):
     def getAllTasks(self):
         return self._irs.getAllTasks()
 
+    def getLockStats(self):
+        return self._irs.getLockStats()
+
     def setMOMPolicy(self, policy):
         try:
             self._cif.mom.setPolicy(policy)
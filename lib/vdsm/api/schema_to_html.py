@@ -219,7 +219,7 @@ def create_doc(api_schema, filename):
         f.write(header)
 
         # First, write out commands in sorted order
-        for method_name in api_schema.get_methods:
+        for method_name in api_schema.method_names:
             className, methodName = method_name.split('.', 1)
             method = api_schema.get_method(
                 vdsmapi.MethodRep(className, methodName))
@@ -227,7 +227,7 @@ def create_doc(api_schema, filename):
             write_symbol(f, method)
 
         # Write out the data types
-        for type_name in api_schema.get_types:
+        for type_name in api_schema.type_names:
             write_symbol(f, api_schema.get_type(type_name))
 
         f.write(footer)
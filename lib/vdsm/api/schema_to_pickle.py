@@ -26,6 +26,7 @@ import io
 import sys
 import yaml
 
+from vdsm.api import vdsmapi
 from vdsm.common.compat import pickle
 
 
@@ -41,10 +42,42 @@ def _load_yaml_file(file_path):
 def _dump_pickled_schema(schema_path, pickled_schema_path):
     with io.open(schema_path, 'rb') as f:
         loaded_schema = _load_yaml_file(f)
-        with io.open(pickled_schema_path, 'wb') as pickled_schema:
-            pickle.dump(loaded_schema,
-                        pickled_schema,
-                        protocol=pickle.HIGHEST_PROTOCOL)
+    types = loaded_schema.pop('types')
+    # Types are shared by yaml aliases; store every type once, and refer to
+    # it by name from other entries.
+    type_names = {id(value): name for name, value in types.items()}
+
+    data = io.BytesIO()
+    index = {
+        'methods': {name: _dump_entry(data, value, type_names)
+                    for name, value in loaded_schema.items()},
+        'types': {name: _dump_entry(data, value, type_names)
+                  for name, value in types.items()},
+    }
+    pickled_index = pickle.dumps(index, pickle.HIGHEST_PROTOCOL)
+
+    with io.open(pickled_schema_path, 'wb') as pickled_schema:
+        pickled_schema.write(vdsmapi.FILE_HEADER.pack(
+            vdsmapi.FILE_MAGIC, len(pickled_index)))
+        pickled_schema.write(pickled_index)
+        pickled_schema.write(data.getvalue())
+
+
+def _dump_entry(data, value, type_names):
+    """
+    Pickle value into data, and return the offset and size of the pickled
+    value.
+    """
+    def persistent_id(obj):
+        if obj is not value:
+            return type_names.get(id(obj))
+        return None
+
+    offset = data.tell()
+    pickler = pickle.Pickler(data, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(value)
+    return offset, data.tell() - offset
 
 
 def main():
@@ -23,8 +23,13 @@ from __future__ import division
 import io
 import json
 import logging
+import mmap
 import os
+import struct
+import threading
+
 import six
+from six.moves import cStringIO
 
 from vdsm import utils
 from vdsm.common.compat import Enum, pickle
@@ -52,6 +57,15 @@ DEFAULT_VALUES = {'{}': {},
 
 _log_devel = logging.getLogger("devel")
 
+# Schema files built by schema_to_pickle.py start with this header:
+# magic (8 bytes) | index size (uint32). The header is followed by the
+# pickled index, mapping method and type names to the (offset, size) of
+# their pickled entry in the data following the index. Entries refer to
+# types by name using pickle persistent ids, so types shared by many
+# entries are stored once, and loaded once when first used.
+FILE_MAGIC = b"VDSMAPI1"
+FILE_HEADER = struct.Struct("!8sI")
+
 
 class SchemaNotFound(Exception):
     pass
@@ -122,6 +136,87 @@ class EventRep(object):
         return self._id
 
 
+class _SchemaFile(object):
+    """
+    A schema file, loaded lazily. Methods and types are unpickled when they
+    are used for the first time. The file is memory-mapped if possible, so
+    unused entries are never read from disk.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.RLock()
+        # Types being loaded, published when loading is done.
+        self._loading = {}
+        with io.open(path, 'rb') as f:
+            header = f.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size or \
+                    header[:len(FILE_MAGIC)] != FILE_MAGIC:
+                # Schema pickled as one object by an older
+                # schema_to_pickle.py.
+                f.seek(0)
+                self._load_all(pickle.load(f))
+                return
+            _, index_size = FILE_HEADER.unpack(header)
+            index = pickle.loads(f.read(index_size))
+            self._offset = FILE_HEADER.size + index_size
+            try:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (EnvironmentError, ValueError):
+                f.seek(0)
+                self._data = f.read()
+        self.method_index = index['methods']
+        self.type_index = index['types']
+        self._methods = {}
+        self._types = {}
+
+    def _load_all(self, loaded_schema):
+        self._types = loaded_schema.pop('types')
+        self._methods = loaded_schema
+        self.type_index = dict.fromkeys(self._types)
+        self.method_index = dict.fromkeys(self._methods)
+
+    def get_method(self, name):
+        try:
+            return self._methods[name]
+        except KeyError:
+            with self._lock:
+                if name not in self._methods:
+                    self._methods[name] = self._load(self.method_index[name])
+                return self._methods[name]
+
+    def get_type(self, name):
+        try:
+            return self._types[name]
+        except KeyError:
+            with self._lock:
+                if name in self._types:
+                    return self._types[name]
+                if name in self._loading:
+                    # A type referring to itself while this thread is
+                    # loading it.
+                    return self._loading[name]
+                t = self._loading[name] = {}
+                try:
+                    t.update(self._load(self.type_index[name]))
+                finally:
+                    del self._loading[name]
+                self._types[name] = t
+                return t
+
+    def _load(self, entry):
+        offset, size = entry
+        start = self._offset + offset
+        data = self._data[start:start + size]
+        # Unpickling from a file without buffering is much slower.
+        if six.PY2:
+            f = cStringIO(data)
+        else:
+            f = io.BufferedReader(io.BytesIO(data))
+        unpickler = pickle.Unpickler(f)
+        unpickler.persistent_load = self.get_type
+        return unpickler.load()
+
+
 class Schema(object):
 
     log = logging.getLogger("SchemaCache")
@@ -132,18 +227,19 @@ class Schema(object):
         enumerations and a mode which determines request/response
         validation behavior. Usually it is based on api_strict_mode
         property from config.py
+
+        Methods and types are loaded on first use.
         """
         self._strict_mode = strict_mode
         self._methods = {}
         self._types = {}
         try:
             for schema_type in schema_types:
-                with io.open(schema_type.path(), 'rb') as f:
-                    loaded_schema = pickle.load(f)
-
-                types = loaded_schema.pop('types')
-                self._types.update(types)
-                self._methods.update(loaded_schema)
+                schema_file = _SchemaFile(schema_type.path())
+                self._methods.update(
+                    dict.fromkeys(schema_file.method_index, schema_file))
+                self._types.update(
+                    dict.fromkeys(schema_file.type_index, schema_file))
         except EnvironmentError:
             raise SchemaNotFound("Unable to find API schema file")
 
@@ -181,13 +277,20 @@ class Schema(object):
 
     def get_method(self, rep):
         try:
-            return self._methods[rep.id]
+            schema_file = self._methods[rep.id]
         except KeyError:
             raise MethodNotFound(rep.id)
+        return schema_file.get_method(rep.id)
+
+    @property
+    def method_names(self):
+        return list(self._methods)
 
     @property
     def get_methods(self):
-        return utils.picklecopy(self._methods)
+        methods = {name: schema_file.get_method(name)
+                   for name, schema_file in six.iteritems(self._methods)}
+        return utils.picklecopy(methods)
 
     def get_method_description(self, rep):
         method = self.get_method(rep)
@@ -195,13 +298,20 @@ class Schema(object):
 
     def get_type(self, type_name):
         try:
-            return self._types[type_name]
+            schema_file = self._types[type_name]
         except KeyError:
             raise TypeNotFound(type_name)
+        return schema_file.get_type(type_name)
+
+    @property
+    def type_names(self):
+        return list(self._types)
 
     @property
     def get_types(self):
-        return utils.picklecopy(self._types)
+        types = {name: schema_file.get_type(name)
+                 for name, schema_file in six.iteritems(self._types)}
+        return utils.picklecopy(types)
 
     def _check_primitive_type(self, t, value, name):
         condition = PRIMITIVE_TYPES.get(t)
@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -79,6 +79,19 @@ Setting timeout per command::
 
     cli.Host.getVMList(_timeout=180)
 
+Sending many requests without waiting for the responses. The requests are
+sent on the same connection, and vdsm runs them concurrently::
+
+    futures = [cli.VM.getStats.submit(vmID=vm_id) for vm_id in vm_ids]
+    stats = [f.result() for f in futures]
+
+Reusing connections to many hosts. The clients returned by the pool are
+shared, and must not be closed by the caller::
+
+    with utils.closing(client.Pool(timeout=180)) as pool:
+        cli = pool.get('host1.example.com')
+        ...
+
 ConnectionError: client can't connect to vdsm::
 
     vdsm.client.ConnectionError: Connection to localhost:54321 with
@@ -111,7 +124,7 @@ failed::
 
 from __future__ import absolute_import
 
-import functools
+import threading
 import uuid
 
 from vdsm.api import vdsmapi
@@ -124,6 +137,10 @@ import yajsonrpc
 
 DEFAULT_PORT = 54321
 
+# Schemas are loaded once and shared by all clients.
+_schemas = {}
+_schemas_lock = threading.Lock()
+
 
 def connect(
         host, port=DEFAULT_PORT, use_tls=True, timeout=60,
@@ -141,6 +158,86 @@ def connect(
     return _Client(client, timeout, gluster_enabled)
 
 
+def api_schema(gluster_enabled=False):
+    """
+    Return the vdsm API schema, loading it on the first call.
+
+    Raises:
+        MissingSchemaError: if the schema cannot be loaded
+    """
+    return _load_schema(("api", gluster_enabled), vdsmapi.Schema.vdsm_api,
+                        with_gluster=gluster_enabled)
+
+
+def _events_schema():
+    return _load_schema(("events",), vdsmapi.Schema.vdsm_events)
+
+
+def _load_schema(key, loader, **kwargs):
+    with _schemas_lock:
+        try:
+            return _schemas[key]
+        except KeyError:
+            try:
+                schema = loader(strict_mode=False, **kwargs)
+            except vdsmapi.SchemaNotFound as e:
+                raise MissingSchemaError(e)
+            _schemas[key] = schema
+            return schema
+
+
+class Pool(object):
+    """
+    Connections to vdsm hosts, reused by all callers.
+
+    The pool connects to a host on the first get() for the host, and
+    returns the same client on the next calls. Clients are thread safe, so
+    many threads can use the same client concurrently.
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Arguments:
+            **kwargs: arguments for connect(), used for all connections
+        """
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def get(self, host, port=DEFAULT_PORT):
+        """
+        Return a client connected to host and port. The client is owned by
+        the pool, and must not be closed by the caller.
+
+        Raises:
+            ConnectionError: if connecting to the host failed
+        """
+        key = (host, port)
+        with self._lock:
+            cli = self._clients.get(key)
+        if cli is not None:
+            return cli
+
+        # Connect without the lock, so connecting to a slow host does not
+        # delay other hosts.
+        cli = connect(host, port, **self._kwargs)
+        with self._lock:
+            current = self._clients.setdefault(key, cli)
+        if current is not cli:
+            cli.close()
+        return current
+
+    def close(self):
+        """
+        Close all connections.
+        """
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for cli in clients:
+            cli.close()
+
+
 class Error(Exception):
     """
     Base class for vdsm.client errors
@@ -206,13 +303,84 @@ class ServerError(Error):
 
 
 class Namespace(object):
-    def __init__(self, name, call):
+    def __init__(self, name, call, submit):
         self._name = name
         self._call = call
+        self._submit = submit
         self.methods = []
 
     def __getattr__(self, method_name):
-        return functools.partial(self._call, self._name, method_name)
+        return Method(self._name, method_name, self._call, self._submit)
+
+
+class Method(object):
+    """
+    A vdsm API method. Calling the method sends a request and waits for
+    the response. Use submit() to send a request without waiting.
+    """
+
+    def __init__(self, namespace, name, call, submit):
+        self._namespace = namespace
+        self._name = name
+        self._call = call
+        self._submit = submit
+
+    def __call__(self, **kwargs):
+        return self._call(self._namespace, self._name, **kwargs)
+
+    def submit(self, **kwargs):
+        """
+        Send a request and return a Future for the result, without waiting
+        for the response.
+        """
+        return self._submit(self._namespace, self._name, **kwargs)
+
+
+class Future(object):
+    """
+    The result of a request sent with Method.submit().
+    """
+
+    def __init__(self, cmd, params, call, timeout):
+        self._cmd = cmd
+        self._params = params
+        self._call = call
+        self._timeout = timeout
+
+    def done(self):
+        """
+        Return True if the response was received.
+        """
+        return self._call.isSet()
+
+    def result(self, timeout=None):
+        """
+        Wait for the response and return the result of the request.
+
+        Arguments:
+            timeout (float): seconds to wait for the response. If None, use
+                the timeout of the request.
+
+        Raises:
+            TimeoutError: if there is no response after timeout seconds.
+            ServerError: in case of an error while executing the command
+        """
+        if timeout is None:
+            timeout = self._timeout
+
+        if not self._call.wait(timeout):
+            raise TimeoutError(self._cmd, self._params, timeout)
+
+        # jsonrpc can handle batch requests so it sends a list of responses,
+        # but we call only one verb at a time so responses contains only one
+        # item.
+
+        resp = self._call.responses[0]
+        if resp.error:
+            raise ServerError(
+                self._cmd, self._params, resp.error.code, str(resp.error))
+
+        return resp.result
 
 
 class _Client(object):
@@ -228,18 +396,15 @@ class _Client(object):
 
     # Will be overriden during unit testing
     def _init_schema(self, gluster_enabled):
-        try:
-            self._schema = vdsmapi.Schema.vdsm_api(
-                strict_mode=False, with_gluster=gluster_enabled)
-            self._event_schema = vdsmapi.Schema.vdsm_events(strict_mode=False)
-        except vdsmapi.SchemaNotFound as e:
-            raise MissingSchemaError(e)
+        self._schema = api_schema(gluster_enabled)
+        self._event_schema = None
 
     def _create_namespaces(self):
-        for method in self._schema.get_methods:
+        for method in self._schema.method_names:
             namespace, method = method.split('.', 1)
             if not hasattr(self, namespace):
-                setattr(self, namespace, Namespace(namespace, self._call))
+                setattr(self, namespace,
+                        Namespace(namespace, self._call, self._submit))
             getattr(self, namespace).methods.append(method)
 
     def _call(self, namespace, method_name, **kwargs):
@@ -259,29 +424,34 @@ class _Client(object):
             TimeoutError: if there is no response after a pre configured time.
             ServerError: in case of an error while executing the command
         """
+        return self._submit(namespace, method_name, **kwargs).result()
+
+    def _submit(self, namespace, method_name, **kwargs):
+        """
+        Send a request without waiting for the response.
+
+        Args:
+            namespace (string): namespace name
+            method_name (string): method name
+            **kwargs: Arbitrary keyword arguments
+
+        Returns:
+            Future for the method result
+
+        Raises:
+            ClientError: in case of an error in the protocol.
+        """
         method = namespace + "." + method_name
         timeout = kwargs.pop("_timeout", self._default_timeout)
 
         req = yajsonrpc.JsonRpcRequest(
             method, kwargs, reqId=str(uuid.uuid4()))
         try:
-            responses = self._client.call(req, timeout=timeout)
+            call = self._client.call_async(req)
         except EnvironmentError as e:
             raise ClientError(method, kwargs, e)
 
-        if not responses:
-            raise TimeoutError(method, kwargs, timeout)
-
-        # jsonrpc can handle batch requests so it sends a list of responses,
-        # but we call only one verb at a time so responses contains only one
-        # item.
-
-        resp = responses[0]
-        if resp.error:
-            raise ServerError(
-                method, kwargs, resp.error.code, str(resp.error))
-
-        return resp.result
+        return Future(method, kwargs, call, timeout)
 
     def close(self):
         self._client.close()
@@ -315,4 +485,6 @@ class _Client(object):
         :param dest: Name of the desitnation queue
         :param params: Optional parameters
         """
+        if self._event_schema is None:
+            self._event_schema = _events_schema()
         self._client.notify(event_id, dest, self._event_schema, params)
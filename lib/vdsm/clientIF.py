@@ -1,5 +1,5 @@
 #
-# Copyright 2011-2017 Red Hat, Inc.
+# Copyright 2011-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -46,6 +46,7 @@ from vdsm.virt import events
 from vdsm.virt import migration
 from vdsm.virt import recovery
 from vdsm.virt import secret
+from vdsm.virt import vmevents
 from vdsm.virt import vmstatus
 from vdsm.virt.vmchannels import Listener
 from vdsm.virt.vmdevices.storage import DISK_TYPE
@@ -109,6 +110,9 @@ class clientIF(object):
         self._broker_client = None
         self._subscriptions = defaultdict(list)
         self._scheduler = scheduler
+        self._vm_events = vmevents.Aggregator(
+            self.notify, scheduler,
+            config.getfloat('vars', 'vm_events_window'))
         self._unknown_vm_ids = set()
         if _glusterEnabled:
             self.gluster = gapi.GlusterApi()
@@ -190,7 +194,7 @@ class clientIF(object):
     def ready(self):
         return (self.irs is None or self.irs.ready) and not self._recovery
 
-    def notify(self, event_id, params=None):
+    def notify(self, event_id, params=None, coalesce=True):
         """
         Send notification using provided subscription id as
         event_id and a dictionary as event body. Before sending
@@ -202,6 +206,10 @@ class clientIF(object):
         Args:
             event_id (string): unique event name
             params (dict): event content
+            coalesce (bool): if True, replace an event with the same
+                event_id queued for a client and not sent yet. Must be
+                False if the params of events with the same event_id may
+                describe different objects.
         """
         if not params:
             params = {}
@@ -213,9 +221,12 @@ class clientIF(object):
 
         json_binding = self.servers['jsonrpc']
 
+        key = event_id if coalesce else None
+
         def _send_notification(message):
             json_binding.reactor.server.send(
-                message, config.get('addresses', 'event_queue'))
+                message, config.get('addresses', 'event_queue'),
+                key=key)
 
         try:
             notification = Notification(event_id, _send_notification,
@@ -227,6 +238,19 @@ class clientIF(object):
             self.log.warning("Attempt to send an event when jsonrpc binding"
                              " not available")
 
+    def notify_vm(self, operation, vm_id, params):
+        """
+        Send a VM event, such as VM_status. Events sent during
+        vars:vm_events_window are coalesced, and sent in one notification
+        per operation, with the latest event of every VM.
+
+        Args:
+            operation (string): event name, e.g. 'VM_status'
+            vm_id (string): the VM sending the event
+            params (dict): event content for this VM
+        """
+        self._vm_events.send(operation, vm_id, params)
+
     def contEIOVms(self, sdUUID, isDomainStateValid):
         # This method is called everytime the onDomainStateChange
         # event is emitted, this event is emitted even when a domain goes
@@ -377,6 +401,7 @@ class clientIF(object):
                 return errCode['unavail']
 
             self._wait_for_shutting_down_vms()
+            self._vm_events.flush()
 
             self._acceptor.stop()
             for binding in self.servers.values():
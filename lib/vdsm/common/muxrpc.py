@@ -0,0 +1,473 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+muxrpc - multiplexed RPC over a unix socket
+===========================================
+
+Used by vdsm to call supervdsm. A client keeps one connection to the
+server, and any number of threads may call methods on the same
+connection. The server runs every call in its own thread, so a slow call
+does not delay the other calls, and replies are sent when calls finish,
+in any order.
+
+Every message is a frame::
+
+    size (uint32) | call id (uint64) | kind (uint8) | payload
+
+The payload of a request is the pickled tuple (name, args, kwargs). The
+payload of a reply is the pickled result, or the pickled exception raised
+by the method. Arguments and results may be any picklable object, and
+exceptions raised in the server are raised again in the client, like in
+multiprocessing.managers.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import itertools
+import logging
+import os
+import socket
+import struct
+import threading
+
+from six.moves import cPickle as pickle
+
+from vdsm.common import concurrent
+from vdsm.common import osutils
+
+REQUEST = 0
+REPLY = 1
+ERROR = 2
+
+# Supported by python 2 and 3.
+PICKLE_PROTOCOL = 2
+
+_HEADER = struct.Struct("!IQB")
+
+log = logging.getLogger("muxrpc")
+
+
+class Disconnected(Exception):
+    """ Raised when the connection was closed before a call finished """
+
+
+class Client(object):
+    """
+    A connection to a muxrpc server. Threadsafe; any number of threads may
+    call methods at the same time.
+
+    There is no reader thread. A thread waiting for a reply reads the
+    replies of all calls until its reply arrives, and then passes the
+    connection to another waiting thread. When calls do not overlap, the
+    caller reads its own reply without waking up another thread, and
+    without creating any object for the call.
+    """
+
+    def __init__(self, address):
+        self._address = address
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(address)
+        except:
+            self._sock.close()
+            raise
+        self._pid = os.getpid()
+        self._reader = _FrameReader(self._sock)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count()
+        # Replies of calls, None until the reply arrives.
+        self._replies = {}
+        # Events of calls waiting for another thread to read their reply.
+        self._waiting = {}
+        self._reading = False
+        self._closed = False
+        self._error = None
+
+    @property
+    def closed(self):
+        """
+        Return True if the connection cannot be used any more, because it
+        was closed, or because it was inherited from the parent process.
+        """
+        return self._closed or self._pid != os.getpid()
+
+    def call(self, name, args=(), kwargs=None):
+        """
+        Call method name on the server, wait for the reply, and return the
+        result.
+
+        Raises:
+            Disconnected if the connection was closed
+            the exception raised by the method
+        """
+        call_id = self._send_request(name, args, kwargs)
+        kind, payload = self._wait(call_id, name)
+        return _decode_reply(name, kind, payload)
+
+    def submit(self, name, args=(), kwargs=None):
+        """
+        Send a call to method name on the server, and return a Call object
+        to wait for the result.
+        """
+        call_id = self._send_request(name, args, kwargs)
+        return Call(self, call_id, name)
+
+    def close(self, error=None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._error = error
+            waiting = list(self._waiting.values())
+            self._waiting.clear()
+        for event in waiting:
+            event.set()
+        if error is not None:
+            log.warning("Connection to %s closed: %s", self._address, error)
+        # Wake up the thread reading replies.
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except EnvironmentError:
+            pass
+        self._sock.close()
+
+    def _send_request(self, name, args, kwargs):
+        payload = pickle.dumps((name, args, kwargs or {}), PICKLE_PROTOCOL)
+        with self._lock:
+            if self._closed:
+                raise Disconnected("Connection to %s was closed"
+                                   % self._address)
+            call_id = next(self._ids)
+            self._replies[call_id] = None
+        try:
+            with self._send_lock:
+                _send(self._sock, call_id, REQUEST, payload)
+        except EnvironmentError as e:
+            self.close(e)
+        return call_id
+
+    def _wait(self, call_id, name):
+        """
+        Wait for the reply of call_id, reading replies if no other thread is
+        reading, and return the reply (kind, payload).
+        """
+        while True:
+            with self._lock:
+                reply = self._replies[call_id]
+                if reply is not None:
+                    del self._replies[call_id]
+                    return reply
+                if self._closed:
+                    del self._replies[call_id]
+                    raise Disconnected("Connection closed before %s "
+                                       "finished: %s" % (name, self._error))
+                if not self._reading:
+                    self._reading = True
+                    break
+                # Created only when waiting, since most calls do not wait.
+                event = self._waiting[call_id] = threading.Event()
+            event.wait()
+
+        try:
+            return self._read_replies(call_id, name)
+        finally:
+            with self._lock:
+                self._reading = False
+                if self._waiting:
+                    # Let another waiting thread read replies.
+                    self._waiting.popitem()[1].set()
+
+    def _read_replies(self, call_id, name):
+        try:
+            while True:
+                reply_id, kind, payload = self._reader.read()
+                with self._lock:
+                    if reply_id == call_id:
+                        del self._replies[call_id]
+                        return kind, payload
+                    if reply_id not in self._replies:
+                        log.warning("Ignoring reply for unknown call %d",
+                                    reply_id)
+                        continue
+                    self._replies[reply_id] = kind, payload
+                    event = self._waiting.pop(reply_id, None)
+                if event is not None:
+                    event.set()
+        except Exception as e:
+            self.close(e)
+            with self._lock:
+                del self._replies[call_id]
+            raise Disconnected("Connection closed before %s finished: %s"
+                               % (name, e))
+
+
+class Call(object):
+    """
+    A call sent to the server with Client.submit(). The reply is decoded by
+    the thread waiting for the result.
+    """
+
+    def __init__(self, client, call_id, name):
+        self.name = name
+        self._client = client
+        self._call_id = call_id
+
+    def result(self):
+        kind, payload = self._client._wait(self._call_id, self.name)
+        return _decode_reply(self.name, kind, payload)
+
+
+def _decode_reply(name, kind, payload):
+    try:
+        value = pickle.loads(payload)
+    except Exception as e:
+        raise RuntimeError("Cannot decode reply of %s: %s" % (name, e))
+    if kind == ERROR:
+        raise value
+    return value
+
+
+class Server(object):
+    """
+    Serve the public methods of instance on a unix socket.
+    """
+
+    def __init__(self, address, instance):
+        self._address = address
+        self._instance = instance
+        self._closed = False
+        self._workers = _Workers()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.bind(address)
+            self._sock.listen(32)
+        except:
+            self._sock.close()
+            raise
+
+    def serve_forever(self):
+        while True:
+            try:
+                sock, _ = osutils.uninterruptible(self._sock.accept)
+            except EnvironmentError as e:
+                if not self._closed:
+                    log.error("Error accepting connection on %s: %s",
+                              self._address, e)
+                return
+            conn = _ServerConnection(sock, self._instance, self._workers)
+            self._workers.dispatch(conn.serve)
+
+    def close(self):
+        self._closed = True
+        # Wake up serve_forever.
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except EnvironmentError:
+            pass
+        self._sock.close()
+
+
+class _ServerConnection(object):
+
+    def __init__(self, sock, instance, workers):
+        self._sock = sock
+        self._instance = instance
+        self._workers = workers
+        self._reader = _FrameReader(sock)
+        self._send_lock = threading.Lock()
+
+    def serve(self):
+        """
+        Read one request, pass the connection to another worker to read the
+        next request, and run the call in this thread.
+        """
+        try:
+            call_id, kind, payload = self._reader.read()
+            if kind != REQUEST:
+                raise ValueError("Unexpected frame kind %d" % kind)
+        except EOFError:
+            log.debug("Client disconnected")
+            self._sock.close()
+            return
+        except Exception:
+            log.exception("Error reading requests, closing connection")
+            self._sock.close()
+            return
+        self._workers.dispatch(self.serve)
+        self._run(call_id, payload)
+
+    def _run(self, call_id, payload):
+        try:
+            name, args, kwargs = pickle.loads(payload)
+            if name.startswith("_"):
+                raise AttributeError("Method %r is not public" % name)
+            method = getattr(self._instance, name)
+            result = method(*args, **kwargs)
+        except Exception as e:
+            kind, data = ERROR, _dumps_error(e)
+        else:
+            try:
+                kind, data = REPLY, pickle.dumps(result, PICKLE_PROTOCOL)
+            except Exception as e:
+                kind, data = ERROR, _dumps_error(e)
+
+        try:
+            with self._send_lock:
+                _send(self._sock, call_id, kind, data)
+        except EnvironmentError as e:
+            log.warning("Cannot send reply for call %d: %s", call_id, e)
+
+
+class _Workers(object):
+    """
+    Threads running calls. A finished worker waits for the next call, and a
+    new worker is started only when all workers are busy, so calls never
+    wait for other calls, and starting a thread is rare.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def dispatch(self, func, *args):
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+        if worker is None:
+            worker = _Worker(self)
+            worker.start((func, args))
+        else:
+            worker.assign((func, args))
+
+    def release(self, worker):
+        with self._lock:
+            self._idle.append(worker)
+
+
+class _Worker(object):
+
+    def __init__(self, workers):
+        self._workers = workers
+        self._ready = threading.Event()
+        self._task = None
+
+    def start(self, task):
+        self._task = task
+        t = concurrent.thread(self._run, name="muxrpc/worker", log=log)
+        t.start()
+
+    def assign(self, task):
+        self._task = task
+        self._ready.set()
+
+    def _run(self):
+        while True:
+            func, args = self._task
+            self._task = None
+            try:
+                func(*args)
+            except Exception:
+                log.exception("Unhandled error in %s", func)
+            self._ready.clear()
+            self._workers.release(self)
+            self._ready.wait()
+
+
+def _dumps_error(e):
+    try:
+        return pickle.dumps(e, PICKLE_PROTOCOL)
+    except Exception:
+        return pickle.dumps(RuntimeError("%s: %s" % (type(e).__name__, e)),
+                            PICKLE_PROTOCOL)
+
+
+_RECV_SIZE = 64 * 1024
+
+
+if hasattr(socket.socket, "sendmsg"):
+
+    def _send(sock, call_id, kind, payload):
+        # Send the header and the payload in one call without joining them.
+        header = _HEADER.pack(len(payload), call_id, kind)
+        sent = osutils.uninterruptible(sock.sendmsg, (header, payload))
+        if sent < len(header):
+            _send_all(sock, header[sent:])
+            _send_all(sock, payload)
+        elif sent < len(header) + len(payload):
+            _send_all(sock, memoryview(payload)[sent - len(header):])
+
+else:
+    # Larger payloads are sent without copying them. Copying small payloads
+    # is cheaper than sending the header in another call.
+    _COPY_PAYLOAD_SIZE = 64 * 1024
+
+    def _send(sock, call_id, kind, payload):
+        header = _HEADER.pack(len(payload), call_id, kind)
+        if len(payload) <= _COPY_PAYLOAD_SIZE:
+            _send_all(sock, header + payload)
+        else:
+            _send_all(sock, header)
+            _send_all(sock, payload)
+
+
+def _send_all(sock, data):
+    data = memoryview(data)
+    while data:
+        n = osutils.uninterruptible(sock.send, data)
+        data = data[n:]
+
+
+class _FrameReader(object):
+    """
+    Read frames from a socket. Small frames are usually read with one
+    recv() call. Must be used by one thread at a time.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._buf = b""
+
+    def read(self):
+        header = self._read(_HEADER.size)
+        size, call_id, kind = _HEADER.unpack(header)
+        return call_id, kind, self._read(size)
+
+    def _read(self, size):
+        if len(self._buf) < size:
+            chunks = [self._buf]
+            have = len(self._buf)
+            while have < size:
+                chunk = osutils.uninterruptible(
+                    self._sock.recv, max(size - have, _RECV_SIZE))
+                if not chunk:
+                    raise EOFError("Connection closed")
+                chunks.append(chunk)
+                have += len(chunk)
+            self._buf = b"".join(chunks)
+        if len(self._buf) == size:
+            # Usually the buffer has one frame.
+            data = self._buf
+            self._buf = b""
+        else:
+            data = self._buf[:size]
+            self._buf = self._buf[size:]
+        return data
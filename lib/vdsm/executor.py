@@ -1,5 +1,5 @@
 #
-# Copyright 2014-2017 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -72,7 +72,7 @@ class Executor(object):
     _log = logging.getLogger('Executor')
 
     def __init__(self, name, workers_count, max_tasks, scheduler,
-                 max_workers=None, log=None):
+                 max_workers=None, log=None, priorities=None):
         """
         :param name: Name of the executor; no special purpose, just for
           logging and debugging.
@@ -97,13 +97,21 @@ class Executor(object):
         :param log: logger instance to override the default logger. This is
           useful for testing
         :type log: logger as returned by logging.getLogger()
+        :param priorities: Priority classes of the tasks, see
+          `PriorityTaskQueue`. If set, `max_tasks` limits the number of
+          waiting tasks in each class.
+        :type priorities: sequence of (name, max_running) tuples or None
 
         """
         self._name = name
         self._workers_count = workers_count
         self._max_workers = max_workers
         self._worker_id = 0
-        self._tasks = TaskQueue(name, max_tasks)
+        self._priorities = priorities
+        if priorities is None:
+            self._tasks = TaskQueue(name, max_tasks)
+        else:
+            self._tasks = PriorityTaskQueue(name, max_tasks, priorities)
         self._scheduler = scheduler
         if log is not None:
             self._log = log
@@ -144,7 +152,7 @@ class Executor(object):
         for worker in workers:
             worker.join()
 
-    def dispatch(self, callable, timeout=None, discard=True):
+    def dispatch(self, callable, timeout=None, discard=True, priority=None):
         """
         Dispatches a new task to the executor.
 
@@ -165,10 +173,26 @@ class Executor(object):
           completed, emits a warning in the log if it didn't complete,
           and reschedules the check after `timeout` seconds.
         :type discard: boolean
+        :param priority: name of the priority class of the task, if the
+          executor was created with priorities. If None, the task is added to
+          the class with the highest priority.
+        :type priority: basestring or None
         """
         if not self._running:
             raise NotRunning()
-        self._tasks.put(Task(callable, timeout, discard))
+        task = Task(callable, timeout, discard, priority)
+        if self._priorities is None:
+            self._tasks.put(task)
+        else:
+            self._tasks.put(task, priority)
+
+    def stats(self):
+        """
+        Return the statistics of the priority classes, see
+        `PriorityTaskQueue.stats()`. Available only if the executor was
+        created with priorities.
+        """
+        return self._tasks.stats()
 
     # Serving workers
 
@@ -245,6 +269,13 @@ class Executor(object):
             raise NotRunning()
         return task
 
+    def _task_done(self, task):
+        """
+        Called from the worker thread when a task has finished.
+        """
+        if self._priorities is not None:
+            self._tasks.done(task.priority)
+
     # Private
 
     def _add_worker(self):
@@ -317,6 +348,7 @@ class _Worker(object):
             self._log.exception("Unhandled exception in %s", task)
         finally:
             self._task = None
+            self._executor._task_done(task)
             # We want to discard workers that were too slow to disarm
             # the timer. It does not matter if the thread was still
             # blocked on callable when we discard it or it just finished.
@@ -374,10 +406,11 @@ class _Worker(object):
 
 class Task(object):
 
-    def __init__(self, callable, timeout, discard=True):
+    def __init__(self, callable, timeout, discard=True, priority=None):
         self._callable = callable
         self.timeout = timeout
         self.discard = discard
+        self.priority = priority
         self._start = None
 
     @property
@@ -466,3 +499,140 @@ class TaskQueue(object):
     def clear(self):
         with self._cond:
             self._tasks.clear()
+
+
+class PriorityTaskQueue(object):
+    """
+    Task queue with priority classes, used instead of TaskQueue when the
+    executor is created with priorities.
+
+    Tasks are taken from the class with the highest priority having waiting
+    tasks, in FIFO order within a class. A class may limit the number of its
+    tasks running at the same time, keeping workers available for the
+    classes with higher priority.
+    """
+
+    def __init__(self, name, max_tasks, priorities):
+        """
+        :param name: Name of the executor; no special purpose, just for
+          logging and debugging.
+        :type name: basestring
+        :param max_tasks: Maximum number of tasks waiting for execution in
+          each priority class.
+        :type max_tasks: int
+        :param priorities: The priority classes, highest priority first.
+          max_running is the maximum number of tasks of the class running at
+          the same time, or None for no limit.
+        :type priorities: sequence of (name, max_running) tuples
+        """
+        self._name = name
+        self._max_tasks = max_tasks
+        self._classes = collections.OrderedDict(
+            (cls_name, _PriorityClass(cls_name, max_running))
+            for cls_name, max_running in priorities)
+        self._default = next(iter(self._classes.values()))
+        self._cond = threading.Condition(threading.Lock())
+
+    def __repr__(self):
+        return "<PriorityTaskQueue %s max_tasks=%i %s at 0x%x>" % (
+            self._name,
+            self._max_tasks,
+            " ".join(repr(cls) for cls in self._classes.values()),
+            id(self)
+        )
+
+    def put(self, task, priority=None):
+        """
+        Put a new task in the queue of priority class priority, or in the
+        class with the highest priority if priority is None.
+        Do not block when full, raises ResourceExhausted instead.
+        """
+        cls = self._default if priority is None else self._classes[priority]
+        with self._cond:
+            if len(cls.tasks) == self._max_tasks:
+                raise exception.ResourceExhausted(
+                    "Too many tasks",
+                    resource="%s/%s" % (self._name, cls.name),
+                    current_tasks=self._max_tasks)
+            cls.tasks.append((task, time.monotonic_time()))
+            self._cond.notify()
+
+    def get(self):
+        """
+        Get a new task. Blocks if there is no task that may run.
+        """
+        with self._cond:
+            while True:
+                for cls in self._classes.values():
+                    if cls.tasks and cls.may_run():
+                        task, queued = cls.tasks.popleft()
+                        cls.started(time.monotonic_time() - queued)
+                        return task
+                self._cond.wait()
+
+    def done(self, priority):
+        """
+        Called when a task of priority class priority has finished.
+        """
+        cls = self._default if priority is None else self._classes[priority]
+        with self._cond:
+            cls.running -= 1
+            if cls.tasks:
+                self._cond.notify()
+
+    def clear(self):
+        with self._cond:
+            for cls in self._classes.values():
+                cls.tasks.clear()
+
+    def stats(self):
+        """
+        Return dict mapping priority class name to its statistics:
+
+        - queued: number of waiting tasks
+        - running: number of running tasks
+        - started: number of tasks started since the queue was created
+        - wait_time: total time the started tasks waited in the queue
+        - max_wait: longest time a started task waited in the queue
+        - oldest: time the oldest waiting task is waiting
+        """
+        now = time.monotonic_time()
+        with self._cond:
+            return {cls.name: cls.stats(now)
+                    for cls in self._classes.values()}
+
+
+class _PriorityClass(object):
+
+    def __init__(self, name, max_running):
+        self.name = name
+        self.max_running = max_running
+        # (task, queued time) tuples
+        self.tasks = collections.deque()
+        self.running = 0
+        self.started_count = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def may_run(self):
+        return self.max_running is None or self.running < self.max_running
+
+    def started(self, wait):
+        self.running += 1
+        self.started_count += 1
+        self.wait_time += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self, now):
+        return {
+            "queued": len(self.tasks),
+            "running": self.running,
+            "started": self.started_count,
+            "wait_time": self.wait_time,
+            "max_wait": self.max_wait,
+            "oldest": now - self.tasks[0][1] if self.tasks else 0.0,
+        }
+
+    def __repr__(self):
+        return "%s(queued=%d running=%d max_running=%s)" % (
+            self.name, len(self.tasks), self.running, self.max_running)
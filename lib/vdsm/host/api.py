@@ -1,5 +1,5 @@
 #
-# Copyright 2016-2017 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -27,9 +27,13 @@ from . import stats
 from vdsm import utils
 from vdsm import metrics
 from vdsm.common import hooks
+from vdsm.common import supervdsm
 from vdsm.common.define import Kbytes, Mbytes
 from vdsm.config import config
+from vdsm.storage import sdc
+from vdsm.storage import workers
 from vdsm.virt import vmstatus
+from yajsonrpc import stompserver
 
 haClient = None
 try:
@@ -95,6 +99,24 @@ def send_metrics(hoststats):
             data[storage_prefix + '.delay'] = dom_info['delay']
             data[storage_prefix + '.last_check'] = dom_info['lastCheck']
 
+        for name, queue in workers.stats().items():
+            queue_prefix = prefix + '.storage.workers.' + name
+            data[queue_prefix + '.queued'] = queue['queued']
+            data[queue_prefix + '.running'] = queue['running']
+            data[queue_prefix + '.wait'] = queue['oldest']
+
+        for name, value in sdc.sdCache.stats().items():
+            data[prefix + '.storage.sdc.' + name] = value
+
+        for name, value in stompserver.stats().items():
+            data[prefix + '.jsonrpc.' + name] = value
+
+        for name, method in supervdsm.stats().items():
+            method_prefix = prefix + '.supervdsm.' + name
+            data[method_prefix + '.calls'] = method['calls']
+            data[method_prefix + '.time'] = method['time']
+            data[method_prefix + '.max'] = method['max']
+
         metrics.send(data)
     except KeyError:
         logging.exception('Host metrics collection failed')
@@ -1,4 +1,4 @@
-# Copyright 2017 Red Hat, Inc.
+# Copyright 2017-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,28 +19,106 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import logging
+import threading
+
+from vdsm.common.time import monotonic_time
+from vdsm.network.lldpad import clif
 from vdsm.network.lldpad import lldptool
 
 from . import LldpAPI
 
+# Neighbor reports are valid for the Time to Live the neighbor advertises
+# (msgTxInterval * msgTxHold, 120 seconds by default). Reports without one,
+# e.g. of interfaces without a neighbor, are kept for the default
+# msgTxInterval.
+_DEFAULT_TTL = 30
+
+
+class TlvCache(object):
+    """Caches the TLV reports of interfaces for as long as LLDP holds
+    them."""
+
+    def __init__(self, clock=monotonic_time):
+        self._clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, iface, fetch):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(iface)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        tlvs = fetch(iface)
+        with self._lock:
+            self._entries[iface] = (now + _ttl(tlvs), tlvs)
+        return tlvs
+
+    def invalidate(self, iface=None):
+        with self._lock:
+            if iface is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(iface, None)
+
+
+def _ttl(tlvs):
+    for tlv in tlvs:
+        if tlv['type'] == 3:
+            try:
+                return int(tlv['properties']['time to live'])
+            except (KeyError, ValueError):
+                break
+    return _DEFAULT_TTL
+
+
+_client = clif.Client()
+_cache = TlvCache()
+_use_clif = True
+
+
+def _query(clif_func, lldptool_func, iface):
+    """Queries lldpad over the shared clif connection, falling back to
+    lldptool if the connection fails. lldpad versions whose protocol the
+    client does not speak are not asked again."""
+    global _use_clif
+    if _use_clif:
+        try:
+            return clif_func(iface)
+        except clif.ClifProtocolError as e:
+            logging.warning('Querying lldpad directly failed, using lldptool '
+                            'from now on: %s', e)
+            _use_clif = False
+        except clif.ClifError as e:
+            logging.debug('Querying lldpad directly failed: %s', e)
+    return lldptool_func(iface)
+
+
+def _get_tlvs(iface):
+    return _query(_client.get_tlvs, lldptool.get_tlvs, iface)
+
 
 class Lldp(LldpAPI):
 
     @staticmethod
     def enable_lldp_on_iface(iface, rx_only=True):
         lldptool.enable_lldp_on_iface(iface, rx_only)
+        _cache.invalidate(iface)
 
     @staticmethod
     def disable_lldp_on_iface(iface):
         lldptool.disable_lldp_on_iface(iface)
+        _cache.invalidate(iface)
 
     @staticmethod
     def is_lldp_enabled_on_iface(iface):
-        return lldptool.is_lldp_enabled_on_iface(iface)
+        return _query(_client.is_lldp_enabled_on_iface,
+                      lldptool.is_lldp_enabled_on_iface, iface)
 
     @staticmethod
     def get_tlvs(iface):
-        return lldptool.get_tlvs(iface)
+        return _cache.get(iface, _get_tlvs)
 
     @staticmethod
     def is_active():
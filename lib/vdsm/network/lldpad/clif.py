@@ -0,0 +1,359 @@
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""Client of the lldpad control interface (clif).
+
+lldptool is a thin client of the datagram socket lldpad listens on. Talking
+to that socket directly lets a single connection serve the queries of all
+the interfaces, instead of forking lldptool for each of them. Neighbor TLVs
+are returned by lldpad in their wire format, hex encoded, and are decoded
+here into the report format of lldptool.get_tlvs.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import binascii
+import itertools
+import os
+import socket
+import struct
+import threading
+
+from vdsm.network import py2to3
+from vdsm.network.lldp import TlvReportLldpError
+
+from . import lldptool
+
+LLDPAD_SOCKET = '\0/com/intel/lldpad'
+_CLIENT_SOCKET = '\0/com/intel/lldpad/vdsm-%d-%d'
+_RECV_SIZE = 64 * 1024
+_TIMEOUT = 5
+_ATTEMPTS = 2
+
+# lldpad include/clif_msgs.h
+CLIF_MSG_VERSION = 3
+MOD_CMD = 'M'
+CMD_REQUEST = 'C'
+CMD_RESPONSE = 'R'
+CMD_GETTLV = 1
+CMD_GET_LLDP = 3
+OP_NEIGHBOR = 0x02
+OP_ARG = 0x04
+OP_CONFIG = 0x10
+STATUS_SUCCESS = 0
+STATUS_PEER_NOT_PRESENT = 6
+
+# lldpad include/lldp_mand.h, include/lldp_tlv.h
+LLDP_MOD_MAND = 1
+INVALID_TLVID = 128
+NEAREST_BRIDGE = 0
+
+_counter = itertools.count()
+
+
+class ClifError(Exception):
+    pass
+
+
+class ClifProtocolError(ClifError):
+    """lldpad did not understand the request or answered with something
+    this client does not understand."""
+
+
+class Client(object):
+    """A connection to lldpad, reconnected on demand. Requests are
+    serialized, so a single client can be shared by threads."""
+
+    def __init__(self, path=LLDPAD_SOCKET, timeout=_TIMEOUT):
+        self._path = path
+        self._timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def get_tlvs(self, iface):
+        """Returns the TLVs lldpad received from the neighbor of iface, in
+        the format of lldptool.get_tlvs."""
+        status, payload = self._request(
+            CMD_GETTLV, OP_NEIGHBOR, iface, INVALID_TLVID)
+        if status == STATUS_PEER_NOT_PRESENT:
+            return []
+        _check_status(status, payload, iface)
+        try:
+            data = binascii.unhexlify(payload)
+        except (TypeError, ValueError):
+            raise ClifProtocolError('Malformed lldpad reply: %r' % payload)
+        return decode_tlvs(data)
+
+    def is_lldp_enabled_on_iface(self, iface):
+        status, payload = self._request(
+            CMD_GET_LLDP, OP_CONFIG | OP_ARG, iface, INVALID_TLVID,
+            args=('adminStatus',))
+        if status != STATUS_SUCCESS:
+            return False
+        name, value = _parse_arg_value(payload)
+        return name == 'adminStatus' and value != 'disabled'
+
+    def _request(self, cmd, ops, iface, tlvid, args=()):
+        request = '%s%08x%s%1x%02x%08x%02x%s%02x%08x' % (
+            MOD_CMD, LLDP_MOD_MAND, CMD_REQUEST, CLIF_MSG_VERSION, cmd, ops,
+            len(iface), iface, NEAREST_BRIDGE, tlvid)
+        request += ''.join('%02x%s' % (len(arg), arg) for arg in args)
+        # The reply echoes the request header; it is how stale replies of
+        # timed out requests are told apart.
+        echo = '%s%1x%02x%08x%02x%s' % (CMD_REQUEST, CLIF_MSG_VERSION, cmd,
+                                        ops, len(iface), iface)
+        with self._lock:
+            # lldpad may drop requests when it is busy or restarted. A
+            # timed out request is sent again once on a new connection.
+            for _ in range(_ATTEMPTS):
+                try:
+                    reply = self._send_request(request, echo)
+                    break
+                except socket.timeout:
+                    self._close()
+                except socket.error as e:
+                    self._close()
+                    raise ClifError('lldpad request failed: %s' % e)
+            else:
+                raise ClifError('lldpad did not reply')
+        try:
+            status = int(reply[1:3], 16)
+        except ValueError:
+            raise ClifProtocolError('Malformed lldpad reply: %r' % reply)
+        return status, reply[3 + len(echo):]
+
+    def _send_request(self, request, echo):
+        sock = self._connect()
+        sock.send(py2to3.to_binary(request))
+        while True:
+            reply = py2to3.to_str(sock.recv(_RECV_SIZE))
+            if reply[:1] == CMD_RESPONSE and reply[3:].startswith(echo):
+                return reply
+
+    def _connect(self):
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                sock.settimeout(self._timeout)
+                sock.bind(_CLIENT_SOCKET % (os.getpid(), next(_counter)))
+                sock.connect(self._path)
+            except:
+                sock.close()
+                raise
+            self._sock = sock
+        return self._sock
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def _check_status(status, payload, iface):
+    if status != STATUS_SUCCESS:
+        raise TlvReportLldpError(status, payload,
+                                 'lldpad replied with status %d' % status,
+                                 iface)
+
+
+def _parse_arg_value(payload):
+    try:
+        name_len = int(payload[:2], 16)
+        name = payload[2:2 + name_len]
+        value_len = int(payload[2 + name_len:6 + name_len], 16)
+        value = payload[6 + name_len:6 + name_len + value_len]
+    except ValueError:
+        raise ClifProtocolError('Malformed lldpad reply: %r' % payload)
+    return name, value
+
+
+def decode_tlvs(data):
+    """Decodes LLDPDU TLVs, skipping those lldptool.get_tlvs does not report
+    either."""
+    tlvs_report = []
+    offset = 0
+    while offset + 2 <= len(data):
+        header, = struct.unpack_from('!H', data, offset)
+        tlv_type, length = header >> 9, header & 0x1ff
+        value = data[offset + 2:offset + 2 + length]
+        offset += 2 + length
+        oui = subtype = 0
+        if tlv_type == 0x7f and length >= 4:
+            oui_subtype, = struct.unpack('!I', value[:4])
+            oui, subtype = oui_subtype >> 8, oui_subtype & 0xff
+            value = value[4:]
+        tlv, decode = _TLVS.get((tlv_type, oui, subtype), (None, None))
+        if tlv is None:
+            continue
+        try:
+            properties = decode(value)
+        except (struct.error, IndexError, ValueError):
+            continue
+        tlv_info = {'type': tlv.type,
+                    'name': tlv.name,
+                    'properties': properties}
+        if tlv.oui:
+            tlv_info['oui'] = tlv.oui
+            tlv_info['subtype'] = tlv.subtype
+        tlvs_report.append(tlv_info)
+    return tlvs_report
+
+
+def _byte(data, index):
+    return bytearray(data[index:index + 1])[0]
+
+
+def _text(value):
+    return py2to3.to_str(value.strip(b'\0').strip())
+
+
+def _address(subtype, value):
+    """Returns the lldptool label and text of an IANA family address."""
+    if subtype == 1 and len(value) == 4:
+        return 'IPv4', socket.inet_ntop(socket.AF_INET, value)
+    elif subtype == 2 and len(value) == 16:
+        return 'IPv6', socket.inet_ntop(socket.AF_INET6, value)
+    return 'Network Address Type %d' % subtype, _hex(value)
+
+
+def _mac(value):
+    return ':'.join('%02x' % b for b in bytearray(value))
+
+
+def _hex(value):
+    return py2to3.to_str(binascii.hexlify(value))
+
+
+def _id_value(labels, mac_subtype, address_subtype, value):
+    subtype = _byte(value, 0)
+    value = value[1:]
+    if subtype == mac_subtype:
+        return 'MAC', _mac(value)
+    elif subtype == address_subtype:
+        return _address(_byte(value, 0), value[1:])
+    return labels.get(subtype, 'Unknown'), _text(value)
+
+
+_CHASSIS_ID_SUBTYPES = {1: 'Chassis Component', 2: 'IfAlias',
+                        3: 'Port Component', 6: 'Ifname', 7: 'Local'}
+_PORT_ID_SUBTYPES = {1: 'Ifalias', 2: 'Port Component', 5: 'Ifname',
+                     6: 'Agent Circuit ID', 7: 'Local'}
+
+
+def _chassis_id(value):
+    subtype, chassis_id = _id_value(_CHASSIS_ID_SUBTYPES, 4, 5, value)
+    return {'chassis ID subtype': subtype, 'chassis ID': chassis_id}
+
+
+def _port_id(value):
+    subtype, port_id = _id_value(_PORT_ID_SUBTYPES, 3, 4, value)
+    return {'port ID subtype': subtype, 'port ID': port_id}
+
+
+def _string(name):
+    def decode(value):
+        return {name: _text(value)}
+    return decode
+
+
+def _u16(name):
+    def decode(value):
+        return {name: str(struct.unpack('!H', value[:2])[0])}
+    return decode
+
+
+_CAPABILITIES = ('Other', 'Repeater', 'Bridge', 'WLAN Access Point',
+                 'Router', 'Telephone', 'DOCSIS cable device', 'Station Only',
+                 'C-VLAN', 'S-VLAN', 'TPMR')
+
+
+def _capabilities(bits):
+    return ', '.join(name for i, name in enumerate(_CAPABILITIES)
+                     if bits & (1 << i))
+
+
+def _system_capabilities(value):
+    system, enabled = struct.unpack('!HH', value[:4])
+    return {'system capabilities': _capabilities(system),
+            'enabled capabilities': _capabilities(enabled)}
+
+
+_INTERFACE_NUMBERING = {1: 'Unknown', 2: 'Ifindex', 3: 'System port number'}
+
+
+def _management_address(value):
+    address_len = _byte(value, 0)
+    subtype, address = _address(_byte(value, 1),
+                                value[2:1 + address_len])
+    offset = 1 + address_len
+    numbering, number = struct.unpack('!BI', value[offset:offset + 5])
+    properties = {
+        'management address subtype': subtype,
+        'management address': address,
+        'interface numbering subtype': _INTERFACE_NUMBERING.get(
+            numbering, 'Unknown'),
+        'interface numbering': str(number),
+    }
+    oid_len = _byte(value, offset + 5)
+    if oid_len:
+        properties['object identifier'] = _text(
+            value[offset + 6:offset + 6 + oid_len])
+    return properties
+
+
+def _port_vlan_id(value):
+    return {'Port VLAN ID': str(struct.unpack('!H', value[:2])[0])}
+
+
+def _vlan_name(value):
+    vid, name_len = struct.unpack('!HB', value[:3])
+    return {'VLAN ID': str(vid), 'VLAN Name': _text(value[3:3 + name_len])}
+
+
+def _link_aggregation(value):
+    status, port_id = struct.unpack('!BI', value[:5])
+    return {'Aggregation capable': str(bool(status & 1)),
+            'Currently aggregated': str(bool(status & 2)),
+            'Aggregated Port ID': str(port_id)}
+
+
+_DECODERS = {
+    'Chassis ID': _chassis_id,
+    'Port ID': _port_id,
+    'Time to Live': _u16('time to live'),
+    'Port Description': _string('port description'),
+    'System Name': _string('system name'),
+    'System Description': _string('system description'),
+    'System Capabilities': _system_capabilities,
+    'Management Address': _management_address,
+    'Port VLAN ID': _port_vlan_id,
+    'VLAN Name': _vlan_name,
+    'Link Aggregation': _link_aggregation,
+    'MTU': _u16('mtu'),
+}
+
+_TLVS = dict(((tlv.type, tlv.oui, tlv.subtype), (tlv, _DECODERS[tlv.name]))
+             for tlv in lldptool.TLVS)
+# lldptool shows both Link Aggregation TLVs in the same way, so it reports
+# the IEEE 802.3 one as the IEEE 802.1 TLV. Keep the reports identical.
+_TLVS[(0x7f, lldptool.OUI.IEEE8023, 3)] = _TLVS[
+    (0x7f, lldptool.OUI.IEEE8021, 7)]
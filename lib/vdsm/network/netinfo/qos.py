@@ -34,8 +34,9 @@ DEFAULT_CLASSID = '%x' % NON_VLANNED_ID
 def report_network_qos(nets_info, devs_info):
     """Augment netinfo information with QoS data for the engine"""
     qdiscs = defaultdict(list)
-    for qdisc in tc.qdiscs(dev=None):  # None -> all dev qdiscs
+    for qdisc in tc.dump_qdiscs(dev=None):  # None -> all dev qdiscs
         qdiscs[qdisc['dev']].append(qdisc)
+    classes = {}  # iface -> {classid: hfsc class}, dumped once per iface
     for net, attrs in six.viewitems(nets_info):
         iface = attrs['iface']
         if iface in devs_info['bridges']:
@@ -65,10 +66,12 @@ def report_network_qos(nets_info, devs_info):
                         DEFAULT_CLASSID)
 
         # Now that iface is either a bond or a nic, let's get the QoS info
-        classes = [cls for cls in tc.classes(iface, classid=class_id) if
-                   cls['kind'] == 'hfsc']
-        if classes:
-            cls, = classes
+        if iface not in classes:
+            classes[iface] = dict((cls['handle'], cls) for cls in
+                                  tc.dump_classes(iface) if
+                                  cls['kind'] == 'hfsc')
+        cls = classes[iface].get(class_id)
+        if cls is not None and 'hfsc' in cls:
             attrs['hostQos'] = {'out': cls['hfsc']}
 
 
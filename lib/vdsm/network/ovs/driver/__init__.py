@@ -24,6 +24,7 @@ import abc
 
 import six
 
+from vdsm.common.config import config
 from vdsm.network import driverloader
 
 
@@ -166,9 +167,12 @@ class OvsApi(object):
 
 class Drivers(object):
     VSCTL = 'vsctl'
+    OVSDB = 'ovsdb'
 
 
-def create(driver_name=Drivers.VSCTL):
+def create(driver_name=None):
+    if driver_name is None:
+        driver_name = config.get('vars', 'ovs_driver')
     _drivers = driverloader.load_drivers('Ovs', __name__, __path__[0])
     ovs_driver = driverloader.get_driver(driver_name, _drivers)
     return ovs_driver()
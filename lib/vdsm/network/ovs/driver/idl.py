@@ -0,0 +1,445 @@
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+Persistent OVSDB (RFC 7047) connection to the local ovsdb-server.
+
+The connection monitors the tables vdsm is interested in and keeps an
+in-memory replica of them, updated by the server's "update" notifications.
+Reads are served from the replica, writes are sent as "transact" requests
+over the same connection.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import codecs
+import itertools
+import json
+import logging
+import re
+import socket
+import threading
+
+import six
+
+from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
+from vdsm.network import errors as ne
+from vdsm.network.errors import ConfigNetworkError, OvsDBConnectionError
+
+DEFAULT_SOCKET = '/var/run/openvswitch/db.sock'
+DATABASE = 'Open_vSwitch'
+TABLES = ('Open_vSwitch', 'Bridge', 'Port', 'Interface', 'Mirror')
+
+_MONITOR_ID = 'vdsm'
+_RECV_SIZE = 256 * 1024
+
+# Characters which may change the nesting level outside of a string, and the
+# characters which may end a string.
+_STRUCTURE_CHARS = re.compile(r'[{}"]')
+_STRING_CHARS = re.compile(r'["\\]')
+
+
+class JsonStream(object):
+    """
+    Split a stream of concatenated JSON objects into messages.
+
+    OVSDB JSON-RPC does not frame its messages, each message ends when its
+    top level object is closed.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = u''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data):
+        """Consume data and return the list of completed messages."""
+        self._buf += self._decoder.decode(data)
+        messages = []
+        while True:
+            if self._in_string:
+                match = _STRING_CHARS.search(self._buf, self._pos)
+                if match is None:
+                    self._pos = len(self._buf)
+                    break
+                if match.group() == u'\\':
+                    if match.end() == len(self._buf):
+                        # The escaped character was not received yet.
+                        self._pos = match.start()
+                        break
+                    self._pos = match.end() + 1
+                else:
+                    self._in_string = False
+                    self._pos = match.end()
+                continue
+
+            match = _STRUCTURE_CHARS.search(self._buf, self._pos)
+            if match is None:
+                self._pos = len(self._buf)
+                break
+            self._pos = match.end()
+            char = match.group()
+            if char == u'"':
+                self._in_string = True
+            elif char == u'{':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    messages.append(json.loads(self._buf[:self._pos]))
+                    self._buf = self._buf[self._pos:]
+                    self._pos = 0
+        return messages
+
+
+class Schema(object):
+    """Column types of the monitored database, as reported by get_schema."""
+
+    def __init__(self, schema):
+        self._tables = schema['tables']
+
+    def table_name(self, name):
+        """
+        Resolve a table name the way ovs-vsctl does: case insensitive, with
+        any unique prefix accepted (e.g. "open" for "Open_vSwitch").
+        """
+        if name in self._tables:
+            return name
+        lname = name.lower()
+        matches = [table for table in self._tables
+                   if table.lower().startswith(lname)]
+        if len(matches) != 1:
+            raise ConfigNetworkError(
+                ne.ERR_BAD_PARAMS, 'unknown table "%s"' % name)
+        return matches[0]
+
+    def columns(self, table):
+        return self._tables[table]['columns']
+
+    def column_type(self, table, column):
+        """
+        Return the type of the column normalized to a dict with "key",
+        "value" (None for non-map columns), "min" and "max" keys.
+        """
+        try:
+            coltype = self._tables[table]['columns'][column]['type']
+        except KeyError:
+            raise ConfigNetworkError(
+                ne.ERR_BAD_PARAMS,
+                'table %s does not contain a column "%s"' % (table, column))
+        if not isinstance(coltype, dict):
+            coltype = {'key': coltype}
+        value = coltype.get('value')
+        return {
+            'key': _base_type(coltype['key']),
+            'value': _base_type(value) if value is not None else None,
+            'min': coltype.get('min', 1),
+            'max': coltype.get('max', 1),
+        }
+
+    def default(self, table, column):
+        """Return the default datum of the column."""
+        coltype = self.column_type(table, column)
+        if coltype['value'] is not None:
+            return ['map', []]
+        if coltype['min'] == 0:
+            return ['set', []]
+        return _DEFAULT_ATOMS.get(coltype['key']['type'])
+
+
+_DEFAULT_ATOMS = {
+    'integer': 0,
+    'real': 0.0,
+    'boolean': False,
+    'string': u'',
+}
+
+
+def _base_type(base):
+    return base if isinstance(base, dict) else {'type': base}
+
+
+def set_elements(datum):
+    """Return the atoms of an OVSDB set datum."""
+    if isinstance(datum, list) and datum[0] == 'set':
+        return list(datum[1])
+    return [datum]
+
+
+def make_set(atoms):
+    """Build a set datum, single atoms are represented as themselves."""
+    atoms = list(atoms)
+    if len(atoms) == 1:
+        return atoms[0]
+    return ['set', atoms]
+
+
+def map_items(datum):
+    return list(datum[1])
+
+
+def make_map(items):
+    return ['map', [list(item) for item in items]]
+
+
+def hashable(atom):
+    """Atoms such as uuids are lists, make them usable as dict keys."""
+    if isinstance(atom, list):
+        return tuple(hashable(item) for item in atom)
+    return atom
+
+
+class _Call(object):
+
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._event = threading.Event()
+        self._response = None
+        self._error = None
+
+    def complete(self, response):
+        if self._callback is not None and response.get('error') is None:
+            self._callback(response['result'])
+        self._response = response
+        self._event.set()
+
+    def abort(self, error):
+        self._error = error
+        self._event.set()
+
+    def wait(self, timeout):
+        return self._event.wait(timeout)
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        error = self._response.get('error')
+        if error is not None:
+            raise ConfigNetworkError(
+                ne.ERR_BAD_PARAMS, 'ovsdb-server error: %s' % (error,))
+        return self._response['result']
+
+
+class Connection(object):
+    """
+    A persistent JSON-RPC connection to ovsdb-server, monitoring the given
+    tables.
+
+    The replica maps a table name to a dict of row uuid to row, each row
+    being a dict of column name to datum, in the OVSDB JSON notation. Rows
+    are replaced and never modified, so a shallow copy of the replica is a
+    consistent snapshot.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, tables=TABLES):
+        self._path = path
+        self._tables = tables
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(threading.Lock())
+        self._sock = None
+        self._ids = itertools.count()
+        self._calls = {}
+        self._replica = None
+        self.schema = None
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def connect(self, timeout=None):
+        with self._lock:
+            if self._sock is not None:
+                return
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self._path)
+            except socket.error as e:
+                sock.close()
+                raise OvsDBConnectionError(
+                    'database connection failed (%s)' % e)
+            self._sock = sock
+            reader = concurrent.thread(self._read_loop, args=(sock,),
+                                       name='ovsdb/reader')
+            reader.start()
+
+        logging.debug('Connected to ovsdb-server at %s', self._path)
+        try:
+            self.schema = Schema(self.call('get_schema', [DATABASE], timeout))
+            requests = {table: {} for table in self._tables}
+            self.call('monitor', [DATABASE, _MONITOR_ID, requests], timeout,
+                      callback=self._load_replica)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            sock = self._sock
+        if sock is not None:
+            # Wakes up the reader, which cleans up the connection state.
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def snapshot(self):
+        """Return a consistent copy of the replica."""
+        with self._cond:
+            if self._replica is None:
+                raise OvsDBConnectionError('database connection failed')
+            return {table: dict(rows)
+                    for table, rows in six.iteritems(self._replica)}
+
+    def wait_for(self, predicate, timeout=None):
+        """
+        Wait until predicate(replica) is true. Return False if timeout
+        expired before that.
+        """
+        deadline = None if timeout is None else monotonic_time() + timeout
+        with self._cond:
+            while True:
+                if self._replica is None:
+                    raise OvsDBConnectionError('database connection failed')
+                if predicate(self._replica):
+                    return True
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - monotonic_time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+
+    def transact(self, operations, timeout=None):
+        """
+        Run operations in a single transaction, raising ConfigNetworkError
+        if any of them, or the commit itself, failed.
+        """
+        results = self.call('transact', [DATABASE] + operations, timeout)
+        for result in results:
+            if result and 'error' in result:
+                raise ConfigNetworkError(
+                    ne.ERR_BAD_PARAMS,
+                    'Executing commands failed: %s: %s' %
+                    (result['error'], result.get('details', '')))
+        return results
+
+    def call(self, method, params, timeout=None, callback=None):
+        """
+        Send a request and wait for its result. callback is invoked with the
+        result on the reader thread, before any later notification is
+        handled.
+        """
+        call = _Call(callback)
+        with self._lock:
+            if self._sock is None:
+                raise OvsDBConnectionError('database connection failed')
+            call_id = next(self._ids)
+            self._calls[call_id] = call
+            message = {'method': method, 'params': params, 'id': call_id}
+            try:
+                self._sock.sendall(json.dumps(message).encode('utf-8'))
+            except socket.error as e:
+                del self._calls[call_id]
+                raise OvsDBConnectionError(
+                    'database connection failed (%s)' % e)
+
+        if not call.wait(timeout):
+            with self._lock:
+                self._calls.pop(call_id, None)
+            raise ConfigNetworkError(
+                ne.ERR_BAD_PARAMS,
+                'Timeout waiting for ovsdb-server reply to %s' % method)
+        return call.result()
+
+    def _read_loop(self, sock):
+        stream = JsonStream()
+        try:
+            while True:
+                data = sock.recv(_RECV_SIZE)
+                if not data:
+                    break
+                for message in stream.feed(data):
+                    self._dispatch(sock, message)
+        except socket.error as e:
+            logging.warning('Connection to ovsdb-server failed: %s', e)
+        finally:
+            self._disconnected(sock)
+
+    def _dispatch(self, sock, message):
+        method = message.get('method')
+        if method == 'update':
+            monitor_id, updates = message['params']
+            if monitor_id == _MONITOR_ID:
+                self._update_replica(updates)
+        elif method == 'echo':
+            reply = {'result': message['params'], 'error': None,
+                     'id': message['id']}
+            with self._lock:
+                sock.sendall(json.dumps(reply).encode('utf-8'))
+        elif method is None:
+            with self._lock:
+                call = self._calls.pop(message.get('id'), None)
+            if call is not None:
+                call.complete(message)
+
+    def _disconnected(self, sock):
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+            calls = self._calls
+            self._calls = {}
+        sock.close()
+        error = OvsDBConnectionError('database connection failed')
+        for call in six.itervalues(calls):
+            call.abort(error)
+        with self._cond:
+            self._replica = None
+            self._cond.notify_all()
+        logging.debug('Disconnected from ovsdb-server at %s', self._path)
+
+    def _load_replica(self, updates):
+        with self._cond:
+            self._replica = {table: {} for table in self._tables}
+            self._apply(updates)
+            self._cond.notify_all()
+
+    def _update_replica(self, updates):
+        with self._cond:
+            if self._replica is None:
+                return
+            self._apply(updates)
+            self._cond.notify_all()
+
+    def _apply(self, updates):
+        for table, rows in six.iteritems(updates):
+            replica_rows = self._replica[table]
+            for uuid, row_update in six.iteritems(rows):
+                new = row_update.get('new')
+                if new is None:
+                    replica_rows.pop(uuid, None)
+                elif 'old' in row_update and uuid in replica_rows:
+                    # A modification, unchanged columns may be omitted.
+                    row = dict(replica_rows[uuid])
+                    row.update(new)
+                    replica_rows[uuid] = row
+                else:
+                    replica_rows[uuid] = new
@@ -0,0 +1,695 @@
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""
+OVS driver talking to ovsdb-server over a persistent JSON-RPC connection.
+
+Commands have the same semantics as their ovs-vsctl counterparts in the vsctl
+driver, but they are evaluated in-process against the replica kept by the
+connection. Read only transactions are answered from the replica without any
+I/O, other transactions are sent as a single "transact" request.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import logging
+import threading
+import uuid
+
+import six
+
+from vdsm.network import errors as ne
+from vdsm.network.errors import ConfigNetworkError
+
+from . import (OvsApi,
+               Transaction as DriverTransaction,
+               Command as DriverCommand)
+from . import idl
+from .vsctl import _normalize, _val_to_py
+
+DEFAULT_TIMEOUT = 5
+
+# Like ovs-vsctl, bump next_cfg on every change and wait until ovs-vswitchd
+# reports it as cur_cfg. This also guarantees that the replica reflects the
+# transaction once commit returns.
+_INCREMENT_NEXT_CFG = [
+    {'op': 'mutate', 'table': 'Open_vSwitch', 'where': [],
+     'mutations': [['next_cfg', '+=', 1]]},
+    {'op': 'select', 'table': 'Open_vSwitch', 'where': [],
+     'columns': ['next_cfg']},
+]
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+class Transaction(DriverTransaction):
+
+    def __init__(self):
+        self.commands = []
+        self.timeout = DEFAULT_TIMEOUT
+
+    def commit(self):
+        if not self.commands:
+            return
+
+        timeout = self.timeout or None
+        connection = _connect(timeout)
+        view = _View(connection.schema, connection.snapshot())
+        for command in self.commands:
+            command.run(view)
+
+        uuids = {}
+        operations, names = view.operations()
+        if operations:
+            logging.debug('Executing operations: %s', operations)
+            results = connection.transact(
+                operations + _INCREMENT_NEXT_CFG, timeout)
+            for name, result in zip(names, results):
+                uuids[name] = result['uuid'][1]
+            next_cfg = results[-1]['rows'][0]['next_cfg']
+            _wait_for_cfg(connection, next_cfg, timeout)
+
+        for command in self.commands:
+            command.resolve(uuids)
+        return [cmd.result for cmd in self.commands]
+
+    def add(self, *commands):
+        self.commands += commands
+
+
+class Command(DriverCommand):
+
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+        self._output = None
+        self._result = None
+
+    def execute(self, timeout=DEFAULT_TIMEOUT):
+        with Transaction() as t:
+            t.timeout = timeout
+            t.add(self)
+        return self.result
+
+    @property
+    def result(self):
+        return self._result
+
+    def run(self, view):
+        self._output = self._func(view, *self._args)
+
+    def resolve(self, uuids):
+        self._result = self._output if self._output is not None else []
+
+
+class DBResultCommand(Command):
+
+    def resolve(self, uuids):
+        self._result = [_row_to_py(key, row, uuids)
+                        for key, row in self._output]
+
+
+class Ovs(OvsApi):
+
+    def transaction(self):
+        return Transaction()
+
+    def add_br(self, bridge, may_exist=False):
+        return Command(_add_br, bridge, may_exist)
+
+    def list_br(self):
+        return Command(_list_br)
+
+    def del_br(self, bridge, if_exists=False):
+        return Command(_del_br, bridge, if_exists)
+
+    def list_db_table(self, table, row=None):
+        return DBResultCommand(_list, table, row)
+
+    def add_vlan(self, bridge, vlan, fake_bridge_name=None, may_exist=False):
+        if fake_bridge_name is None:
+            fake_bridge_name = 'vlan{}'.format(vlan)
+        return Command(_add_vlan, bridge, vlan, fake_bridge_name, may_exist)
+
+    def del_vlan(self, vlan, fake_bridge_name=None, if_exist=False):
+        if fake_bridge_name is None:
+            fake_bridge_name = 'vlan{}'.format(vlan)
+        return self.del_br(fake_bridge_name, if_exist)
+
+    def add_bond(self, bridge, bond, nics, fake_iface=False, may_exist=False):
+        return Command(_add_bond, bridge, bond, nics, fake_iface, may_exist)
+
+    def attach_bond_slave(self, bond, slave):
+        id = _new_id()
+        return (Command(_create, 'Interface', {'name': slave}, id),
+                Command(_add, 'Port', bond, 'interfaces', id))
+
+    def detach_bond_slave(self, bond, slave):
+        id = _new_id()
+        return (Command(_get, 'Interface', slave, id),
+                Command(_remove, 'Port', bond, 'interfaces', id))
+
+    def add_port(self, bridge, port, may_exist=False):
+        return Command(_add_port, bridge, port, may_exist)
+
+    def set_dpdk_port(self, port, pci_addr):
+        values = (('type', 'dpdk'), ('options:dpdk-devargs', pci_addr))
+        return Command(_set_many, 'Interface', port, values)
+
+    def set_vhostuser_iface(self, iface, socket_path):
+        values = (('type', 'dpdkvhostuserclient'),
+                  ('options:vhost-server-path', socket_path))
+        return Command(_set_many, 'Interface', iface, values)
+
+    def del_port(self, port, bridge=None, if_exists=False):
+        return Command(_del_port, port, bridge, if_exists)
+
+    def list_ports(self, bridge):
+        return Command(_list_ports, bridge)
+
+    def add_mirror(self, bridge, mirror, output_port):
+        port_id = _new_id()
+        mirror_id = _new_id()
+        values = {'name': mirror, 'select_all': True,
+                  'output_port': port_id}
+        return (Command(_get, 'Port', output_port, port_id),
+                Command(_create, 'Mirror', values, mirror_id),
+                Command(_set, 'Bridge', bridge, 'mirrors', mirror_id))
+
+    def del_mirror(self, bridge, mirror):
+        id = _new_id()
+        return (Command(_get, 'Mirror', mirror, id),
+                Command(_remove, 'Bridge', bridge, 'mirrors', id))
+
+    def set_db_entry(self, table, row, key, value):
+        return Command(_set, table, row, key, value)
+
+    def do_nothing(self):
+        return Command(_do_nothing)
+
+
+class _View(object):
+    """
+    The database as seen by the commands of a single transaction.
+
+    Commands read and modify the view, the modifications are then turned
+    into OVSDB operations. Rows inserted by the transaction are keyed by
+    their uuid-name until the transaction is committed. Rows are never
+    deleted explicitly, ovsdb-server garbage collects the rows which are no
+    longer referenced.
+    """
+
+    def __init__(self, schema, tables):
+        self.schema = schema
+        self.ids = {}
+        self._tables = tables
+        self._names = {}
+        self._original = {}
+        self._inserted = collections.OrderedDict()
+        self._named = set()
+        self._deleted = set()
+
+    def rows(self, table):
+        return self._tables[table]
+
+    def row(self, table, key):
+        return self._tables[table][key]
+
+    def ref(self, key):
+        return ['named-uuid' if key in self._named else 'uuid', key]
+
+    def find(self, table, record):
+        """Find a row by uuid or name, "." is the Open_vSwitch root row."""
+        rows = self._tables[table]
+        if table == 'Open_vSwitch' and record == '.':
+            return next(iter(rows), None)
+        if record in rows:
+            return record
+        return self._name_index(table).get(record)
+
+    def insert(self, table, values):
+        name = 'row' + uuid.uuid4().hex
+        row = {column: self.schema.default(table, column)
+               for column in self.schema.columns(table)}
+        row.update(values)
+        self._tables[table][name] = row
+        self._inserted[name] = (table, set(values))
+        self._named.add(name)
+        if 'name' in row and table in self._names:
+            self._names[table][row['name']] = name
+        return self.ref(name)
+
+    def update(self, table, key, column, datum):
+        row = self._tables[table][key]
+        if key in self._inserted:
+            self._inserted[key][1].add(column)
+        elif (table, key) not in self._original:
+            self._original[(table, key)] = row
+            row = self._tables[table][key] = dict(row)
+        if column == 'name':
+            self._names.pop(table, None)
+        row[column] = datum
+
+    def delete(self, table, key):
+        row = self._tables[table].pop(key)
+        index = self._names.get(table)
+        if index is not None and 'name' in row:
+            index.pop(row['name'], None)
+        if key in self._inserted:
+            del self._inserted[key]
+        else:
+            self._deleted.add(key)
+
+    def add_to_set(self, table, key, column, atoms):
+        elements = idl.set_elements(self.row(table, key)[column])
+        present = {idl.hashable(atom) for atom in elements}
+        elements.extend(atom for atom in atoms
+                        if idl.hashable(atom) not in present)
+        self.update(table, key, column, idl.make_set(elements))
+
+    def remove_from_set(self, table, key, column, atoms):
+        removed = {idl.hashable(atom) for atom in atoms}
+        elements = [atom
+                    for atom in idl.set_elements(self.row(table, key)[column])
+                    if idl.hashable(atom) not in removed]
+        self.update(table, key, column, idl.make_set(elements))
+
+    def operations(self):
+        """
+        Return the operations applying the modifications, and the uuid-names
+        of the inserted rows, in the order of their insert operations which
+        come first.
+        """
+        operations = []
+        names = []
+        for name, (table, columns) in six.iteritems(self._inserted):
+            row = self._tables[table][name]
+            operations.append({
+                'op': 'insert',
+                'table': table,
+                'row': {column: row[column] for column in columns},
+                'uuid-name': name,
+            })
+            names.append(name)
+
+        for (table, key), original in six.iteritems(self._original):
+            if key in self._deleted:
+                continue
+            for column, datum in six.iteritems(self._tables[table][key]):
+                old = original.get(column)
+                if old is None:
+                    old = self.schema.default(table, column)
+                if datum != old:
+                    operations.append(
+                        self._column_operation(table, key, column, old, datum))
+        return operations, names
+
+    def _column_operation(self, table, key, column, old, new):
+        """
+        Sets and maps are mutated, so concurrent changes of other elements by
+        other clients are kept.
+        """
+        where = [['_uuid', '==', ['uuid', key]]]
+        coltype = self.schema.column_type(table, column)
+        if coltype['value'] is not None:
+            old_items = {idl.hashable(k): v for k, v in idl.map_items(old)}
+            new_items = {idl.hashable(k): v for k, v in idl.map_items(new)}
+            removed = [k for k, v in idl.map_items(old)
+                       if new_items.get(idl.hashable(k), v) != v or
+                       idl.hashable(k) not in new_items]
+            added = [[k, v] for k, v in idl.map_items(new)
+                     if old_items.get(idl.hashable(k)) != v or
+                     idl.hashable(k) not in old_items]
+            mutations = []
+            if removed:
+                mutations.append([column, 'delete', ['set', removed]])
+            if added:
+                mutations.append([column, 'insert', ['map', added]])
+        elif coltype['max'] != 1:
+            old_atoms = {idl.hashable(a) for a in idl.set_elements(old)}
+            new_atoms = {idl.hashable(a) for a in idl.set_elements(new)}
+            removed = [a for a in idl.set_elements(old)
+                       if idl.hashable(a) not in new_atoms]
+            added = [a for a in idl.set_elements(new)
+                     if idl.hashable(a) not in old_atoms]
+            mutations = []
+            if removed:
+                mutations.append([column, 'delete', ['set', removed]])
+            if added:
+                mutations.append([column, 'insert', ['set', added]])
+        else:
+            return {'op': 'update', 'table': table, 'where': where,
+                    'row': {column: new}}
+        return {'op': 'mutate', 'table': table, 'where': where,
+                'mutations': mutations}
+
+    def _name_index(self, table):
+        index = self._names.get(table)
+        if index is None:
+            index = {row['name']: key
+                     for key, row in six.iteritems(self._tables[table])
+                     if 'name' in row}
+            self._names[table] = index
+        return index
+
+
+def _connect(timeout):
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = idl.Connection()
+        if not _connection.connected:
+            _connection.connect(timeout)
+        return _connection
+
+
+def _wait_for_cfg(connection, next_cfg, timeout):
+    def applied(replica):
+        return any(row['cur_cfg'] >= next_cfg
+                   for row in six.itervalues(replica['Open_vSwitch']))
+
+    if not connection.wait_for(applied, timeout):
+        raise ConfigNetworkError(
+            ne.ERR_BAD_PARAMS,
+            'Timeout waiting for ovs-vswitchd to reconfigure')
+
+
+def _new_id():
+    return '@%s' % uuid.uuid4()
+
+
+def _error(message):
+    return ConfigNetworkError(
+        ne.ERR_BAD_PARAMS, 'Executing commands failed: %s' % message)
+
+
+def _do_nothing(view):
+    pass
+
+
+def _add_br(view, bridge, may_exist):
+    if _find_bridge(view, bridge) is not None:
+        if may_exist:
+            return
+        raise _error('cannot create a bridge named %s because a bridge '
+                     'named %s already exists' % (bridge, bridge))
+    _check_port_is_free(view, bridge)
+    iface = view.insert('Interface', {'name': bridge, 'type': 'internal'})
+    port = view.insert('Port', {'name': bridge, 'interfaces': iface})
+    br = view.insert('Bridge', {'name': bridge, 'ports': port})
+    view.add_to_set('Open_vSwitch', _root(view), 'bridges', [br])
+
+
+def _del_br(view, bridge, if_exists):
+    found = _find_bridge(view, bridge)
+    if found is None:
+        if if_exists:
+            return
+        raise _error('no bridge named %s' % bridge)
+
+    key, vlan = found
+    if vlan is None:
+        row = view.row('Bridge', key)
+        view.remove_from_set(
+            'Open_vSwitch', _root(view), 'bridges', [view.ref(key)])
+        for port_key in _port_keys(view, key):
+            _delete_port(view, port_key)
+        for ref in idl.set_elements(row['mirrors']):
+            view.delete('Mirror', ref[1])
+        view.delete('Bridge', key)
+    else:
+        port_keys = [port_key for port_key in _port_keys(view, key)
+                     if view.row('Port', port_key)['tag'] == vlan]
+        view.remove_from_set('Bridge', key, 'ports',
+                             [view.ref(port_key) for port_key in port_keys])
+        for port_key in port_keys:
+            _delete_port(view, port_key)
+
+
+def _list_br(view):
+    bridges = [row['name'] for row in six.itervalues(view.rows('Bridge'))]
+    bridges += [row['name'] for row in six.itervalues(view.rows('Port'))
+                if row['fake_bridge'] is True]
+    return sorted(bridges)
+
+
+def _add_vlan(view, bridge, vlan, fake_bridge_name, may_exist):
+    parent_key, parent_vlan = _get_bridge(view, bridge)
+    found = _find_bridge(view, fake_bridge_name)
+    if found is not None:
+        if may_exist and found == (parent_key, vlan):
+            return
+        raise _error('cannot create a bridge named %s because a bridge '
+                     'named %s already exists' %
+                     (fake_bridge_name, fake_bridge_name))
+    if parent_vlan is not None:
+        raise _error('cannot create a bridge with a fake bridge %s as parent'
+                     % bridge)
+    _check_port_is_free(view, fake_bridge_name)
+    iface = view.insert(
+        'Interface', {'name': fake_bridge_name, 'type': 'internal'})
+    port = view.insert('Port', {'name': fake_bridge_name,
+                                'interfaces': iface,
+                                'tag': int(vlan),
+                                'fake_bridge': True})
+    view.add_to_set('Bridge', parent_key, 'ports', [port])
+
+
+def _add_port(view, bridge, port, may_exist):
+    _attach_port(view, bridge, port, [port], {}, may_exist)
+
+
+def _add_bond(view, bridge, bond, nics, fake_iface, may_exist):
+    values = {'bond_fake_iface': True} if fake_iface else {}
+    _attach_port(view, bridge, bond, nics, values, may_exist)
+
+
+def _attach_port(view, bridge, port, ifaces, values, may_exist):
+    key, vlan = _get_bridge(view, bridge)
+    existing = view.find('Port', port)
+    if existing is not None:
+        if may_exist and _port_bridge(view, existing) == key:
+            return
+        _check_port_is_free(view, port)
+
+    values = dict(values)
+    values['name'] = port
+    values['interfaces'] = idl.make_set(
+        view.insert('Interface', {'name': iface}) for iface in ifaces)
+    if vlan is not None:
+        values['tag'] = vlan
+    view.add_to_set('Bridge', key, 'ports', [view.insert('Port', values)])
+
+
+def _del_port(view, port, bridge, if_exists):
+    port_key = view.find('Port', port)
+    if port_key is None:
+        if if_exists:
+            return
+        raise _error('no port named %s' % port)
+
+    key = _port_bridge(view, port_key)
+    if bridge is not None:
+        bridge_key, vlan = _get_bridge(view, bridge)
+        if bridge_key != key or (
+                vlan is not None and
+                view.row('Port', port_key)['tag'] != vlan):
+            raise _error('bridge %s does not have a port %s' %
+                         (bridge, port))
+    view.remove_from_set('Bridge', key, 'ports', [view.ref(port_key)])
+    _delete_port(view, port_key)
+
+
+def _list_ports(view, bridge):
+    key, vlan = _get_bridge(view, bridge)
+    ports = [view.row('Port', port_key) for port_key in _port_keys(view, key)]
+    fake_vlans = {port['tag'] for port in ports if port['fake_bridge'] is True}
+    if vlan is None:
+        selected = [port for port in ports
+                    if idl.hashable(port['tag']) not in fake_vlans]
+    else:
+        selected = [port for port in ports if port['tag'] == vlan]
+    return sorted(port['name'] for port in selected
+                  if port['name'] != bridge and
+                  port['fake_bridge'] is not True)
+
+
+def _get(view, table, record, id):
+    table = view.schema.table_name(table)
+    view.ids[id] = view.ref(_get_row(view, table, record))
+
+
+def _create(view, table, values, id):
+    table = view.schema.table_name(table)
+    row = {column: _datum(view, table, column, value)
+           for column, value in six.iteritems(values)}
+    view.ids[id] = view.insert(table, row)
+
+
+def _add(view, table, record, column, id):
+    table = view.schema.table_name(table)
+    key = _get_row(view, table, record)
+    view.add_to_set(table, key, column, [view.ids[id]])
+
+
+def _remove(view, table, record, column, id):
+    table = view.schema.table_name(table)
+    key = _get_row(view, table, record)
+    view.remove_from_set(table, key, column, [view.ids[id]])
+
+
+def _set(view, table, record, column, value):
+    table = view.schema.table_name(table)
+    column, _, map_key = column.partition(':')
+    column = column.replace('-', '_')
+    key = _get_row(view, table, record)
+    if map_key:
+        coltype = view.schema.column_type(table, column)
+        if coltype['value'] is None:
+            raise _error('cannot specify key to set for non-map column %s' %
+                         column)
+        items = [item for item in idl.map_items(view.row(table, key)[column])
+                 if item[0] != map_key]
+        items.append([_atom(view, coltype['key'], map_key),
+                      _atom(view, coltype['value'], value)])
+        datum = idl.make_map(items)
+    else:
+        datum = _datum(view, table, column, value)
+    view.update(table, key, column, datum)
+
+
+def _set_many(view, table, record, values):
+    for column, value in values:
+        _set(view, table, record, column, value)
+
+
+def _list(view, table, record):
+    table = view.schema.table_name(table)
+    if record:
+        keys = [_get_row(view, table, record)]
+    else:
+        keys = list(view.rows(table))
+    return [(key, dict(view.row(table, key))) for key in keys]
+
+
+def _root(view):
+    return view.find('Open_vSwitch', '.')
+
+
+def _get_row(view, table, record):
+    key = view.find(table, record)
+    if key is None:
+        raise _error('no row "%s" in table %s' % (record, table))
+    return key
+
+
+def _find_bridge(view, name):
+    """
+    Return the key of the bridge named name and its vlan, or None if there is
+    no such bridge. Fake bridges are reported as their parent bridge and the
+    vlan of the fake bridge, for real bridges the vlan is None.
+    """
+    key = view.find('Bridge', name)
+    if key is not None:
+        return key, None
+    port_key = view.find('Port', name)
+    if port_key is not None:
+        port = view.row('Port', port_key)
+        if port['fake_bridge'] is True:
+            return _port_bridge(view, port_key), port['tag']
+    return None
+
+
+def _get_bridge(view, name):
+    found = _find_bridge(view, name)
+    if found is None:
+        raise _error('no bridge named %s' % name)
+    return found
+
+
+def _port_bridge(view, port_key):
+    ref = view.ref(port_key)
+    for key, row in six.iteritems(view.rows('Bridge')):
+        if ref in idl.set_elements(row['ports']):
+            return key
+    return None
+
+
+def _port_keys(view, bridge_key):
+    ports = view.row('Bridge', bridge_key)['ports']
+    return [ref[1] for ref in idl.set_elements(ports)]
+
+
+def _check_port_is_free(view, name):
+    port_key = view.find('Port', name)
+    if port_key is not None:
+        bridge_key = _port_bridge(view, port_key)
+        bridge = view.row('Bridge', bridge_key)['name'] if bridge_key else ''
+        raise _error('cannot create a port named %s because a port named %s '
+                     'already exists on bridge %s' % (name, name, bridge))
+
+
+def _delete_port(view, port_key):
+    for ref in idl.set_elements(view.row('Port', port_key)['interfaces']):
+        view.delete('Interface', ref[1])
+    view.delete('Port', port_key)
+
+
+def _datum(view, table, column, value):
+    coltype = view.schema.column_type(table, column)
+    if coltype['value'] is not None:
+        raise _error('cannot set map column %s without a key' % column)
+    return _atom(view, coltype['key'], value)
+
+
+def _atom(view, base, value):
+    if isinstance(value, six.string_types) and value in view.ids:
+        return view.ids[value]
+    atom_type = base['type']
+    if atom_type == 'uuid':
+        return ['uuid', str(value)]
+    if atom_type == 'integer':
+        return int(value)
+    if atom_type == 'real':
+        return float(value)
+    if atom_type == 'boolean':
+        if isinstance(value, bool):
+            return value
+        return str(value).lower() == 'true'
+    value = six.text_type(value)
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    return value
+
+
+def _row_to_py(key, row, uuids):
+    obj = {'_uuid': uuid.UUID(uuids.get(key, key))}
+    for column, datum in six.iteritems(row):
+        obj[column] = _normalize(
+            column, _val_to_py(_resolve_named_uuids(datum, uuids)))
+    return obj
+
+
+def _resolve_named_uuids(datum, uuids):
+    if isinstance(datum, list):
+        if len(datum) == 2 and datum[0] == 'named-uuid':
+            return ['uuid', uuids[datum[1]]]
+        return [_resolve_named_uuids(item, uuids) for item in datum]
+    return datum
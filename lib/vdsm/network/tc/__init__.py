@@ -27,6 +27,7 @@ import errno
 from vdsm.network import ipwrapper
 
 from . import filter as tc_filter
+from . import _netlink
 from . import _parser
 from . import cls
 from . import qdisc
@@ -185,3 +186,8 @@ def _iterate(module, dev, out=None, **kwargs):
 _filters = partial(_iterate, tc_filter)  # kwargs: parent and pref
 qdiscs = partial(_iterate, qdisc)  # kwargs: dev
 classes = partial(_iterate, cls)  # kwargs: parent and classid
+
+# Over rtnetlink, with statistics. A single kernel dump each.
+dump_qdiscs = _netlink.dump_qdiscs  # kwargs: dev
+dump_classes = _netlink.dump_classes
+dump_filters = _netlink.dump_filters  # kwargs: parent
@@ -0,0 +1,469 @@
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+"""Traffic control dumps over rtnetlink.
+
+Each dump is a single RTM_GET* request answered by the kernel with all the
+qdiscs, classes or filters at once, so no tc process is spawned and no text
+has to be tokenized. The replies are decoded into the same dictionaries the
+textual parsers of this package produce, with an additional 'stats' record.
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+from collections import namedtuple
+from contextlib import closing
+import os
+import socket
+import struct
+
+from vdsm.network import py2to3
+
+from ._wrapper import TrafficControlException
+
+# include/uapi/linux/netlink.h
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+_NLA_TYPE_MASK = 0x3fff
+
+# include/uapi/linux/rtnetlink.h
+RTM_GETQDISC = 38
+RTM_GETTCLASS = 42
+RTM_GETTFILTER = 46
+TCA_KIND = 1
+TCA_OPTIONS = 2
+TCA_STATS2 = 7
+
+# include/uapi/linux/gen_stats.h
+TCA_STATS_BASIC = 1
+TCA_STATS_QUEUE = 3
+
+# include/uapi/linux/pkt_sched.h
+TC_H_ROOT = 0xffffffff
+TCA_HFSC_RSC = 1
+TCA_HFSC_FSC = 2
+TCA_HFSC_USC = 3
+TCA_FQ_CODEL_TARGET = 1
+TCA_FQ_CODEL_LIMIT = 2
+TCA_FQ_CODEL_INTERVAL = 3
+TCA_FQ_CODEL_ECN = 4
+TCA_FQ_CODEL_FLOWS = 5
+TCA_FQ_CODEL_QUANTUM = 6
+
+# include/uapi/linux/pkt_cls.h
+TCA_BASIC_CLASSID = 1
+TCA_U32_CLASSID = 1
+TCA_U32_HASH = 2
+TCA_U32_DIVISOR = 4
+TCA_U32_SEL = 5
+TCA_U32_ACT = 7
+TC_U32_TERMINAL = 1
+TCA_ACT_KIND = 1
+TCA_ACT_OPTIONS = 2
+
+# include/uapi/linux/tc_act/tc_mirred.h
+TCA_MIRRED_PARMS = 2
+
+_NLMSGHDR = struct.Struct('=IHHII')
+_NLMSGERR = struct.Struct('=i')
+_TCMSG = struct.Struct('=BxxxiIII')
+_RTATTR = struct.Struct('=HH')
+_U32 = struct.Struct('=I')
+_STATS_BASIC = struct.Struct('=QI')
+_STATS_QUEUE = struct.Struct('=IIIII')
+_HFSC_QOPT = struct.Struct('=H')
+_HFSC_CURVE = struct.Struct('=III')
+_SFQ_QOPT = struct.Struct('=IiIII')
+_PRIO_QOPT = struct.Struct('=i16B')
+_U32_SEL = struct.Struct('=BBBxHHhhI')
+_U32_KEY = struct.Struct('>II')
+_INT = struct.Struct('=i')
+_MIRRED = struct.Struct('=IIiiiiI')
+
+_RECV_SIZE = 64 * 1024
+
+_PROTOCOLS = {
+    0x0003: 'all',
+    0x0800: 'ip',
+    0x0806: 'arp',
+    0x8100: '802.1Q',
+    0x86dd: 'ipv6',
+}
+_ACT_OPS = {0: 'pass', 1: 'reclassify', 2: 'drop', 3: 'pipe', 4: 'stolen'}
+_MIRRED_ACTIONS = {1: 'egress_redirect', 2: 'egress_mirror',
+                   3: 'ingress_redirect', 4: 'ingress_mirror'}
+
+Stats = namedtuple('Stats',
+                   'bytes packets qlen backlog drops requeues overlimits')
+_NO_STATS = Stats(0, 0, 0, 0, 0, 0, 0)
+
+
+def dump_qdiscs(dev=None):
+    """Returns the qdiscs of dev, or of all the devices if dev is None, in
+    the format of qdisc.parse."""
+    if dev is None:
+        return _decode_all(_dump(RTM_GETQDISC), _decode_qdisc, _link_names())
+    # The kernel ignores the ifindex of qdisc dump requests and returns the
+    # qdiscs of all the devices.
+    ifindex = _ifindex(dev)
+    messages = [message for message in _dump(RTM_GETQDISC, ifindex)
+                if _message_ifindex(message) == ifindex]
+    return _decode_all(messages, _decode_qdisc, None)
+
+
+def dump_classes(dev):
+    """Returns the classes of dev in the format of cls.parse."""
+    return _decode_all(_dump(RTM_GETTCLASS, _ifindex(dev)), _decode_class,
+                       None)
+
+
+def dump_filters(dev, parent=None):
+    """Returns the filters of dev attached to parent (the root qdisc if None)
+    in the format of filter.parse."""
+    messages = _dump(RTM_GETTFILTER, _ifindex(dev),
+                     0 if parent is None else parse_handle(parent))
+    return _decode_all(messages, _decode_filter, _link_names(),
+                       show_parent=parent is None)
+
+
+def parse_handle(handle):
+    """Converts a textual tc handle, e.g., '1:10' or 'ffff:', to its
+    numerical value."""
+    if handle == 'root':
+        return TC_H_ROOT
+    major, minor = handle.split(':')
+    return (int(major or '0', 16) << 16) | int(minor or '0', 16)
+
+
+def format_handle(handle):
+    """The inverse of parse_handle, formatting as tc does."""
+    if handle == TC_H_ROOT:
+        return 'root'
+    major, minor = handle >> 16, handle & 0xffff
+    if major == 0:
+        return ':%x' % minor
+    elif minor == 0:
+        return '%x:' % major
+    return '%x:%x' % (major, minor)
+
+
+def _ifindex(dev):
+    if dev is None:
+        return 0
+    # Imported here so that decoding does not require libnl
+    from vdsm.network.netlink import link
+    return link.get_link(dev)['index']
+
+
+def _link_names():
+    from vdsm.network.netlink import link
+    return dict((info['index'], info['name']) for info in link.iter_links())
+
+
+def _dump(msg_type, ifindex=0, parent=0):
+    """Sends a dump request for tc objects and returns the bounds of the
+    received tcmsgs."""
+    request = (
+        _NLMSGHDR.pack(_NLMSGHDR.size + _TCMSG.size, msg_type,
+                       NLM_F_REQUEST | NLM_F_DUMP, 1, 0) +
+        _TCMSG.pack(socket.AF_UNSPEC, ifindex, 0, parent, 0))
+    messages = []
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    with closing(sock):
+        sock.sendto(request, (0, 0))
+        while not _split(sock.recv(_RECV_SIZE), messages):
+            pass
+    return messages
+
+
+def _split(data, messages):
+    """Appends the (data, start, end) bounds of the tcmsgs in data to
+    messages. Returns True when the end of the dump was reached."""
+    offset = 0
+    while offset < len(data):
+        length, kind, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if kind == NLMSG_DONE:
+            return True
+        elif kind == NLMSG_ERROR:
+            error, = _NLMSGERR.unpack_from(data, offset + _NLMSGHDR.size)
+            if error == 0:
+                return True
+            raise TrafficControlException(-error, os.strerror(-error),
+                                          ['netlink', 'dump'])
+        messages.append((data, offset + _NLMSGHDR.size, offset + length))
+        offset += (length + 3) & ~3
+    return False
+
+
+def _decode_all(messages, decode, names, **kwargs):
+    records = []
+    for data, start, end in messages:
+        record = decode(data, start, end, names, **kwargs)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def _attrs(data, start, end):
+    """Returns a dictionary of attribute type to the (start, end) bounds of
+    its payload. No payload is copied."""
+    attrs = {}
+    while start + _RTATTR.size <= end:
+        length, kind = _RTATTR.unpack_from(data, start)
+        if length < _RTATTR.size:
+            break
+        attrs[kind & _NLA_TYPE_MASK] = (start + _RTATTR.size, start + length)
+        start += (length + 3) & ~3
+    return attrs
+
+
+def _str(data, bounds):
+    start, end = bounds
+    return py2to3.to_str(data[start:end].split(b'\0', 1)[0])
+
+
+def _u32(data, bounds):
+    return _U32.unpack_from(data, bounds[0])[0]
+
+
+def _message_ifindex(message):
+    data, start, _ = message
+    return _TCMSG.unpack_from(data, start)[1]
+
+
+def _tcmsg(data, start, end):
+    _, ifindex, handle, parent, info = _TCMSG.unpack_from(data, start)
+    return ifindex, handle, parent, info, _attrs(data, start + _TCMSG.size,
+                                                 end)
+
+
+def _stats(data, attrs):
+    bounds = attrs.get(TCA_STATS2)
+    if bounds is None:
+        return _NO_STATS
+    stats = _attrs(data, *bounds)
+    nbytes = packets = 0
+    qlen = backlog = drops = requeues = overlimits = 0
+    if TCA_STATS_BASIC in stats:
+        nbytes, packets = _STATS_BASIC.unpack_from(
+            data, stats[TCA_STATS_BASIC][0])
+    if TCA_STATS_QUEUE in stats:
+        qlen, backlog, drops, requeues, overlimits = (
+            _STATS_QUEUE.unpack_from(data, stats[TCA_STATS_QUEUE][0]))
+    return Stats(nbytes, packets, qlen, backlog, drops, requeues, overlimits)
+
+
+def _decode_qdisc(data, start, end, names):
+    ifindex, handle, parent, info, attrs = _tcmsg(data, start, end)
+    kind = _str(data, attrs[TCA_KIND])
+    if kind == 'noqueue':
+        return None
+    record = {'kind': kind, 'handle': '%x:' % (handle >> 16)}
+    if names is not None:
+        record['dev'] = names.get(ifindex, str(ifindex))
+    if parent == TC_H_ROOT:
+        record['root'] = True
+    elif parent:
+        record['parent'] = format_handle(parent)
+    if info > 1:
+        record['refcnt'] = info
+    decode_options = _QDISC_OPTIONS.get(kind)
+    if decode_options is not None and TCA_OPTIONS in attrs:
+        options = decode_options(data, attrs[TCA_OPTIONS])
+        if options:
+            record[kind] = options
+    record['stats'] = _stats(data, attrs)
+    return record
+
+
+def _decode_hfsc_qdisc(data, bounds):
+    defcls, = _HFSC_QOPT.unpack_from(data, bounds[0])
+    return {'default': defcls}
+
+
+def _decode_sfq(data, bounds):
+    quantum, perturb, limit, _, _ = _SFQ_QOPT.unpack_from(data, bounds[0])
+    options = {'limit': limit, 'quantum': quantum}
+    if perturb:
+        options['perturb'] = perturb
+    return options
+
+
+def _decode_pfifo_fast(data, bounds):
+    values = _PRIO_QOPT.unpack_from(data, bounds[0])
+    return {'bands': values[0], 'priomap': list(values[1:])}
+
+
+_FQ_CODEL_OPTIONS = {
+    TCA_FQ_CODEL_TARGET: 'target',
+    TCA_FQ_CODEL_LIMIT: 'limit',
+    TCA_FQ_CODEL_INTERVAL: 'interval',
+    TCA_FQ_CODEL_FLOWS: 'flows',
+    TCA_FQ_CODEL_QUANTUM: 'quantum',
+}
+
+
+def _decode_fq_codel(data, bounds):
+    attrs = _attrs(data, *bounds)
+    options = dict((name, _u32(data, attrs[attr]))
+                   for attr, name in _FQ_CODEL_OPTIONS.items()
+                   if attr in attrs)
+    if TCA_FQ_CODEL_ECN in attrs and _u32(data, attrs[TCA_FQ_CODEL_ECN]):
+        options['ecn'] = True
+    return options
+
+
+_QDISC_OPTIONS = {
+    'fq_codel': _decode_fq_codel,
+    'hfsc': _decode_hfsc_qdisc,
+    'pfifo_fast': _decode_pfifo_fast,
+    'sfq': _decode_sfq,
+}
+
+
+def _decode_class(data, start, end, names):
+    ifindex, handle, parent, info, attrs = _tcmsg(data, start, end)
+    kind = _str(data, attrs[TCA_KIND])
+    record = {'kind': kind, 'handle': format_handle(handle)}
+    if names is not None:
+        record['dev'] = names.get(ifindex, str(ifindex))
+    if parent == TC_H_ROOT:
+        record['root'] = True
+    elif parent:
+        record['parent'] = format_handle(parent)
+    if info:
+        record['leaf'] = '%x:' % (info >> 16)
+    if kind == 'hfsc' and TCA_OPTIONS in attrs:
+        curves = _decode_hfsc_class(data, attrs[TCA_OPTIONS])
+        if curves:
+            record[kind] = curves
+    record['stats'] = _stats(data, attrs)
+    return record
+
+
+def _decode_hfsc_class(data, bounds):
+    """Returns the curves in the units cls.parse reports them: bits for the
+    real time and upper limit curves; link share, which is configured
+    multiplied by 8, divided back."""
+    attrs = _attrs(data, *bounds)
+    curves = {}
+    for attr, name in ((TCA_HFSC_RSC, 'rt'), (TCA_HFSC_USC, 'ul')):
+        if attr in attrs:
+            m1, d, m2 = _HFSC_CURVE.unpack_from(data, attrs[attr][0])
+            curves[name] = {'m1': m1 * 8, 'd': d, 'm2': m2 * 8}
+    if TCA_HFSC_FSC in attrs:
+        m1, d, m2 = _HFSC_CURVE.unpack_from(data, attrs[TCA_HFSC_FSC][0])
+        curves['ls'] = {'m1': m1, 'd': d // 8, 'm2': m2}
+    return curves
+
+
+def _decode_filter(data, start, end, names, show_parent=True):
+    ifindex, handle, parent, info, attrs = _tcmsg(data, start, end)
+    kind = _str(data, attrs[TCA_KIND])
+    protocol = socket.ntohs(info & 0xffff)
+    record = {'kind': kind, 'pref': info >> 16,
+              'protocol': _PROTOCOLS.get(protocol, '%04x' % protocol)}
+    if parent == TC_H_ROOT:
+        record['root'] = True
+    elif show_parent:
+        record['parent'] = format_handle(parent)
+    decode_options = _FILTER_OPTIONS.get(kind)
+    if decode_options is not None:
+        options = attrs.get(TCA_OPTIONS)
+        record[kind] = ({} if options is None else
+                        decode_options(data, options, handle, names))
+    return record
+
+
+def _decode_basic(data, bounds, handle, names):
+    attrs = _attrs(data, *bounds)
+    options = {}
+    if handle:
+        options['handle'] = '0x%x' % handle
+    if TCA_BASIC_CLASSID in attrs:
+        options['flowid'] = format_handle(_u32(data, attrs[TCA_BASIC_CLASSID]))
+    return options
+
+
+def _decode_u32(data, bounds, handle, names):
+    attrs = _attrs(data, *bounds)
+    options = {}
+    if handle:
+        options['fh'] = _format_u32_handle(handle)
+        if handle & 0xfff:
+            options['order'] = handle & 0xfff
+    if TCA_U32_DIVISOR in attrs:
+        options['ht_divisor'] = _u32(data, attrs[TCA_U32_DIVISOR])
+    if TCA_U32_HASH in attrs:
+        htid = _u32(data, attrs[TCA_U32_HASH])
+        options['key_ht'] = htid >> 20
+        options['key_bkt'] = (htid >> 12) & 0xff
+    if TCA_U32_CLASSID in attrs:
+        options['flowid'] = format_handle(_u32(data, attrs[TCA_U32_CLASSID]))
+    if TCA_U32_SEL in attrs:
+        offset = attrs[TCA_U32_SEL][0]
+        flags, _, nkeys, _, _, _, _, _ = _U32_SEL.unpack_from(data, offset)
+        if flags & TC_U32_TERMINAL:
+            options['terminal'] = True
+        if nkeys:
+            key_offset = offset + _U32_SEL.size + (nkeys - 1) * 16
+            mask, value = _U32_KEY.unpack_from(data, key_offset)
+            at, = _INT.unpack_from(data, key_offset + _U32_KEY.size)
+            options['match'] = {'value': value, 'mask': mask, 'offset': at}
+    if TCA_U32_ACT in attrs:
+        options['actions'] = _decode_actions(data, attrs[TCA_U32_ACT], names)
+    return options
+
+
+def _format_u32_handle(handle):
+    htid, bucket, node = handle >> 20, (handle >> 12) & 0xff, handle & 0xfff
+    text = '%x:' % htid if htid else ''
+    if bucket:
+        text += '%x' % bucket
+    if node:
+        text += ':%x' % node
+    return text
+
+
+def _decode_actions(data, bounds, names):
+    actions = []
+    for order, action_bounds in sorted(_attrs(data, *bounds).items()):
+        attrs = _attrs(data, *action_bounds)
+        action = {'order': order, 'kind': _str(data, attrs[TCA_ACT_KIND])}
+        if action['kind'] == 'mirred' and TCA_ACT_OPTIONS in attrs:
+            mirred = _attrs(data, *attrs[TCA_ACT_OPTIONS])
+            if TCA_MIRRED_PARMS in mirred:
+                (index, _, op, ref, bind, eaction,
+                 ifindex) = _MIRRED.unpack_from(data,
+                                                mirred[TCA_MIRRED_PARMS][0])
+                action.update(
+                    action=_MIRRED_ACTIONS.get(eaction, str(eaction)),
+                    target=names.get(ifindex, str(ifindex)),
+                    op=_ACT_OPS.get(op, str(op)),
+                    index=index, ref=ref, bind=bind)
+        actions.append(action)
+    return actions
+
+
+_FILTER_OPTIONS = {
+    'basic': _decode_basic,
+    'u32': _decode_u32,
+}
@@ -1,4 +1,4 @@
-# Copyright (C) 2012 - 2017 Adam Litke, IBM Corporation
+# Copyright (C) 2012 - 2018 Adam Litke, IBM Corporation
 # Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
@@ -26,6 +26,10 @@ from yajsonrpc import exception
 
 from vdsm import API
 from vdsm.api import vdsmapi
+from vdsm.common import concurrent
+from vdsm.common.exception import VdsmException
+from vdsm.common.logutils import Suppressed
+from vdsm.common.threadlocal import vars
 from vdsm.config import config
 from vdsm.network.netinfo.addresses import getDeviceByIP
 
@@ -108,8 +112,84 @@ class DynamicBridge(object):
             self._schema.get_method(vdsmapi.MethodRep(className, methodName))
         except (vdsmapi.MethodNotFound, ValueError):
             raise exception.JsonRpcMethodNotFoundError(method=method)
+        if method == 'Host.multiCall':
+            return self._multiCall
         return partial(self._dynamicMethod, className, methodName)
 
+    def _multiCall(self, calls, parallel=1):
+        """
+        Call many methods in one request, returning a list of results in
+        the order of the calls. Each result is either {'result': value} or
+        {'error': {'code': code, 'message': message}}, like a JSON-RPC
+        response.
+
+        The calls share the context of the request, and run in up to
+        parallel threads. The return value is not verified, since every
+        call verifies its own return value.
+        """
+        rep = vdsmapi.MethodRep('Host', 'multiCall')
+        self._schema.verify_args(rep, {'calls': calls, 'parallel': parallel})
+
+        parallel = max(1, min(parallel, len(calls),
+                              config.getint('rpc', 'multi_call_max_parallel')))
+        if parallel == 1:
+            return [self._call(call) for call in calls]
+
+        results = [None] * len(calls)
+        pending = iter(enumerate(calls))
+        lock = threading.Lock()
+        context = vars.context
+        server = getattr(self._threadLocal, 'server', None)
+
+        def worker():
+            vars.context = context
+            self.register_server_address(server)
+            try:
+                while True:
+                    with lock:
+                        try:
+                            i, call = next(pending)
+                        except StopIteration:
+                            return
+                    results[i] = self._call(call)
+            finally:
+                self.unregister_server_address()
+                vars.context = None
+
+        threads = [concurrent.thread(worker, name='multicall/%d' % i)
+                   for i in range(parallel)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        return results
+
+    def _call(self, call):
+        method = call.get('method')
+        params = call.get('params', {})
+        try:
+            if method == 'Host.multiCall':
+                raise exception.JsonRpcInvalidRequestError(
+                    'Host.multiCall cannot be called by Host.multiCall')
+            fn = self.dispatch(method)
+            if isinstance(params, list):
+                res = fn(*params)
+            else:
+                res = fn(**params)
+        except VdsmException as e:
+            return {'error': {'code': e.code, 'message': str(e)}}
+        except Exception as e:
+            self.log.exception("Internal server error in %s", method)
+            e = exception.JsonRpcInternalError(str(e))
+            return {'error': {'code': e.code, 'message': str(e)}}
+
+        if res is None:
+            res = True
+        elif isinstance(res, Suppressed):
+            res = res.value
+        return {'result': res}
+
     def _convert_class_name(self, name):
         """
         The schema has a different name for the 'Global' namespace.  Until
@@ -340,6 +420,7 @@ command_info = {
     'Host_getExternalVmFromOva': {'ret': 'vmList'},
     'Host_getConvertedVm': {'ret': 'ovf'},
     'Host_getLldp': {'ret': 'info'},
+    'Host_getLockStats': {'ret': 'lockStats'},
     'Host_getHardwareInfo': {'ret': 'info'},
     'Host_getLVMVolumeGroups': {'ret': 'vglist'},
     'Host_getStats': {'ret': 'info'},
@@ -351,6 +432,7 @@ command_info = {
     'Host_getVMFullList': {'call': Host_getVMFullList_Call, 'ret': 'vmList'},
     'Host_getAllVmStats': {'ret': 'statsList'},
     'Host_getAllVmIoTunePolicies': {'ret': 'io_tune_policies_dict'},
+    'Host_getMigrationQueue': {'ret': 'queue'},
     'Host_setupNetworks': {'ret': 'status'},
     'Host_setKsmTune': {'ret': 'status'},
     'Host_setHaMaintenanceMode': {'ret': 'status'},
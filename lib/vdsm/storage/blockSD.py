@@ -28,7 +28,7 @@ import re
 import time
 import functools
 import sys
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from contextlib import contextmanager
 from operator import itemgetter
 
@@ -61,6 +61,9 @@ from vdsm.storage.compat import sanlock
 from vdsm.storage.mailbox import MAILBOX_SIZE
 from vdsm.storage.persistent import PersistentDict, DictValidator
 from vdsm.storage.sdm import volume_artifacts
+from vdsm.storage.volumemetadata import VolumeInfo
+from vdsm.storage.volumemetadata import VolumeMetadata
+from vdsm.storage.volumemetadata import VolumesSnapshot
 
 import vdsm.common.supervdsm as svdsm
 
@@ -956,6 +959,102 @@ class BlockStorageDomainManifest(sd.StorageDomainManifest):
     def metadata_volume_path(self):
         return lvm.lvPath(self.sdUUID, sd.METADATA)
 
+    def read_volumes_metadata(self):
+        """
+        Read the metadata of all the volumes in the domain.
+
+        The metadata volume is read once, up to the last occupied slot, and
+        each volume's slot is sliced from this buffer, instead of reading the
+        slots one by one.
+
+        Returns:
+            dict mapping volume UUID to its metadata lines, as read by
+            BlockVolumeManifest.getMetadata.
+        """
+        slots = {}
+        special_lvs = self.special_volumes(self.getVersion())
+        for lv in lvm.getLV(self.sdUUID):
+            if lv.name in special_lvs:
+                # Special LVs have no mapping
+                continue
+            for tag in lv.tags:
+                if tag.startswith(sc.TAG_PREFIX_MD):
+                    slots[lv.name] = int(tag[len(sc.TAG_PREFIX_MD):])
+                    break
+            else:
+                self.log.warning("Could not find mapping for lv %s/%s",
+                                 self.sdUUID, lv.name)
+
+        if not slots:
+            return {}
+
+        size = (max(six.itervalues(slots)) + 1) * sc.METADATA_SIZE
+        data = misc.read_direct(self.metadata_volume_path(), 0, size)
+
+        result = {}
+        for vol_id, slot in six.iteritems(slots):
+            start = slot * sc.METADATA_SIZE
+            end = start + sc.METADATA_SIZE
+            result[vol_id] = data[start:end].splitlines()
+        return result
+
+    def list_image_volumes(self, imgUUID):
+        lvs = lvm.lvsByTag(self.sdUUID, sc.TAG_PREFIX_IMAGE + imgUUID)
+        return [lv.name for lv in lvs]
+
+    def read_volumes_info(self, imgUUID, volUUIDs):
+        # Like _load_volumes_snapshot, reading only the metadata slots of
+        # these volumes.
+        result = {}
+        for vol_id in volUUIDs:
+            try:
+                lv = lvm.getLV(self.sdUUID, vol_id)
+            except se.LogicalVolumeDoesNotExistError:
+                continue
+            if sc.TEMP_VOL_LVTAG in lv.tags:
+                continue
+            tags = {}
+            for tag in lv.tags:
+                for prefix in (sc.TAG_PREFIX_IMAGE, sc.TAG_PREFIX_PARENT,
+                               sc.TAG_PREFIX_MD):
+                    if tag.startswith(prefix):
+                        tags[prefix] = tag[len(prefix):]
+            if len(tags) < 3:
+                continue
+            offset = int(tags[sc.TAG_PREFIX_MD]) * sc.METADATA_SIZE
+            lines = misc.read_direct(self.metadata_volume_path(), offset,
+                                     sc.METADATA_SIZE).splitlines()
+            try:
+                md = VolumeMetadata.from_lines(lines)
+            except se.MetaDataKeyNotFoundError as e:
+                self.log.warning("Ignoring volume %s/%s with invalid "
+                                 "metadata: %s", self.sdUUID, vol_id, e)
+                continue
+            result[vol_id] = VolumeInfo(tags[sc.TAG_PREFIX_IMAGE],
+                                        tags[sc.TAG_PREFIX_PARENT],
+                                        md.voltype)
+        return result
+
+    def _load_volumes_snapshot(self):
+        # Images and parents are taken from the LV tags, like
+        # BlockVolume.getImageVolumes and getParent do.
+        vols = _getVolsTree(self.sdUUID)
+        volumes = {}
+        images = defaultdict(list)
+        for vol_id, lines in six.iteritems(self.read_volumes_metadata()):
+            vol = vols.get(vol_id)
+            if vol is None:
+                continue
+            try:
+                md = VolumeMetadata.from_lines(lines)
+            except se.MetaDataKeyNotFoundError as e:
+                self.log.warning("Ignoring volume %s/%s with invalid "
+                                 "metadata: %s", self.sdUUID, vol_id, e)
+                continue
+            volumes[vol_id] = VolumeInfo(vol.image, vol.parent, md.voltype)
+            images[vol.image].append(vol_id)
+        return VolumesSnapshot(self.sdUUID, volumes, images)
+
 
 class BlockStorageDomain(sd.StorageDomain):
     manifestClass = BlockStorageDomainManifest
@@ -232,7 +232,7 @@ class BlockVolumeManifest(volume.VolumeManifest):
         lvm.setrwLV(self.sdUUID, self.volUUID, rw)
 
     @classmethod
-    def _putMetadata(cls, metaId, meta):
+    def _putMetadata(cls, metaId, meta, imgUUID=None):
         vgname, offs = metaId
 
         data = cls.formatMetadata(meta)
@@ -243,6 +243,9 @@ class BlockVolumeManifest(volume.VolumeManifest):
         with directio.DirectFile(metavol, "r+") as f:
             f.seek(offs * sc.METADATA_SIZE)
             f.write(data)
+        # Wiped metadata has no image; if the image is unknown the whole
+        # snapshot is dropped.
+        sd.invalidate_volumes_snapshot(meta.get(sc.IMAGE, imgUUID))
 
     def changeVolumeTag(self, tagPrefix, uuid):
 
@@ -261,6 +264,10 @@ class BlockVolumeManifest(volume.VolumeManifest):
         newTag = tagPrefix + uuid
         if oldTag != newTag:
             lvm.replaceLVTag(self.sdUUID, self.volUUID, oldTag, newTag)
+            manifest = sdCache.produce_manifest(self.sdUUID)
+            manifest.invalidate_volumes_snapshot(self.imgUUID)
+            if tagPrefix == sc.TAG_PREFIX_IMAGE:
+                manifest.invalidate_volumes_snapshot(uuid)
 
     def setParentMeta(self, puuid):
         """
@@ -291,7 +298,8 @@ class BlockVolumeManifest(volume.VolumeManifest):
         Just wipe meta.
         """
         try:
-            self._putMetadata(metaId, {"NONE": "#" * (sc.METADATA_SIZE - 10)})
+            self._putMetadata(metaId, {"NONE": "#" * (sc.METADATA_SIZE - 10)},
+                              imgUUID=self.imgUUID)
         except Exception as e:
             self.log.error(e, exc_info=True)
             raise se.VolumeMetadataWriteError("%s: %s" % (metaId, e))
@@ -732,6 +740,8 @@ class BlockVolume(volume.Volume):
 
         self._manifest.volUUID = newUUID
         self._manifest.volumePath = os.path.join(self.imagePath, newUUID)
+        sdCache.produce_manifest(self.sdUUID).invalidate_volumes_snapshot(
+            self.imgUUID)
 
     def getDevPath(self):
         return self._manifest.getDevPath()
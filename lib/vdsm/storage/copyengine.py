@@ -0,0 +1,190 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+copyengine - run copy operations concurrently
+=============================================
+
+Copying an image copies every volume of the image using a separate
+qemu-img convert operation. The operations are independent, so the engine
+runs up to parallel operations at the same time, and reports the progress
+of the whole copy.
+
+Operations are objects with run(), abort() and a progress property,
+returning the progress as float between 0 and 100, like
+qemuimg.ProgressCommand.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import logging
+import sys
+import threading
+
+import six
+
+from vdsm import utils
+from vdsm.common import concurrent
+from vdsm.common import exception
+
+
+class Copy(object):
+    """
+    A copy operation, and the size of the data it copies, used to weight
+    the progress of the operation.
+    """
+
+    def __init__(self, name, operation, size):
+        self.name = name
+        self.operation = operation
+        self.size = size
+        self.done = False
+
+    @property
+    def progress(self):
+        if self.done:
+            return 100.0
+        return self.operation.progress
+
+
+class CopyEngine(object):
+
+    log = logging.getLogger("storage.copyengine")
+
+    def __init__(self, copies, parallel=1, progress_interval=None):
+        """
+        Arguments:
+            copies (list): list of Copy objects. Copies are started in order.
+            parallel (int): maximum number of copies running at the same
+                time.
+            progress_interval (float): if set, log the progress of the copy
+                every progress_interval seconds.
+        """
+        self._copies = copies
+        self._parallel = max(1, min(parallel, len(copies)))
+        self._progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._pending = collections.deque(copies)
+        self._running = set()
+        self._error = None
+        self._aborted = False
+        self._workers = self._parallel
+        self._done = threading.Event()
+
+    @property
+    def progress(self):
+        """
+        Return the progress of all copies as float between 0 and 100.
+
+        This method is threadsafe and may be called from any thread.
+        """
+        total = sum(copy.size for copy in self._copies)
+        if total == 0:
+            done = sum(1 for copy in self._copies if copy.done)
+            return 100.0 * done / len(self._copies) if self._copies else 100.0
+        return sum(copy.size * copy.progress for copy in self._copies) / total
+
+    def run(self):
+        """
+        Run the copies and wait until they finish. If a copy fails, abort
+        the running copies, do not start the rest, and raise the error of
+        the failed copy.
+
+        Raises:
+            `exception.ActionStopped` if the copy was aborted
+            any error raised by a copy operation
+        """
+        if not self._copies:
+            return
+
+        self.log.info("Starting %d copies (parallel=%d)",
+                      len(self._copies), self._parallel)
+        with utils.stopwatch("Copy %d volumes" % len(self._copies),
+                             level=logging.INFO, log=self.log):
+            # The copies run in worker threads even if parallel is 1, so
+            # this thread can log the progress.
+            for i in range(self._parallel):
+                t = concurrent.thread(self._run_copies,
+                                      name="copy/%d" % i, log=self.log)
+                t.start()
+            while not self._done.wait(self._progress_interval):
+                self._log_progress()
+
+        if self._error:
+            six.reraise(*self._error)
+
+        if self._aborted:
+            # Aborted before the remaining copies were started.
+            raise exception.ActionStopped()
+
+    def abort(self):
+        """
+        Abort the running copies. Copies not started yet are not started.
+
+        This method is threadsafe and may be called from any thread.
+        """
+        with self._lock:
+            self._aborted = True
+            self._pending.clear()
+            running = list(self._running)
+        for copy in running:
+            copy.operation.abort()
+
+    def _run_copies(self):
+        try:
+            while True:
+                with self._lock:
+                    if self._aborted or not self._pending:
+                        return
+                    copy = self._pending.popleft()
+                    self._running.add(copy)
+                try:
+                    self._run_copy(copy)
+                finally:
+                    with self._lock:
+                        self._running.discard(copy)
+        finally:
+            with self._lock:
+                self._workers -= 1
+                if self._workers == 0:
+                    self._done.set()
+
+    def _run_copy(self, copy):
+        try:
+            with utils.stopwatch("Copy volume %s" % copy.name):
+                copy.operation.run()
+        except Exception:
+            with self._lock:
+                if self._error is None:
+                    self._error = sys.exc_info()
+                    first = True
+                else:
+                    first = False
+            if first:
+                self.log.error("Copy %s failed, aborting the other copies",
+                               copy.name)
+                self.abort()
+        else:
+            copy.done = True
+
+    def _log_progress(self):
+        self.log.info("Copy progress: %.2f%%", self.progress)
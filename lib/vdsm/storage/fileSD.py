@@ -19,19 +19,22 @@
 #
 from __future__ import absolute_import
 
-import collections
 import os
 import errno
 import logging
 import glob
 import fnmatch
 import re
+import threading
 
 from contextlib import contextmanager
 
+import six
+
 from vdsm import utils
 from vdsm.common import supervdsm
 from vdsm.common.compat import glob_escape
+from vdsm.common.time import monotonic_time
 from vdsm.storage import clusterlock
 from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
@@ -44,6 +47,9 @@ from vdsm.storage import sd
 from vdsm.storage import xlease
 from vdsm.storage.persistent import PersistentDict, DictValidator
 from vdsm.storage.sdm import volume_artifacts
+from vdsm.storage.volumemetadata import VolumeInfo
+from vdsm.storage.volumemetadata import VolumeMetadata
+from vdsm.storage.volumemetadata import VolumesSnapshot
 
 from vdsm import constants
 from vdsm.utils import stripNewLines
@@ -71,6 +77,16 @@ ST_BYTES_PER_BLOCK = 512
 
 _MOUNTLIST_IGNORE = ('/' + sd.BLOCKSD_DIR, '/' + sd.GLUSTERSD_DIR)
 
+# Maximum number of concurrent volume metadata reads when loading the
+# volumes snapshot of a domain.
+_VOLUMES_METADATA_READERS = 10
+
+# Directories modified less than this number of seconds before they were
+# scanned may be modified again without changing their mtime, because of the
+# file system timestamps granularity, so they are scanned again. The scan time
+# is estimated using the server clock, see VolumesIndex._server_time().
+_MTIME_RACY_WINDOW = 2
+
 getProcPool = oop.getGlobalProcPool
 
 
@@ -160,6 +176,143 @@ FileSDMetadata = lambda metafile: DictValidator(
     PersistentDict(FileMetadataRW(metafile)), FILE_SD_MD_FIELDS)
 
 
+class VolumesIndex(object):
+    """
+    Cached mapping of the images of a file domain to their volumes.
+
+    Listing the volumes of a domain requires reading every image directory.
+    The index keeps the volumes of every image with the image directory
+    mtime, so a refresh reads only the directories modified since the last
+    refresh. The mtimes of all the images are read using a single command.
+    Changes made by this host are applied to the index in place.
+    """
+
+    log = logging.getLogger("storage.VolumesIndex")
+
+    def __init__(self, images_dir, oop, list_mtimes=fileUtils.list_mtimes,
+                 clock=monotonic_time):
+        self._images_dir = images_dir
+        self._oop = oop
+        self._list_mtimes = list_mtimes
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (server time, local time) of the last listing.
+        self._last_listing = None
+        # imgUUID: (mtime, server time when scanned, set of volUUIDs)
+        self._images = {}
+        self._dirty = set()
+        self._last_refresh = None
+        self._refresh_duration = None
+        self._rescanned = 0
+
+    def images(self):
+        """
+        Refresh the index and return dict {imgUUID: [volUUID, ...]} of all
+        the directories in the images directory.
+        """
+        with self._lock:
+            self._refresh()
+            return dict((img, list(vols))
+                        for img, (_, _, vols) in six.iteritems(self._images))
+
+    def add_volume(self, imgUUID, volUUID):
+        with self._lock:
+            entry = self._images.get(imgUUID)
+            if entry is None:
+                self._dirty.add(imgUUID)
+            else:
+                entry[2].add(volUUID)
+
+    def remove_volume(self, imgUUID, volUUID):
+        with self._lock:
+            entry = self._images.get(imgUUID)
+            if entry is not None:
+                entry[2].discard(volUUID)
+
+    def invalidate_image(self, imgUUID):
+        with self._lock:
+            self._dirty.add(imgUUID)
+
+    def stats(self):
+        """
+        Return dict describing the index and how stale it is. "age" is the
+        number of seconds since the last refresh, or None if the index was
+        never refreshed.
+        """
+        with self._lock:
+            if self._last_refresh is None:
+                age = None
+            else:
+                age = monotonic_time() - self._last_refresh
+            return {
+                "age": age,
+                "images": len(self._images),
+                "volumes": sum(len(vols) for _, _, vols
+                               in six.itervalues(self._images)),
+                "dirty": len(self._dirty),
+                "rescanned": self._rescanned,
+                "refresh_duration": self._refresh_duration,
+            }
+
+    def _refresh(self):
+        start = monotonic_time()
+        listed = self._clock()
+        images_mtime, found = self._list_mtimes(self._images_dir)
+        server_time = self._server_time(
+            listed, [images_mtime] + list(found.values()))
+
+        rescanned = 0
+        images = {}
+        for imgUUID, mtime in six.iteritems(found):
+            entry = self._images.get(imgUUID)
+            if (entry is None or
+                    imgUUID in self._dirty or
+                    entry[0] != mtime or
+                    entry[1] < mtime + _MTIME_RACY_WINDOW):
+                entry = self._scan(imgUUID, mtime, server_time)
+                rescanned += 1
+            images[imgUUID] = entry
+
+        self._images = images
+        self._dirty.clear()
+        self._last_refresh = monotonic_time()
+        self._refresh_duration = self._last_refresh - start
+        self._rescanned = rescanned
+        self.log.debug("Refreshed volumes index %s: %d images, %d rescanned "
+                       "in %.2f seconds", self._images_dir, len(images),
+                       rescanned, self._refresh_duration)
+
+    def _server_time(self, listed, mtimes):
+        """
+        Return an estimate of the server time when the images were listed,
+        not later than the real server time. Comparing it with the mtimes
+        of the images is not affected by clock skew between this host and
+        the server.
+
+        The newest mtime is a lower bound of the server time, but it is the
+        mtime of the newest image, which would always look racy. Since the
+        last listing, the server clock advanced as much as the local
+        monotonic clock, so the estimate keeps advancing when nothing is
+        modified on the server.
+        """
+        server_time = max(mtimes)
+        if self._last_listing is not None:
+            last_server_time, last_listed = self._last_listing
+            server_time = max(server_time,
+                              last_server_time + listed - last_listed)
+        self._last_listing = (server_time, listed)
+        return server_time
+
+    def _scan(self, imgUUID, mtime, server_time):
+        pattern = os.path.join(glob_escape(self._images_dir),
+                               glob_escape(imgUUID), "*.meta")
+        vols = set()
+        for metaPath in self._oop.glob.glob(pattern):
+            volUUID, volExt = os.path.splitext(os.path.basename(metaPath))
+            vols.add(volUUID)
+        return (mtime, server_time, vols)
+
+
 class FileStorageDomainManifest(sd.StorageDomainManifest):
     def __init__(self, domainPath, metadata=None):
         # Using glob might look like the simplest thing to do but it isn't
@@ -179,6 +332,10 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         if not self.oop.fileUtils.pathExists(self.metafile):
             raise se.StorageDomainMetadataNotFound(self.sdUUID, self.metafile)
 
+        self._volumes_index = VolumesIndex(
+            os.path.join(self.mountpoint, self.sdUUID, sd.DOMAIN_IMAGES),
+            self.oop)
+
     @classmethod
     def special_volumes(cls, version):
         if cls.supports_external_leases(version):
@@ -244,6 +401,9 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         except OSError as e:
             self.log.error("image: %s can't be moved", currImgDir)
             raise se.ImageDeleteError("%s %s" % (imgUUID, str(e)))
+        finally:
+            self._volumes_index.invalidate_image(imgUUID)
+            self._volumes_index.invalidate_image(os.path.basename(toDelDir))
 
     def purgeImage(self, sdUUID, imgUUID, volsImgs, discard):
         self.log.debug("Purging image %s", imgUUID)
@@ -256,6 +416,7 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
             self._deleteVolumeFile(volPath + fileVolume.META_FILEEXT)
             if self.hasVolumeLeases():
                 self._deleteVolumeFile(volPath + LEASE_FILEEXT)
+        self._volumes_index.invalidate_image(os.path.basename(toDelDir))
         self.log.info("Removing directory: %s", toDelDir)
         try:
             self.oop.os.rmdir(toDelDir)
@@ -295,18 +456,8 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         Template volumes have no parent, and thus we report BLANK_UUID as their
         parentUUID.
         """
-        volMetaPattern = os.path.join(glob_escape(self.mountpoint),
-                                      self.sdUUID,
-                                      sd.DOMAIN_IMAGES, "*", "*.meta")
-        volMetaPaths = self.oop.glob.glob(volMetaPattern)
-
-        # First create mapping from images to volumes
-        images = collections.defaultdict(list)
-        for metaPath in volMetaPaths:
-            head, tail = os.path.split(metaPath)
-            volUUID, volExt = os.path.splitext(tail)
-            imgUUID = os.path.basename(head)
-            images[imgUUID].append(volUUID)
+        # First get mapping from images to volumes
+        images = self._volumes_index.images()
 
         # Using images to volumes mapping, we can create volumes to images
         # mapping, detecting template volumes and template images, based on
@@ -342,6 +493,81 @@ class FileStorageDomainManifest(sd.StorageDomainManifest):
         return dict((k, sd.ImgsPar(tuple(v['imgs']), v['parent']))
                     for k, v in volumes.iteritems())
 
+    def volume_added(self, imgUUID, volUUID):
+        """
+        Called when volUUID is created in, or linked into imgUUID.
+        """
+        self._volumes_index.add_volume(imgUUID, volUUID)
+
+    def volume_removed(self, imgUUID, volUUID):
+        """
+        Called when volUUID is removed from imgUUID.
+        """
+        self._volumes_index.remove_volume(imgUUID, volUUID)
+
+    def volumes_index_stats(self):
+        return self._volumes_index.stats()
+
+    def list_image_volumes(self, imgUUID):
+        # Like the volumes index, includes template volumes linked in the
+        # image directory.
+        pattern = os.path.join(glob_escape(self.getImagePath(imgUUID)),
+                               "*" + fileVolume.META_FILEEXT)
+        return [os.path.splitext(os.path.basename(path))[0]
+                for path in self.oop.glob.glob(pattern)]
+
+    def read_volumes_info(self, imgUUID, volUUIDs):
+        imagePath = self.getImagePath(imgUUID)
+        metaPaths = dict(
+            (volUUID, os.path.join(imagePath,
+                                   volUUID + fileVolume.META_FILEEXT))
+            for volUUID in volUUIDs)
+        return self._read_volumes_info(metaPaths)
+
+    def _load_volumes_snapshot(self):
+        images = self._volumes_index.images()
+
+        # Template volumes are hard linked in every image directory derived
+        # from the template; their metadata is read only once.
+        metaPaths = {}
+        for imgUUID, volUUIDs in six.iteritems(images):
+            for volUUID in volUUIDs:
+                if volUUID not in metaPaths:
+                    metaPaths[volUUID] = os.path.join(
+                        self.getImagePath(imgUUID),
+                        volUUID + fileVolume.META_FILEEXT)
+
+        volumes = self._read_volumes_info(metaPaths)
+
+        # Images list only volumes with valid metadata.
+        images = dict((imgUUID, [v for v in volUUIDs if v in volumes])
+                      for imgUUID, volUUIDs in images.items())
+        return VolumesSnapshot(self.sdUUID, volumes, images)
+
+    def _read_volumes_info(self, metaPaths):
+        """
+        Read the metadata files metaPaths, a dict mapping volume UUID to its
+        metadata file path, and return dict mapping volume UUID to
+        VolumeInfo.
+        """
+        def read_metadata(item):
+            volUUID, metaPath = item
+            try:
+                lines = self.oop.directReadLines(metaPath)
+                return volUUID, VolumeMetadata.from_lines(lines)
+            except Exception as e:
+                # The volume may have been removed since we listed it.
+                self.log.warning("Ignoring volume %s/%s, cannot read "
+                                 "metadata: %s", self.sdUUID, volUUID, e)
+                return volUUID, None
+
+        volumes = {}
+        for volUUID, md in misc.itmap(read_metadata, metaPaths.items(),
+                                      _VOLUMES_METADATA_READERS):
+            if md is not None:
+                volumes[volUUID] = VolumeInfo(md.image, md.puuid, md.voltype)
+        return volumes
+
     def getAllImages(self):
         """
         Fetch the set of the Image UUIDs in the SD.
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -40,6 +40,7 @@ from vdsm import constants
 from vdsm import utils
 from vdsm.common.network import address
 from vdsm.storage import constants as sc
+from vdsm.storage import operation
 
 log = logging.getLogger('storage.fileUtils')
 
@@ -69,6 +70,29 @@ def tarCopy(src, dst, exclude=()):
         raise TarCopyFailed(tsrc.returncode, tdst.returncode, out, err)
 
 
+def list_mtimes(path):
+    """
+    Return the mtime of directory path, and a dict mapping the names of the
+    entries in path to their mtime, using a single find command.
+
+    The mtimes are set by the server, so they can be compared with each
+    other even if the clock of this host is not synchronized with the
+    server.
+    """
+    cmd = [constants.EXT_FIND, path, "-maxdepth", "1",
+           "-printf", r"%d %T@ %f\n"]
+    out = operation.Command(cmd, nice=None, ioclass=None).run()
+    mtime = None
+    entries = {}
+    for line in out.decode("utf-8").splitlines():
+        depth, entry_mtime, name = line.split(" ", 2)
+        if depth == "0":
+            mtime = float(entry_mtime)
+        else:
+            entries[name] = float(entry_mtime)
+    return mtime, entries
+
+
 def transformPath(remotePath):
     """
     Transform remote path to new one for local mount
@@ -253,6 +253,11 @@ class FileVolumeManifest(volume.VolumeManifest):
 
         sdUUID = getDomUuidFromVolumePath(volPath)
         oop.getProcessPool(sdUUID).os.rename(metaPath + ".new", metaPath)
+        manifest = sdCache.produce_manifest(sdUUID)
+        imgPath, volUUID = os.path.split(volPath)
+        imgUUID = os.path.basename(imgPath)
+        manifest.volume_added(imgUUID, volUUID)
+        manifest.invalidate_volumes_snapshot(imgUUID)
 
     def setImage(self, imgUUID):
         """
@@ -268,6 +273,9 @@ class FileVolumeManifest(volume.VolumeManifest):
         if self.oop.os.path.lexists(metaPath):
             self.log.info("Removing: %s", metaPath)
             self.oop.os.unlink(metaPath)
+            manifest = sdCache.produce_manifest(self.sdUUID)
+            manifest.volume_removed(self.imgUUID, self.volUUID)
+            manifest.invalidate_volumes_snapshot(self.imgUUID)
 
     @classmethod
     def leaseVolumePath(cls, vol_path):
@@ -321,6 +329,9 @@ class FileVolumeManifest(volume.VolumeManifest):
         if sdCache.produce(self.sdUUID).hasVolumeLeases():
             self._shareLease(dstImgPath)
 
+        sdCache.produce_manifest(self.sdUUID).volume_added(
+            os.path.basename(dstImgPath), self.volUUID)
+
     @classmethod
     def getImageVolumes(cls, sdUUID, imgUUID):
         """
@@ -612,6 +623,10 @@ class FileVolume(volume.Volume):
         except OSError as e:
             if e.errno != os.errno.ENOENT:
                 raise
+        manifest = sdCache.produce_manifest(self.sdUUID)
+        manifest.volume_removed(self.imgUUID, self.volUUID)
+        manifest.volume_added(self.imgUUID, newUUID)
+        manifest.invalidate_volumes_snapshot(self.imgUUID)
 
         self.renameLease((volPath, LEASE_FILEOFFSET), newUUID,
                          recovery=recovery)
@@ -2193,6 +2193,14 @@ class HSM(object):
         allTasksStatus = self._pool.getAllTasksStatuses()
         return dict(allTasksStatus=allTasksStatus)
 
+    @public
+    def getLockStats(self):
+        """
+        Gets the wait and hold time statistics of the resource locks, and
+        the resources that have requests waiting for them.
+        """
+        return dict(lockStats=rm.lock_stats())
+
     @public
     def getTaskInfo(self, taskID, spUUID=None, options=None):
         """
@@ -3329,7 +3337,6 @@ class HSM(object):
             try:
                 if self._pool.spmMailer:
                     self._pool.spmMailer.stop()
-                    self._pool.spmMailer.tp.joinAll(waitForTasks=False)
 
                 if self._pool.hsmMailer:
                     self._pool.hsmMailer.stop()
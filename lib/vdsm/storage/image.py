@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2017 Red Hat, Inc.
+# Copyright 2009-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -33,6 +33,7 @@ from vdsm.common import cmdutils
 from vdsm.common import logutils
 from vdsm.common.threadlocal import vars
 from vdsm.storage import constants as sc
+from vdsm.storage import copyengine
 from vdsm.storage import exception as se
 from vdsm.storage import imageSharing
 from vdsm.storage import misc
@@ -76,6 +77,10 @@ RENAME_RANDOM_STRING_LEN = 8
 TEMPORARY_VOLUME_SIZE = 20480  # in blocks (10M)
 
 
+def _convert_coroutines():
+    return config.getint('irs', 'qemu_img_convert_coroutines') or None
+
+
 def _deleteImage(dom, imgUUID, postZero, discard):
     """This ancillary function will be removed.
 
@@ -108,7 +113,8 @@ class Image:
 
     def _run_qemuimg_operation(self, operation):
         self.log.debug('running qemu-img operation')
-        with vars.task.abort_callback(operation.abort):
+        with vars.task.abort_callback(operation.abort), \
+                vars.task.progress_source(operation):
             operation.run()
         self.log.debug('qemu-img operation has completed')
 
@@ -180,67 +186,13 @@ class Image:
         Return the chain of volumes of image as a sorted list
         (not including a shared base (template) if any)
         """
-        chain = []
-        volclass = sdCache.produce(sdUUID).getVolumeClass()
-
-        # Use volUUID when provided
-        if volUUID:
-            srcVol = volclass(self.repoPath, sdUUID, imgUUID, volUUID)
-
-            # For template images include only one volume (the template itself)
-            # NOTE: this relies on the fact that in a template there is only
-            #       one volume
-            if srcVol.isShared():
-                return [srcVol]
-
-        # Find all the volumes when volUUID is not provided
-        else:
-            # Find all volumes of image
-            uuidlist = volclass.getImageVolumes(sdUUID, imgUUID)
-
-            if not uuidlist:
-                raise se.ImageDoesNotExistInSD(imgUUID, sdUUID)
-
-            srcVol = volclass(self.repoPath, sdUUID, imgUUID, uuidlist[0])
-
-            # For template images include only one volume (the template itself)
-            if len(uuidlist) == 1 and srcVol.isShared():
-                return [srcVol]
-
-            # Searching for the leaf
-            for vol in uuidlist:
-                srcVol = volclass(self.repoPath, sdUUID, imgUUID, vol)
-
-                if srcVol.isLeaf():
-                    break
-
-                srcVol = None
-
-            if not srcVol:
-                self.log.error("There is no leaf in the image %s", imgUUID)
-                raise se.ImageIsNotLegalChain(imgUUID)
-
-        # We have seen corrupted chains that cause endless loops here.
-        # https://bugzilla.redhat.com/1125197
-        seen = set()
-
-        # Build up the sorted parent -> child chain
-        while not srcVol.isShared():
-            chain.insert(0, srcVol)
-            seen.add(srcVol.volUUID)
-
-            parentUUID = srcVol.getParent()
-            if parentUUID == sc.BLANK_UUID:
-                break
-
-            if parentUUID in seen:
-                self.log.error("Image %s volume %s has invalid parent UUID %s",
-                               imgUUID, srcVol.volUUID, parentUUID)
-                raise se.ImageIsNotLegalChain(imgUUID)
-
-            srcVol = srcVol.getParentVolume()
-
-        return chain
+        dom = sdCache.produce(sdUUID)
+        volclass = dom.getVolumeClass()
+        # Resolved using the volumes metadata snapshot of the domain, instead
+        # of reading the metadata of every volume in the image.
+        uuidlist = dom.image_chain(imgUUID, volUUID)
+        return [volclass(self.repoPath, sdUUID, imgUUID, vol)
+                for vol in uuidlist]
 
     def getTemplate(self, sdUUID, imgUUID):
         """
@@ -444,61 +396,80 @@ class Image:
             raise
 
         try:
-            for srcVol in chains['srcChain']:
-                # Do the actual copy
-                try:
-                    dstVol = destDom.produceVolume(imgUUID=imgUUID,
-                                                   volUUID=srcVol.volUUID)
+            copies = [self._volumeCopy(destDom, srcSdUUID, imgUUID, srcVol)
+                      for srcVol in chains['srcChain']]
+            # Every copy writes only the data of its source volume, so the
+            # volumes of the chain can be copied in any order.
+            engine = copyengine.CopyEngine(
+                copies,
+                parallel=config.getint('irs', 'copy_parallel_volumes'),
+                progress_interval=config.getint('irs', 'progress_interval'))
+            try:
+                self._run_qemuimg_operation(engine)
+            except ActionStopped:
+                raise
+            except se.StorageException:
+                self.log.error("Unexpected error", exc_info=True)
+                raise
+            except Exception:
+                self.log.error("Copy image error: image=%s, src domain=%s,"
+                               " dst domain=%s", imgUUID, srcSdUUID,
+                               destDom.sdUUID, exc_info=True)
+                raise se.CopyImageError()
+        finally:
+            # teardown volumes
+            self.__cleanupMove(srcLeafVol, dstLeafVol)
 
-                    if workarounds.invalid_vm_conf_disk(srcVol):
-                        srcFormat = dstFormat = qemuimg.FORMAT.RAW
-                    else:
-                        srcFormat = sc.fmt2str(srcVol.getFormat())
-                        dstFormat = sc.fmt2str(dstVol.getFormat())
+    def _volumeCopy(self, destDom, srcSdUUID, imgUUID, srcVol):
+        try:
+            dstVol = destDom.produceVolume(imgUUID=imgUUID,
+                                           volUUID=srcVol.volUUID)
 
-                    parentVol = dstVol.getParentVolume()
+            if workarounds.invalid_vm_conf_disk(srcVol):
+                srcFormat = dstFormat = qemuimg.FORMAT.RAW
+            else:
+                srcFormat = sc.fmt2str(srcVol.getFormat())
+                dstFormat = sc.fmt2str(dstVol.getFormat())
 
-                    if parentVol is not None:
-                        backing = volume.getBackingVolumePath(
-                            imgUUID, parentVol.volUUID)
-                        backingFormat = sc.fmt2str(parentVol.getFormat())
-                    else:
-                        backing = None
-                        backingFormat = None
+            parentVol = dstVol.getParentVolume()
 
-                    if (destDom.supportsSparseness and
-                            dstVol.getType() == sc.PREALLOCATED_VOL):
-                        preallocation = qemuimg.PREALLOCATION.FALLOC
-                    else:
-                        preallocation = None
+            if parentVol is not None:
+                backing = volume.getBackingVolumePath(
+                    imgUUID, parentVol.volUUID)
+                backingFormat = sc.fmt2str(parentVol.getFormat())
+            else:
+                backing = None
+                backingFormat = None
 
-                    operation = qemuimg.convert(
-                        srcVol.getVolumePath(),
-                        dstVol.getVolumePath(),
-                        srcFormat=srcFormat,
-                        dstFormat=dstFormat,
-                        dstQcow2Compat=destDom.qcow2_compat(),
-                        backing=backing,
-                        backingFormat=backingFormat,
-                        preallocation=preallocation,
-                        unordered_writes=destDom.recommends_unordered_writes(
-                            dstVol.getFormat()))
-                    with utils.stopwatch("Copy volume %s"
-                                         % srcVol.volUUID):
-                        self._run_qemuimg_operation(operation)
-                except ActionStopped:
-                    raise
-                except se.StorageException:
-                    self.log.error("Unexpected error", exc_info=True)
-                    raise
-                except Exception:
-                    self.log.error("Copy image error: image=%s, src domain=%s,"
-                                   " dst domain=%s", imgUUID, srcSdUUID,
-                                   destDom.sdUUID, exc_info=True)
-                    raise se.CopyImageError()
-        finally:
-            # teardown volumes
-            self.__cleanupMove(srcLeafVol, dstLeafVol)
+            if (destDom.supportsSparseness and
+                    dstVol.getType() == sc.PREALLOCATED_VOL):
+                preallocation = qemuimg.PREALLOCATION.FALLOC
+            else:
+                preallocation = None
+
+            operation = qemuimg.convert(
+                srcVol.getVolumePath(),
+                dstVol.getVolumePath(),
+                srcFormat=srcFormat,
+                dstFormat=dstFormat,
+                dstQcow2Compat=destDom.qcow2_compat(),
+                backing=backing,
+                backingFormat=backingFormat,
+                preallocation=preallocation,
+                unordered_writes=destDom.recommends_unordered_writes(
+                    dstVol.getFormat()),
+                coroutines=_convert_coroutines())
+
+            return copyengine.Copy(srcVol.volUUID, operation,
+                                   srcVol.getVolumeTrueSize(bs=1))
+        except se.StorageException:
+            self.log.error("Unexpected error", exc_info=True)
+            raise
+        except Exception:
+            self.log.error("Copy image error: image=%s, src domain=%s,"
+                           " dst domain=%s", imgUUID, srcSdUUID,
+                           destDom.sdUUID, exc_info=True)
+            raise se.CopyImageError()
 
     def _finalizeDestinationImage(self, destDom, imgUUID, chains, force):
         for srcVol in chains['srcChain']:
@@ -823,7 +794,8 @@ class Image:
                         dstQcow2Compat=destDom.qcow2_compat(),
                         preallocation=preallocation,
                         unordered_writes=destDom.recommends_unordered_writes(
-                            dstVolFormat))
+                            dstVolFormat),
+                        coroutines=_convert_coroutines())
                     with utils.stopwatch("Copy volume %s"
                                          % srcVol.volUUID):
                         self._run_qemuimg_operation(operation)
@@ -1,5 +1,5 @@
 #
-# Copyright 2010-2016 Red Hat, Inc.
+# Copyright 2010-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -40,6 +40,8 @@ import threading
 from itertools import chain
 from subprocess import list2cmdline
 
+from six.moves import intern
+
 from vdsm import constants
 from vdsm.storage import devicemapper
 from vdsm.storage import exception as se
@@ -231,6 +233,83 @@ def makeLV(*args):
     return LV(*args)
 
 
+# Parsing reports in bulk
+#
+# lvs reports one line per lv segment, and a block storage domain may have
+# thousands of lvs. The parsers below split every line once, skip
+# segments we do not use before building records, share the attr tuples
+# of lvs with the same attributes, and intern the names repeated in every
+# line, so the records of all the lvs of a vg share the same strings.
+
+_LV_SEG_START_PE = LV._fields.index("seg_start_pe")
+
+
+def _split_report(lines):
+    """
+    Split report lines into fields. Lvm pads only the start of the line
+    when using a separator, so the fields do not need stripping.
+    """
+    return [line.strip().split(SEPARATOR) for line in lines]
+
+
+def _parse_pvs(lines):
+    """
+    Parse pvs report lines, returning a list of PV.
+    """
+    pvs = []
+    for fields in _split_report(lines):
+        uuid, name, size, vg_name, vg_uuid = fields[:5]
+        pvs.append(PV(uuid, name, size, intern(vg_name), intern(vg_uuid),
+                      *fields[5:] + [os.path.basename(name)]))
+    return pvs
+
+
+def _parse_lvs(lines):
+    """
+    Parse lvs report lines, returning a list of LV for the first segment of
+    every lv. We are not interested in the other segments.
+    """
+    attrs_cache = {}
+    lvs = []
+    for fields in _split_report(lines):
+        if fields[_LV_SEG_START_PE] != "0":
+            continue
+        uuid, name, vg_name, attr, size, seg_start_pe, devices, tags = fields
+        try:
+            attrs, writeable, opened, active = attrs_cache[attr]
+        except KeyError:
+            attrs = LV_ATTR(*attr[:len(LV_ATTR._fields)])
+            writeable = attrs.permission == "w"
+            opened = attrs.devopen == "o"
+            active = attrs.state == "a"
+            attrs_cache[attr] = attrs, writeable, opened, active
+        lvs.append(LV(uuid, name, intern(vg_name), attrs, size, "0",
+                      devices, _tags2Tuple(tags), writeable, opened, active))
+    return lvs
+
+
+def _parse_vgs(lines):
+    """
+    Parse vgs report lines, returning a list of VG. vgs reports one line
+    per pv; lines of missing pvs are skipped.
+    """
+    pv_name_idx = VG._fields.index("pv_name")
+    uuid_idx = VG._fields.index("uuid")
+    vgs_fields = {}
+    for fields in _split_report(lines):
+        pv_name = fields[pv_name_idx]
+        if pv_name == UNKNOWN:
+            # PV is missing, e.g. device lost of target not connected
+            continue
+        uuid = fields[uuid_idx]
+        if uuid not in vgs_fields:
+            fields[pv_name_idx] = [pv_name]  # Make a pv_names list
+            vgs_fields[uuid] = fields
+        else:
+            vgs_fields[uuid][pv_name_idx].append(pv_name)
+    return [makeVG(*fields) for fields in vgs_fields.values()]
+
+
 class LVMCache(object):
     """
     Keep all the LVM information.
@@ -317,6 +396,16 @@ class LVMCache(object):
 
         rc, out, err = self.cmd(cmd)
 
+        # Parse the report before taking the lock, so reloading a large
+        # report does not block other threads using the cache.
+        updatedPVs = {}
+        if rc == 0:
+            for pv in _parse_pvs(out):
+                if pv.name == UNKNOWN:
+                    log.error("Missing pv: %s in vg: %s", pv.uuid, pv.vg_name)
+                    continue
+                updatedPVs[pv.name] = pv
+
         with self._lock:
             if rc != 0:
                 log.warning("lvm pvs failed: %s %s %s", str(rc), str(out),
@@ -327,24 +416,16 @@ class LVMCache(object):
                         self._pvs[p] = Unreadable(self._pvs[p].name, True)
                 return dict(self._pvs)
 
-            updatedPVs = {}
-            for line in out:
-                fields = [field.strip() for field in line.split(SEPARATOR)]
-                pv = makePV(*fields)
-                if pv.name == UNKNOWN:
-                    log.error("Missing pv: %s in vg: %s", pv.uuid, pv.vg_name)
-                    continue
-                self._pvs[pv.name] = pv
-                updatedPVs[pv.name] = pv
             # If we updated all the PVs drop stale flag
             if not pvName:
                 self._stalepv = False
                 # Remove stalePVs
-                stalePVs = [staleName for staleName in self._pvs.keys()
-                            if staleName not in updatedPVs.iterkeys()]
+                stalePVs = [staleName for staleName in self._pvs
+                            if staleName not in updatedPVs]
                 for staleName in stalePVs:
                     log.warning("Removing stale PV: %s", staleName)
                     self._pvs.pop((staleName), None)
+            self._pvs.update(updatedPVs)
 
         return updatedPVs
 
@@ -370,6 +451,22 @@ class LVMCache(object):
 
         rc, out, err = self.cmd(cmd, self._getVGDevs(vgNames))
 
+        if rc != 0:
+            # vgs fails if one of the requested vgs is missing, but still
+            # reports the other vgs, so the report is used, but vgs missing
+            # from it are not stale.
+            log.warning("lvm vgs failed: %s %s %s", str(rc), str(out),
+                        str(err))
+
+        # Parse the report before taking the lock, so reloading many vgs
+        # does not block other threads using the cache.
+        updatedVGs = {}
+        for vg in _parse_vgs(out):
+            if int(vg.pv_count) != len(vg.pv_name):
+                log.error("vg %s has pv_count %s but pv_names %s",
+                          vg.name, vg.pv_count, vg.pv_name)
+            updatedVGs[vg.name] = vg
+
         with self._lock:
             if rc != 0:
                 vgNames = vgNames if vgNames else self._vgs.keys()
@@ -380,38 +477,17 @@ class LVMCache(object):
             if not len(out):
                 return dict(self._vgs)
 
-            updatedVGs = {}
-            vgsFields = {}
-            for line in out:
-                fields = [field.strip() for field in line.split(SEPARATOR)]
-                uuid = fields[VG._fields.index("uuid")]
-                pvNameIdx = VG._fields.index("pv_name")
-                pv_name = fields[pvNameIdx]
-                if pv_name == UNKNOWN:
-                    # PV is missing, e.g. device lost of target not connected
-                    continue
-                if uuid not in vgsFields:
-                    fields[pvNameIdx] = [pv_name]  # Make a pv_names list
-                    vgsFields[uuid] = fields
-                else:
-                    vgsFields[uuid][pvNameIdx].append(pv_name)
-            for fields in vgsFields.itervalues():
-                vg = makeVG(*fields)
-                if int(vg.pv_count) != len(vg.pv_name):
-                    log.error("vg %s has pv_count %s but pv_names %s",
-                              vg.name, vg.pv_count, vg.pv_name)
-                self._vgs[vg.name] = vg
-                updatedVGs[vg.name] = vg
             # If we updated all the VGs drop stale flag
-            if not vgName:
+            if not vgName and rc == 0:
                 self._stalevg = False
                 # Remove stale VGs
-                staleVGs = [staleName for staleName in self._vgs.keys()
-                            if staleName not in updatedVGs.iterkeys()]
+                staleVGs = [staleName for staleName in self._vgs
+                            if staleName not in updatedVGs]
                 for staleName in staleVGs:
                     removeVgMapping(staleName)
                     log.warning("Removing stale VG: %s", staleName)
                     self._vgs.pop((staleName), None)
+            self._vgs.update(updatedVGs)
 
         return updatedVGs
 
@@ -425,6 +501,13 @@ class LVMCache(object):
 
         rc, out, err = self.cmd(cmd, self._getVGDevs((vgName,)))
 
+        # Parse the report before taking the lock, so reloading a vg with
+        # many lvs does not block other threads using the cache.
+        updatedLVs = {}
+        if rc == 0:
+            for lv in _parse_lvs(out):
+                updatedLVs[(lv.vg_name, lv.name)] = lv
+
         with self._lock:
             if rc != 0:
                 log.warning("lvm lvs failed: %s %s %s", str(rc), str(out),
@@ -435,24 +518,17 @@ class LVMCache(object):
                         self._lvs[l] = Unreadable(self._lvs[l].name, True)
                 return dict(self._lvs)
 
-            updatedLVs = {}
-            for line in out:
-                fields = [field.strip() for field in line.split(SEPARATOR)]
-                lv = makeLV(*fields)
-                # For LV we are only interested in its first extent
-                if lv.seg_start_pe == "0":
-                    self._lvs[(lv.vg_name, lv.name)] = lv
-                    updatedLVs[(lv.vg_name, lv.name)] = lv
+            self._lvs.update(updatedLVs)
 
             # Determine if there are stale LVs
             if lvNames:
-                staleLVs = (lvName for lvName in lvNames
-                            if (vgName, lvName) not in updatedLVs.iterkeys())
+                staleLVs = [lvName for lvName in lvNames
+                            if (vgName, lvName) not in updatedLVs]
             else:
                 # All the LVs in the VG
-                staleLVs = (lvName for v, lvName in self._lvs.keys()
+                staleLVs = [lvName for v, lvName in self._lvs
                             if (v == vgName) and
-                            ((vgName, lvName) not in updatedLVs.iterkeys()))
+                            ((vgName, lvName) not in updatedLVs)]
 
             for lvName in staleLVs:
                 log.warning("Removing stale lv: %s/%s", vgName, lvName)
@@ -469,21 +545,18 @@ class LVMCache(object):
         cmd = list(LVS_CMD)
         rc, out, err = self.cmd(cmd)
         if rc == 0:
-            updatedLVs = set()
-            for line in out:
-                fields = [field.strip() for field in line.split(SEPARATOR)]
-                lv = makeLV(*fields)
-                # For LV we are only interested in its first extent
-                if lv.seg_start_pe == "0":
-                    self._lvs[(lv.vg_name, lv.name)] = lv
-                    updatedLVs.add((lv.vg_name, lv.name))
-
-            # Remove stales
-            for vgName, lvName in self._lvs.keys():
-                if (vgName, lvName) not in updatedLVs:
-                    self._lvs.pop((vgName, lvName), None)
-                    log.error("Removing stale lv: %s/%s", vgName, lvName)
-            self._stalelv = False
+            updatedLVs = {}
+            for lv in _parse_lvs(out):
+                updatedLVs[(lv.vg_name, lv.name)] = lv
+
+            with self._lock:
+                # Remove stales
+                for vgName, lvName in self._lvs.keys():
+                    if (vgName, lvName) not in updatedLVs:
+                        log.error("Removing stale lv: %s/%s", vgName, lvName)
+                # Replace the cache instead of updating every lv.
+                self._lvs = updatedLVs
+                self._stalelv = False
         return dict(self._lvs)
 
     def _invalidatepvs(self, pvNames):
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2017 Red Hat, Inc.
+# Copyright 2009-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -20,6 +20,7 @@
 
 from __future__ import absolute_import
 import array
+import functools
 import os
 import errno
 import time
@@ -27,15 +28,12 @@ import threading
 import struct
 import logging
 
-import uuid
-
 from six.moves import queue
 
-from vdsm.config import config
 from vdsm.storage import misc
 from vdsm.storage import task
+from vdsm.storage import workers
 from vdsm.storage.exception import InvalidParameterException
-from vdsm.storage.threadPool import ThreadPool
 
 from vdsm import constants
 from vdsm.common import concurrent
@@ -215,7 +213,6 @@ class HSM_Mailbox:
     def stop(self):
         if self._mailman:
             self._mailman.immStop()
-            self._mailman.tp.joinAll(waitForTasks=False)
         else:
             self.log.warning("HSM_MailboxMonitor - No mail monitor object "
                              "available to stop")
@@ -229,10 +226,6 @@ class HSM_MailMonitor(object):
 
     def __init__(self, inbox, outbox, hostID, queue, monitorInterval):
         # Save arguments
-        tpSize = config.getint('irs', 'thread_pool_size') // 2
-        waitTimeout = wait_timeout(monitorInterval)
-        maxTasks = config.getint('irs', 'max_tasks')
-        self.tp = ThreadPool("mailbox-hsm", tpSize, waitTimeout, maxTasks)
         self._stop = False
         self._queue = queue
         self._activeMessages = {}
@@ -339,10 +332,11 @@ class HSM_MailMonitor(object):
                 msg.checkReply(newMsg)
                 if msg.callback:
                     try:
-                        id = str(uuid.uuid4())
-                        if not self.tp.queueTask(id, runTask, (msg.callback,
-                                                 msg.volumeData)):
-                            raise Exception()
+                        workers.dispatch(
+                            functools.partial(
+                                self._runTask,
+                                (msg.callback, msg.volumeData)),
+                            workers.EXTEND)
                     except:
                         self.log.error("HSM_MailMonitor: exception caught "
                                        "while running msg callback, for "
@@ -503,6 +497,13 @@ class HSM_MailMonitor(object):
             self._outgoingMail = EMPTYMAILBOX
             self._sendMail()  # Clear outgoing mailbox
 
+    def _runTask(self, args):
+        if self._stop:
+            self.log.debug("HSM_MailMonitor stopped, dropping reply "
+                           "callback")
+            return
+        runTask(args)
+
 
 class SPM_MailMonitor:
 
@@ -524,10 +525,6 @@ class SPM_MailMonitor:
         self._stop = False
         self._stopped = False
         self._poolID = poolID
-        tpSize = config.getint('irs', 'thread_pool_size') // 2
-        waitTimeout = wait_timeout(monitorInterval)
-        maxTasks = config.getint('irs', 'max_tasks')
-        self.tp = ThreadPool("mailbox-spm", tpSize, waitTimeout, maxTasks)
         self._inbox = inbox
         if not os.path.exists(self._inbox):
             self.log.error("SPM_MailMonitor create failed - inbox %s does not "
@@ -676,17 +673,15 @@ class SPM_MailMonitor:
                     if msgType in self._messageTypes:
                         # Use message class to process request according to
                         # message specific logic
-                        id = str(uuid.uuid4())
                         self.log.debug("SPM_MailMonitor: processing request: "
                                        "%s" % repr(newMail[
                                            msgStart:msgStart + MESSAGE_SIZE]))
-                        res = self.tp.queueTask(
-                            id, runTask, (self._messageTypes[msgType], msgId,
-                                          newMail[msgStart:
-                                                  msgStart + MESSAGE_SIZE])
-                        )
-                        if not res:
-                            raise Exception()
+                        workers.dispatch(
+                            functools.partial(
+                                self._runTask,
+                                (self._messageTypes[msgType], msgId,
+                                 newMail[msgStart:msgStart + MESSAGE_SIZE])),
+                            workers.EXTEND)
                     else:
                         self.log.error("SPM_MailMonitor: unknown message type "
                                        "encountered: %s", msgType)
@@ -763,15 +758,13 @@ class SPM_MailMonitor:
                 time.sleep(self._monitorInterval)
         finally:
             self._stopped = True
-            self.tp.joinAll(waitForTasks=False)
             self.log.info("SPM_MailMonitor - Incoming mail monitoring thread "
                           "stopped")
 
-
-def wait_timeout(monitor_interval):
-    """
-    Designed to return 3 seconds wait timeout for monitor interval of 2
-    seconds, keeping the behaivor in runtime the same as it was in the last 8
-    years, while allowing shorter times for testing.
-    """
-    return monitor_interval * 3 / 2
+    def _runTask(self, args):
+        # Requests received before the monitor was stopped may wait in the
+        # shared workers queue; the pool may not be the SPM now.
+        if self._stop:
+            self.log.debug("SPM_MailMonitor stopped, dropping request")
+            return
+        runTask(args)
@@ -46,12 +46,12 @@ from functools import wraps, partial
 from six.moves import map
 from six.moves import queue
 
-from vdsm import constants
 from vdsm.common import commands
 from vdsm.common import concurrent
 from vdsm.common import logutils
 from vdsm.common import proc
 
+from vdsm.storage import directio
 from vdsm.storage import exception as se
 from vdsm.storage.constants import BLOCK_SIZE
 
@@ -60,6 +60,7 @@ DIRECTFLAG = "direct"
 STR_UUID_SIZE = 36
 UUID_HYPHENS = [8, 13, 18, 23]
 MEGA = 1 << 20
+DIRECT_READ_CHUNK = 8 * MEGA
 UNLIMITED_THREADS = -1
 
 log = logging.getLogger('storage.Misc')
@@ -92,31 +93,41 @@ def readblock(name, offset, size):
     '''
     Read (direct IO) the content of device 'name' at offset, size bytes
     '''
+    return read_direct(name, offset, size).splitlines()
 
+
+def read_direct(name, offset, size):
+    """
+    Read size bytes from device 'name' at offset using direct I/O.
+
+    The read is done in this process into aligned buffers, instead of
+    running dd for every call. Reading a large range, like a whole
+    metadata volume, costs a single open and few reads.
+    """
     # direct io must be aligned on block size boundaries
     if (size % 512) or (offset % 512):
         raise se.MiscBlockReadException(name, offset, size)
 
+    chunks = []
     left = size
-    ret = ""
-    baseoffset = offset
-
-    while left > 0:
-        (iounit, count, iooffset) = _alignData(left, offset)
-
-        cmd = [constants.EXT_DD, "iflag=%s" % DIRECTFLAG, "skip=%d" % iooffset,
-               "bs=%d" % iounit, "if=%s" % name, "count=%s" % count]
-
-        (rc, out, err) = execCmd(cmd, raw=True)
-        if rc:
-            raise se.MiscBlockReadException(name, offset, size)
-        if not validateDDBytes(err.splitlines(), iounit * count):
-            raise se.MiscBlockReadIncomplete(name, offset, size)
+    try:
+        with directio.DirectFile(name, "r") as f:
+            f.seek(offset)
+            while left > 0:
+                length = min(left, DIRECT_READ_CHUNK)
+                chunk = f.read(length)
+                chunks.append(chunk)
+                left -= len(chunk)
+                if len(chunk) < length:
+                    break  # EOF
+    except EnvironmentError as e:
+        log.error("Error reading %s offset=%s size=%s: %s",
+                  name, offset, size, e)
+        raise se.MiscBlockReadException(name, offset, size)
 
-        ret += out
-        left = left % iounit
-        offset = baseoffset + size - left
-    return ret.splitlines()
+    if left > 0:
+        raise se.MiscBlockReadIncomplete(name, offset, size)
+    return b"".join(chunks)
 
 
 def validateDDBytes(ddstderr, size):
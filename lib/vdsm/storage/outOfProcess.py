@@ -1,5 +1,5 @@
 #
-# Copyright 2011-2016 Red Hat, Inc.
+# Copyright 2011-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -331,6 +331,10 @@ def readLines(ioproc, path):
     return ioproc.readlines(path)
 
 
+def readFile(ioproc, path, direct=False):
+    return ioproc.readfile(path, direct=direct)
+
+
 def writeLines(ioproc, path, lines):
     data = ''.join(lines)
     return writeFile(ioproc, path, data)
@@ -371,6 +375,7 @@ class _IOProcWrapper(types.ModuleType):
 
         self.directReadLines = partial(directReadLines, ioproc)
         self.readLines = partial(readLines, ioproc)
+        self.readFile = partial(readFile, ioproc)
         self.writeLines = partial(writeLines, ioproc)
         self.writeFile = partial(writeFile, ioproc)
         self.simpleWalk = partial(simpleWalk, ioproc)
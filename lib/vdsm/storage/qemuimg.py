@@ -1,5 +1,5 @@
 #
-# Copyright 2012-2017 Red Hat, Inc.
+# Copyright 2012-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -234,12 +234,15 @@ def check(image, format=None):
 
 def convert(srcImage, dstImage, srcFormat=None, dstFormat=None,
             dstQcow2Compat=None, backing=None, backingFormat=None,
-            preallocation=None, compressed=False, unordered_writes=False):
+            preallocation=None, compressed=False, unordered_writes=False,
+            coroutines=None):
     """
     Arguments:
         unordered_writes (bool): Allow out-of-order writes to the destination.
             This option improves performance, but is only recommended for
             preallocated devices like host devices or other raw block devices.
+        coroutines (int): Number of parallel coroutines used for the copy.
+            If None, use qemu-img default.
     """
     cmd = [_qemuimg.cmd, "convert", "-p", "-t", "none", "-T", "none"]
     options = []
@@ -274,6 +277,9 @@ def convert(srcImage, dstImage, srcFormat=None, dstFormat=None,
     if compressed:
         cmd.append('-c')
 
+    if coroutines:
+        cmd.extend(('-m', str(coroutines)))
+
     if unordered_writes:
         cmd.append('-W')
 
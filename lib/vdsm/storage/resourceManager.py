@@ -1,5 +1,5 @@
 #
-# Copyright 2011-2017 Red Hat, Inc.
+# Copyright 2011-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,6 +19,7 @@
 #
 from __future__ import absolute_import
 
+import bisect
 import threading
 import logging
 import re
@@ -26,10 +27,12 @@ import weakref
 from functools import partial
 from uuid import uuid4
 
+import six
 from six.moves import queue
 
 from vdsm import utils
 from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
 from vdsm.common.logutils import SimpleLogAdapter
 from vdsm.storage import exception as se
 from vdsm.storage import guarded
@@ -167,8 +170,10 @@ class Request(object):
     fullName = property(lambda self: "%s.%s" % (self._namespace, self._name))
     lockType = property(lambda self: self._lockType)
     syncRoot = property(lambda self: self._syncRoot)
+    created = property(lambda self: self._created)
 
     def __init__(self, namespace, name, lockType, callback):
+        self._created = monotonic_time()
         self._syncRoot = threading.RLock()
         self._namespace = namespace
         self._name = name
@@ -394,23 +399,64 @@ class _ResourceManager(object):
             raise ValueError("Invalid resource name '%s'" % name)
 
         with self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager" % namespace)
-            resources = namespaceObj.resources
+            namespaceObj = self._getNamespace(namespace)
+            if not namespaceObj.factory.resourceExists(name):
+                raise KeyError("No such resource '%s.%s'" % (namespace, name))
+
             with namespaceObj.lock:
-                if not namespaceObj.factory.resourceExists(name):
-                    raise KeyError("No such resource '%s.%s'" % (namespace,
-                                                                 name))
+                resource = namespaceObj.resources.get(name)
+
+            if resource is None:
+                return LockState.free
+
+            return LockState.fromType(resource.currentLock)
 
-                if name not in resources:
-                    return LockState.free
+    def lockStats(self):
+        """
+        Return the wait and hold time histograms of every namespace, and the
+        resources that have requests waiting for them.
+        """
+        namespaces = {}
+        contended = []
+        with self._syncRoot.shared:
+            now = monotonic_time()
+            for namespace, namespaceObj in six.iteritems(self._namespaces):
+                with namespaceObj.lock:
+                    resources = list(namespaceObj.resources.values())
+
+                namespaces[namespace] = {
+                    "resources": len(resources),
+                    "waitTime": namespaceObj.waitTimes.info(),
+                    "holdTime": namespaceObj.holdTimes.info(),
+                }
+
+                for resource in resources:
+                    with resource.lock:
+                        waiting = [r for r in resource.queue
+                                   if not r.canceled()]
+                        if not waiting:
+                            continue
+                        contended.append({
+                            "name": resource.fullName,
+                            "lockType": resource.currentLock,
+                            "activeUsers": resource.activeUsers,
+                            "waiting": len(waiting),
+                            "maxWait": now - min(r.created for r in waiting),
+                        })
+
+        return {"namespaces": namespaces, "contended": contended}
 
-                return LockState.fromType(resources[name].currentLock)
+    def _getNamespace(self, namespace):
+        """
+        Must be called when holding self._syncRoot.
+        """
+        try:
+            return self._namespaces[namespace]
+        except KeyError:
+            raise ValueError("Namespace '%s' is not registered with this "
+                             "manager" % namespace)
 
-    def _switchLockType(self, resourceInfo, newLockType):
+    def _switchLockType(self, namespaceObj, resourceInfo, newLockType):
         switchLock = (resourceInfo.currentLock != newLockType)
         resourceInfo.currentLock = newLockType
 
@@ -430,8 +476,7 @@ class _ResourceManager(object):
             # If the resource can't switch we just release it and create it
             # again under a different locktype
             self._freeResource(resourceInfo)
-            namespace = self._namespaces[resourceInfo.namespace]
-            resourceInfo.realObj = namespace.factory.createResource(
+            resourceInfo.realObj = namespaceObj.factory.createResource(
                 resourceInfo.name, resourceInfo.currentLock)
 
     def _freeResource(self, resourceInfo):
@@ -480,6 +525,11 @@ class _ResourceManager(object):
         """
         Register to acquire a resource asynchronously.
 
+        The namespace lock is held only to look up the resource. Requests are
+        queued and granted under the lock of the resource, and the resource
+        object is created without holding any lock, so requests for other
+        resources in the namespace do not wait for it.
+
         :returns: a request object that tracks the current request.
         """
         fullName = "%s.%s" % (namespace, name)
@@ -494,21 +544,36 @@ class _ResourceManager(object):
         self._log.debug("Trying to register resource '%s' for lock type '%s'",
                         fullName, lockType)
         with utils.RollbackContext() as contextCleanup, self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager" % namespace)
-
+            namespaceObj = self._getNamespace(namespace)
             resources = namespaceObj.resources
-            with namespaceObj.lock:
-                try:
-                    resource = resources[name]
-                except KeyError:
+            exists = False
+
+            while True:
+                with namespaceObj.lock:
+                    resource = resources.get(name)
+                    if resource is None and exists:
+                        # Reserve the resource for this request, requests
+                        # registered while we create it wait in its queue.
+                        resource = ResourceInfo(None, namespace, name)
+                        resource.creating = True
+                        resource.currentLock = lockType
+                        resource.activeUsers = 1
+                        resources[name] = resource
+                        break
+
+                if resource is None:
                     if not namespaceObj.factory.resourceExists(name):
                         raise KeyError("No such resource '%s'" % (fullName))
-                else:
-                    if len(resource.queue) == 0 and \
+                    exists = True
+                    continue
+
+                with resource.lock:
+                    if resource.removed:
+                        # Released by the last user after our lookup.
+                        continue
+
+                    if not resource.creating and \
+                            len(resource.queue) == 0 and \
                             resource.currentLock == SHARED and \
                             request.lockType == SHARED:
                         resource.activeUsers += 1
@@ -516,11 +581,8 @@ class _ResourceManager(object):
                                         "and queue is empty, Joining current "
                                         "shared lock (%d active users)",
                                         fullName, resource.activeUsers)
-                        request.grant()
-                        contextCleanup.defer(request.emit,
-                                             ResourceRef(namespace, name,
-                                                         resource.realObj,
-                                                         request.reqID))
+                        self._grant(namespaceObj, resource, request,
+                                    contextCleanup)
                         return RequestRef(request)
 
                     resource.queue.insert(0, request)
@@ -529,33 +591,61 @@ class _ResourceManager(object):
                                     fullName, len(resource.queue))
                     return RequestRef(request)
 
-                # TODO : Creating the object inside the namespace lock causes
-                #        the entire namespace to lock and might cause
-                #        performance issues. As this is no currently a problem
-                #        I left it as it is to keep the code simple. If there
-                #        is a bottleneck in the resource framework, its
-                #        probably here.
+            self._createResource(namespaceObj, resource, request,
+                                 contextCleanup)
+            return RequestRef(request)
+
+    def _createResource(self, namespaceObj, resource, request,
+                        contextCleanup):
+        """
+        Create the object of a resource reserved for request. Must be called
+        without holding the namespace or the resource lock.
+
+        If the factory fails, the request is canceled and the creation is
+        retried for the next request waiting for the resource.
+        """
+        while True:
+            try:
+                obj = namespaceObj.factory.createResource(resource.name,
+                                                          request.lockType)
+            except Exception:
+                self._log.warn("Resource factory failed to create resource"
+                               " '%s'. Canceling request.", resource.fullName,
+                               exc_info=True)
                 try:
-                    obj = namespaceObj.factory.createResource(name, lockType)
-                except:
-                    self._log.warn("Resource factory failed to create resource"
-                                   " '%s'. Canceling request.", fullName,
-                                   exc_info=True)
-                    contextCleanup.defer(request.cancel)
-                    return RequestRef(request)
+                    request.cancel()
+                except RequestAlreadyProcessedError:
+                    pass
 
-                resource = resources[name] = ResourceInfo(obj, namespace, name)
-                resource.currentLock = request.lockType
-                resource.activeUsers += 1
+                with resource.lock:
+                    request = self._popWaitingRequest(resource)
+                    if request is None:
+                        self._removeResource(namespaceObj, resource)
+                        return
+                    resource.currentLock = request.lockType
+                continue
+
+            with resource.lock:
+                resource.realObj = obj
+                resource.creating = False
+                with request.syncRoot:
+                    if request.canceled():
+                        self._log.debug("Request '%s' was canceled while "
+                                        "creating the resource", request)
+                        resource.activeUsers = 0
+                        self._grantNext(namespaceObj, resource,
+                                        contextCleanup)
+                        return
+
+                    self._grant(namespaceObj, resource, request,
+                                contextCleanup)
 
                 self._log.debug("Resource '%s' is free. Now locking as '%s' "
-                                "(1 active user)", fullName, request.lockType)
-                request.grant()
-                contextCleanup.defer(request.emit,
-                                     ResourceRef(namespace, name,
-                                                 resource.realObj,
-                                                 request.reqID))
-                return RequestRef(request)
+                                "(1 active user)", resource.fullName,
+                                request.lockType)
+                if resource.currentLock == SHARED:
+                    self._grantShared(namespaceObj, resource, contextCleanup)
+                return
 
     def releaseResource(self, namespace, name):
         # WARN : unlike in resource acquire the user now has the request
@@ -566,17 +656,18 @@ class _ResourceManager(object):
 
         self._log.debug("Trying to release resource '%s'", fullName)
         with utils.RollbackContext() as contextCleanup, self._syncRoot.shared:
-            try:
-                namespaceObj = self._namespaces[namespace]
-            except KeyError:
-                raise ValueError("Namespace '%s' is not registered with this "
-                                 "manager", namespace)
-            resources = namespaceObj.resources
+            namespaceObj = self._getNamespace(namespace)
 
             with namespaceObj.lock:
-                try:
-                    resource = resources[name]
-                except KeyError:
+                resource = namespaceObj.resources.get(name)
+
+            if resource is None:
+                raise ValueError("Resource '%s.%s' is not currently "
+                                 "registered" % (namespace, name))
+
+            with resource.lock:
+                if resource.removed or resource.creating or \
+                        resource.activeUsers == 0:
                     raise ValueError("Resource '%s.%s' is not currently "
                                      "registered" % (namespace, name))
 
@@ -587,97 +678,179 @@ class _ResourceManager(object):
                 # Is some one else is using the resource
                 if resource.activeUsers > 0:
                     return
+
+                namespaceObj.holdTimes.add(
+                    monotonic_time() - resource.lockedSince)
+                resource.lockedSince = None
+
                 self._log.debug("Resource '%s' is free, finding out if anyone "
                                 "is waiting for it.", fullName)
-                # Grant a request
-                while True:
-                    # Is there someone waiting for the resource
-                    if len(resource.queue) == 0:
-                        self._freeResource(resources[name])
-                        del resources[name]
-                        self._log.debug("No one is waiting for resource '%s', "
-                                        "Clearing records.", fullName)
-                        return
+                self._grantNext(namespaceObj, resource, contextCleanup)
 
-                    self._log.debug("Resource '%s' has %d requests in queue. "
-                                    "Handling top request.", fullName,
-                                    len(resource.queue))
-                    nextRequest = resource.queue.pop()
-                    # We lock the request to simulate a transaction. We cannot
-                    # grant the request before there is a resource switch. And
-                    # we can't do a resource switch before we can guarantee
-                    # that the request will be granted.
-                    with nextRequest.syncRoot:
-                        if nextRequest.canceled():
-                            self._log.debug("Request '%s' was canceled, "
-                                            "Ignoring it.", nextRequest)
-                            continue
+    def _grantNext(self, namespaceObj, resource, contextCleanup):
+        """
+        Grant the free resource to the requests waiting for it, or remove it
+        if no one is waiting. Must be called when holding resource.lock.
+        """
+        while True:
+            # Is there someone waiting for the resource
+            if len(resource.queue) == 0:
+                self._removeResource(namespaceObj, resource)
+                self._log.debug("No one is waiting for resource '%s', "
+                                "Clearing records.", resource.fullName)
+                return
 
-                        try:
-                            self._switchLockType(resource,
-                                                 nextRequest.lockType)
-                        except Exception:
-                            self._log.warn("Resource factory failed to create "
-                                           "resource '%s'. Canceling request.",
-                                           fullName, exc_info=True)
-                            nextRequest.cancel()
-                            continue
+            self._log.debug("Resource '%s' has %d requests in queue. "
+                            "Handling top request.", resource.fullName,
+                            len(resource.queue))
+            nextRequest = resource.queue.pop()
+            # We lock the request to simulate a transaction. We cannot
+            # grant the request before there is a resource switch. And
+            # we can't do a resource switch before we can guarantee
+            # that the request will be granted.
+            with nextRequest.syncRoot:
+                if nextRequest.canceled():
+                    self._log.debug("Request '%s' was canceled, "
+                                    "Ignoring it.", nextRequest)
+                    continue
 
-                        nextRequest.grant()
-                        contextCleanup.defer(
-                            partial(nextRequest.emit,
-                                    ResourceRef(namespace, name,
-                                                resource.realObj,
-                                                nextRequest.reqID)))
+                try:
+                    self._switchLockType(namespaceObj, resource,
+                                         nextRequest.lockType)
+                except Exception:
+                    self._log.warn("Resource factory failed to create "
+                                   "resource '%s'. Canceling request.",
+                                   resource.fullName, exc_info=True)
+                    nextRequest.cancel()
+                    continue
+
+                self._grant(namespaceObj, resource, nextRequest,
+                            contextCleanup)
+                resource.activeUsers += 1
 
-                        resource.activeUsers += 1
+                self._log.debug("Request '%s' was granted", nextRequest)
+                break
 
-                        self._log.debug("Request '%s' was granted",
-                                        nextRequest)
-                        break
+        # If the lock is exclusive were done
+        if resource.currentLock == EXCLUSIVE:
+            return
 
-                # If the lock is exclusive were done
-                if resource.currentLock == EXCLUSIVE:
-                    return
+        self._grantShared(namespaceObj, resource, contextCleanup)
 
-                # Keep granting shared locks
-                self._log.debug("This is a shared lock. Granting all shared "
-                                "requests")
-                while len(resource.queue) > 0:
+    def _grantShared(self, namespaceObj, resource, contextCleanup):
+        """
+        Grant the shared requests at the head of the queue of a resource
+        locked as shared. Must be called when holding resource.lock.
+        """
+        self._log.debug("This is a shared lock. Granting all shared "
+                        "requests")
+        while len(resource.queue) > 0:
 
-                    nextRequest = resource.queue[-1]
-                    if nextRequest.canceled():
-                        resource.queue.pop()
-                        continue
+            nextRequest = resource.queue[-1]
+            if nextRequest.canceled():
+                resource.queue.pop()
+                continue
 
-                    if nextRequest.lockType == EXCLUSIVE:
-                        break
+            if nextRequest.lockType == EXCLUSIVE:
+                break
 
-                    nextRequest = resource.queue.pop()
-                    try:
-                        nextRequest.grant()
-                        contextCleanup.defer(
-                            partial(nextRequest.emit,
-                                    ResourceRef(namespace, name,
-                                                resource.realObj,
-                                                nextRequest.reqID)))
-                    except RequestAlreadyProcessedError:
-                        continue
+            nextRequest = resource.queue.pop()
+            try:
+                self._grant(namespaceObj, resource, nextRequest,
+                            contextCleanup)
+            except RequestAlreadyProcessedError:
+                continue
 
-                    resource.activeUsers += 1
-                    self._log.debug("Request '%s' was granted (%d "
-                                    "active users)", nextRequest,
-                                    resource.activeUsers)
+            resource.activeUsers += 1
+            self._log.debug("Request '%s' was granted (%d "
+                            "active users)", nextRequest,
+                            resource.activeUsers)
+
+    def _grant(self, namespaceObj, resource, request, contextCleanup):
+        """
+        Grant request and record how long it waited. The request is notified
+        when contextCleanup exits, after the locks were released. Must be
+        called when holding resource.lock.
+        """
+        request.grant()
+        now = monotonic_time()
+        namespaceObj.waitTimes.add(now - request.created)
+        if resource.lockedSince is None:
+            resource.lockedSince = now
+        contextCleanup.defer(
+            partial(request.emit,
+                    ResourceRef(resource.namespace, resource.name,
+                                resource.realObj, request.reqID)))
+
+    def _popWaitingRequest(self, resource):
+        """
+        Must be called when holding resource.lock.
+        """
+        while len(resource.queue) > 0:
+            request = resource.queue.pop()
+            if not request.canceled():
+                return request
+        return None
+
+    def _removeResource(self, namespaceObj, resource):
+        """
+        Must be called when holding resource.lock.
+        """
+        self._freeResource(resource)
+        resource.removed = True
+        with namespaceObj.lock:
+            del namespaceObj.resources[resource.name]
+
+
+class Histogram(object):
+    """
+    Thread safe histogram of durations in seconds.
+
+    Every bucket counts the durations up to its limit, the last bucket counts
+    the durations longer than the last limit.
+    """
+    LIMITS = (0.001, 0.01, 0.1, 1.0, 10.0, 60.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = [0] * (len(self.LIMITS) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+
+    def add(self, seconds):
+        index = bisect.bisect_left(self.LIMITS, seconds)
+        with self._lock:
+            self._buckets[index] += 1
+            self._count += 1
+            self._total += seconds
+            self._max = max(self._max, seconds)
+
+    def info(self):
+        with self._lock:
+            return {
+                "limits": list(self.LIMITS),
+                "buckets": list(self._buckets),
+                "count": self._count,
+                "total": self._total,
+                "max": self._max,
+            }
 
 
 class Namespace(object):
     """
     Namespace struct
+
+    The lock protects only the resources dict, the state of each resource is
+    protected by the resource lock. Never take the namespace lock and then a
+    resource lock.
     """
     def __init__(self, factory):
         self.resources = {}
-        self.lock = threading.Lock()  # rwlock.RWLock()
+        self.lock = threading.Lock()
         self.factory = factory
+        self.waitTimes = Histogram()
+        self.holdTimes = Histogram()
 
 
 class ResourceInfo(object):
@@ -685,6 +858,7 @@ class ResourceInfo(object):
     Resource struct
     """
     def __init__(self, realObj, namespace, name):
+        self.lock = threading.Lock()
         self.queue = []
         self.activeUsers = 0
         self.currentLock = None
@@ -692,6 +866,11 @@ class ResourceInfo(object):
         self.namespace = namespace
         self.name = name
         self.fullName = "%s.%s" % (namespace, name)
+        # True while the resource object is created for the first user.
+        self.creating = False
+        # True once removed from the namespace, lookups must be retried.
+        self.removed = False
+        self.lockedSince = None
 
 
 class Owner(object):
@@ -1029,6 +1208,10 @@ def releaseResource(namespace, name):
     _manager.releaseResource(namespace, name)
 
 
+def lock_stats():
+    return _manager.lockStats()
+
+
 def getNamespace(*args):
     """
     Format namespace stirng from sequence of names.
@@ -320,6 +320,10 @@ class StorageDomainManifest(object):
         self.replaceMetadata(metadata)
         self._domainLock = self._makeDomainLock()
         self._external_leases_lock = rwlock.RWLock()
+        self._volumes_snapshot = None
+        # Images whose volumes must be reloaded before using the snapshot.
+        self._stale_images = set()
+        self._volumes_snapshot_lock = threading.Lock()
 
     @classmethod
     def special_volumes(cls, version):
@@ -449,6 +453,104 @@ class StorageDomainManifest(object):
         return self.getVolumeClass()(self.mountpoint, self.sdUUID, imgUUID,
                                      volUUID)
 
+    # Volumes metadata snapshot
+
+    def volumes_snapshot(self, refresh=False):
+        """
+        Return a VolumesSnapshot with the metadata of all the volumes in the
+        domain, loading it if there is no snapshot, or if refresh is True.
+        The volumes of invalidated images are reloaded.
+        """
+        with self._volumes_snapshot_lock:
+            if refresh or self._volumes_snapshot is None:
+                with utils.stopwatch(
+                        "Loading volumes metadata of domain %s" % self.sdUUID,
+                        log=self.log):
+                    self._volumes_snapshot = self._load_volumes_snapshot()
+                self._stale_images.clear()
+            elif self._stale_images:
+                images = {}
+                for imgUUID in self._stale_images:
+                    images[imgUUID] = self.read_volumes_info(
+                        imgUUID, self.list_image_volumes(imgUUID))
+                self.log.debug("Reloaded volumes metadata of images %s",
+                               sorted(images))
+                self._volumes_snapshot = self._volumes_snapshot.replace_images(
+                    images)
+                self._stale_images.clear()
+            return self._volumes_snapshot
+
+    def invalidate_volumes_snapshot(self, imgUUID=None):
+        """
+        Mark the volumes of image imgUUID in the volumes metadata snapshot as
+        stale, or drop the snapshot if imgUUID is None. Must be called after
+        creating or deleting volumes, or modifying their metadata.
+        """
+        with self._volumes_snapshot_lock:
+            if imgUUID is None:
+                self._volumes_snapshot = None
+                self._stale_images.clear()
+            elif self._volumes_snapshot is not None:
+                self._stale_images.add(imgUUID)
+
+    def image_chain(self, imgUUID, volUUID=None):
+        """
+        Return the UUIDs of the volumes in the chain of image imgUUID, as
+        returned by VolumesSnapshot.chain.
+
+        Another host (the SPM, or the host running a VM after a live merge)
+        may have changed the image since the snapshot was loaded. Added or
+        removed volumes are detected by listing the image volumes, which is
+        cheap. Changing the parent or the type of a volume does not change
+        the image volumes, so the metadata of the volumes in the chain is
+        read again, once per volume. If the image changed, only the volumes
+        of this image are reloaded.
+        """
+        snapshot = self.volumes_snapshot()
+        if (sorted(snapshot.image_volumes(imgUUID)) !=
+                sorted(self.list_image_volumes(imgUUID))):
+            self.log.debug("Image %s volumes changed since the volumes "
+                           "snapshot was loaded, reloading", imgUUID)
+            self.invalidate_volumes_snapshot(imgUUID)
+            snapshot = self.volumes_snapshot()
+
+        try:
+            chain = snapshot.chain(imgUUID, volUUID)
+        except (se.ImageDoesNotExistInSD, se.ImageIsNotLegalChain,
+                se.VolumeDoesNotExist) as e:
+            self.log.debug("Cannot resolve image %s chain using the volumes "
+                           "snapshot (%s), reloading", imgUUID, e)
+        else:
+            current = self.read_volumes_info(imgUUID, chain)
+            changed = [vol for vol in chain
+                       if current.get(vol) != snapshot.volume(vol)]
+            if not changed:
+                return chain
+            self.log.debug("Image %s volumes %s changed since the volumes "
+                           "snapshot was loaded, reloading", imgUUID, changed)
+
+        self.invalidate_volumes_snapshot(imgUUID)
+        return self.volumes_snapshot().chain(imgUUID, volUUID)
+
+    def _load_volumes_snapshot(self):
+        raise NotImplementedError
+
+    def read_volumes_info(self, imgUUID, volUUIDs):
+        """
+        Read the metadata of volumes volUUIDs of image imgUUID, and return
+        dict mapping volume UUID to VolumeInfo, in the same form as the
+        volumes snapshot. Volumes that cannot be read are not included.
+        """
+        raise NotImplementedError
+
+    def list_image_volumes(self, imgUUID):
+        """
+        Return the UUIDs of the volumes of image imgUUID found on storage,
+        in the same form as VolumesSnapshot.image_volumes, without reading
+        the volumes metadata.
+        """
+        raise NotImplementedError
+
     def isISO(self):
         return self.getMetaParam(DMDK_CLASS) == ISO_DOMAIN
 
@@ -715,10 +817,16 @@ class StorageDomain(object):
         return self._manifest.getVAllocSize(imgUUID, volUUID)
 
     def deleteImage(self, sdUUID, imgUUID, volsImgs):
-        self._manifest.deleteImage(sdUUID, imgUUID, volsImgs)
+        try:
+            self._manifest.deleteImage(sdUUID, imgUUID, volsImgs)
+        finally:
+            self._manifest.invalidate_volumes_snapshot(imgUUID)
 
     def purgeImage(self, sdUUID, imgUUID, volsImgs, discard):
-        self._manifest.purgeImage(sdUUID, imgUUID, volsImgs, discard)
+        try:
+            self._manifest.purgeImage(sdUUID, imgUUID, volsImgs, discard)
+        finally:
+            self._manifest.invalidate_volumes_snapshot(imgUUID)
 
     def getAllImages(self):
         return self._manifest.getAllImages()
@@ -726,6 +834,21 @@ class StorageDomain(object):
     def getAllVolumes(self):
         return self._manifest.getAllVolumes()
 
+    def volumes_snapshot(self, refresh=False):
+        return self._manifest.volumes_snapshot(refresh=refresh)
+
+    def invalidate_volumes_snapshot(self, imgUUID=None):
+        self._manifest.invalidate_volumes_snapshot(imgUUID)
+
+    def image_chain(self, imgUUID, volUUID=None):
+        return self._manifest.image_chain(imgUUID, volUUID)
+
+    def read_volumes_info(self, imgUUID, volUUIDs):
+        return self._manifest.read_volumes_info(imgUUID, volUUIDs)
+
+    def list_image_volumes(self, imgUUID):
+        return self._manifest.list_image_volumes(imgUUID)
+
     def prepareMailbox(self):
         """
         This method has been introduced in order to prepare the mailbox
@@ -1144,6 +1267,7 @@ class StorageDomain(object):
         self._manifest.refreshDirTree()
 
     def refresh(self):
+        self._manifest.invalidate_volumes_snapshot()
         self._manifest.refresh()
 
     def extend(self, devlist, force):
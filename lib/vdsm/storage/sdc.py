@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2017 Red Hat, Inc.
+# Copyright 2009-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -21,18 +21,33 @@
 """
 Cache module provides general purpose (more or less) cache infrastructure
 for keeping storage related data that is expensive to harvest, but needed often
+
+Domains that were not found are remembered for sd_cache_miss_ttl seconds, so
+looking them up again does not scan the storage. Invalidating the storage
+forgets them, since connecting to storage may make them available.
 """
 from __future__ import absolute_import
 
+import collections
+import functools
 import logging
 import threading
 
+from vdsm import utils
+from vdsm.common import concurrent
+from vdsm.common.time import monotonic_time
+from vdsm.config import config
 from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
 from vdsm.storage import lvm
 from vdsm.storage import misc
 from vdsm.storage import multipath
 
+# The maximum number of threads looking up domains in each backend. When a
+# backend is blocked, for example by an unavailable nfs mount, lookups wait
+# for the blocked threads instead of starting new threads.
+FIND_THREADS = 4
+
 
 class DomainProxy(object):
     """
@@ -63,26 +78,39 @@ class StorageDomainCache:
     STORAGE_STALE = 1
     STORAGE_REFRESHING = 2
 
-    def __init__(self, storage_repo):
+    def __init__(self, storage_repo, miss_ttl=None):
         self._syncroot = threading.Condition()
         self.__domainCache = {}
         self.__inProgress = set()
+        self.__notFound = {}  # {sdUUID: expiration time}
         self.__staleStatus = self.STORAGE_STALE
+        if miss_ttl is None:
+            miss_ttl = config.getint('irs', 'sd_cache_miss_ttl')
+        self._miss_ttl = miss_ttl
+        self._stats = _Stats()
         self.storage_repo = storage_repo
         self.knownSDs = {}  # {sdUUID: mod.findDomain}
+        self._finders = None
 
     def invalidateStorage(self):
         with self._syncroot:
             self.__staleStatus = self.STORAGE_STALE
+            self.__notFound.clear()
 
+    # Concurrent calls wait for the running refresh and share its result,
+    # so many domain lookups trigger only one rescan.
     @misc.samplingmethod
     def refreshStorage(self, resize=True):
         self.__staleStatus = self.STORAGE_REFRESHING
 
+        start = monotonic_time()
         multipath.rescan()
         if resize:
             multipath.resize_devices()
         lvm.invalidateCache()
+        elapsed = monotonic_time() - start
+
+        self.log.info("Storage refreshed in %.2f seconds", elapsed)
 
         # If a new invalidateStorage request came in after the refresh
         # started then we cannot flag the storages as updated (force a
@@ -90,6 +118,7 @@ class StorageDomainCache:
         with self._syncroot:
             if self.__staleStatus == self.STORAGE_REFRESHING:
                 self.__staleStatus = self.STORAGE_UPDATED
+            self._stats.refreshed(elapsed)
 
     def produce_manifest(self, sdUUID):
         """
@@ -110,14 +139,99 @@ class StorageDomainCache:
         domain.getRealDomain()
         return domain
 
+    def prefetch(self, sdUUIDs, timeout=None):
+        """
+        Look up the domains that are not in the cache concurrently, so
+        produce() will find them in the cache. Errors are ignored; produce()
+        will raise them.
+
+        Wait until all the lookups finished, or until timeout seconds
+        passed. Lookups that did not finish keep running, and produce()
+        waits for them.
+        """
+        with self._syncroot:
+            missing = [sdUUID for sdUUID in sdUUIDs
+                       if sdUUID not in self.__domainCache and
+                       sdUUID not in self.__inProgress]
+        if not missing:
+            return
+
+        with utils.stopwatch("Prefetching %d domains" % len(missing),
+                             level=logging.INFO, log=self.log):
+            # Refresh the storage once before starting the lookups. If the
+            # lookups refreshed the storage, a lookup starting while another
+            # one is refreshing would wait and refresh the storage again.
+            if self.__staleStatus != self.STORAGE_UPDATED:
+                self.refreshStorage()
+
+            cond = threading.Condition(threading.Lock())
+            running = set(missing)
+
+            def lookup(sdUUID):
+                try:
+                    self._realProduce(sdUUID)
+                except Exception:
+                    pass
+                finally:
+                    with cond:
+                        running.remove(sdUUID)
+                        cond.notify_all()
+
+            for i, sdUUID in enumerate(missing):
+                t = concurrent.thread(lookup, args=(sdUUID,),
+                                      name="sd-prefetch/%d" % i,
+                                      log=self.log)
+                t.start()
+
+            if timeout is not None:
+                deadline = monotonic_time() + timeout
+            with cond:
+                while running:
+                    if timeout is None:
+                        cond.wait()
+                        continue
+                    remaining = deadline - monotonic_time()
+                    if remaining <= 0:
+                        self.log.warning("Timeout prefetching domains, "
+                                         "still looking up %s",
+                                         sorted(running))
+                        break
+                    cond.wait(remaining)
+
+    def stats(self):
+        """
+        Return a dict with the lookup statistics of the cache:
+
+        - hits: lookups served from the cache
+        - negative_hits: lookups failed because the domain was not found
+          recently
+        - lookups: lookups that searched the storage
+        - not_found: lookups that did not find the domain
+        - lookup_time: total time spent in lookups (seconds)
+        - lookup_max: longest lookup (seconds)
+        - refreshes: storage refreshes
+        - refresh_time: total time spent in refreshes (seconds)
+        - refresh_max: longest refresh (seconds)
+        """
+        with self._syncroot:
+            return self._stats.info()
+
     def _realProduce(self, sdUUID):
         with self._syncroot:
             while True:
                 domain = self.__domainCache.get(sdUUID)
 
                 if domain is not None:
+                    self._stats.hits += 1
                     return domain
 
+                expires = self.__notFound.get(sdUUID)
+                if expires is not None:
+                    if monotonic_time() < expires:
+                        self._stats.negative_hits += 1
+                        raise se.StorageDomainDoesNotExist(sdUUID)
+                    del self.__notFound[sdUUID]
+
                 if sdUUID not in self.__inProgress:
                     self.__inProgress.add(sdUUID)
                     break
@@ -131,9 +245,25 @@ class StorageDomainCache:
             if self.__staleStatus != self.STORAGE_UPDATED:
                 self.refreshStorage()
 
-            domain = self._findDomain(sdUUID)
+            start = monotonic_time()
+            try:
+                domain = self._findDomain(sdUUID)
+            except se.StorageDomainDoesNotExist:
+                elapsed = monotonic_time() - start
+                self.log.info("Domain %s not found in %.2f seconds",
+                              sdUUID, elapsed)
+                with self._syncroot:
+                    self._stats.looked_up(elapsed, found=False)
+                    if self._miss_ttl > 0:
+                        self.__notFound[sdUUID] = (monotonic_time() +
+                                                   self._miss_ttl)
+                raise
+
+            elapsed = monotonic_time() - start
+            self.log.debug("Domain %s found in %.2f seconds", sdUUID, elapsed)
 
             with self._syncroot:
+                self._stats.looked_up(elapsed)
                 self.__domainCache[sdUUID] = domain
                 return domain
 
@@ -151,29 +281,48 @@ class StorageDomainCache:
         return findMethod(sdUUID)
 
     def _findUnfetchedDomain(self, sdUUID):
+        self.log.debug("looking for domain %s", sdUUID)
+
+        # The backends are searched concurrently, so an unavailable nfs
+        # mount does not delay finding block or local domains. If a domain
+        # is found by more than one backend, the first backend in this
+        # order wins.
+        finders = self._backend_finders()
+        results = [None] * len(finders)
+        cond = threading.Condition(threading.Lock())
+
+        def done(i, result):
+            with cond:
+                results[i] = result
+                cond.notify_all()
+
+        for i, finder in enumerate(finders):
+            finder.find(sdUUID, functools.partial(done, i))
+
+        # Return when the preferred backends have finished, without waiting
+        # for the rest.
+        for i in range(len(finders)):
+            with cond:
+                while results[i] is None:
+                    cond.wait()
+            if results[i].succeeded:
+                return results[i].value
+
+        raise se.StorageDomainDoesNotExist(sdUUID)
+
+    def _backend_finders(self):
         from vdsm.storage import blockSD
         from vdsm.storage import glusterSD
         from vdsm.storage import localFsSD
         from vdsm.storage import nfsSD
 
-        self.log.debug("looking for domain %s", sdUUID)
-
-        # The order is somewhat important, it's ordered
-        # by how quickly get can find the domain. For instance
-        # if an nfs mount is unavailable we will get stuck
-        # until it times out, this should affect fetching
-        # of block\local domains. If for any case in the future
-        # this changes, please update the order.
-        for mod in (blockSD, glusterSD, localFsSD, nfsSD):
-            try:
-                return mod.findDomain(sdUUID)
-            except se.StorageDomainDoesNotExist:
-                pass
-            except Exception:
-                self.log.error("Error while looking for domain `%s`", sdUUID,
-                               exc_info=True)
-
-        raise se.StorageDomainDoesNotExist(sdUUID)
+        with self._syncroot:
+            if self._finders is None:
+                self._finders = [
+                    _BackendFinder(i, mod, FIND_THREADS, self.log)
+                    for i, mod in enumerate(
+                        (blockSD, glusterSD, localFsSD, nfsSD))]
+            return self._finders
 
     def getUUIDs(self):
         from vdsm.storage import blockSD
@@ -189,10 +338,12 @@ class StorageDomainCache:
         with self._syncroot:
             lvm.invalidateCache()
             self.__domainCache.clear()
+            self.__notFound.clear()
 
     def manuallyAddDomain(self, domain):
         with self._syncroot:
             self.__domainCache[domain.sdUUID] = domain
+            self.__notFound.pop(domain.sdUUID, None)
 
     def manuallyRemoveDomain(self, sdUUID):
         with self._syncroot:
@@ -202,4 +353,85 @@ class StorageDomainCache:
                 pass
 
 
+class _BackendFinder(object):
+    """
+    Look up domains in one backend, using up to max_threads threads.
+    Lookups are queued, and served by the first available thread.
+    """
+
+    def __init__(self, index, mod, max_threads, log):
+        self._index = index
+        self._mod = mod
+        self._max_threads = max_threads
+        self._log = log
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._threads = 0
+
+    def find(self, sdUUID, done):
+        """
+        Look up sdUUID in the backend, and call done() with a
+        concurrent.Result in a finder thread.
+        """
+        with self._lock:
+            self._queue.append((sdUUID, done))
+            if self._threads == self._max_threads:
+                return
+            self._threads += 1
+        t = concurrent.thread(self._run, name="sd-find/%d" % self._index,
+                              log=self._log)
+        t.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._threads -= 1
+                    return
+                sdUUID, done = self._queue.popleft()
+            done(self._find(sdUUID))
+
+    def _find(self, sdUUID):
+        try:
+            return concurrent.Result(True, self._mod.findDomain(sdUUID))
+        except se.StorageDomainDoesNotExist:
+            return concurrent.Result(False, None)
+        except Exception:
+            self._log.error("Error while looking for domain `%s`", sdUUID,
+                            exc_info=True)
+            return concurrent.Result(False, None)
+
+
+class _Stats(object):
+    """
+    Lookup statistics. Must be accessed when holding the cache lock.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.negative_hits = 0
+        self.lookups = 0
+        self.not_found = 0
+        self.lookup_time = 0.0
+        self.lookup_max = 0.0
+        self.refreshes = 0
+        self.refresh_time = 0.0
+        self.refresh_max = 0.0
+
+    def looked_up(self, elapsed, found=True):
+        self.lookups += 1
+        if not found:
+            self.not_found += 1
+        self.lookup_time += elapsed
+        self.lookup_max = max(self.lookup_max, elapsed)
+
+    def refreshed(self, elapsed):
+        self.refreshes += 1
+        self.refresh_time += elapsed
+        self.refresh_max = max(self.refresh_max, elapsed)
+
+    def info(self):
+        return dict(self.__dict__)
+
+
 sdCache = StorageDomainCache(sc.REPO_DATA_CENTER)
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2017 Red Hat, Inc.
+# Copyright 2009-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -58,6 +58,10 @@ SPM_FREE = 'Free'
 SPM_ID_FREE = -1
 LVER_INVALID = -1
 
+# Seconds to wait for looking up the pool domains before starting the
+# domain monitors. Lookups taking more time continue in the monitors.
+PREFETCH_TIMEOUT = 30
+
 
 class DisconnectedPool(object):
     """
@@ -603,6 +607,7 @@ class StoragePool(object):
         # Check the domains before pool creation
         domains = []
         msdVersion = None
+        sdCache.prefetch(domList)
         for sdUUID in domList:
             try:
                 domain = sdCache.produce(sdUUID)
@@ -1521,6 +1526,9 @@ class StoragePool(object):
         self.domainMonitor.stopMonitoring(monitorsToStop)
 
         monitorsToStart = activeDomains - monitoredDomains
+        # Look up the domains concurrently with a single storage refresh,
+        # instead of a lookup and refresh in each new monitor.
+        sdCache.prefetch(monitorsToStart, timeout=PREFETCH_TIMEOUT)
         for sdUUID in monitorsToStart:
             self.domainMonitor.startMonitoring(sdUUID, self.id)
 
@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2017 Red Hat, Inc.
+# Copyright 2009-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -66,6 +66,7 @@ from vdsm.config import config
 from vdsm.storage import exception as se
 from vdsm.storage import outOfProcess as oop
 from vdsm.storage import resourceManager
+from vdsm.storage import taskjournal
 
 
 getProcPool = oop.getGlobalProcPool
@@ -96,6 +97,16 @@ def _eq_decode(s):
     return s.replace(KEY_SEPARATOR_ENCODED, KEY_SEPARATOR)
 
 
+def _useJournal():
+    return config.getboolean('irs', 'task_journal')
+
+
+def _journal(store):
+    return taskjournal.get_journal(
+        store,
+        flush_interval=config.getfloat('irs', 'task_journal_flush_interval'))
+
+
 def threadlocal_task(m):
     """
     Decorator that set the task object in thread local storage task attribute
@@ -495,6 +506,7 @@ class Task:
         self._abort_lock = threading.Lock()
         self._abort_callbacks = set()
         self._aborting = False
+        self._progress_source = None
         self._forceAbort = False
         self.ref = 0
 
@@ -506,20 +518,26 @@ class Task:
         self.log = SimpleLogAdapter(self.log, {"Task": self.id})
 
     def __del__(self):
-        def finalize(log, owner, taskDir):
+        def finalize(log, owner, taskid, store):
             log.warn("Task was autocleaned")
             owner.releaseAll()
-            if taskDir is not None:
-                getProcPool().fileUtils.cleanupdir(taskDir)
+            if store is not None:
+                if _useJournal():
+                    try:
+                        _journal(store).remove(taskid)
+                    except taskjournal.Error as e:
+                        log.warning("Cannot remove task from journal: %s", e)
+                else:
+                    getProcPool().fileUtils.cleanupdir(
+                        os.path.join(store, taskid))
 
         if not self.state.isDone():
-            taskDir = None
-            if (self.cleanPolicy == TaskCleanType.auto and
-                    self.store is not None):
-                taskDir = os.path.join(self.store, self.id)
+            store = None
+            if self.cleanPolicy == TaskCleanType.auto:
+                store = self.store
             t = concurrent.thread(
                 finalize,
-                args=(self.log, self.resOwner, taskDir),
+                args=(self.log, self.resOwner, self.id, store),
                 name="task/" + self.id[:8])
             t.start()
 
@@ -751,7 +769,74 @@ class Task:
             self._loadRecoveryMetaFile(taskDir, rn)
             self.recoveries[rn].setOwnerTask(self)
 
+    @classmethod
+    def _toDict(cls, obj, fields):
+        return {field: six.text_type(getattr(obj, field)) for field in fields}
+
+    @classmethod
+    def _fromDict(cls, values, obj, fields):
+        for field, value in six.iteritems(values):
+            if field not in fields:
+                cls.log.warning("Task._fromDict: ignoring field %s", field)
+                continue
+            setattr(obj, field, fields[field](value))
+
+    def _record(self):
+        """
+        Return the journal record of the task, holding the same data as the
+        task directory.
+        """
+        self.njobs = len(self.jobs)
+        self.nrecoveries = len(self.recoveries)
+        record = {
+            "task": self._toDict(self, Task.fields),
+            "jobs": [self._toDict(j, Job.fields) for j in self.jobs],
+            "recoveries": [self._toDict(r, Recovery.fields)
+                           for r in self.recoveries],
+        }
+        if self.state == State.finished:
+            record["result"] = self._toDict(self.result, TaskResult.fields)
+        return record
+
+    def _loadRecord(self, record):
+        self.log.debug("%s: load from journal record", self)
+        if self.state != State.init:
+            raise se.TaskMetaDataLoadError("task %s - can't load self: "
+                                           "not in init state" % self)
+        oldid = self.id
+        try:
+            self._fromDict(record["task"], self, Task.fields)
+            if self.id != oldid:
+                raise se.TaskMetaDataLoadError(
+                    "task %s: loaded record do not match id (%s != %s)" %
+                    (self, self.id, oldid))
+            if self.state == State.finished:
+                self._fromDict(record["result"], self.result,
+                               TaskResult.fields)
+            for values in record["jobs"]:
+                job = Job("load", None)
+                self._fromDict(values, job, Job.fields)
+                job.setOwnerTask(self)
+                self.jobs.append(job)
+            for values in record["recoveries"]:
+                recovery = Recovery("load", "load", "load", "load", "")
+                self._fromDict(values, recovery, Recovery.fields)
+                recovery.setOwnerTask(self)
+                self.recoveries.append(recovery)
+        except se.TaskMetaDataLoadError:
+            raise
+        except Exception:
+            self.log.error("Unexpected error", exc_info=True)
+            raise se.TaskMetaDataLoadError(self.id)
+
     def _save(self, storPath):
+        if _useJournal():
+            try:
+                _journal(storPath).write(self.id, self._record())
+            except taskjournal.Error as e:
+                raise se.TaskPersistError("%s persist failed: %s" % (self, e))
+            return
+
         origTaskDir = os.path.join(storPath, self.id)
         if not getProcPool().os.path.exists(origTaskDir):
             raise se.TaskDirError("_save: no such task dir '%s'" % origTaskDir)
@@ -785,6 +870,13 @@ class Task:
         getProcPool().fileUtils.fsyncPath(origTaskDir)
 
     def _clean(self, storPath):
+        if _useJournal():
+            try:
+                _journal(storPath).remove(self.id)
+            except taskjournal.Error as e:
+                raise se.TaskPersistError("%s clean failed: %s" % (self, e))
+            return
+
         taskDir = os.path.join(storPath, self.id)
         getProcPool().fileUtils.cleanupdir(taskDir)
 
@@ -1110,13 +1202,20 @@ class Task:
         self.setCleanPolicy(cleanPolicy)
         if self.persistPolicy != TaskPersistType.none and not self.store:
             raise se.TaskPersistError("no store defined")
-        taskDir = os.path.join(self.store, self.id)
-        try:
-            getProcPool().fileUtils.createdir(taskDir)
-        except Exception as e:
-            self.log.error("Unexpected error", exc_info=True)
-            raise se.TaskPersistError("%s: cannot access/create taskdir"
-                                      " %s: %s" % (self, taskDir, e))
+        if _useJournal():
+            try:
+                _journal(self.store)
+            except taskjournal.Error as e:
+                raise se.TaskPersistError("%s: cannot access task journal: %s"
+                                          % (self, e))
+        else:
+            taskDir = os.path.join(self.store, self.id)
+            try:
+                getProcPool().fileUtils.createdir(taskDir)
+            except Exception as e:
+                self.log.error("Unexpected error", exc_info=True)
+                raise se.TaskPersistError("%s: cannot access/create taskdir"
+                                          " %s: %s" % (self, taskDir, e))
         if (self.persistPolicy == TaskPersistType.auto and
                 self.state != State.init):
             self.persist()
@@ -1162,6 +1261,27 @@ class Task:
         t._load(store, ext)
         return t
 
+    @classmethod
+    def loadRecord(cls, store, taskid, record):
+        """
+        Load a task from its journal record. The task is persisted to store
+        with the policies in the record.
+        """
+        t = Task(taskid)
+        t._loadRecord(record)
+        t.store = store
+        return t
+
+    @classmethod
+    def removeTaskDirs(cls, store, taskid):
+        """
+        Remove the task directories left by loadTask(), once the task is
+        persisted in the journal.
+        """
+        for ext in ("", TEMP_EXT, BACKUP_EXT):
+            getProcPool().fileUtils.cleanupdir(
+                os.path.join(store, taskid + ext))
+
     @threadlocal_task
     def prepare(self, func, *args, **kwargs):
         message = self.error
@@ -1236,6 +1356,33 @@ class Task:
             with self._abort_lock:
                 self._abort_callbacks.discard(callback)
 
+    @contextmanager
+    def progress_source(self, source):
+        """
+        Report the progress of source, an object with a progress property
+        returning the progress as float between 0 and 100, as the progress
+        of the task while the context is active.
+        """
+        self._progress_source = source
+        try:
+            yield
+        finally:
+            self._progress_source = None
+
+    @property
+    def progress(self):
+        """
+        Return the progress of the running operation of the task as int
+        between 0 and 100, or None if the task does not report progress.
+        """
+        source = self._progress_source
+        if source is None:
+            return None
+        progress = source.progress
+        if progress is None:
+            return None
+        return int(progress)
+
     def _execute_abort_callbacks(self):
         with self._abort_lock:
             self._aborting = True
@@ -1318,6 +1465,9 @@ class Task:
         oReturn["taskResult"] = self.state.DEPRECATED_RESULT[self.state.state]
         oReturn["code"] = self.result.code
         oReturn["message"] = self.result.message
+        progress = self.progress
+        if progress is not None:
+            oReturn["progress"] = progress
         return oReturn
 
     def getStatus(self):
@@ -1329,7 +1479,7 @@ class Task:
         return oReturn
 
     def getDetails(self):
-        return {
+        details = {
             "id": self.id,
             "verb": self.name,
             "state": str(self.state),
@@ -1338,6 +1488,10 @@ class Task:
             "result": self.result.result,
             "tag": self.tag
         }
+        progress = self.progress
+        if progress is not None:
+            details["progress"] = progress
+        return details
 
     def getID(self):
         return self.id
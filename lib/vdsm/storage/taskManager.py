@@ -1,5 +1,5 @@
 #
-# Copyright 2009-2016 Red Hat, Inc.
+# Copyright 2009-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -23,20 +23,19 @@ import os
 import logging
 import threading
 
+import six
+
 from vdsm.config import config
 from vdsm.storage import exception as se
+from vdsm.storage import taskjournal
+from vdsm.storage import workers
 from vdsm.storage.task import Task, Job, TaskCleanType
-from vdsm.storage.threadPool import ThreadPool
 
 
 class TaskManager:
     log = logging.getLogger('storage.TaskManager')
 
-    def __init__(self,
-                 tpSize=config.getint('irs', 'thread_pool_size'),
-                 waitTimeout=3,
-                 maxTasks=config.getint('irs', 'max_tasks')):
-        self.tp = ThreadPool("tasks", tpSize, waitTimeout, maxTasks)
+    def __init__(self):
         self._tasks = {}
         self._unqueuedTasks = []
         self._insertTaskLock = threading.Lock()
@@ -57,14 +56,13 @@ class TaskManager:
             self._tasks[task.id] = task
 
         try:
-            if not self.tp.queueTask(task.id, method):
-                self.log.error("unable to queue task: %s", task.dumpTask())
-                del self._tasks[task.id]
-                raise se.AddTaskError()
-            self.log.debug("task queued: %s", task.id)
+            workers.dispatch(method, workers.TASK)
         except Exception:
-            self.log.exception('could not queue task %s', task.id)
-            raise
+            self.log.exception("unable to queue task: %s", task.dumpTask())
+            del self._tasks[task.id]
+            raise se.AddTaskError()
+
+        self.log.debug("task queued: %s", task.id)
 
         return task.id
 
@@ -95,7 +93,7 @@ class TaskManager:
                 t.stop()
             self.log.info(str(t))
 
-        self.tp.joinAll(waitForTasks=False, waitForThreads=False)
+        workers.stop()
 
     def getTaskStatus(self, taskID):
         """ Internal return Task status for a given task.
@@ -206,9 +204,18 @@ class TaskManager:
         if not os.path.exists(store):
             self.log.debug("task dump path %s does not exist.", store)
             return
-        # taskID is the root part of each (root.ext) entry in the dump task dir
-        tasksIDs = set(os.path.splitext(tid)[0] for tid in os.listdir(store))
-        for taskID in tasksIDs:
+
+        useJournal = config.getboolean('irs', 'task_journal')
+        loaded = set()
+        if useJournal:
+            loaded = self._loadJournal(store)
+
+        # Task directories are written when the journal is disabled, or by
+        # older versions. taskID is the root part of each (root.ext) entry
+        # in the dump task dir.
+        tasksIDs = set(os.path.splitext(tid)[0] for tid in os.listdir(store)
+                       if not tid.startswith(taskjournal.JOURNAL))
+        for taskID in tasksIDs - loaded:
             self.log.debug("Loading dumped task %s", taskID)
             try:
                 t = Task.loadTask(store, taskID)
@@ -221,6 +228,28 @@ class TaskManager:
                                taskID,
                                exc_info=True)
                 continue
+            if useJournal:
+                # The task was persisted to the journal by setPersistence.
+                Task.removeTaskDirs(store, taskID)
+
+    def _loadJournal(self, store):
+        """
+        Load the tasks in the journal of store, and return their ids.
+        """
+        journal = taskjournal.open_journal(
+            store,
+            flush_interval=config.getfloat('irs',
+                                           'task_journal_flush_interval'))
+        records = journal.load()
+        for taskID, record in six.iteritems(records):
+            self.log.debug("Loading journaled task %s", taskID)
+            try:
+                t = Task.loadRecord(store, taskID, record)
+                self._unqueuedTasks.append(t)
+            except Exception:
+                self.log.error("taskManager: Skipping task: %s", taskID,
+                               exc_info=True)
+        return set(records)
 
     def recoverDumpedTasks(self):
         for task in self._unqueuedTasks[:]:
@@ -0,0 +1,379 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+taskjournal - persist tasks in an append-only journal
+=====================================================
+
+Persisting a task used to rewrite a directory of files on the master
+file system, renaming directories and syncing the file system on every
+state change of every task. The journal replaces the task directories
+with a sequence of files in the tasks store.
+
+Every record is one line holding the complete state of a task, or a
+tombstone for a removed task. The last record of a task wins, so loading
+the journal is one sequential read of its segments.
+
+Writers wait until their record is on storage. Records appended by
+concurrent tasks are written together by one of the writers as a new
+segment of the journal, using one write and one fsync per flush. When
+the journal grows much larger than the records of the live tasks, the
+flushing writer compacts it by writing the live records to a new segment
+and removing the older segments.
+
+The tasks store is on the master domain, so all the journal I/O is done
+using ioprocess; ioprocess cannot append to a file, this is why every
+flush writes a new segment.
+
+Record format::
+
+    crc32 json\\n
+
+The checksum covers the json text. A record with a bad checksum is
+skipped, so a torn write loses only the records of the segment being
+written.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+import six
+
+from vdsm.common.compat import glob_escape
+from vdsm.common.time import monotonic_time
+from vdsm.storage import outOfProcess as oop
+
+JOURNAL = "tasks.journal"
+
+# Compact when the journal is larger than this and twice the size of the
+# live records.
+COMPACT_MIN_SIZE = 1024**2
+
+# Compact when the journal has more segments than this.
+COMPACT_MAX_SEGMENTS = 64
+
+# Delay in seconds before compacting again after a failure, doubled after
+# every failure.
+COMPACT_RETRY_MIN = 10
+COMPACT_RETRY_MAX = 600
+
+log = logging.getLogger("storage.taskjournal")
+
+getProcPool = oop.getGlobalProcPool
+
+
+class Error(Exception):
+    """ Raised when a journal cannot be read or written """
+
+
+class Journal(object):
+    """
+    The journal of a tasks store.
+
+    There must be one instance per journal, use open_journal() and
+    get_journal() to access it.
+    """
+
+    def __init__(self, store, oop, flush_interval=0):
+        self._store = store
+        self._oop = oop
+        self._flush_interval = flush_interval
+        self._cond = threading.Condition(threading.Lock())
+        # Latest record of every live task, used for compaction.
+        self._records = {}
+        self._pending = []
+        self._flushing = False
+        self._last_flush = 0
+        # Sequence numbers of the segments, oldest first.
+        self._segments = []
+        self._size = 0
+        self._compact_size = COMPACT_MIN_SIZE
+        self._compact_retry = 0
+        self._next_compact = 0
+
+    @property
+    def path(self):
+        return os.path.join(self._store, JOURNAL)
+
+    def load(self):
+        """
+        Read the journal and return the records of the live tasks, indexed
+        by task id.
+        """
+        with self._cond:
+            try:
+                segments = self._list_segments()
+                data = [self._oop.readFile(self._segment_path(seq))
+                        for seq in segments]
+            except EnvironmentError as e:
+                raise Error("Cannot read %s: %s" % (self.path, e))
+
+            records = {}
+            lines = {}
+            for seq, segment in zip(segments, data):
+                for n, line in enumerate(segment.splitlines(), 1):
+                    try:
+                        record = _decode(line)
+                    except ValueError as e:
+                        log.warning("Skipping bad record %d in %s: %s",
+                                    n, self._segment_path(seq), e)
+                        continue
+                    task_id = record.pop("id")
+                    if record.get("removed"):
+                        records.pop(task_id, None)
+                        lines.pop(task_id, None)
+                    else:
+                        records[task_id] = record
+                        lines[task_id] = line + b"\n"
+
+            self._records = lines
+            self._segments = segments
+            self._size = sum(len(segment) for segment in data)
+            self._update_compact_size()
+
+        log.info("Loaded %d tasks from %s (%d segments)",
+                 len(records), self.path, len(segments))
+        return records
+
+    def write(self, task_id, record):
+        """
+        Append the record of a task and wait until it is on storage.
+        """
+        record = dict(record, id=task_id)
+        self._append(_Entry(task_id, _encode(record)))
+
+    def remove(self, task_id):
+        """
+        Append a tombstone for a task and wait until it is on storage.
+        """
+        record = {"id": task_id, "removed": True}
+        self._append(_Entry(task_id, _encode(record), removed=True))
+
+    def _append(self, entry):
+        with self._cond:
+            self._pending.append(entry)
+            while not entry.done:
+                if self._flushing:
+                    self._cond.wait()
+                else:
+                    self._flush()
+
+        if entry.error:
+            raise Error("Cannot write %s: %s" % (self.path, entry.error))
+
+    def _flush(self):
+        """
+        Write the pending records, and the records appended while waiting
+        for the flush interval. Must be called when holding self._cond, and
+        not flushing.
+        """
+        self._flushing = True
+        try:
+            delay = self._last_flush + self._flush_interval - monotonic_time()
+            if delay > 0:
+                self._cond.release()
+                try:
+                    time.sleep(delay)
+                finally:
+                    self._cond.acquire()
+
+            batch = self._pending
+            self._pending = []
+            data = b"".join(entry.line for entry in batch)
+            seq = self._next_seq()
+
+            self._cond.release()
+            try:
+                error = None
+                try:
+                    self._write(seq, data)
+                except Exception as e:
+                    log.error("Error writing %d records to %s: %s",
+                              len(batch), self.path, e)
+                    error = e
+            finally:
+                self._cond.acquire()
+
+            self._last_flush = monotonic_time()
+
+            for entry in batch:
+                entry.error = error
+                entry.done = True
+                if error is None:
+                    if entry.removed:
+                        self._records.pop(entry.task_id, None)
+                    else:
+                        self._records[entry.task_id] = entry.line
+
+            if error is None:
+                self._segments.append(seq)
+                self._size += len(data)
+                if self._should_compact():
+                    self._compact()
+        finally:
+            self._flushing = False
+            self._cond.notify_all()
+
+    def _write(self, seq, data):
+        # A new file must be synced, and its directory entry too.
+        path = self._segment_path(seq)
+        self._oop.writeFile(path, data)
+        self._oop.fileUtils.fsyncPath(path)
+        self._oop.fileUtils.fsyncPath(self._store)
+
+    def _should_compact(self):
+        if (self._size <= self._compact_size and
+                len(self._segments) <= COMPACT_MAX_SEGMENTS):
+            return False
+        return monotonic_time() >= self._next_compact
+
+    def _compact(self):
+        """
+        Must be called when holding self._cond and flushing.
+        """
+        # The records change only when flushing, so they can be written
+        # without the lock.
+        data = b"".join(six.itervalues(self._records))
+        seq = self._next_seq()
+        old_segments = self._segments
+        start = monotonic_time()
+        self._cond.release()
+        try:
+            self._write(seq, data)
+            # The new segment has the records of all the live tasks, and is
+            # replayed after the old segments. The old segments must be
+            # removed oldest first; if we fail in the middle, a remaining
+            # segment must not lose a newer segment removing its tasks.
+            for old in old_segments:
+                self._oop.os.unlink(self._segment_path(old))
+        except Exception as e:
+            # The journal is still valid, try again later.
+            self._cond.acquire()
+            self._compact_retry = min(
+                max(COMPACT_RETRY_MIN, 2 * self._compact_retry),
+                COMPACT_RETRY_MAX)
+            self._next_compact = monotonic_time() + self._compact_retry
+            log.warning("Error compacting %s, retrying in %d seconds: %s",
+                        self.path, self._compact_retry, e)
+            try:
+                self._segments = self._list_segments()
+            except EnvironmentError:
+                self._segments = old_segments + [seq]
+            return
+        else:
+            self._cond.acquire()
+
+        log.info("Compacted %s from %d to %d bytes (%d segments, %d tasks) "
+                 "in %.2f seconds", self.path, self._size, len(data),
+                 len(old_segments), len(self._records),
+                 monotonic_time() - start)
+        self._segments = [seq]
+        self._size = len(data)
+        self._compact_retry = 0
+        self._next_compact = 0
+        self._update_compact_size()
+
+    def _update_compact_size(self):
+        self._compact_size = max(COMPACT_MIN_SIZE, 2 * self._size)
+
+    def _next_seq(self):
+        # Segments are never written concurrently, since writing happens
+        # only when flushing.
+        return self._segments[-1] + 1 if self._segments else 0
+
+    def _list_segments(self):
+        pattern = os.path.join(glob_escape(self._store), JOURNAL + ".*")
+        segments = []
+        for path in self._oop.glob.glob(pattern):
+            ext = os.path.splitext(path)[1][1:]
+            if ext.isdigit():
+                segments.append(int(ext))
+        return sorted(segments)
+
+    def _segment_path(self, seq):
+        return os.path.join(self._store, "%s.%d" % (JOURNAL, seq))
+
+
+class _Entry(object):
+
+    __slots__ = ("task_id", "line", "removed", "done", "error")
+
+    def __init__(self, task_id, line, removed=False):
+        self.task_id = task_id
+        self.line = line
+        self.removed = removed
+        self.done = False
+        self.error = None
+
+
+def _encode(record):
+    text = json.dumps(record, sort_keys=True).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(text) & 0xffffffff, text)
+
+
+def _decode(line):
+    checksum, sep, text = line.partition(b" ")
+    if not sep:
+        raise ValueError("Missing checksum")
+    if int(checksum, 16) != zlib.crc32(text) & 0xffffffff:
+        raise ValueError("Checksum mismatch")
+    record = json.loads(text.decode("utf-8"))
+    if not isinstance(record, dict) or "id" not in record:
+        raise ValueError("Invalid record")
+    return record
+
+
+_lock = threading.Lock()
+_journals = {}
+
+
+def open_journal(store, flush_interval=0):
+    """
+    Open the journal of a tasks store, replacing the journal opened before,
+    and return it. Must be called when the tasks store may have been
+    modified by another host, before loading the tasks.
+    """
+    journal = Journal(store, getProcPool(), flush_interval=flush_interval)
+    with _lock:
+        _journals[store] = journal
+    return journal
+
+
+def get_journal(store, flush_interval=0):
+    """
+    Return the journal of a tasks store, opening and loading it on first
+    use.
+    """
+    with _lock:
+        journal = _journals.get(store)
+        if journal is not None:
+            return journal
+
+    journal = Journal(store, getProcPool(), flush_interval=flush_interval)
+    journal.load()
+    with _lock:
+        return _journals.setdefault(store, journal)
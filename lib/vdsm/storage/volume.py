@@ -1068,6 +1068,9 @@ class Volume(object):
         except Exception as e:
             raise se.CannotShareVolume(self.getVolumePath(), dstPath, str(e))
 
+        manifest = sdCache.produce_manifest(self.sdUUID)
+        manifest.invalidate_volumes_snapshot(os.path.basename(dstImgPath))
+
     def refreshVolume(self):
         return self._manifest.refreshVolume()
 
@@ -20,12 +20,17 @@
 
 from __future__ import absolute_import
 
+import collections
 import logging
 import time
 
+import six
+
 from vdsm.storage import constants
 from vdsm.storage import exception
 
+VolumeInfo = collections.namedtuple("VolumeInfo", "image, parent, voltype")
+
 
 class VolumeMetadata(object):
 
@@ -157,3 +162,137 @@ class VolumeMetadata(object):
             constants.LEGALITY: self.legality,
             constants.GENERATION: self.generation,
         }
+
+
+class VolumesSnapshot(object):
+    """
+    Metadata of all the volumes in a storage domain, read at once.
+
+    Answers the image chain queries from memory, instead of reading the
+    metadata of every volume in the chain. The snapshot is never modified;
+    when volumes are created, deleted or their metadata changes, the storage
+    domain creates a new snapshot with the volumes of the changed images
+    reloaded.
+    """
+
+    log = logging.getLogger('storage.VolumesSnapshot')
+
+    def __init__(self, sd_id, volumes, images):
+        """
+        Arguments:
+            sd_id (str): storage domain UUID
+            volumes (dict): mapping of volume UUID to VolumeInfo
+            images (dict): mapping of image UUID to the UUIDs of the
+                volumes in the image, as reported by getImageVolumes
+        """
+        self.sd_id = sd_id
+        self._volumes = volumes
+        self._images = images
+        self._children = collections.defaultdict(list)
+        for vol_id, info in six.iteritems(volumes):
+            if info.parent != constants.BLANK_UUID:
+                self._children[info.parent].append(vol_id)
+
+    def replace_images(self, images):
+        """
+        Return a new snapshot with the volumes of some images replaced.
+
+        Arguments:
+            images (dict): mapping of image UUID to a dict mapping volume
+                UUID to VolumeInfo, with the current volumes of the image.
+        """
+        volumes = dict(self._volumes)
+        all_images = dict(self._images)
+        for img_id, image_volumes in six.iteritems(images):
+            # Template volumes listed in this image belong to the template
+            # image, and are kept.
+            for vol_id in all_images.pop(img_id, ()):
+                info = volumes.get(vol_id)
+                if info is not None and info.image == img_id:
+                    del volumes[vol_id]
+            volumes.update(image_volumes)
+            if image_volumes:
+                all_images[img_id] = list(image_volumes)
+        return VolumesSnapshot(self.sd_id, volumes, all_images)
+
+    def __contains__(self, vol_id):
+        return vol_id in self._volumes
+
+    def __len__(self):
+        return len(self._volumes)
+
+    def volume(self, vol_id):
+        try:
+            return self._volumes[vol_id]
+        except KeyError:
+            raise exception.VolumeDoesNotExist(vol_id)
+
+    def image_volumes(self, img_id):
+        return list(self._images.get(img_id, ()))
+
+    def parent(self, vol_id):
+        return self.volume(vol_id).parent
+
+    def children(self, vol_id):
+        return list(self._children.get(vol_id, ()))
+
+    def is_leaf(self, vol_id):
+        return (self.volume(vol_id).voltype ==
+                constants.type2name(constants.LEAF_VOL))
+
+    def is_shared(self, vol_id):
+        return (self.volume(vol_id).voltype ==
+                constants.type2name(constants.SHARED_VOL))
+
+    def leaf(self, img_id):
+        """
+        Return the leaf volume UUID of image img_id.
+        """
+        vol_ids = self._images.get(img_id)
+        if not vol_ids:
+            raise exception.ImageDoesNotExistInSD(img_id, self.sd_id)
+        for vol_id in vol_ids:
+            if self.is_leaf(vol_id):
+                return vol_id
+        self.log.error("There is no leaf in the image %s", img_id)
+        raise exception.ImageIsNotLegalChain(img_id)
+
+    def chain(self, img_id, vol_id=None):
+        """
+        Return the UUIDs of the volumes in the chain of image img_id, sorted
+        from base to leaf, not including a shared base (template). The chain
+        of a template image contains only the template itself.
+
+        If vol_id is specified, return the chain ending with this volume.
+        """
+        if vol_id is None:
+            vol_ids = self._images.get(img_id)
+            if not vol_ids:
+                raise exception.ImageDoesNotExistInSD(img_id, self.sd_id)
+            if len(vol_ids) == 1 and self.is_shared(vol_ids[0]):
+                return [vol_ids[0]]
+            vol_id = self.leaf(img_id)
+        elif self.is_shared(vol_id):
+            return [vol_id]
+
+        chain = []
+        # We have seen corrupted chains that cause endless loops here.
+        # https://bugzilla.redhat.com/1125197
+        seen = set()
+
+        while not self.is_shared(vol_id):
+            chain.insert(0, vol_id)
+            seen.add(vol_id)
+
+            parent = self.parent(vol_id)
+            if parent == constants.BLANK_UUID:
+                break
+
+            if parent in seen:
+                self.log.error("Image %s volume %s has invalid parent UUID %s",
+                               img_id, vol_id, parent)
+                raise exception.ImageIsNotLegalChain(img_id)
+
+            vol_id = parent
+
+        return chain
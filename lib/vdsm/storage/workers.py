@@ -0,0 +1,104 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+workers - shared worker threads for storage
+===========================================
+
+The storage tasks and the SPM and HSM mailboxes run their work in one
+executor with two priority classes:
+
+- EXTEND: processing volume extend requests on the SPM, and running the
+  callbacks of extend replies on the HSM. Always taken first.
+- TASK: storage tasks, such as copying images. At most thread_pool_size
+  tasks run at the same time, so some workers are always available for
+  extend requests, even when many long tasks are running.
+
+The executor has thread_pool_size workers for tasks, and thread_pool_size / 2
+workers for each of the SPM and HSM mailboxes, the same number of threads
+the storage tasks and the mailboxes had when each had its own thread pool.
+
+The executor is started on first use. Storage work may block for a long
+time, so tasks have no timeout and workers are never discarded.
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+from vdsm import executor
+from vdsm.config import config
+
+EXTEND = "extend"
+TASK = "task"
+
+_lock = threading.Lock()
+_executor = None
+
+
+def dispatch(func, priority):
+    """
+    Run func() in a worker thread, in priority class priority.
+
+    Raises:
+    - vdsm.executor.NotRunning if the workers were stopped
+    - vdsm.common.exception.ResourceExhausted if there are too many waiting
+      tasks in this priority class
+    """
+    _get_executor().dispatch(func, priority=priority)
+
+
+def stop():
+    """
+    Stop the workers, without waiting for running tasks. Waiting tasks are
+    dropped, and new tasks cannot be dispatched.
+    """
+    with _lock:
+        if _executor is not None:
+            _executor.stop(wait=False)
+
+
+def stats():
+    """
+    Return the statistics of the priority classes, see
+    vdsm.executor.PriorityTaskQueue.stats(), or an empty dict if the workers
+    were not started.
+    """
+    with _lock:
+        if _executor is None:
+            return {}
+    return _executor.stats()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            tasks = config.getint('irs', 'thread_pool_size')
+            # Reserved for the SPM and HSM mailboxes.
+            extends = 2 * (tasks // 2)
+            _executor = executor.Executor(
+                "storage",
+                workers_count=tasks + extends,
+                max_tasks=config.getint('irs', 'max_tasks'),
+                scheduler=None,
+                priorities=((EXTEND, None), (TASK, tasks)))
+            _executor.start()
+        return _executor
@@ -1,5 +1,5 @@
 #
-# Copyright 2016-2017 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -469,6 +469,7 @@ class Record(object):
 
 # Record with empty values, mark a free record in the index.
 EMPTY_RECORD = Record("", 0)
+EMPTY_RECORD_BYTES = EMPTY_RECORD.bytes()
 
 
 class LeasesVolume(object):
@@ -547,32 +548,59 @@ class LeasesVolume(object):
         - OSError if I/O operation failed
         - sanlock.SanlockException if sanlock operation failed.
         """
-        log.info("Adding lease %r in lockspace %r",
-                 lease_id, self.lockspace)
-        recnum = self._index.find_record(lease_id)
-        if recnum != -1:
-            record = self._index.read_record(recnum)
-            if record.updating:
-                # TODO: rebuild this record instead of failing
-                raise LeaseUpdating(lease_id)
-            else:
-                raise LeaseExists(lease_id)
-
-        recnum = self._index.find_free_record()
-        if recnum == -1:
-            raise NoSpace(lease_id)
-
-        offset = lease_offset(recnum)
-        record = Record(lease_id, offset, updating=True)
-        self._write_record(recnum, record)
+        return self.add_many([lease_id])[0]
 
-        sanlock.write_resource(self.lockspace, lease_id,
-                               [(self._file.name, offset)])
+    def add_many(self, lease_ids):
+        """
+        Add leases to index, returning list of LeaseInfo, in the order of
+        lease_ids.
 
-        record = Record(lease_id, offset)
-        self._write_record(recnum, record)
+        The records of all leases are written to storage together, so adding
+        n leases writes the index twice instead of 2 * n times. If creating a
+        sanlock resource fails, the leases created before the failure are
+        added, and the rest are left updating.
 
-        return LeaseInfo(self.lockspace, lease_id, self._file.name, offset)
+        Raises: same as add(). No lease is added if a lease exists, or if
+        there is no space for all leases.
+        """
+        log.info("Adding leases %s in lockspace %r",
+                 lease_ids, self.lockspace)
+        if len(set(lease_ids)) != len(lease_ids):
+            raise ValueError("Duplicate lease ids: %s" % lease_ids)
+
+        for lease_id in lease_ids:
+            found = self._index.find_record(lease_id)
+            if found != -1:
+                record = self._index.read_record(found)
+                if record.updating:
+                    # TODO: rebuild this record instead of failing
+                    raise LeaseUpdating(lease_id)
+                else:
+                    raise LeaseExists(lease_id)
+
+        recnums = self._index.find_free_records(len(lease_ids))
+        if len(recnums) < len(lease_ids):
+            raise NoSpace(lease_ids[len(recnums)])
+
+        leases = [(recnum, lease_id, lease_offset(recnum))
+                  for recnum, lease_id in zip(recnums, lease_ids)]
+
+        self._write_records([(recnum, Record(lease_id, offset, updating=True))
+                             for recnum, lease_id, offset in leases])
+
+        created = []
+        try:
+            for lease in leases:
+                sanlock.write_resource(self.lockspace, lease[1],
+                                       [(self._file.name, lease[2])])
+                created.append(lease)
+        finally:
+            if created:
+                self._write_records([(recnum, Record(lease_id, offset))
+                                     for recnum, lease_id, offset in created])
+
+        return [LeaseInfo(self.lockspace, lease_id, self._file.name, offset)
+                for _, lease_id, offset in leases]
 
     def remove(self, lease_id):
         """
@@ -583,22 +611,49 @@ class LeasesVolume(object):
         - OSError if I/O operation failed
         - sanlock.SanlockException if sanlock operation failed.
         """
-        log.info("Removing lease %r in lockspace %r",
-                 lease_id, self.lockspace)
-        recnum = self._index.find_record(lease_id)
-        if recnum == -1:
-            raise NoSuchLease(lease_id)
+        self.remove_many([lease_id])
 
-        offset = lease_offset(recnum)
-        record = Record(lease_id, offset, updating=True)
-        self._write_record(recnum, record)
+    def remove_many(self, lease_ids):
+        """
+        Remove leases from index.
+
+        The records of all leases are written to storage together. If
+        clearing a sanlock resource fails, the leases cleared before the
+        failure are removed, and the rest are left updating.
+
+        Raises: same as remove(). No lease is removed if a lease was not
+        found.
+        """
+        log.info("Removing leases %s in lockspace %r",
+                 lease_ids, self.lockspace)
+        if len(set(lease_ids)) != len(lease_ids):
+            raise ValueError("Duplicate lease ids: %s" % lease_ids)
 
-        # There is no way to remove a resource, so we write an invalid resource
-        # with empty resource and lockspace values.
-        # TODO: Use SANLK_WRITE_CLEAR, expected in rhel 7.4.
-        sanlock.write_resource("", "", [(self._file.name, offset)])
+        recnums = []
+        for lease_id in lease_ids:
+            found = self._index.find_record(lease_id)
+            if found == -1:
+                raise NoSuchLease(lease_id)
+            recnums.append(found)
 
-        self._write_record(recnum, EMPTY_RECORD)
+        leases = [(recnum, lease_id, lease_offset(recnum))
+                  for recnum, lease_id in zip(recnums, lease_ids)]
+
+        self._write_records([(recnum, Record(lease_id, offset, updating=True))
+                             for recnum, lease_id, offset in leases])
+
+        removed = []
+        try:
+            for lease in leases:
+                # There is no way to remove a resource, so we write an invalid
+                # resource with empty resource and lockspace values.
+                # TODO: Use SANLK_WRITE_CLEAR, expected in rhel 7.4.
+                sanlock.write_resource("", "", [(self._file.name, lease[2])])
+                removed.append(lease[0])
+        finally:
+            if removed:
+                self._write_records([(recnum, EMPTY_RECORD)
+                                     for recnum in removed])
 
     def leases(self):
         """
@@ -606,36 +661,45 @@ class LeasesVolume(object):
         """
         log.debug("Getting all leases for lockspace %r", self.lockspace)
         leases = {}
-        for recnum in range(MAX_RECORDS):
+        # Free records are never decoded.
+        for recnum in self._index.used_records():
             # TODO: handle bad records - currently will raise InvalidRecord and
             # fail the request.
             record = self._index.read_record(recnum)
-            # Record can be:
-            # - free - empty resource
-            # - used - non empty resource, may be updating
-            if record.resource:
-                leases[record.resource] = {
-                    "offset": lease_offset(recnum),
-                    "updating": record.updating,
-                }
+            leases[record.resource] = {
+                "offset": lease_offset(recnum),
+                "updating": record.updating,
+            }
         return leases
 
     def close(self):
         log.debug("Closing index for lockspace %r", self.lockspace)
         self._index.close()
 
-    def _write_record(self, recnum, record):
+    def _write_records(self, records):
         """
-        Write record recnum to storage atomically.
+        Write list of (recnum, record) to storage.
+
+        Copy the blocks where the records are located, modify them and write
+        the blocks to storage, using one write for every run of adjacent
+        blocks. If this succeeds, write the records to the index.
 
-        Copy the block where the record is located, modify it and write the
-        block to storage. If this succeeds, write the record to the index.
+        Every record is written atomically, since a record never crosses a
+        block boundary.
         """
-        block = self._index.copy_record_block(recnum)
-        with utils.closing(block):
-            block.write_record(recnum, record)
-            block.dump(self._file)
-        self._index.write_record(recnum, record)
+        blocks = self._index.copy_record_blocks(
+            [recnum for recnum, _ in records])
+        try:
+            for block in blocks:
+                for recnum, record in records:
+                    if block.has_record(recnum):
+                        block.write_record(recnum, record)
+                block.dump(self._file)
+        finally:
+            for block in blocks:
+                block.close()
+        for recnum, record in records:
+            self._index.write_record(recnum, record)
 
 
 def format_index(lockspace, file):
@@ -669,36 +733,53 @@ class VolumeIndex(object):
     """
     Index maintaining volume metadata and the mapping from lease id to lease
     offset.
+
+    Besides the index buffer, the index keeps in memory the record number of
+    every lease id, and a map of the free records, built when loading the
+    index and updated when writing records.
     """
 
     def __init__(self):
         self._buf = mmap.mmap(-1, INDEX_SIZE, mmap.MAP_SHARED)
+        # Lookup key (see LOOKUP_STRUCT) -> record number.
+        self._records = {}
+        # 1 if the record is free, 0 otherwise.
+        self._free = bytearray(MAX_RECORDS)
 
     def find_record(self, lease_id):
         """
         Search for lease_id record. Returns record number if found, -1
         otherwise.
         """
-        prefix = LOOKUP_STRUCT.pack(lease_id.encode("ascii"))
-
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(prefix, RECORD_BASE)
-        if offset == -1:
-            return -1
-
-        return self._record_number(offset)
+        key = LOOKUP_STRUCT.pack(lease_id.encode("ascii"))
+        return self._records.get(key, -1)
 
     def find_free_record(self):
         """
         Find the first free record. Returns record number if found, -1
         otherwise.
         """
-        # TODO: continue search if offset is not aligned to record size.
-        offset = self._buf.find(EMPTY_RECORD.bytes(), RECORD_BASE)
-        if offset == -1:
-            return -1
+        return self._free.find(b"\1")
 
-        return self._record_number(offset)
+    def find_free_records(self, count):
+        """
+        Find the first count free records. Returns list of record numbers,
+        shorter than count if there are not enough free records.
+        """
+        recnums = []
+        recnum = -1
+        while len(recnums) < count:
+            recnum = self._free.find(b"\1", recnum + 1)
+            if recnum == -1:
+                break
+            recnums.append(recnum)
+        return recnums
+
+    def used_records(self):
+        """
+        Return the sorted record numbers of the records with a lease id.
+        """
+        return sorted(six.itervalues(self._records))
 
     def read_record(self, recnum):
         """
@@ -718,8 +799,13 @@ class VolumeIndex(object):
         storage.
         """
         offset = self._record_offset(recnum)
+        key = self._buf[offset:offset + LOOKUP_STRUCT.size]
+        if self._records.get(key) == recnum:
+            del self._records[key]
+        data = record.bytes()
         self._buf.seek(offset)
-        self._buf.write(record.bytes())
+        self._buf.write(data)
+        self._add_record(recnum, data)
 
     def read_metadata(self):
         """
@@ -752,6 +838,12 @@ class VolumeIndex(object):
         if nread < len(self._buf):
             raise TruncatedIndex(len(self._buf), nread)
 
+        self._records = {}
+        self._free = bytearray(MAX_RECORDS)
+        for recnum in range(MAX_RECORDS):
+            offset = self._record_offset(recnum)
+            self._add_record(recnum, self._buf[offset:offset + RECORD_SIZE])
+
     def dump(self, file):
         """
         Write the entire buffer to storage and wait until the data reach
@@ -761,9 +853,25 @@ class VolumeIndex(object):
         file.pwrite(INDEX_BASE, self._buf)
 
     def copy_record_block(self, recnum):
-        offset = self._record_offset(recnum)
-        block_start = offset - (offset % BLOCK_SIZE)
-        return ChangeBlock(self._buf, block_start)
+        return self.copy_record_blocks([recnum])[0]
+
+    def copy_record_blocks(self, recnums):
+        """
+        Return a list of ChangeBlocks with the aligned blocks holding records
+        recnums. Adjacent blocks are copied to the same ChangeBlock, so they
+        are written in one write. Blocks without any of the records are not
+        copied.
+        """
+        runs = []
+        for recnum in sorted(recnums):
+            start = self._record_offset(recnum)
+            start -= start % BLOCK_SIZE
+            if runs and start <= runs[-1][1]:
+                runs[-1][1] = start + BLOCK_SIZE
+            else:
+                runs.append([start, start + BLOCK_SIZE])
+        return [ChangeBlock(self._buf, offset, end - offset)
+                for offset, end in runs]
 
     @contextmanager
     def updating(self, lockspace, file):
@@ -794,8 +902,20 @@ class VolumeIndex(object):
     def _record_offset(self, recnum):
         return RECORD_BASE + recnum * RECORD_SIZE
 
-    def _record_number(self, offset):
-        return (offset - RECORD_BASE) // RECORD_SIZE
+    def _add_record(self, recnum, data):
+        """
+        Update the lookup tables with record data written at recnum.
+        """
+        if data == EMPTY_RECORD_BYTES:
+            self._free[recnum] = 1
+            return
+
+        self._free[recnum] = 0
+        key = data[:LOOKUP_STRUCT.size]
+        if key.rstrip(b"\0"):
+            # If a corrupted index has duplicate records, keep the first, like
+            # a search from the start of the index.
+            self._records.setdefault(key, recnum)
 
 
 class ChangeBlock(object):
@@ -805,20 +925,25 @@ class ChangeBlock(object):
     To change a block of data, create a ChangeBlock from the original buffer.
     Modify the change block and dump it to storage. If the write was
     successful, modify the original buffer.
+
+    A change block may span several blocks, to write changes to adjacent
+    blocks in one write. Only the writes of the single blocks are atomic.
     """
 
-    def __init__(self, buf, offset):
+    def __init__(self, buf, offset, size=BLOCK_SIZE):
         """
-        Initialize a ChangeBlock from a buffer, copying the block starting at
-        offset.
+        Initialize a ChangeBlock from a buffer, copying the blocks starting
+        at offset.
 
         Arguments:
             buf (buffer): the buffer holding the block contents
             offset (int): offset in of this block in index_buf
+            size (int): size of the change, multiple of BLOCK_SIZE
         """
         self._offset = offset
-        self._buf = mmap.mmap(-1, BLOCK_SIZE, mmap.MAP_SHARED)
-        self._buf[:] = buf[offset:offset + BLOCK_SIZE]
+        self._size = size
+        self._buf = mmap.mmap(-1, size, mmap.MAP_SHARED)
+        self._buf[:] = buf[offset:offset + size]
 
     def write_record(self, recnum, record):
         """
@@ -830,6 +955,13 @@ class ChangeBlock(object):
         self._buf.seek(offset)
         self._buf.write(record.bytes())
 
+    def has_record(self, recnum):
+        """
+        Return True if this block contains recnum.
+        """
+        offset = RECORD_BASE + recnum * RECORD_SIZE - self._offset
+        return 0 <= offset <= self._size - RECORD_SIZE
+
     def dump(self, file):
         """
         Write the block to storage and wait until the data reach storage.
@@ -843,11 +975,9 @@ class ChangeBlock(object):
         self._buf.close()
 
     def _record_offset(self, recnum):
-        offset = RECORD_BASE + recnum * RECORD_SIZE - self._offset
-        last_offset = BLOCK_SIZE - RECORD_SIZE
-        if not 0 <= offset <= last_offset:
+        if not self.has_record(recnum):
             raise ValueError("recnum %s out of range for this block" % recnum)
-        return offset
+        return RECORD_BASE + recnum * RECORD_SIZE - self._offset
 
 
 class DirectFile(object):
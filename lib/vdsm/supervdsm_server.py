@@ -1,4 +1,4 @@
-# Copyright 2011-2017 Red Hat, Inc.
+# Copyright 2011-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -39,6 +39,7 @@ from vdsm.common import concurrent
 from vdsm.common import constants
 from vdsm.common import fileutils
 from vdsm.common import lockfile
+from vdsm.common import muxrpc
 from vdsm.common import sigutils
 from vdsm.common import time
 from vdsm.common import zombiereaper
@@ -63,7 +64,6 @@ from vdsm.storage.fileUtils import chown, resolveGid, resolveUid
 from vdsm.storage.fileUtils import validateAccess as _validateAccess
 from vdsm.storage.iscsi import getDevIscsiInfo as _getdeviSCSIinfo
 from vdsm.storage.iscsi import readSessionInfo as _readSessionInfo
-from vdsm.common.supervdsm import _SuperVdsmManager
 
 from vdsm.network.initializer import init_privileged_network_components
 
@@ -308,11 +308,8 @@ def main(args):
             signal.signal(signal.SIGTERM, terminate)
             signal.signal(signal.SIGINT, terminate)
 
-            log.debug("Creating remote object manager")
-            manager = _SuperVdsmManager(address=address, authkey='')
-            manager.register('instance', callable=_SuperVdsm)
-
-            server = manager.get_server()
+            log.debug("Creating supervdsm server")
+            server = muxrpc.Server(address, _SuperVdsm())
             servThread = concurrent.thread(server.serve_forever)
             servThread.start()
 
@@ -0,0 +1,356 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+convergence - predict migration convergence
+===========================================
+
+During pre-copy migration, qemu sends the guest memory while the guest
+keeps dirtying pages. When the data remaining can be sent within the
+allowed downtime, qemu pauses the guest and sends the rest.
+
+If the transfer rate is B, the dirty rate is D, and R bytes remain, the
+remaining data changes at rate D - B. When B > D, the time needed to
+reach a remaining size that can be sent within downtime d is::
+
+    (R - B * d) / (B - D)
+
+When B <= D the migration never converges; the only way to finish is a
+downtime large enough to send R at once, post-copy, or abort.
+
+The Estimator computes B and D from successive migration progress
+samples (migration.Progress). The Controller uses the estimates to pick
+the smallest downtime finishing the migration in the allowed time, and
+switches to post-copy or aborts early when even the maximum downtime
+cannot finish the migration in time.
+
+replay() runs a controller on recorded progress samples, to compare
+policies offline. Changing the downtime does not change how qemu sends
+memory until the migration finishes, so a recording made with one policy
+shows when another policy would have finished the migration.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import logging
+import math
+
+# Actions of the convergence schedule sent by Engine, also returned by the
+# Controller.
+SET_DOWNTIME = "setDowntime"
+POST_COPY = "postcopy"
+ABORT = "abort"
+
+# Used when libvirt does not report the page size.
+DEFAULT_PAGE_SIZE = 4096
+
+
+class Estimator(object):
+    """
+    Estimate the transfer rate and the dirty rate of a migration, in bytes
+    per second, from progress samples.
+
+    libvirt reports the transfer rate, the dirty rate and the iteration
+    since libvirt 1.3. When they are missing, the transfer rate is computed
+    from the data processed between samples. Pages dirtied during an
+    iteration are added to the remaining data when the next iteration
+    starts, so the dirty rate is computed from the data added between
+    iterations. Estimates are smoothed using exponential moving average.
+    """
+
+    def __init__(self, alpha=0.5):
+        self._alpha = alpha
+        self._last = None
+        # Time and total data when the last iteration started.
+        self._iteration = None
+        self.transfer_rate = None
+        self.dirty_rate = None
+
+    @property
+    def ready(self):
+        # Nothing can be estimated while no data is transferred.
+        return (self.transfer_rate is not None and self.transfer_rate > 0 and
+                self.dirty_rate is not None)
+
+    def update(self, progress):
+        last = self._last
+        self._last = progress
+        time = progress.time_elapsed / 1000
+        total = progress.data_processed + progress.data_remaining
+
+        if last is None:
+            # The first iteration started with the job.
+            self._iteration = (0, total)
+            interval = 0
+        else:
+            interval = time - last.time_elapsed / 1000
+            if interval <= 0:
+                return
+
+        if progress.mem_bps > 0:
+            transfer_rate = progress.mem_bps
+        elif interval:
+            transfer_rate = ((progress.data_processed - last.data_processed) /
+                             interval)
+        else:
+            transfer_rate = None
+        if transfer_rate is not None:
+            self.transfer_rate = self._smooth(self.transfer_rate,
+                                              transfer_rate)
+
+        if progress.mem_iteration >= 0:
+            iteration_started = (last is not None and
+                                 progress.mem_iteration > last.mem_iteration)
+        else:
+            iteration_started = (
+                last is not None and
+                total > last.data_processed + last.data_remaining)
+
+        # qemu reports the dirty rate after the first iteration.
+        if progress.dirty_rate >= 0 and progress.mem_iteration > 1:
+            page_size = progress.mem_page_size or DEFAULT_PAGE_SIZE
+            self.dirty_rate = self._smooth(self.dirty_rate,
+                                           progress.dirty_rate * page_size)
+        elif iteration_started:
+            start_time, start_total = self._iteration
+            dirty_rate = (total - start_total) / (time - start_time)
+            self.dirty_rate = self._smooth(self.dirty_rate, dirty_rate)
+
+        if iteration_started:
+            self._iteration = (time, total)
+
+    def pending(self, progress):
+        """
+        Return the data that must be sent to finish the migration: the data
+        remaining in this iteration, and the pages dirtied since this
+        iteration started. qemu adds the dirty pages to the remaining data
+        before deciding to finish the migration.
+        """
+        start_time, _ = self._iteration
+        dirtied = self.dirty_rate * (progress.time_elapsed / 1000 -
+                                     start_time)
+        return progress.data_remaining + dirtied
+
+    def converging(self):
+        return self.transfer_rate > self.dirty_rate
+
+    def time_to_converge(self, remaining, downtime):
+        """
+        Return the time in seconds until remaining bytes can be sent within
+        downtime milliseconds, or None if this will never happen.
+        """
+        left = remaining - self.transfer_rate * downtime / 1000
+        if left <= 0:
+            return 0
+        if not self.converging():
+            return None
+        return left / (self.transfer_rate - self.dirty_rate)
+
+    def required_downtime(self, remaining, timeout=None):
+        """
+        Return the downtime in milliseconds needed to finish sending
+        remaining bytes within timeout seconds. If the migration does not
+        converge, return the downtime needed to send remaining bytes now.
+        If the migration converges and timeout is None, return 0.
+        """
+        if self.transfer_rate <= 0:
+            return float("inf")
+        if self.converging():
+            if timeout is None:
+                return 0
+            left = remaining - timeout * (self.transfer_rate -
+                                          self.dirty_rate)
+        else:
+            left = remaining
+        return max(0, left) / self.transfer_rate * 1000
+
+    def _smooth(self, current, value):
+        if current is None:
+            return value
+        return self._alpha * value + (1 - self._alpha) * current
+
+
+class Controller(object):
+    """
+    Decide how to make a migration converge, using the progress samples of
+    the migration.
+    """
+
+    log = logging.getLogger("virt.convergence")
+
+    # Added to the required downtime, since the estimates are noisy.
+    DOWNTIME_MARGIN = 1.2
+
+    def __init__(self, initial_downtime, max_downtime, max_time=0,
+                 post_copy=False, patience=3, estimator=None):
+        """
+        Arguments:
+            initial_downtime (int): downtime in milliseconds used when the
+                migration starts.
+            max_downtime (int): maximum downtime in milliseconds.
+            max_time (int): time in seconds the migration may take, or 0 if
+                unlimited. If the migration cannot finish in time even with
+                max_downtime, it is switched to post-copy, or aborted.
+            post_copy (bool): whether switching to post-copy is allowed.
+            patience (int): number of successive samples predicting that
+                the migration cannot finish before switching to post-copy
+                or aborting.
+            estimator (Estimator): estimator to update, shared with the
+                caller.
+        """
+        self.downtime = min(initial_downtime, max_downtime)
+        self._max_downtime = max_downtime
+        self._max_time = max_time
+        self._post_copy = post_copy
+        self._patience = patience
+        self._estimator = estimator or Estimator()
+        self._failures = 0
+        self._done = False
+        self._post_copy_requested = False
+        self._last_pending = None
+
+    @property
+    def estimator(self):
+        return self._estimator
+
+    def initial_actions(self):
+        return [_action(SET_DOWNTIME, self.downtime)]
+
+    def step(self, progress):
+        """
+        Update the estimates using progress, and return a list of actions
+        to perform. Actions use the format of the convergence schedule
+        actions: {"name": name, "params": [param, ...]}.
+
+        Must be called only during pre-copy. If step() is called after
+        returning a POST_COPY action, switching to post-copy failed, and
+        the migration is aborted.
+        """
+        estimator = self._estimator
+        estimator.update(progress)
+        if self._done:
+            return []
+
+        if self._post_copy_requested:
+            self.log.warning("Migration was not switched to post-copy, "
+                             "aborting")
+            self._done = True
+            return [_action(ABORT)]
+
+        if not estimator.ready:
+            return []
+
+        timeout = None
+        if self._max_time > 0:
+            timeout = max(0, self._max_time - progress.time_elapsed / 1000)
+
+        pending = estimator.pending(progress)
+        required = estimator.required_downtime(pending, timeout)
+        if self._last_pending is not None and pending >= self._last_pending:
+            # When iterations become short, the pages dirtied during an
+            # iteration do not become fewer, even if the migration
+            # converges. Finish the migration now.
+            required = max(required, pending / estimator.transfer_rate * 1000)
+        self._last_pending = pending
+        required *= self.DOWNTIME_MARGIN
+        self.log.debug("Transfer rate %d bytes/s, dirty rate %d bytes/s, "
+                       "pending %d bytes, required downtime %.0f ms",
+                       estimator.transfer_rate, estimator.dirty_rate,
+                       pending, required)
+
+        if required <= self._max_downtime:
+            self._failures = 0
+            return self._increase_downtime(required)
+
+        actions = self._increase_downtime(self._max_downtime)
+        self._failures += 1
+        if self._failures < self._patience:
+            return actions
+
+        if self._post_copy:
+            self.log.info("Migration cannot finish with downtime %d ms, "
+                          "switching to post-copy", self._max_downtime)
+            actions.append(_action(POST_COPY))
+            self._post_copy_requested = True
+        elif timeout is not None:
+            self.log.warning("Migration cannot finish in %d seconds with "
+                             "downtime %d ms, aborting",
+                             self._max_time, self._max_downtime)
+            actions.append(_action(ABORT))
+            self._done = True
+        return actions
+
+    def _increase_downtime(self, downtime):
+        downtime = int(math.ceil(downtime))
+        if downtime <= self.downtime:
+            return []
+        self.downtime = downtime
+        return [_action(SET_DOWNTIME, downtime)]
+
+
+def _action(name, *params):
+    return {"name": name, "params": list(params)}
+
+
+COMPLETED = "completed"
+POST_COPY_COMPLETED = "post-copy"
+ABORTED = "aborted"
+UNFINISHED = "unfinished"
+
+Result = collections.namedtuple("Result", ["outcome", "time", "downtime"])
+
+
+def replay(samples, controller):
+    """
+    Run controller on recorded migration progress samples, and return a
+    Result with the outcome of the migration, the time in seconds when the
+    migration would have finished, and the downtime in milliseconds.
+
+    A migration completes when the pending data (see Estimator.pending())
+    can be sent within the downtime selected by the controller. After
+    switching to post-copy, the pending data is sent once. If the recording
+    ends first, the outcome is UNFINISHED.
+    """
+    estimator = Estimator()
+    downtime = controller.downtime
+    time = 0
+    for progress in samples:
+        time = progress.time_elapsed / 1000
+        estimator.update(progress)
+        if progress.data_remaining == 0:
+            return Result(COMPLETED, time, 0)
+        if estimator.ready:
+            send_time = estimator.pending(progress) / estimator.transfer_rate
+            if send_time * 1000 <= downtime:
+                return Result(COMPLETED, time + send_time, send_time * 1000)
+
+        for action in controller.step(progress):
+            if action["name"] == SET_DOWNTIME:
+                downtime = action["params"][0]
+            elif action["name"] == POST_COPY:
+                send_time = (estimator.pending(progress) /
+                             estimator.transfer_rate)
+                return Result(POST_COPY_COMPLETED, time + send_time, 0)
+            elif action["name"] == ABORT:
+                return Result(ABORTED, time, None)
+
+    return Result(UNFINISHED, time, None)
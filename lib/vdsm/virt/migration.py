@@ -1,5 +1,5 @@
 #
-# Copyright 2008-2017 Red Hat, Inc.
+# Copyright 2008-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -40,6 +40,8 @@ from vdsm.common.define import NORMAL, Mbytes
 from vdsm.common.network.address import normalize_literal_addr
 from vdsm.virt.utils import DynamicBoundedSemaphore
 
+from vdsm.virt import convergence
+from vdsm.virt import migrationqueue
 from vdsm.virt import virdomain
 from vdsm.virt import vmexitreason
 from vdsm.virt import vmstatus
@@ -57,11 +59,6 @@ incomingMigrations = DynamicBoundedSemaphore(
     max(1, config.getint('vars', 'max_incoming_migrations')))
 
 
-CONVERGENCE_SCHEDULE_SET_DOWNTIME = "setDowntime"
-CONVERGENCE_SCHEDULE_POST_COPY = "postcopy"
-CONVERGENCE_SCHEDULE_SET_ABORT = "abort"
-
-
 _MiB_IN_GiB = 1024
 
 
@@ -93,7 +90,8 @@ class SourceThread(object):
     """
     _RECOVERY_LOOP_PAUSE = 10
 
-    ongoingMigrations = DynamicBoundedSemaphore(1)
+    ongoingMigrations = migrationqueue.Scheduler(
+        bandwidth=config.getint('vars', 'migration_total_bandwidth'))
 
     def __init__(self, vm, dst='', dstparams='',
                  mode=MODE_REMOTE, method=METHOD_ONLINE,
@@ -184,6 +182,34 @@ class SourceThread(object):
     def hibernating(self):
         return self._mode == MODE_FILE
 
+    # Used by migrationqueue.Scheduler.
+
+    @property
+    def vm_id(self):
+        return self._vm.id
+
+    @property
+    def mem_size(self):
+        return self._vm.mem_size_mb()
+
+    @property
+    def remaining(self):
+        if self._monitorThread is None or \
+                self._monitorThread.progress is None:
+            return None
+        return self._monitorThread.progress.data_remaining / Mbytes
+
+    @property
+    def dirty_rate(self):
+        if self._monitorThread is None or \
+                self._monitorThread.estimator.dirty_rate is None:
+            return None
+        return self._monitorThread.estimator.dirty_rate / Mbytes
+
+    @property
+    def max_bandwidth(self):
+        return self._maxBandwidth
+
     def _update_progress(self):
         if self._monitorThread is None:
             return
@@ -404,7 +430,7 @@ class SourceThread(object):
             while not self._started:
                 try:
                     self.log.info("Migration semaphore: acquiring")
-                    with SourceThread.ongoingMigrations:
+                    with SourceThread.ongoingMigrations.schedule(self):
                         self.log.info("Migration semaphore: acquired")
                         timeout = config.getint(
                             'vars', 'guest_lifecycle_event_reply_timeout')
@@ -502,6 +528,8 @@ class SourceThread(object):
 
             if self._use_convergence_schedule:
                 self._perform_with_conv_schedule(duri, muri)
+            elif config.getboolean('vars', 'migration_convergence_model'):
+                self._perform_with_convergence_model(duri, muri)
             else:
                 self._perform_with_downtime_thread(duri, muri)
 
@@ -566,7 +594,7 @@ class SourceThread(object):
         # - Perhaps non-shared block storage may cause some trouble.
         for stalling in self._convergence_schedule.get('stalling', []):
             action = stalling.get('action', {}).get('name')
-            if action == CONVERGENCE_SCHEDULE_POST_COPY:
+            if action == convergence.POST_COPY:
                 flags |= libvirt.VIR_MIGRATE_POSTCOPY
                 break
         return flags
@@ -584,6 +612,24 @@ class SourceThread(object):
 
         self._monitorThread.join()
 
+    def _perform_with_convergence_model(self, duri, muri):
+        self._vm.log.debug('performing migration with convergence model')
+        downtimes = exponential_downtime(
+            int(self._downtime),
+            config.getint('vars', 'migration_downtime_steps'))
+        self._monitorThread.controller = convergence.Controller(
+            next(downtimes),
+            int(self._downtime),
+            max_time=max_migration_time(self._vm),
+            post_copy=bool(self._migration_flags &
+                           libvirt.VIR_MIGRATE_POSTCOPY),
+            estimator=self._monitorThread.estimator)
+
+        with utils.running(self._monitorThread):
+            self._perform_migration(duri, muri)
+
+        self._monitorThread.join()
+
     def _perform_with_conv_schedule(self, duri, muri):
         self._vm.log.debug('performing migration with conv schedule')
         with utils.running(self._monitorThread):
@@ -592,8 +638,8 @@ class SourceThread(object):
 
     def set_max_bandwidth(self, bandwidth):
         self._vm.log.debug('setting migration max bandwidth to %d', bandwidth)
-        self._maxBandwidth = bandwidth
         self._vm._dom.migrateSetMaxSpeed(bandwidth)
+        self._maxBandwidth = bandwidth
 
     def stop(self):
         # if its locks we are before the migrateToURI3()
@@ -635,6 +681,15 @@ class SourceThread(object):
             self._recover("Migration failed")
 
 
+def max_migration_time(vm):
+    """
+    Return the time in seconds a migration of vm may take, or 0 if the time
+    is not limited.
+    """
+    max_time_per_gib = config.getint('vars', 'migration_max_time_per_gib_mem')
+    return (max_time_per_gib * vm.mem_size_mb() + 1023) // 1024
+
+
 def exponential_downtime(downtime, steps):
     if steps > 1:
         offset = downtime / float(steps)
@@ -740,6 +795,10 @@ class MonitorThread(object):
         self._conv_schedule = conv_schedule
         self._use_conv_schedule = use_conv_schedule
         self.downtime_thread = _FakeThreadInterface()
+        # convergence.Controller adjusting the downtime, if used.
+        self.controller = None
+        # Shared with the controller, and used by the migration scheduler.
+        self.estimator = convergence.Estimator()
         self._thread = concurrent.thread(
             self.run, name='migmon/' + self._vm.id[:8])
 
@@ -779,10 +838,7 @@ class MonitorThread(object):
                               ' (monitoring interval set to 0)')
 
     def monitor_migration(self):
-        memSize = self._vm.mem_size_mb()
-        maxTimePerGiB = config.getint('vars',
-                                      'migration_max_time_per_gib_mem')
-        migrationMaxTime = (maxTimePerGiB * memSize + 1023) // 1024
+        migrationMaxTime = max_migration_time(self._vm)
         progress_timeout = config.getint('vars', 'migration_progress_timeout')
         lastProgressTime = time.time()
         lowmark = None
@@ -790,7 +846,9 @@ class MonitorThread(object):
         iterationCount = 0
 
         self._execute_init(self._conv_schedule['init'])
-        if not self._use_conv_schedule:
+        if self.controller is not None:
+            self._execute_init(self.controller.initial_actions())
+        elif not self._use_conv_schedule:
             self._vm.log.debug('setting initial migration downtime')
             self.downtime_thread.set_initial_downtime()
 
@@ -862,6 +920,12 @@ class MonitorThread(object):
 
             lastDataRemaining = progress.data_remaining
 
+            if self.controller is not None and not self._vm.post_copy:
+                for action in self.controller.step(progress):
+                    self._execute_action_with_params(action)
+            else:
+                self.estimator.update(progress)
+
             if not self._use_conv_schedule and\
                     (now - lastProgressTime) > progress_timeout:
                 # Migration is stuck, abort
@@ -876,6 +940,7 @@ class MonitorThread(object):
 
             self.progress = progress
             self._vm.log.info('%s', progress)
+            SourceThread.ongoingMigrations.update()
 
     def stop(self):
         self._vm.log.debug('stopping migration monitor thread')
@@ -900,16 +965,16 @@ class MonitorThread(object):
     def _execute_action_with_params(self, action_with_params):
         action = str(action_with_params['name'])
         vm = self._vm
-        if action == CONVERGENCE_SCHEDULE_SET_DOWNTIME:
+        if action == convergence.SET_DOWNTIME:
             downtime = int(action_with_params['params'][0])
             vm.log.debug('Setting downtime to %d', downtime)
             vm._dom.migrateSetMaxDowntime(downtime, 0)
-        elif action == CONVERGENCE_SCHEDULE_POST_COPY:
+        elif action == convergence.POST_COPY:
             if not self._vm.switch_migration_to_post_copy():
                 # Do nothing for now; the next action will be invoked after a
                 # while
                 vm.log.warn('Failed to switch to post-copy migration')
-        elif action == CONVERGENCE_SCHEDULE_SET_ABORT:
+        elif action == convergence.ABORT:
             vm.log.warn('Aborting migration')
             vm._dom.abortJob()
             self.stop()
@@ -920,7 +985,7 @@ _Progress = collections.namedtuple('_Progress', [
     'data_processed', 'data_remaining',
     'mem_total', 'mem_processed', 'mem_remaining',
     'mem_bps', 'mem_constant', 'compression_bytes',
-    'dirty_rate', 'mem_iteration'
+    'dirty_rate', 'mem_iteration', 'mem_page_size'
 ])
 
 
@@ -945,6 +1010,8 @@ class Progress(_Progress):
             stats.get('memory_dirty_rate', -1),
             # available since libvirt 1.3
             stats.get('memory_iteration', -1),
+            # available since libvirt 3.9
+            stats.get('memory_page_size', 0),
         )
 
     def __str__(self):
@@ -0,0 +1,355 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+migrationqueue - schedule outgoing migrations
+=============================================
+
+The Scheduler limits the number of concurrent outgoing migrations, like a
+semaphore, but admits waiting migrations by their estimated completion
+time instead of arrival order. When many VMs are migrated, for example
+when evacuating a host, running short migrations first frees the host
+and the migration slots sooner.
+
+If the host migration bandwidth is configured, the scheduler divides it
+between the running migrations, instead of running each migration with a
+fixed maximum bandwidth. Each migration gets the bandwidth needed to
+keep up with the dirty rate of its VM, and an equal share of the rest.
+When fewer migrations are running than allowed, the running migrations
+use the idle bandwidth. Hibernating VMs save their memory to a file, so
+they take a migration slot, but do not use the migration bandwidth.
+
+Migrations scheduled by the scheduler (jobs) provide:
+
+    vm_id               id of the migrating VM
+    mem_size            memory size of the VM in MiB
+    remaining           data remaining in MiB, or None if unknown
+    dirty_rate          dirty rate in MiB/s, or None if unknown
+    max_bandwidth       current maximum bandwidth in MiB/s
+    set_max_bandwidth   change the maximum bandwidth
+    hibernating         True if the VM is saved to a file
+
+All sizes are in MiB and all rates are in MiB/s.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import contextlib
+import logging
+import threading
+
+from vdsm.common.time import monotonic_time
+
+# Used when the estimated time is unknown.
+UNKNOWN = -1
+
+
+class Scheduler(object):
+
+    log = logging.getLogger("virt.migrationqueue")
+
+    # Dirty rates remembered for migrating VMs again, for example after
+    # a failed migration.
+    _HISTORY_SIZE = 1024
+
+    # Estimated time in seconds used for ordering jobs which cannot
+    # converge or whose time cannot be estimated, so they age like other
+    # jobs.
+    _MAX_ESTIMATE = 3600
+
+    def __init__(self, bound=1, bandwidth=0, clock=monotonic_time):
+        """
+        Arguments:
+            bound (int): maximum number of concurrent migrations.
+            bandwidth (int): migration bandwidth of the host in MiB/s
+                divided between running migrations, or 0 to keep the
+                maximum bandwidth of each migration.
+            clock (callable): for testing.
+        """
+        self._cond = threading.Condition(threading.Lock())
+        # Serializes bandwidth updates, which may block in libvirt.
+        self._update_lock = threading.Lock()
+        self._bound = bound
+        self._bandwidth = bandwidth
+        self._clock = clock
+        self._waiting = []
+        self._running = []
+        self._seq = 0
+        self._dirty_rates = collections.OrderedDict()
+
+    @property
+    def bound(self):
+        with self._cond:
+            return self._bound
+
+    @bound.setter
+    def bound(self, value):
+        with self._cond:
+            self._bound = value
+            self._admit()
+            self._cond.notify_all()
+        self.update()
+
+    @property
+    def bandwidth(self):
+        return self._bandwidth
+
+    @contextlib.contextmanager
+    def schedule(self, job):
+        """
+        Context manager waiting until job is admitted, and releasing it
+        when the context exits.
+        """
+        self.acquire(job)
+        try:
+            yield
+        finally:
+            self.release(job)
+
+    def acquire(self, job):
+        """
+        Wait until job is admitted.
+        """
+        with self._cond:
+            self._enqueue(job)
+            self._admit()
+            while not self._is_running(job):
+                self._cond.wait()
+        self.update()
+
+    def enqueue(self, job):
+        """
+        Add job to the queue without waiting. Call admit() to admit the
+        next jobs.
+        """
+        with self._cond:
+            self._enqueue(job)
+
+    def admit(self):
+        """
+        Admit waiting jobs while the number of running jobs is below the
+        bound, and return the admitted jobs.
+        """
+        with self._cond:
+            admitted = self._admit()
+            if admitted:
+                self._cond.notify_all()
+        if admitted:
+            self.update()
+        return admitted
+
+    def release(self, job):
+        with self._cond:
+            entry = self._find(self._running, job)
+            self._running.remove(entry)
+            self._remember(job)
+            self._admit()
+            self._cond.notify_all()
+        self.update()
+
+    def update(self):
+        """
+        Divide the host migration bandwidth between the running jobs,
+        using their current dirty rates.
+
+        A job whose bandwidth was changed by someone else (for example by
+        Engine, using VM.migrateChangeParams) keeps its bandwidth, which is
+        not available to the other jobs.
+        """
+        if not self._bandwidth:
+            return
+        with self._update_lock:
+            with self._cond:
+                changes = self._allocate()
+            for entry, bandwidth in changes:
+                self.log.debug("Setting bandwidth of migration of VM %s to "
+                               "%d MiB/s", entry.job.vm_id, bandwidth)
+                try:
+                    entry.job.set_max_bandwidth(bandwidth)
+                except Exception:
+                    # The migration may have ended.
+                    self.log.warning("Cannot set bandwidth of migration of "
+                                     "VM %s", entry.job.vm_id, exc_info=True)
+                else:
+                    entry.bandwidth = bandwidth
+
+    def info(self):
+        """
+        Return the state of the queue, reported by Host.getMigrationQueue.
+        """
+        now = self._clock()
+        with self._cond:
+            return {
+                'limit': self._bound,
+                'bandwidth': self._bandwidth,
+                'running': [self._entry_info(e, now) for e in self._running],
+                'waiting': [self._entry_info(e, now)
+                            for e in sorted(self._waiting,
+                                            key=self._priority)],
+            }
+
+    # Private, must be called while holding self._cond.
+
+    def _enqueue(self, job):
+        self._seq += 1
+        self._waiting.append(_Entry(job, self._seq, self._clock()))
+        self.log.debug("Migration of VM %s queued (%d waiting)",
+                       job.vm_id, len(self._waiting))
+
+    def _admit(self):
+        admitted = []
+        while self._waiting and len(self._running) < self._bound:
+            entry = min(self._waiting, key=self._priority)
+            self._waiting.remove(entry)
+            entry.started = self._clock()
+            self._running.append(entry)
+            admitted.append(entry.job)
+            self.log.info("Migration of VM %s admitted after %.1f seconds, "
+                          "estimated time %s seconds", entry.job.vm_id,
+                          entry.started - entry.queued,
+                          self._format_time(self._estimate(entry.job)))
+        return admitted
+
+    def _is_running(self, job):
+        return any(e.job is job for e in self._running)
+
+    def _find(self, entries, job):
+        for entry in entries:
+            if entry.job is job:
+                return entry
+        raise KeyError(job.vm_id)
+
+    def _priority(self, entry):
+        # Shortest job first. Subtracting the waiting time keeps large jobs
+        # from waiting forever while shorter jobs keep arriving. If the time
+        # cannot be estimated, smaller jobs go first.
+        waited = self._clock() - entry.queued
+        estimate = min(self._estimate(entry.job), self._MAX_ESTIMATE)
+        return (estimate - waited, self._remaining(entry.job), entry.seq)
+
+    def _estimate(self, job, bandwidth=None):
+        """
+        Return the estimated time in seconds to migrate job using
+        bandwidth, or inf if the bandwidth is unlimited or the migration
+        cannot converge.
+        """
+        if bandwidth is None:
+            if self._bandwidth:
+                bandwidth = self._bandwidth / max(1, self._bound)
+            else:
+                bandwidth = job.max_bandwidth
+        rate = bandwidth - self._dirty_rate(job)
+        if bandwidth <= 0 or rate <= 0:
+            return float("inf")
+        return self._remaining(job) / rate
+
+    def _remaining(self, job):
+        remaining = job.remaining
+        if remaining is None:
+            remaining = job.mem_size
+        return remaining
+
+    def _dirty_rate(self, job):
+        dirty_rate = job.dirty_rate
+        if dirty_rate is None:
+            dirty_rate = self._dirty_rates.get(job.vm_id, 0)
+        return dirty_rate
+
+    def _remember(self, job):
+        if job.dirty_rate is None:
+            return
+        self._dirty_rates.pop(job.vm_id, None)
+        self._dirty_rates[job.vm_id] = job.dirty_rate
+        if len(self._dirty_rates) > self._HISTORY_SIZE:
+            self._dirty_rates.popitem(last=False)
+
+    def _allocate(self):
+        """
+        Return list of (entry, bandwidth) for running jobs whose bandwidth
+        should change.
+        """
+        available = self._bandwidth
+        managed = []
+        for entry in self._running:
+            if entry.job.hibernating:
+                continue
+            if (entry.bandwidth is not None and
+                    entry.job.max_bandwidth != entry.bandwidth):
+                available -= entry.job.max_bandwidth
+            else:
+                managed.append(entry)
+        if not managed:
+            return []
+        available = max(available, len(managed))
+
+        demands = [self._dirty_rate(e.job) for e in managed]
+        total_demand = sum(demands)
+        if total_demand < available:
+            share = (available - total_demand) / len(managed)
+            shares = [demand + share for demand in demands]
+        else:
+            shares = [available * demand / total_demand
+                      for demand in demands]
+
+        changes = []
+        for entry, bandwidth in zip(managed, shares):
+            bandwidth = max(1, int(bandwidth))
+            if bandwidth != entry.bandwidth:
+                changes.append((entry, bandwidth))
+        return changes
+
+    def _entry_info(self, entry, now):
+        job = entry.job
+        info = {
+            'vmId': job.vm_id,
+            'memSize': job.mem_size,
+            'maxBandwidth': job.max_bandwidth,
+        }
+        if entry.started is None:
+            info['waitTime'] = int(now - entry.queued)
+            estimate = self._estimate(job)
+        else:
+            info['runTime'] = int(now - entry.started)
+            estimate = self._estimate(job, bandwidth=job.max_bandwidth)
+        info['estimatedTime'] = self._format_time(estimate, UNKNOWN)
+        dirty_rate = self._dirty_rate(job)
+        if dirty_rate:
+            info['dirtyRate'] = int(dirty_rate)
+        return info
+
+    def _format_time(self, estimate, unknown="unknown"):
+        if estimate == float("inf"):
+            return unknown
+        return int(estimate)
+
+
+class _Entry(object):
+
+    __slots__ = ("job", "seq", "queued", "started", "bandwidth")
+
+    def __init__(self, job, seq, queued):
+        self.job = job
+        self.seq = seq
+        self.queued = queued
+        self.started = None
+        # Bandwidth set by the scheduler.
+        self.bandwidth = None
@@ -648,8 +648,7 @@ class Vm(object):
         self._notify('VM_migration_status', status)
 
     def _notify(self, operation, params):
-        sub_id = '|virt|%s|%s' % (operation, self.id)
-        self.cif.notify(sub_id, {self.id: params})
+        self.cif.notify_vm(operation, self.id, params)
 
     def _onGuestStatusChange(self):
         self.send_status_event(**self._getGuestStats())
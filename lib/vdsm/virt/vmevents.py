@@ -0,0 +1,117 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+"""
+vmevents - coalesce VM events
+=============================
+
+VMs send a VM_status or VM_migration_status event on every change. When
+many VMs change at the same time, for example during a storage outage or
+when migrating many VMs, sending every event separately floods Engine
+with notifications.
+
+The aggregator keeps the events sent during a short window, and sends
+them when the window ends. The events of each kind sent by a VM are
+merged, since an event may hold only the changed fields, and the events
+of all VMs are sent in one notification per kind. The params of VM
+events are already a map indexed by VM id, so the batched notification
+uses the format defined in vdsm-events.yml.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import logging
+import threading
+
+
+class Aggregator(object):
+
+    log = logging.getLogger("virt.vmevents")
+
+    def __init__(self, notify, scheduler, window):
+        """
+        Arguments:
+            notify (callable): called as notify(event_id, params,
+                coalesce=bool) to send an event, see clientIF.notify().
+            scheduler (vdsm.schedule.Scheduler): used to send the events
+                when the window ends.
+            window (float): time in seconds to keep events before sending
+                them. If 0, or if scheduler is None, events are sent
+                immediately.
+        """
+        self._notify = notify
+        self._scheduler = scheduler
+        self._window = window
+        self._lock = threading.Lock()
+        # Pending events by operation, then by VM id.
+        self._events = collections.OrderedDict()
+        self._call = None
+
+    def send(self, operation, vm_id, params):
+        """
+        Send an event of a VM, merging params into the pending event of
+        the same operation sent by this VM.
+        """
+        if self._window <= 0 or self._scheduler is None:
+            self._send(operation, {vm_id: params})
+            return
+
+        with self._lock:
+            vms = self._events.setdefault(operation,
+                                          collections.OrderedDict())
+            # Keep the fields of the pending event, and move the VM to the
+            # end.
+            merged = vms.pop(vm_id, {})
+            merged.update(params)
+            vms[vm_id] = merged
+            if self._call is None:
+                self._call = self._scheduler.schedule(self._window,
+                                                      self._flush)
+
+    def flush(self):
+        """
+        Send the pending events now.
+        """
+        with self._lock:
+            if self._call is not None:
+                self._call.cancel()
+        self._flush()
+
+    def _flush(self):
+        with self._lock:
+            events = self._events
+            self._events = collections.OrderedDict()
+            self._call = None
+
+        for operation, vms in events.items():
+            self._send(operation, vms)
+
+    def _send(self, operation, vms):
+        # The event id ends with the id of the first VM; Engine reads the
+        # VM ids from the params. An event of several VMs must not replace
+        # a queued event with the same id, holding other VMs.
+        event_id = '|virt|%s|%s' % (operation, next(iter(vms)))
+        try:
+            self._notify(event_id, dict(vms), coalesce=len(vms) == 1)
+        except Exception:
+            self.log.exception("Error sending %s for %d VMs",
+                               operation, len(vms))
@@ -1,5 +1,5 @@
 #
-# Copyright 2016-2017 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -250,17 +250,13 @@ def parse_file(filename):
 
 
 def find_schema(gluster_enabled=False):
-    try:
-        schema = vdsmapi.Schema.vdsm_api(strict_mode=False,
-                                         with_gluster=gluster_enabled)
-    except vdsmapi.SchemaNotFound as e:
-        raise client.MissingSchemaError(e)
-    return schema
+    # Loaded once, and reused by the client.
+    return client.api_schema(gluster_enabled)
 
 
 def create_namespaces(schema):
     namespaces = {}
-    for method in schema.get_methods:
+    for method in schema.method_names:
         namespace, command_name = method.split('.', 1)
         if namespace not in namespaces:
             namespaces[namespace] = []
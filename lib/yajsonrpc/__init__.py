@@ -1,4 +1,4 @@
-# Copyright (C) 2014-2017 Red Hat Inc.
+# Copyright (C) 2014-2018 Red Hat Inc.
 # Copyright (C) 2014 Saggi Mizrahi, Red Hat Inc.
 #
 # This program is free software; you can redistribute it and/or modify
@@ -16,6 +16,8 @@
 from __future__ import absolute_import
 from __future__ import division
 import logging
+
+import six
 from six.moves import queue
 
 from vdsm.common import exception as vdsmexception
@@ -36,6 +38,17 @@ _STATE_INCOMING = 1
 _STATE_OUTGOING = 2
 _STATE_ONESHOT = 4
 
+# Responses are encoded into chunks of about this size, so large results
+# are never held in one string.
+CHUNK_SIZE = 64 * 1024
+
+# Containers nested less than this are encoded item by item, deeper values
+# are encoded with one call to the encoder.
+_STREAM_DEPTH = 2
+
+# Like json.dumps(obj, 'utf-8'), which passes 'utf-8' as skipkeys.
+_encoder = json.JSONEncoder(skipkeys=True)
+
 
 class JsonRpcRequest(object):
     def __init__(self, method, params=(), reqId=None):
@@ -120,6 +133,13 @@ class JsonRpcResponse(object):
         res = self.toDict()
         return json.dumps(res, 'utf-8')
 
+    def encode_chunks(self):
+        """
+        Return the encoded response as a list of bytes chunks, see
+        encode_chunks().
+        """
+        return encode_chunks(self.toDict())
+
     @staticmethod
     def decode(msg):
         obj = json.loads(msg, encoding='utf-8')
@@ -222,19 +242,27 @@ class _JsonRpcServeRequestContext(object):
         encodedObjects = []
         for response in self._responses:
             try:
-                encodedObjects.append(response.encode())
+                encodedObjects.append(response.encode_chunks())
             except:  # Error encoding data
                 response = JsonRpcResponse(None,
                                            exception.JsonRpcInternalError(),
                                            response.id)
-                encodedObjects.append(response.encode())
+                encodedObjects.append(response.encode_chunks())
 
         if len(encodedObjects) == 1:
             data = encodedObjects[0]
         else:
-            data = '[' + ','.join(encodedObjects) + ']'
-
-        self._client.send(data.encode('utf-8'))
+            data = [b'[']
+            for i, chunks in enumerate(encodedObjects):
+                if i:
+                    data.append(b',')
+                data.extend(chunks)
+            data.append(b']')
+
+        # Pass the ids with the encoded data, so the transport can route
+        # the reply without decoding it.
+        response_ids = [r.id for r in self._responses]
+        self._client.send(data, response_ids=response_ids)
 
     def addResponse(self, response):
         self._responses.append(response)
@@ -251,6 +279,76 @@ class _JsonRpcServeRequestContext(object):
         self.sendReply()
 
 
+def encode_chunks(obj, chunk_size=CHUNK_SIZE):
+    """
+    Encode obj to JSON, returning a list of bytes chunks of about
+    chunk_size bytes. The chunks joined are the same text returned by
+    json.dumps(obj, 'utf-8').
+
+    The text is built incrementally, so we never hold the entire text in
+    one string. A single value larger than chunk_size, such as the stats
+    of one vm, is returned in one chunk.
+    """
+    chunks = []
+    buf = []
+    size = 0
+    for s in _iterencode(obj, 0):
+        buf.append(s)
+        size += len(s)
+        if size >= chunk_size:
+            chunks.append(_join(buf))
+            buf = []
+            size = 0
+    if buf:
+        chunks.append(_join(buf))
+    return chunks
+
+
+def _iterencode(obj, depth):
+    if depth < _STREAM_DEPTH:
+        if isinstance(obj, dict):
+            return _iterencode_dict(obj, depth)
+        if isinstance(obj, (list, tuple)):
+            return _iterencode_list(obj, depth)
+    return (_encoder.encode(obj),)
+
+
+def _iterencode_dict(obj, depth):
+    yield "{"
+    first = True
+    for key, value in six.iteritems(obj):
+        # Let the encoder convert the key, or skip it if it is not a
+        # valid key.
+        prefix = _encoder.encode({key: None})[1:-5]
+        if not prefix:
+            continue
+        if first:
+            first = False
+        else:
+            yield ", "
+        yield prefix
+        for s in _iterencode(value, depth + 1):
+            yield s
+    yield "}"
+
+
+def _iterencode_list(obj, depth):
+    yield "["
+    for i, item in enumerate(obj):
+        if i:
+            yield ", "
+        for s in _iterencode(item, depth + 1):
+            yield s
+    yield "]"
+
+
+def _join(buf):
+    data = "".join(buf)
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    return data
+
+
 class JsonRpcTask(object):
 
     def __init__(self, handler, ctx, req):
@@ -1,4 +1,4 @@
-# Copyright (C) 2014-2017 Saggi Mizrahi, Red Hat Inc.
+# Copyright (C) 2014-2018 Saggi Mizrahi, Red Hat Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License version 2 as
@@ -21,13 +21,17 @@ from __future__ import division
 
 import asyncore
 import errno
+import heapq
 import logging
+import select
 import socket
+from collections import deque
 
 import six
 
 from vdsm import sslutils
 from vdsm.common.eventfd import EventFD
+from vdsm.common.time import monotonic_time
 
 
 _BLOCKING_IO_ERRORS = (errno.EAGAIN, errno.EALREADY, errno.EINPROGRESS,
@@ -214,48 +218,214 @@ class AsyncoreEvent(asyncore.file_dispatcher):
         asyncore.file_dispatcher.close(self)
 
 
+class _ChannelMap(dict):
+    """
+    Asyncore channel map, remembering the file descriptors of the channels
+    added or removed since the reactor checked the map.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.changes = deque()
+
+    def __setitem__(self, fd, channel):
+        dict.__setitem__(self, fd, channel)
+        self.changes.append(fd)
+
+    def __delitem__(self, fd):
+        dict.__delitem__(self, fd)
+        self.changes.append(fd)
+
+
 class Reactor(object):
     """
     map dictionary maps sock.fileno() to channels to watch. We add channels to
     it by running add_dispatcher and removing by remove_dispatcher.
-    It is used by asyncore loop to know which channels events to track.
+
+    The channels are registered in an epoll object, which is kept between
+    iterations. The reactor asks a channel if it is readable or writable,
+    and when it wants to be checked again (next_check_interval), only when
+    the channel may have changed:
+
+    - the channel was added to the map
+    - the channel had events
+    - the time returned by next_check_interval has passed
+    - wakeup() was called with the channel
+
+    Calling wakeup() without a channel checks all the channels, so callers
+    changing a channel from another thread without telling the reactor
+    which channel changed still work.
 
     We use eventfd as mechanism to trigger processing when needed.
     """
 
+    # Longest time to wait for events.
+    MAX_TIMEOUT = 30.0
+
     def __init__(self):
-        self._map = {}
-        self._is_running = False
+        self._map = _ChannelMap()
+        # Set here and not in process_requests(), so stop() works if called
+        # before the reactor thread started.
+        self._is_running = True
+        self._poller = None
+        # fd -> (channel, registered events)
+        self._registered = {}
+        # Heap of (deadline, fd), and the current deadline of every fd.
+        # Entries with another deadline in _deadlines are stale.
+        self._timers = []
+        self._deadlines = {}
+        # Channels to check, or None to check all channels.
+        self._pending = deque()
         self._wakeupEvent = AsyncoreEvent(self._map)
 
     def create_dispatcher(self, sock, impl=None):
         return Dispatcher(impl=impl, sock=sock, map=self._map)
 
     def process_requests(self):
-        self._is_running = True
-        while self._is_running:
-            asyncore.loop(
-                timeout=self._get_timeout(self._map),
-                use_poll=True,
-                map=self._map,
-                count=1,
-            )
+        self._poller = select.epoll()
+        try:
+            while self._is_running:
+                self._poll()
+        finally:
+            for dispatcher in list(six.viewvalues(self._map)):
+                dispatcher.close()
+
+            self._map.clear()
+            self._registered.clear()
+            self._poller.close()
+
+    def _poll(self):
+        self._update()
+
+        try:
+            events = self._poller.poll(self._timeout())
+        except (IOError, OSError) as e:
+            if e.errno != errno.EINTR:
+                raise
+            events = []
+
+        for fd, flags in events:
+            channel = self._map.get(fd)
+            if channel is None:
+                continue
+            asyncore.readwrite(channel, flags)
+            self._pending.append(fd)
+
+        now = monotonic_time()
+        while self._timers and self._timers[0][0] <= now:
+            deadline, fd = heapq.heappop(self._timers)
+            if self._deadlines.get(fd) == deadline:
+                del self._deadlines[fd]
+                self._pending.append(fd)
+
+    def _update(self):
+        """
+        Update the registrations of the added and removed channels, and of
+        the channels that may have changed.
+        """
+        changes = self._map.changes
+        pending = self._pending
+        check = set()
+
+        while changes:
+            fd = changes.popleft()
+            registered = self._registered.get(fd)
+            channel = self._map.get(fd)
+            if registered is not None and registered[0] is not channel:
+                self._unregister(fd)
+            if channel is None:
+                self._deadlines.pop(fd, None)
+            else:
+                check.add(fd)
+
+        while pending:
+            fd = pending.popleft()
+            if fd is None:
+                check.update(self._map)
+            else:
+                check.add(fd)
+
+        now = monotonic_time()
+        for fd in check:
+            channel = self._map.get(fd)
+            if channel is not None:
+                self._check(fd, channel, now)
+
+        # Drop stale timers when they are most of the heap.
+        if len(self._timers) > 2 * len(self._deadlines) + 64:
+            self._timers = [(deadline, fd) for fd, deadline
+                            in six.iteritems(self._deadlines)]
+            heapq.heapify(self._timers)
+
+    def _check(self, fd, channel, now):
+        if hasattr(channel, "next_check_interval"):
+            interval = channel.next_check_interval()
+            if interval is not None and interval >= 0:
+                deadline = now + interval
+                if self._deadlines.get(fd) != deadline:
+                    self._deadlines[fd] = deadline
+                    heapq.heappush(self._timers, (deadline, fd))
+            else:
+                self._deadlines.pop(fd, None)
+
+        events = 0
+        if channel.readable():
+            events |= select.EPOLLIN | select.EPOLLPRI
+        # accepting sockets should not be writable
+        if channel.writable() and not channel.accepting:
+            events |= select.EPOLLOUT
+
+        # readable() and writable() may close the channel.
+        if self._map.get(fd) is not channel:
+            return
 
-        for dispatcher in list(six.viewvalues(self._map)):
-            dispatcher.close()
+        registered = self._registered.get(fd)
+        if registered is not None and registered[1] == events:
+            return
 
-        self._map.clear()
+        if not events:
+            # Like asyncore, do not check for errors if the channel is not
+            # readable or writable.
+            self._unregister(fd)
+        elif registered is None:
+            try:
+                self._poller.register(fd, events)
+            except (IOError, OSError) as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                # Registered by a closed channel that used the same fd.
+                self._poller.modify(fd, events)
+            self._registered[fd] = (channel, events)
+        else:
+            self._poller.modify(fd, events)
+            self._registered[fd] = (channel, events)
+
+    def _unregister(self, fd):
+        if self._registered.pop(fd, None) is None:
+            return
+        try:
+            self._poller.unregister(fd)
+        except (IOError, OSError, ValueError):
+            # The file descriptor was closed, or reused by another channel.
+            pass
 
-    def _get_timeout(self, map):
-        timeout = 30.0
-        for disp in list(six.viewvalues(self._map)):
-            if hasattr(disp, "next_check_interval"):
-                interval = disp.next_check_interval()
-                if interval is not None and interval >= 0:
-                    timeout = min(interval, timeout)
-        return timeout
+    def _timeout(self):
+        if self._pending or self._map.changes:
+            return 0
+        if not self._timers:
+            return self.MAX_TIMEOUT
+        timeout = self._timers[0][0] - monotonic_time()
+        return min(max(timeout, 0), self.MAX_TIMEOUT)
 
-    def wakeup(self):
+    def wakeup(self, dispatcher=None):
+        """
+        Wake up the reactor to check dispatcher, or all the dispatchers if
+        dispatcher is None.
+        """
+        if dispatcher is None:
+            self._pending.append(None)
+        elif dispatcher._fileno is not None:
+            self._pending.append(dispatcher._fileno)
         self._wakeupEvent.set()
 
     def stop(self):
@@ -1,4 +1,4 @@
-# Copyright (C) 2017 Red Hat Inc.
+# Copyright (C) 2017-2018 Red Hat Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License version 2 as
@@ -183,7 +183,8 @@ class JsonRpcClient(object):
 
     def _processIncomingResponse(self, resp):
         if isinstance(resp, list):
-            map(self._processIncomingResponse, resp)
+            for r in resp:
+                self._processIncomingResponse(r)
             return
 
         resp = JsonRpcResponse.fromRawObject(resp)
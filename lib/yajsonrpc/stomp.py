@@ -1,4 +1,4 @@
-# Copyright 2014-2017 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 # Copyright (C) 2014 Saggi Mizrahi, Red Hat Inc.
 #
 # This program is free software; you can redistribute it and/or modify
@@ -40,6 +40,11 @@ NR_RETRIES = 1
 # This is the value used by engine
 GRACE_PERIOD_FACTOR = 0.2
 
+# Bodies up to this size are copied into the frame buffer, so small frames
+# are sent with one send() call. Larger bodies are sent from the body
+# itself, without copying.
+COPY_BODY_SIZE = 64 * 1024
+
 _RE_ESCAPE_SEQUENCE = re.compile(br"\\(.)")
 
 _RE_ENCODE_CHARS = re.compile(br"[\r\n\\:]")
@@ -109,11 +114,18 @@ class _HeartBeatFrame(object):
     def encode(self):
         return "\n"
 
+    def encode_buffers(self):
+        return ["\n"]
+
 # There is no reason to have multiple instances
 _heartBeatFrame = _HeartBeatFrame()
 
 
 class Frame(object):
+    """
+    A STOMP frame. The body of frames sent by vdsm may also be a list of
+    bytes chunks, sent without joining them.
+    """
     __slots__ = ("headers", "command", "body")
 
     def __init__(self, command="", headers=None, body=None):
@@ -128,10 +140,22 @@ class Frame(object):
         self.body = body
 
     def encode(self):
+        return ''.join(self.encode_buffers())
+
+    def encode_buffers(self):
+        """
+        Return the encoded frame as a list of buffers to send. The body is
+        not copied if it is larger than COPY_BODY_SIZE.
+        """
         body = self.body
+        if isinstance(body, list):
+            body_size = sum(len(chunk) for chunk in body)
+        elif body is not None:
+            body_size = len(body)
+
         # We do it here so we are sure header is up to date
         if body is not None:
-            self.headers["content-length"] = len(body)
+            self.headers["content-length"] = body_size
 
         data = [self.command, '\n']
         for key, value in six.viewitems(self.headers):
@@ -141,11 +165,24 @@ class Frame(object):
             data.append("\n")
 
         data.append('\n')
-        if body is not None:
+        if body is None:
+            data.append("\0")
+            return [''.join(data)]
+
+        if isinstance(body, list):
+            if body_size <= COPY_BODY_SIZE:
+                data.extend(body)
+                data.append("\0")
+                return [''.join(data)]
+
+            return [''.join(data)] + body + ["\0"]
+
+        if body_size <= COPY_BODY_SIZE:
             data.append(body)
+            data.append("\0")
+            return [''.join(data)]
 
-        data.append("\0")
-        return ''.join(data)
+        return [''.join(data), body, "\0"]
 
     def __repr__(self):
         return "<StompFrame command=%s>" % (repr(self.command))
@@ -181,9 +218,21 @@ def encodeValue(s):
     elif not isinstance(s, str):
         raise ValueError('Unable to encode non-string values')
 
+    # Most values do not need escaping.
+    if _RE_ENCODE_CHARS.search(s) is None:
+        return s
+
     return _RE_ENCODE_CHARS.sub(lambda m: _EC_ENCODE_MAP[m.group(0)], s)
 
 
+if six.PY2:
+    def _view(data, offset):
+        return buffer(data, offset)  # NOQA: F821 (python 2 builtin)
+else:
+    def _view(data, offset):
+        return memoryview(data)[offset:]
+
+
 class Parser(object):
     _STATE_CMD = "Parsing command"
     _STATE_HEADER = "Parsing headers"
@@ -355,7 +404,10 @@ class AsyncDispatcher(object):
         self.connection = connection
         self._bufferSize = bufferSize
         self._parser = Parser()
+        # Buffers of the frame being sent, and the number of bytes sent
+        # from the first buffer.
         self._outbuf = None
+        self._outbuf_offset = 0
         self._incoming_heartbeat_in_milis = 0
         self._outgoing_heartbeat_in_milis = 0
         self._reconnect_interval = 0
@@ -387,6 +439,7 @@ class AsyncDispatcher(object):
     def handle_connect(self, dispatcher):
         self.log.debug("managed to connect successfully.")
         self._outbuf = None
+        self._outbuf_offset = 0
         self._count = 0
         self._on_timeout = False
         self._update_reconnect_time()
@@ -490,9 +543,14 @@ class AsyncDispatcher(object):
                 except IndexError:
                     return
 
-                self._outbuf = frame.encode()
+                self._outbuf = frame.encode_buffers()
+                self._outbuf_offset = 0
 
-            data = self._outbuf
+            # After a partial send, send the rest of the buffer without
+            # copying it.
+            data = self._outbuf[0]
+            if self._outbuf_offset:
+                data = _view(data, self._outbuf_offset)
             numSent = dispatcher.send(data)
             if numSent == 0:
                 # want to resend
@@ -503,9 +561,14 @@ class AsyncDispatcher(object):
 
             self._update_outgoing_heartbeat()
             if numSent < len(data):
-                self._outbuf = data[numSent:]
+                self._outbuf_offset += numSent
                 return
 
+            del self._outbuf[0]
+            self._outbuf_offset = 0
+            if self._outbuf:
+                continue
+
             self._outbuf = None
             self._frame_handler.pop_message()
 
@@ -602,7 +665,11 @@ class StompConnection(object):
 
     def send_raw(self, msg):
         self._async_client.queue_frame(msg)
-        self._reactor.wakeup()
+        self._reactor.wakeup(self._dispatcher)
+
+    def send_event(self, msg, key=None):
+        self._async_client.queue_event(msg, key=key)
+        self._reactor.wakeup(self._dispatcher)
 
     def setTimeout(self, timeout):
         self._dispatcher.socket.settimeout(timeout)
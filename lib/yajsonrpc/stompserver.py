@@ -1,4 +1,4 @@
-# Copyright (C) 2014-2017 Red Hat Inc.
+# Copyright (C) 2014-2018 Red Hat Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License version 2 as
@@ -15,9 +15,13 @@
 
 from __future__ import absolute_import
 from __future__ import division
-import logging
-from collections import deque
+import collections
 import functools
+import logging
+import threading
+import weakref
+
+import six
 
 from vdsm.config import config
 from vdsm.common.compat import json
@@ -25,6 +29,33 @@ from . import JsonRpcServer
 from . import stomp, stompclient
 from .betterAsyncore import Dispatcher, Reactor
 
+# Adapters of the connected clients, used to report the queued events.
+_adapters = weakref.WeakSet()
+_stats_lock = threading.Lock()
+_stats = {"dropped_events": 0, "coalesced_events": 0}
+
+
+def stats():
+    """
+    Return the statistics of the events sent to the clients:
+
+    - queued_events: events waiting to be sent to all clients
+    - dropped_events: events dropped since vdsm was started, because a client
+      did not read them fast enough
+    - coalesced_events: events replaced by a newer event with the same key
+      before they were sent, since vdsm was started
+    """
+    with _stats_lock:
+        adapters = list(_adapters)
+        res = dict(_stats)
+    res["queued_events"] = sum(a.queued_events for a in adapters)
+    return res
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
 
 def parseHeartBeatHeader(v):
     try:
@@ -56,10 +87,23 @@ class StompAdapterImpl(object):
     sub_map - maps a destination id to _Subsctiption object
               representing stomp subscription.
     req_dest - maps a request id to a destination.
+
+    Replies and control frames are queued in the outbox, and are never
+    dropped. Events are queued separately and sent after the outbox, in a
+    queue bounded by rpc:max_queued_events. An event replaces the queued
+    event with the same key, and when the queue is full the oldest event is
+    dropped, so a client that does not read its events cannot grow the
+    memory of vdsm without limit.
     """
     def __init__(self, reactor, sub_map, req_dest):
         self._reactor = reactor
-        self._outbox = deque()
+        self._lock = threading.Lock()
+        self._outbox = collections.deque()
+        self._events = collections.OrderedDict()
+        self._max_events = config.getint('rpc', 'max_queued_events')
+        self._dropping = False
+        # The frame being sent, kept until it is popped.
+        self._current = None
         self._sub_dests = sub_map
         self._req_dest = req_dest
         self._sub_ids = {}
@@ -71,20 +115,71 @@ class StompAdapterImpl(object):
             stomp.Command.SUBSCRIBE: self._cmd_subscribe,
             stomp.Command.UNSUBSCRIBE: self._cmd_unsubscribe,
             stomp.Command.DISCONNECT: self._cmd_disconnect}
+        with _stats_lock:
+            _adapters.add(self)
 
     @property
     def has_outgoing_messages(self):
-        return (len(self._outbox) > 0)
+        return (self._current is not None or
+                len(self._outbox) > 0 or
+                len(self._events) > 0)
+
+    @property
+    def queued_events(self):
+        return len(self._events)
 
     def peek_message(self):
-        return self._outbox[0]
+        with self._lock:
+            if self._current is None:
+                self._current = self._next_message()
+            return self._current
 
     def pop_message(self):
-        return self._outbox.popleft()
+        with self._lock:
+            if self._current is None:
+                return self._next_message()
+            frame, self._current = self._current, None
+            return frame
 
     def queue_frame(self, frame):
         self._outbox.append(frame)
 
+    def queue_event(self, frame, key=None):
+        """
+        Queue an event frame. If key is not None, replace the queued event
+        with the same key. If the queue is full, drop the oldest event.
+        """
+        if key is None:
+            # Unique key, never replaced.
+            key = object()
+        with self._lock:
+            if self._events.pop(key, None) is not None:
+                _count("coalesced_events")
+            elif len(self._events) >= self._max_events:
+                _, dropped = self._events.popitem(last=False)
+                _count("dropped_events")
+                if not self._dropping:
+                    self._dropping = True
+                    self.log.warning(
+                        "Client is not reading events, dropping events "
+                        "(max_queued_events=%d, first dropped: %s)",
+                        self._max_events,
+                        dropped.headers.get(stomp.Headers.DESTINATION))
+            self._events[key] = frame
+
+    def _next_message(self):
+        """
+        Must be called when holding self._lock.
+        """
+        if self._outbox:
+            return self._outbox.popleft()
+        if self._events:
+            _, frame = self._events.popitem(last=False)
+            if not self._events:
+                self._dropping = False
+            return frame
+        raise IndexError("No outgoing messages")
+
     def remove_subscriptions(self):
         for sub in self._sub_ids.values():
             self._remove_subscription(sub)
@@ -302,21 +397,22 @@ class StompServer(object):
 
     """
     Sends message to all subscribes that subscribed to destination.
-    """
-    def send(self, message, destination=stomp.SUBSCRIPTION_ID_RESPONSE):
-        resp = json.loads(message)
-        if not isinstance(resp, dict):
-            raise ValueError(
-                'Provided message %s failed parsing to dictionary' % message)
-        # pylint: disable=no-member
-        response_id = resp.get("id")
 
-        try:
-            destination = self._req_dest[response_id]
-            del self._req_dest[response_id]
-        except KeyError:
-            # we could have no reply-to or we could send events (no message id)
-            pass
+    When sending a reply, response_ids are the ids of the responses in
+    message. The reply is sent to the destination of the requests, if the
+    requests had one.
+
+    Messages without response_ids are events. If key is not None, a queued
+    event with the same key that was not sent yet is replaced by message.
+    """
+    def send(self, message, destination=stomp.SUBSCRIPTION_ID_RESPONSE,
+             response_ids=(), key=None):
+        for response_id in response_ids:
+            try:
+                destination = self._req_dest.pop(response_id)
+            except KeyError:
+                # we could have no reply-to
+                pass
 
         try:
             connections = self._sub_map[destination]
@@ -325,6 +421,11 @@ class StompServer(object):
                           destination)
             return
 
+        # Encode the message once; the frames of all subscribers share the
+        # body and differ only in the headers.
+        if isinstance(message, six.text_type):
+            message = message.encode("utf-8")
+
         for connection in connections:
             res = stomp.Frame(
                 stomp.Command.MESSAGE,
@@ -336,8 +437,12 @@ class StompServer(object):
                 message
             )
             # we need to check whether the channel is not closed
-            if not connection.client.is_closed():
+            if connection.client.is_closed():
+                continue
+            if response_ids:
                 connection.client.send_raw(res)
+            else:
+                connection.client.send_event(res, key=key)
 
 
 def StompListener(reactor, server, acceptHandler, connected_socket):
@@ -439,7 +544,7 @@ class ServerRpcContextAdapter(object):
     def get_local_address(self, *args, **kwargs):
         return self._address
 
-    def send(self, data):
+    def send(self, data, response_ids=()):
         if self._reply_to:
             self._client.send(
                 self._reply_to,
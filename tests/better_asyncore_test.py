@@ -1,5 +1,5 @@
 #
-# Copyright 2016-2017 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -20,13 +20,17 @@
 #
 from __future__ import absolute_import
 from __future__ import division
+from __future__ import print_function
 import socket
+import threading
+import time
 from contextlib import closing
 
 from vdsm.common import concurrent
 from yajsonrpc.betterAsyncore import AsyncoreEvent, Reactor
 
 from testlib import VdsmTestCase as TestCaseBase
+from testValidation import slowtest
 
 
 class TestEvent(TestCaseBase):
@@ -70,3 +74,193 @@ class TestReactor(TestCaseBase):
 
         self.assertTrue(disp.closing)
         self.assertFalse(reactor._wakeupEvent.closing)
+
+
+class EchoImpl(object):
+    """
+    Sends back the data received.
+    """
+
+    def __init__(self):
+        self.outbuf = b""
+        self.checks = 0
+
+    def readable(self, dispatcher):
+        return True
+
+    def writable(self, dispatcher):
+        return len(self.outbuf) > 0
+
+    def handle_read(self, dispatcher):
+        data = dispatcher.recv(4096)
+        if data:
+            self.outbuf += data
+
+    def handle_write(self, dispatcher):
+        sent = dispatcher.send(self.outbuf)
+        self.outbuf = self.outbuf[sent:]
+
+    def next_check_interval(self):
+        self.checks += 1
+        return None
+
+
+class SenderImpl(object):
+    """
+    Sends data queued by another thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outbuf = b""
+
+    def queue(self, data):
+        with self.lock:
+            self.outbuf += data
+
+    def readable(self, dispatcher):
+        return False
+
+    def writable(self, dispatcher):
+        with self.lock:
+            return len(self.outbuf) > 0
+
+    def handle_write(self, dispatcher):
+        with self.lock:
+            sent = dispatcher.send(self.outbuf)
+            self.outbuf = self.outbuf[sent:]
+
+
+class TimerImpl(object):
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.checks = 0
+
+    def readable(self, dispatcher):
+        return True
+
+    def writable(self, dispatcher):
+        return False
+
+    def next_check_interval(self):
+        self.checks += 1
+        return self.interval
+
+
+class TestEpollReactor(TestCaseBase):
+
+    def setUp(self):
+        self.reactor = Reactor()
+        self.thread = concurrent.thread(self.reactor.process_requests,
+                                        name='test reactor')
+        self.thread.start()
+
+    def tearDown(self):
+        self.reactor.stop()
+        self.thread.join(timeout=5)
+
+    def test_echo(self):
+        s1, s2 = socket.socketpair()
+        with closing(s2):
+            self.reactor.create_dispatcher(s1, impl=EchoImpl())
+            self.reactor.wakeup()
+            s2.settimeout(5)
+            for i in range(10):
+                s2.sendall(b"ping %d" % i)
+                self.assertEqual(recv_all(s2, 6), b"ping %d" % i)
+
+    def test_wakeup_dispatcher(self):
+        s1, s2 = socket.socketpair()
+        with closing(s2):
+            impl = SenderImpl()
+            disp = self.reactor.create_dispatcher(s1, impl=impl)
+            self.reactor.wakeup()
+            s2.settimeout(5)
+            for i in range(10):
+                impl.queue(b"message %d" % i)
+                self.reactor.wakeup(disp)
+                self.assertEqual(recv_all(s2, 9), b"message %d" % i)
+
+    def test_idle_dispatchers_not_checked(self):
+        pairs = [socket.socketpair() for i in range(10)]
+        try:
+            impls = [EchoImpl() for i in range(10)]
+            for (s1, s2), impl in zip(pairs, impls):
+                self.reactor.create_dispatcher(s1, impl=impl)
+            self.reactor.wakeup()
+
+            active = pairs[0][1]
+            active.settimeout(5)
+            for i in range(10):
+                active.sendall(b"ping %d" % i)
+                self.assertEqual(recv_all(active, 6), b"ping %d" % i)
+
+            # The active dispatcher is checked after every event, the idle
+            # dispatchers only when added.
+            self.assertGreater(impls[0].checks, 10)
+            for impl in impls[1:]:
+                self.assertLess(impl.checks, 3)
+        finally:
+            for s1, s2 in pairs:
+                s2.close()
+
+    def test_next_check_interval(self):
+        s1, s2 = socket.socketpair()
+        with closing(s2):
+            impl = TimerImpl(0.05)
+            self.reactor.create_dispatcher(s1, impl=impl)
+            self.reactor.wakeup()
+            time.sleep(0.5)
+            self.assertGreater(impl.checks, 3)
+
+    def test_closed_dispatcher(self):
+        s1, s2 = socket.socketpair()
+        with closing(s2):
+            disp = self.reactor.create_dispatcher(s1, impl=EchoImpl())
+            self.reactor.wakeup()
+            disp.close()
+            self.reactor.wakeup()
+
+            # The reactor still serves other dispatchers, possibly using the
+            # same file descriptor.
+            s3, s4 = socket.socketpair()
+            with closing(s4):
+                self.reactor.create_dispatcher(s3, impl=EchoImpl())
+                self.reactor.wakeup()
+                s4.settimeout(5)
+                s4.sendall(b"ping")
+                self.assertEqual(recv_all(s4, 4), b"ping")
+
+    @slowtest
+    def test_benchmark_idle_connections(self):
+        messages = 2000
+        for idle in (0, 100, 1000):
+            pairs = [socket.socketpair() for i in range(idle + 1)]
+            try:
+                for s1, s2 in pairs:
+                    self.reactor.create_dispatcher(s1, impl=EchoImpl())
+                self.reactor.wakeup()
+
+                active = pairs[0][1]
+                active.settimeout(5)
+                start = time.time()
+                for i in range(messages):
+                    active.sendall(b"x")
+                    recv_all(active, 1)
+                elapsed = time.time() - start
+                print("%d idle connections: %.1f usec per round trip"
+                      % (idle, elapsed / messages * 1000000))
+            finally:
+                for s1, s2 in pairs:
+                    s2.close()
+
+
+def recv_all(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
@@ -1,5 +1,5 @@
 #
-# Copyright 2014 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -188,3 +188,27 @@ class BridgeTests(TestCaseBase):
 
         self.assertEqual(bridge.dispatch('Host.getDeviceList')(**params),
                          [])
+
+    @MonkeyPatch(DynamicBridge, '_get_api_instance', _get_api_instance)
+    def testMultiCall(self):
+        bridge = DynamicBridge()
+
+        calls = [
+            {'method': 'Host.getCapabilities'},
+            {'method': 'Host.ping'},
+            {'method': 'Host.getDeviceList',
+             'params': {'storageType': 3, 'checkStatus': False}},
+            {'method': 'Host.missing'},
+            {'method': 'Host.multiCall', 'params': {'calls': []}},
+        ]
+        for parallel in (1, 3):
+            bridge.register_server_address('127.0.0.1')
+            results = bridge.dispatch('Host.multiCall')(calls, parallel)
+            bridge.unregister_server_address()
+
+            self.assertEqual(results[0]['result']['My caps'],
+                             'My capabilites')
+            self.assertEqual(results[1]['error']['code'], 100)
+            self.assertEqual(results[2], {'result': []})
+            self.assertEqual(results[3]['error']['code'], -32601)
+            self.assertEqual(results[4]['error']['code'], -32600)
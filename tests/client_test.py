@@ -1,5 +1,5 @@
 #
-# Copyright 2015-2017 Red Hat, Inc.
+# Copyright 2015-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -35,7 +35,9 @@ from testlib import \
     dummyTextGenerator
 
 from testValidation import skipif, slowtest
+from monkeypatch import MonkeyPatchScope
 
+from vdsm import client as vdsm_client
 from vdsm.client import \
     _Client, \
     ServerError, \
@@ -44,6 +46,8 @@ from vdsm.client import \
 from yajsonrpc.exception import \
     JsonRpcMethodNotFoundError, \
     JsonRpcInternalError
+from yajsonrpc.jsonrpcclient import JsonRpcCall
+from yajsonrpc import JsonRpcResponse
 from vdsm.common import exception
 
 CALL_TIMEOUT = 3
@@ -90,7 +94,7 @@ class _Bridge(object):
 
 
 class _FakeSchema(object):
-    get_methods = [
+    method_names = [
         "Test.echo",
         "Test.slowCall",
         "Test.sendEvent"
@@ -260,3 +264,102 @@ class VdsmClientTests(VdsmTestCase):
                 self._get_with_timeout(event_queue),
                 None
             )
+
+
+class _FakeJsonRpcClient(object):
+
+    def __init__(self):
+        self.calls = []
+        self.closed = False
+
+    def call_async(self, req):
+        call = JsonRpcCall()
+        self.calls.append((req, call))
+        return call
+
+    def respond(self, index, result=None, error=None):
+        req, call = self.calls[index]
+        call.callback(self, [JsonRpcResponse(result, error, req.id)])
+
+    def close(self):
+        self.closed = True
+
+
+class SubmitTests(VdsmTestCase):
+
+    def setUp(self):
+        self.json_client = _FakeJsonRpcClient()
+        self.client = _MockedClient(self.json_client, CALL_TIMEOUT, False)
+
+    def test_pipelined(self):
+        futures = [self.client.Test.echo.submit(text=str(i))
+                   for i in range(3)]
+
+        # All requests were sent before any response was received.
+        self.assertEqual(
+            [req.params for req, call in self.json_client.calls],
+            [{"text": str(i)} for i in range(3)])
+        self.assertFalse(any(f.done() for f in futures))
+
+        for i in reversed(range(3)):
+            self.json_client.respond(i, result=str(i))
+
+        self.assertEqual([f.result() for f in futures], ["0", "1", "2"])
+
+    def test_timeout(self):
+        future = self.client.Test.slowCall.submit(_timeout=0.01)
+        with self.assertRaises(TimeoutError) as ex:
+            future.result()
+        self.assertEqual(ex.exception.timeout, 0.01)
+
+        # The response may still be received later.
+        self.json_client.respond(0, result=True)
+        self.assertTrue(future.result(timeout=0))
+
+    def test_server_error(self):
+        future = self.client.Test.failingCall.submit()
+        self.json_client.respond(
+            0, error=exception.GeneralException("Test failure"))
+        with self.assertRaises(ServerError) as ex:
+            future.result()
+        self.assertEqual(ex.exception.code, exception.GeneralException.code)
+
+
+class PoolTests(VdsmTestCase):
+
+    def setUp(self):
+        self.connections = []
+
+    def fake_connect(self, host, port, **kwargs):
+        cli = _MockedClient(_FakeJsonRpcClient(), CALL_TIMEOUT, False)
+        self.connections.append(((host, port), kwargs, cli))
+        return cli
+
+    def test_reuse_connection(self):
+        with MonkeyPatchScope([(vdsm_client, "connect", self.fake_connect)]):
+            pool = vdsm_client.Pool(timeout=CALL_TIMEOUT)
+            cli = pool.get("host1")
+            self.assertIs(pool.get("host1"), cli)
+            self.assertIsNot(pool.get("host2"), cli)
+            self.assertIsNot(pool.get("host1", 12345), cli)
+
+        port = vdsm_client.DEFAULT_PORT
+        kwargs = {"timeout": CALL_TIMEOUT}
+        self.assertEqual(
+            [(address, kw) for address, kw, _ in self.connections],
+            [(("host1", port), kwargs),
+             (("host2", port), kwargs),
+             (("host1", 12345), kwargs)])
+
+    def test_close(self):
+        with MonkeyPatchScope([(vdsm_client, "connect", self.fake_connect)]):
+            pool = vdsm_client.Pool()
+            pool.get("host1")
+            pool.get("host2")
+            pool.close()
+            self.assertTrue(all(cli._client.closed
+                                for _, _, cli in self.connections))
+
+            # Closed clients are not reused.
+            pool.get("host1")
+            self.assertEqual(len(self.connections), 3)
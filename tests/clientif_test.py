@@ -1,5 +1,5 @@
 #
-# Copyright 2014-2017 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -282,6 +282,15 @@ class TestNotification(TestCaseBase):
         message, address = self.serv.notifications[0]
         self._assertEvent(message, self.TEST_EVENT_NAME)
 
+    def test_notify_coalesce(self):
+        self.cif.notify(self.TEST_EVENT_NAME)
+        self.assertEqual(self.serv.reactor.server.keys,
+                         [self.TEST_EVENT_NAME])
+
+    def test_notify_no_coalesce(self):
+        self.cif.notify(self.TEST_EVENT_NAME, coalesce=False)
+        self.assertEqual(self.serv.reactor.server.keys, [None])
+
     def test_skip_notify_in_recovery(self):
         self.cif._recovery = True
         self.assertFalse(self.cif.ready)
@@ -1,5 +1,5 @@
 #
-# Copyright 2014-2017 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -304,6 +304,102 @@ class TestWorkerSystemNames(TestCaseBase):
                          ["bar/0", "bar/1", "foo/0", "foo/1"])
 
 
+class PriorityExecutorTests(TestCaseBase):
+
+    def setUp(self):
+        self.executor = executor.Executor('test',
+                                          workers_count=3,
+                                          max_tasks=10,
+                                          scheduler=None,
+                                          priorities=(("high", None),
+                                                      ("low", 2)))
+        self.executor.start()
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_dispatch(self):
+        high = Task()
+        low = Task()
+        self.executor.dispatch(high, priority="high")
+        self.executor.dispatch(low, priority="low")
+        self.assertTrue(high.executed.wait(1))
+        self.assertTrue(low.executed.wait(1))
+
+    def test_reserved_worker(self):
+        blocked = threading.Event()
+        try:
+            # Low priority tasks may use only 2 workers.
+            low = [Task(event=blocked) for i in range(3)]
+            for task in low:
+                self.executor.dispatch(task, priority="low")
+            self.assertTrue(low[0].started.wait(1))
+            self.assertTrue(low[1].started.wait(1))
+
+            # The third worker is available for high priority tasks.
+            high = Task()
+            self.executor.dispatch(high, priority="high")
+            self.assertTrue(high.executed.wait(1))
+            self.assertFalse(low[2].started.is_set())
+
+            stats = self.executor.stats()
+            self.assertEqual(stats["low"]["queued"], 1)
+            self.assertEqual(stats["low"]["running"], 2)
+            self.assertEqual(stats["high"]["queued"], 0)
+            self.assertEqual(stats["high"]["started"], 1)
+        finally:
+            blocked.set()
+        self.assertTrue(low[2].executed.wait(1))
+
+    def test_too_many_tasks_per_class(self):
+        blocked = threading.Event()
+        try:
+            running = [Task(event=blocked) for i in range(2)]
+            for task in running:
+                self.executor.dispatch(task, priority="low")
+            for task in running:
+                self.assertTrue(task.started.wait(1))
+            for i in range(10):
+                self.executor.dispatch(Task(event=blocked), priority="low")
+            with self.assertRaises(exception.ResourceExhausted):
+                self.executor.dispatch(Task(), priority="low")
+            # Other classes are not affected.
+            high = Task()
+            self.executor.dispatch(high, priority="high")
+            self.assertTrue(high.executed.wait(1))
+        finally:
+            blocked.set()
+
+
+class PriorityTaskQueueTests(TestCaseBase):
+
+    def test_priority_order(self):
+        queue = executor.PriorityTaskQueue(
+            "test", 10, (("high", None), ("low", None)))
+        queue.put("low-1", "low")
+        queue.put("high-1", "high")
+        queue.put("low-2", "low")
+        queue.put("high-2")
+        self.assertEqual([queue.get() for i in range(4)],
+                         ["high-1", "high-2", "low-1", "low-2"])
+
+    def test_stats(self):
+        queue = executor.PriorityTaskQueue(
+            "test", 10, (("high", None), ("low", 1)))
+        queue.put("low-1", "low")
+        queue.put("low-2", "low")
+        self.assertEqual(queue.get(), "low-1")
+        stats = queue.stats()
+        self.assertEqual(stats["high"]["queued"], 0)
+        self.assertEqual(stats["low"]["queued"], 1)
+        self.assertEqual(stats["low"]["running"], 1)
+        self.assertEqual(stats["low"]["started"], 1)
+        self.assertGreaterEqual(stats["low"]["oldest"], 0)
+        queue.done("low")
+        self.assertEqual(queue.get(), "low-2")
+        self.assertEqual(queue.stats()["low"]["started"], 2)
+
+
 class ExecutorTaskTests(TestCaseBase):
 
     def test_duration_none_if_not_called(self):
@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -68,6 +68,8 @@ class FakeNotifier(object):
 
     def __init__(self):
         self.calls = []
+        self.coalesce = []
 
-    def notify(self, event_id, params=None):
+    def notify(self, event_id, params=None, coalesce=True):
         self.calls.append((event_id, params))
+        self.coalesce.append(coalesce)
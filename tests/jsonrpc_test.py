@@ -1,5 +1,5 @@
 #
-# Copyright 2017 Red Hat, Inc.
+# Copyright 2017-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,12 +19,18 @@
 #
 from __future__ import absolute_import
 from __future__ import division
-from yajsonrpc import JsonRpcRequest, JsonRpcServer
+
+import six
+
+from yajsonrpc import JsonRpcRequest, JsonRpcResponse, JsonRpcServer
+from yajsonrpc import _JsonRpcServeRequestContext
+from yajsonrpc import encode_chunks
 
 from vdsm.common import exception
 from vdsm.common.compat import json
 
 from testlib import VdsmTestCase
+from testValidation import skipif
 
 
 class FakeContext(object):
@@ -37,6 +43,15 @@ class FakeContext(object):
         return self._res
 
 
+class FakeClient(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, message, response_ids=()):
+        self.messages.append((message, response_ids))
+
+
 class ServerTests(VdsmTestCase):
 
     def test_full_pool(self):
@@ -62,3 +77,78 @@ class ServerTests(VdsmTestCase):
         self.assertEqual({"reason": "Too many tasks",
                           "resource": "test",
                           "current_tasks": 0}, reason)
+
+    @skipif(six.PY3, "Needs porting to python 3")
+    def test_send_reply_with_response_ids(self):
+        client = FakeClient()
+        ctx = _JsonRpcServeRequestContext(client, None, None)
+        requests = [
+            JsonRpcRequest.decode(
+                '{"jsonrpc":"2.0","method":"Host.stats","id":"%s"}' % id)
+            for id in ("1", "2")]
+        ctx.setRequests(requests)
+        self.assertEqual(client.messages, [])
+
+        ctx.requestDone(JsonRpcResponse(True, None, "1"))
+        ctx.requestDone(JsonRpcResponse(False, None, "2"))
+
+        [(message, response_ids)] = client.messages
+        self.assertEqual(response_ids, ["1", "2"])
+        message = b"".join(message)
+        self.assertEqual([r["id"] for r in json.loads(message)], ["1", "2"])
+
+    @skipif(six.PY3, "Needs porting to python 3")
+    def test_send_reply_encoding_error(self):
+        client = FakeClient()
+        ctx = _JsonRpcServeRequestContext(client, None, None)
+        ctx.setRequests([JsonRpcRequest.decode(
+            '{"jsonrpc":"2.0","method":"Host.stats","id":"1"}')])
+
+        ctx.requestDone(JsonRpcResponse([1, object()], None, "1"))
+
+        [(message, response_ids)] = client.messages
+        response = json.loads(b"".join(message))
+        self.assertEqual(response["id"], "1")
+        self.assertEqual(response["error"]["code"], -32603)
+
+
+class EncodeChunksTests(VdsmTestCase):
+
+    OBJ = {
+        "jsonrpc": "2.0",
+        "id": "1",
+        "result": [
+            {"vmId": "vm-%d" % i,
+             "disks": {"vda": {"readRate": "0.0"}},
+             "name": u"\u05d0",
+             "list": [1, 2.5, None, True],
+             1: "int key",
+             None: "null key"}
+            for i in range(100)
+        ],
+    }
+
+    def test_same_as_dumps(self):
+        for obj in (self.OBJ, [], {}, [[], {}], "string", 1, None,
+                    {(1, 2): "skipped", "a": 1}):
+            data = b"".join(encode_chunks(obj))
+            self.assertEqual(data, json.dumps(obj, skipkeys=True).encode())
+
+    def test_chunks(self):
+        chunks = encode_chunks(self.OBJ, chunk_size=1024)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertIsInstance(chunk, bytes)
+            self.assertTrue(chunk)
+        # Every chunk is smaller than chunk_size plus the largest value
+        # encoded in one call.
+        max_value = max(len(json.dumps(vm, skipkeys=True))
+                        for vm in self.OBJ["result"])
+        self.assertLess(max(len(chunk) for chunk in chunks),
+                        1024 + max_value)
+        self.assertEqual(json.loads(b"".join(chunks).decode("utf-8")),
+                         json.loads(json.dumps(self.OBJ, skipkeys=True)))
+
+    def test_unserializable(self):
+        with self.assertRaises(TypeError):
+            encode_chunks({"result": [object()]})
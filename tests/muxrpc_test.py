@@ -0,0 +1,197 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import threading
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.common import muxrpc
+from vdsm.common import supervdsm
+
+from monkeypatch import MonkeyPatchScope
+
+
+class Unpicklable(Exception):
+
+    def __init__(self, a, b):
+        super(Unpicklable, self).__init__()
+        self.lock = threading.Lock()
+
+
+class Service(object):
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def echo(self, *args, **kwargs):
+        return args, kwargs
+
+    def wait(self):
+        self.release.wait(5)
+        return "released"
+
+    def fail(self):
+        raise OSError(2, "No such file")
+
+    def fail_unpicklable(self):
+        raise Unpicklable(1, 2)
+
+    def _private(self):
+        return "private"
+
+
+@pytest.fixture
+def service():
+    return Service()
+
+
+@pytest.fixture
+def server(tmpdir, service):
+    address = os.path.join(str(tmpdir), "test.sock")
+    server = muxrpc.Server(address, service)
+    t = concurrent.thread(server.serve_forever)
+    t.start()
+    yield address
+    server.close()
+
+
+@pytest.fixture
+def client(server):
+    client = muxrpc.Client(server)
+    yield client
+    client.close()
+
+
+def test_call(client):
+    assert client.call("echo", (1, "two"), {"three": [3]}) == \
+        ((1, "two"), {"three": [3]})
+
+
+def test_large_payload(client):
+    data = b"x" * (1024**2)
+    assert client.call("echo", (data,)) == ((data,), {})
+
+
+def test_concurrent_calls(client, service):
+    # A blocked call must not delay other calls on the same connection.
+    blocked = client.submit("wait")
+    assert client.call("echo", (1,)) == ((1,), {})
+    service.release.set()
+    assert blocked.result() == "released"
+
+
+def test_many_threads(client):
+    results = {}
+
+    def worker(n):
+        results[n] = client.call("echo", (n,))
+
+    threads = [concurrent.thread(worker, args=(n,)) for n in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == {n: ((n,), {}) for n in range(20)}
+
+
+def test_error(client):
+    with pytest.raises(OSError) as e:
+        client.call("fail")
+    assert e.value.errno == 2
+
+
+def test_unpicklable_error(client):
+    with pytest.raises(RuntimeError) as e:
+        client.call("fail_unpicklable")
+    assert "Unpicklable" in str(e.value)
+
+
+def test_private_method(client):
+    with pytest.raises(AttributeError):
+        client.call("_private")
+
+
+def test_missing_method(client):
+    with pytest.raises(AttributeError):
+        client.call("missing")
+
+
+def test_reply_read_by_other_thread(client, service):
+    # The reply of a call may be read by the thread waiting for another
+    # call.
+    blocked = client.submit("wait")
+    results = []
+    t = concurrent.thread(lambda: results.append(blocked.result()))
+    t.start()
+    try:
+        assert client.call("echo", (1,)) == ((1,), {})
+    finally:
+        service.release.set()
+        t.join()
+    assert results == ["released"]
+    assert client._replies == {}
+    assert client._waiting == {}
+
+
+def test_close_fails_pending_calls(client):
+    call = client.submit("wait")
+    client.close()
+    assert client.closed
+    with pytest.raises(muxrpc.Disconnected):
+        call.result()
+    with pytest.raises(muxrpc.Disconnected):
+        client.call("echo")
+
+
+def test_supervdsm_proxy(server):
+    with MonkeyPatchScope([(supervdsm, "ADDRESS", server),
+                           (supervdsm, "_stats", {})]):
+        proxy = supervdsm.SuperVdsmProxy()
+        assert proxy.echo(1, two=2) == ((1,), {"two": 2})
+        assert proxy.echo(3) == ((3,), {})
+        stats = supervdsm.stats()
+        assert stats["echo"]["calls"] == 2
+        assert stats["echo"]["max"] <= stats["echo"]["time"]
+
+
+def test_supervdsm_proxy_reconnect(server):
+    with MonkeyPatchScope([(supervdsm, "ADDRESS", server),
+                           (supervdsm, "_stats", {})]):
+        proxy = supervdsm.SuperVdsmProxy()
+        proxy._client().close()
+        assert proxy.echo(1) == ((1,), {})
+
+
+def test_supervdsm_proxy_broken_connection(server):
+    with MonkeyPatchScope([(supervdsm, "ADDRESS", server),
+                           (supervdsm, "_stats", {})]):
+        proxy = supervdsm.SuperVdsmProxy()
+        client = proxy._client()
+        client.close()
+        # Simulate a connection closed during the call.
+        proxy._client = lambda: client
+        with pytest.raises(RuntimeError):
+            proxy.echo(1)
@@ -0,0 +1,441 @@
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+
+import copy
+import json
+import socket
+import threading
+import uuid
+
+import six
+
+from vdsm.common import concurrent
+from vdsm.network.ovs.driver.idl import JsonStream
+
+
+def _ref(table, ref_type='strong', min=0, max='unlimited'):
+    key = {'type': 'uuid', 'refTable': table, 'refType': ref_type}
+    return {'type': {'key': key, 'min': min, 'max': max}}
+
+
+_STRING = {'type': 'string'}
+_BOOLEAN = {'type': 'boolean'}
+_INTEGER = {'type': 'integer'}
+_OPTIONAL_INTEGER = {'type': {'key': 'integer', 'min': 0, 'max': 1}}
+_OPTIONAL_STRING = {'type': {'key': 'string', 'min': 0, 'max': 1}}
+_MAP = {'type': {'key': 'string', 'value': 'string',
+                 'min': 0, 'max': 'unlimited'}}
+
+# A trimmed down Open_vSwitch schema, including the columns vdsm uses.
+SCHEMA = {
+    'name': 'Open_vSwitch',
+    'version': '7.15.1',
+    'tables': {
+        'Open_vSwitch': {
+            'isRoot': True,
+            'maxRows': 1,
+            'columns': {
+                'bridges': _ref('Bridge'),
+                'next_cfg': _INTEGER,
+                'cur_cfg': _INTEGER,
+                'external_ids': _MAP,
+                'other_config': _MAP,
+            },
+        },
+        'Bridge': {
+            'columns': {
+                'name': _STRING,
+                'datapath_type': _STRING,
+                'ports': _ref('Port'),
+                'mirrors': _ref('Mirror'),
+                'stp_enable': _BOOLEAN,
+                'other_config': _MAP,
+                'external_ids': _MAP,
+            },
+        },
+        'Port': {
+            'columns': {
+                'name': _STRING,
+                'interfaces': _ref('Interface', min=1),
+                'tag': _OPTIONAL_INTEGER,
+                'fake_bridge': _BOOLEAN,
+                'bond_fake_iface': _BOOLEAN,
+                'other_config': _MAP,
+                'external_ids': _MAP,
+            },
+        },
+        'Interface': {
+            'columns': {
+                'name': _STRING,
+                'type': _STRING,
+                'mtu': _OPTIONAL_INTEGER,
+                'mtu_request': _OPTIONAL_INTEGER,
+                'mac': _OPTIONAL_STRING,
+                'mac_in_use': _OPTIONAL_STRING,
+                'options': _MAP,
+                'other_config': _MAP,
+                'external_ids': _MAP,
+            },
+        },
+        'Mirror': {
+            'columns': {
+                'name': _STRING,
+                'select_all': _BOOLEAN,
+                'output_port': _ref('Port', 'weak', max=1),
+                'select_dst_port': _ref('Port', 'weak'),
+                'select_src_port': _ref('Port', 'weak'),
+                'external_ids': _MAP,
+            },
+        },
+    },
+}
+
+_DEFAULT_ATOMS = {'integer': 0, 'boolean': False, 'string': u''}
+
+
+class TransactionError(Exception):
+    pass
+
+
+class FakeOvsdbServer(object):
+    """
+    A stand-in for the local ovsdb-server, serving the Open_vSwitch database
+    described by SCHEMA over a unix socket.
+
+    It implements the get_schema, monitor, transact and echo methods, garbage
+    collects rows which are not referenced from the root table, and emulates
+    ovs-vswitchd by setting cur_cfg to next_cfg after each transaction.
+
+    The methods of the received requests are recorded in requests, and
+    transact() can be used to modify the database behind the clients' back.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.requests = []
+        self.db = {table: {} for table in SCHEMA['tables']}
+        self.db['Open_vSwitch'][str(uuid.uuid4())] = _new_row('Open_vSwitch')
+        self._lock = threading.Lock()
+        self._listener = None
+        self._clients = []
+        self._monitors = []
+
+    def start(self):
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen(5)
+        concurrent.thread(self._accept, name='fakeovsdb').start()
+
+    def stop(self):
+        self._listener.shutdown(socket.SHUT_RDWR)
+        self._listener.close()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.shutdown(socket.SHUT_RDWR)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def transact(self, operations):
+        """Run operations and notify the monitoring clients."""
+        with self._lock:
+            results, updates = self._transact(operations)
+            if updates:
+                self._notify(updates)
+            return results
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except socket.error:
+                return
+            with self._lock:
+                self._clients.append(client)
+            concurrent.thread(self._serve, args=(client,),
+                              name='fakeovsdb/client').start()
+
+    def _serve(self, client):
+        stream = JsonStream()
+        try:
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                for message in stream.feed(data):
+                    self._handle(client, message)
+        except socket.error:
+            pass
+        finally:
+            with self._lock:
+                self._clients.remove(client)
+                if client in self._monitors:
+                    self._monitors.remove(client)
+            client.close()
+
+    def _handle(self, client, message):
+        method = message['method']
+        params = message['params']
+        self.requests.append(method)
+        with self._lock:
+            if method == 'get_schema':
+                self._reply(client, message, SCHEMA)
+            elif method == 'echo':
+                self._reply(client, message, params)
+            elif method == 'monitor':
+                tables = params[2]
+                initial = {table: {key: {'new': row}
+                                   for key, row in six.iteritems(
+                                       self.db[table])}
+                           for table in tables}
+                self._reply(client, message, initial)
+                self._monitors.append(client)
+            elif method == 'transact':
+                results, updates = self._transact(params[1:])
+                # Reply before the notifications, clients must not assume
+                # their replica is up to date when the reply arrives.
+                self._reply(client, message, results)
+                if updates:
+                    self._notify(updates)
+            else:
+                _send(client, {'id': message['id'], 'result': None,
+                               'error': 'unknown method'})
+
+    def _reply(self, client, message, result):
+        _send(client, {'id': message['id'], 'result': result, 'error': None})
+
+    def _notify(self, updates):
+        for client in self._monitors:
+            _send(client, {'id': None, 'method': 'update',
+                           'params': ['vdsm', updates]})
+
+        # Emulate ovs-vswitchd reconfiguring after a change.
+        root_key, root = next(six.iteritems(self.db['Open_vSwitch']))
+        if root['cur_cfg'] != root['next_cfg']:
+            old = {'cur_cfg': root['cur_cfg']}
+            root['cur_cfg'] = root['next_cfg']
+            update = {'Open_vSwitch': {root_key: {'old': old, 'new': root}}}
+            for client in self._monitors:
+                _send(client, {'id': None, 'method': 'update',
+                               'params': ['vdsm', update]})
+
+    def _transact(self, operations):
+        db = copy.deepcopy(self.db)
+        named = {op['uuid-name']: str(uuid.uuid4())
+                 for op in operations
+                 if op['op'] == 'insert' and 'uuid-name' in op}
+        results = []
+        try:
+            for op in operations:
+                results.append(_execute(db, named, op))
+            _collect_garbage(db)
+        except TransactionError as e:
+            results.append({'error': 'constraint violation',
+                            'details': str(e)})
+            return results, None
+
+        updates = _diff(self.db, db)
+        self.db = db
+        return results, updates
+
+
+def _send(client, message):
+    client.sendall(json.dumps(message).encode('utf-8'))
+
+
+def _columns(table):
+    return SCHEMA['tables'][table]['columns']
+
+
+def _column_type(table, column):
+    coltype = _columns(table)[column]['type']
+    if not isinstance(coltype, dict):
+        coltype = {'key': coltype}
+    return coltype
+
+
+def _new_row(table):
+    row = {}
+    for column in _columns(table):
+        coltype = _column_type(table, column)
+        if 'value' in coltype:
+            row[column] = ['map', []]
+        elif coltype.get('min', 1) == 0 or isinstance(coltype['key'], dict):
+            row[column] = ['set', []]
+        else:
+            row[column] = _DEFAULT_ATOMS[coltype['key']]
+    return row
+
+
+def _elements(datum):
+    if isinstance(datum, list) and datum[0] in ('set', 'map'):
+        return list(datum[1])
+    return [datum]
+
+
+def _make_set(atoms):
+    return atoms[0] if len(atoms) == 1 else ['set', atoms]
+
+
+def _resolve(datum, named):
+    if isinstance(datum, dict):
+        return {k: _resolve(v, named) for k, v in six.iteritems(datum)}
+    if isinstance(datum, list):
+        if len(datum) == 2 and datum[0] == 'named-uuid':
+            return ['uuid', named[datum[1]]]
+        return [_resolve(item, named) for item in datum]
+    return datum
+
+
+def _matches(key, row, where):
+    for column, function, value in where:
+        if function != '==':
+            raise TransactionError('unsupported function %s' % function)
+        actual = ['uuid', key] if column == '_uuid' else row[column]
+        if actual != value:
+            return False
+    return True
+
+
+def _execute(db, named, op):
+    table = op['table']
+    rows = db[table]
+    if op['op'] == 'insert':
+        new_key = named.get(op.get('uuid-name'), str(uuid.uuid4()))
+        new_row = _new_row(table)
+        new_row.update(_resolve(op['row'], named))
+        rows[new_key] = new_row
+        return {'uuid': ['uuid', new_key]}
+
+    where = _resolve(op['where'], named)
+    selected = [key for key, row in six.iteritems(rows)
+                if _matches(key, row, where)]
+    if op['op'] == 'select':
+        columns = op.get('columns')
+        return {'rows': [{c: v for c, v in six.iteritems(rows[key])
+                          if columns is None or c in columns}
+                         for key in selected]}
+    elif op['op'] == 'update':
+        for key in selected:
+            rows[key].update(_resolve(op['row'], named))
+    elif op['op'] == 'mutate':
+        for key in selected:
+            for column, mutator, value in _resolve(op['mutations'], named):
+                _mutate(table, rows[key], column, mutator, value)
+    elif op['op'] == 'delete':
+        for key in selected:
+            del rows[key]
+    else:
+        raise TransactionError('unsupported operation %s' % op['op'])
+    return {'count': len(selected)}
+
+
+def _mutate(table, row, column, mutator, value):
+    if mutator == '+=':
+        row[column] += value
+        return
+
+    is_map = 'value' in _column_type(table, column)
+    elements = _elements(row[column])
+    if mutator == 'insert':
+        if is_map:
+            keys = [k for k, v in elements]
+            elements += [item for item in _elements(value)
+                         if item[0] not in keys]
+        else:
+            elements += [atom for atom in _elements(value)
+                         if atom not in elements]
+    elif mutator == 'delete':
+        if is_map:
+            # Either a set of keys or a map of pairs to delete.
+            removed = _elements(value)
+            elements = [item for item in elements
+                        if item[0] not in removed and item not in removed]
+        else:
+            removed = _elements(value)
+            elements = [atom for atom in elements if atom not in removed]
+    else:
+        raise TransactionError('unsupported mutator %s' % mutator)
+    row[column] = ['map', elements] if is_map else _make_set(elements)
+
+
+def _references(table, row, ref_type):
+    for column in _columns(table):
+        key = _column_type(table, column)['key']
+        if isinstance(key, dict) and key.get('type') == 'uuid':
+            if key.get('refType', 'strong') == ref_type:
+                for atom in _elements(row[column]):
+                    yield column, key['refTable'], atom[1]
+
+
+def _collect_garbage(db):
+    reachable = set()
+    pending = [('Open_vSwitch', key) for key in db['Open_vSwitch']]
+    while pending:
+        table, key = pending.pop()
+        if (table, key) in reachable:
+            continue
+        if key not in db[table]:
+            raise TransactionError('referential integrity violation')
+        reachable.add((table, key))
+        refs = _references(table, db[table][key], 'strong')
+        pending.extend((ref_table, ref) for _, ref_table, ref in refs)
+
+    for table, rows in six.iteritems(db):
+        if SCHEMA['tables'][table].get('isRoot'):
+            continue
+        for key in list(rows):
+            if (table, key) not in reachable:
+                del rows[key]
+
+    for table, rows in six.iteritems(db):
+        for row in six.itervalues(rows):
+            for column, ref_table, ref in list(
+                    _references(table, row, 'weak')):
+                if ref not in db[ref_table]:
+                    elements = [atom for atom in _elements(row[column])
+                                if atom != ['uuid', ref]]
+                    row[column] = _make_set(elements)
+
+
+def _diff(old_db, new_db):
+    updates = {}
+    for table, rows in six.iteritems(new_db):
+        old_rows = old_db[table]
+        table_updates = {}
+        for key, row in six.iteritems(rows):
+            old = old_rows.get(key)
+            if old is None:
+                table_updates[key] = {'new': row}
+            elif old != row:
+                changed = {c: v for c, v in six.iteritems(old) if row[c] != v}
+                table_updates[key] = {'old': changed, 'new': row}
+        for key, row in six.iteritems(old_rows):
+            if key not in rows:
+                table_updates[key] = {'old': row}
+        if table_updates:
+            updates[table] = table_updates
+    return updates
@@ -1,5 +1,5 @@
 #
-# Copyright 2017 Red Hat, Inc.
+# Copyright 2017-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -20,13 +20,20 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import binascii
+import socket
+import struct
+import threading
+
 from nose.plugins.attrib import attr
 from nose.plugins.skip import SkipTest
 
 from vdsm.network.link.iface import iface
+from vdsm.network.lldp import lldpad
+from vdsm.network.lldpad import clif
 from vdsm.network.lldpad import lldptool
 
-from testlib import VdsmTestCase, mock
+from testlib import VdsmTestCase, make_uuid, mock
 
 from .nettestlib import veth_pair
 from .nettestlib import enable_lldp_on_ifaces
@@ -149,6 +156,151 @@ class LldpadReportTests(VdsmTestCase):
         self.assertEqual(self.TLVS_REPORT, lldptool.get_tlvs('iface0'))
 
 
+def _tlv(tlv_type, value):
+    return struct.pack('!H', tlv_type << 9 | len(value)) + value
+
+
+def _org_tlv(oui, subtype, value):
+    return _tlv(0x7f, struct.pack('!I', oui << 8 | subtype) + value)
+
+
+LLDPDU = b''.join([
+    _tlv(1, b'\x04\x01\x23\x45\x67\x89\xab'),
+    _tlv(2, b'\x07588'),
+    _tlv(3, struct.pack('!H', 120)),
+    _tlv(5, b'site1-row2-rack3'),
+    _tlv(6, b'manufacturer, Build date: 2016-01-20 05:03:06 UTC'),
+    _tlv(7, struct.pack('!HH', 0x14, 0x14)),
+    _tlv(8, b'\x05\x01\x0a\x15\x00\x28\x02\x00\x00\x00\x24\x01$'),
+    _tlv(4, b'some important server, port 4'),
+    _org_tlv(lldptool.OUI.IEEE8023, 1, b'\x03\x00\x01\x00\x00'),
+    _org_tlv(lldptool.OUI.IEEE8023, 3, b'\x03\x00\x00\x02\x58'),
+    _org_tlv(lldptool.OUI.IEEE8023, 4, struct.pack('!H', 9216)),
+    _org_tlv(lldptool.OUI.IEEE8021, 1, struct.pack('!H', 2000)),
+    _org_tlv(lldptool.OUI.IEEE8021, 3,
+             struct.pack('!HB', 2000, 8) + b'Name foo'),
+    _org_tlv(lldptool.OUI.IEEE8021, 3,
+             struct.pack('!HB', 2001, 8) + b'Name bar'),
+    _tlv(0, b''),
+])
+
+
+@attr(type='unit')
+class LldpadClifTests(VdsmTestCase):
+
+    def test_decode_tlvs_as_lldptool(self):
+        self.assertEqual(LldpadReportTests.TLVS_REPORT,
+                         clif.decode_tlvs(LLDPDU))
+
+    def test_get_tlvs(self):
+        with _fake_lldpad(clif.STATUS_SUCCESS, LLDPDU) as client:
+            self.assertEqual(LldpadReportTests.TLVS_REPORT,
+                             client.get_tlvs('iface0'))
+            # The same connection serves further requests
+            self.assertEqual(LldpadReportTests.TLVS_REPORT,
+                             client.get_tlvs('iface1'))
+
+    def test_get_tlvs_without_neighbor(self):
+        with _fake_lldpad(clif.STATUS_PEER_NOT_PRESENT, b'') as client:
+            self.assertEqual([], client.get_tlvs('iface0'))
+
+    def test_reconnect_after_timeout(self):
+        with _fake_lldpad(clif.STATUS_SUCCESS, LLDPDU, drop=1,
+                          timeout=0.2) as client:
+            self.assertEqual(LldpadReportTests.TLVS_REPORT,
+                             client.get_tlvs('iface0'))
+
+    def test_timeout_is_not_protocol_error(self):
+        with _fake_lldpad(clif.STATUS_SUCCESS, LLDPDU, drop=2,
+                          timeout=0.2) as client:
+            with self.assertRaises(clif.ClifError) as e:
+                client.get_tlvs('iface0')
+            self.assertNotIsInstance(e.exception, clif.ClifProtocolError)
+            # The next request uses a new connection.
+            self.assertEqual(LldpadReportTests.TLVS_REPORT,
+                             client.get_tlvs('iface0'))
+
+    def test_lldpad_not_running(self):
+        client = clif.Client(path='\0vdsm-test-' + make_uuid())
+        with self.assertRaises(clif.ClifError):
+            client.get_tlvs('iface0')
+
+
+@attr(type='unit')
+class TlvCacheTests(VdsmTestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.fetched = []
+        self.cache = lldpad.TlvCache(clock=lambda: self.now)
+
+    def fetch(self, iface):
+        self.fetched.append(iface)
+        return clif.decode_tlvs(LLDPDU) if iface == 'iface0' else []
+
+    def test_cached_for_neighbor_ttl(self):
+        self.cache.get('iface0', self.fetch)
+        self.now = 119
+        self.cache.get('iface0', self.fetch)
+        self.assertEqual(['iface0'], self.fetched)
+        self.now = 120
+        self.cache.get('iface0', self.fetch)
+        self.assertEqual(['iface0', 'iface0'], self.fetched)
+
+    def test_cached_for_default_ttl_without_neighbor(self):
+        self.cache.get('iface1', self.fetch)
+        self.now = lldpad._DEFAULT_TTL
+        self.cache.get('iface1', self.fetch)
+        self.assertEqual(['iface1', 'iface1'], self.fetched)
+
+    def test_invalidate(self):
+        self.cache.get('iface0', self.fetch)
+        self.cache.invalidate('iface0')
+        self.cache.get('iface0', self.fetch)
+        self.assertEqual(['iface0', 'iface0'], self.fetched)
+
+
+class _fake_lldpad(object):
+    """Replies to get-tlv requests as lldpad does, echoing their header."""
+
+    def __init__(self, status, lldpdu, drop=0, timeout=clif._TIMEOUT):
+        self._reply = 'R%02x' % status
+        self._lldpdu = lldpdu
+        # Number of requests to ignore, as if lldpad was busy.
+        self._drop = drop
+        self._timeout = timeout
+        self._path = '\0vdsm-test-' + make_uuid()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._path)
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        self._client = clif.Client(path=self._path, timeout=self._timeout)
+        return self._client
+
+    def __exit__(self, *args):
+        self._client.close()
+        self._sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                request, sender = self._sock.recvfrom(4096)
+            except socket.error:
+                return
+            if self._drop:
+                self._drop -= 1
+                continue
+            request = request.decode('ascii')
+            ifname_len = int(request[21:23], 16)
+            echo = request[9:23 + ifname_len]
+            reply = (self._reply + echo).encode('ascii') + (
+                binascii.hexlify(self._lldpdu))
+            self._sock.sendto(reply, sender)
+
+
 @attr(type='integration')
 class LldpadReportIntegTests(VdsmTestCase):
 
@@ -0,0 +1,283 @@
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+
+import json
+import time
+from uuid import UUID
+
+import pytest
+
+from network.fakeovsdb import FakeOvsdbServer
+from network.ovsnettestlib import TEST_BOND
+from network.ovsnettestlib import TEST_BRIDGE
+
+from vdsm.network.errors import ConfigNetworkError
+from vdsm.network.errors import OvsDBConnectionError
+from vdsm.network.ovs.driver import idl
+from vdsm.network.ovs.driver import ovsdb
+
+
+@pytest.fixture
+def server(tmpdir):
+    with FakeOvsdbServer(str(tmpdir.join('db.sock'))) as server:
+        yield server
+
+
+@pytest.fixture
+def ovs(server, monkeypatch):
+    connection = idl.Connection(server.path)
+    monkeypatch.setattr(ovsdb, '_connection', connection)
+    try:
+        yield ovsdb.Ovs()
+    finally:
+        connection.close()
+
+
+@pytest.fixture
+def bridge(ovs):
+    ovs.add_br(TEST_BRIDGE).execute()
+    return TEST_BRIDGE
+
+
+class TestJsonStream(object):
+
+    def test_split_messages(self):
+        stream = idl.JsonStream()
+        messages = stream.feed(b'{"id": 1}{"id": 2}\n{"id"')
+        assert messages == [{'id': 1}, {'id': 2}]
+        assert stream.feed(b': 3}') == [{'id': 3}]
+
+    @pytest.mark.parametrize('message', [
+        {'params': ['{{', '}']},
+        {'params': ['\\"}', '"{']},
+        {'params': [u'\u05d0\u05d1}']},
+    ])
+    def test_byte_by_byte(self, message):
+        stream = idl.JsonStream()
+        data = json.dumps(message).encode('utf-8')
+        received = []
+        for i in range(len(data)):
+            received.extend(stream.feed(data[i:i + 1]))
+        assert received == [message]
+
+
+class TestOvsdbDriver(object):
+
+    def test_add_bridge(self, ovs, server):
+        ovs.add_br(TEST_BRIDGE).execute()
+
+        assert ovs.list_br().execute() == [TEST_BRIDGE]
+        bridges = ovs.list_bridge_info().execute()
+        assert len(bridges) == 1
+        assert bridges[0]['name'] == TEST_BRIDGE
+        ports = ovs.list_port_info(TEST_BRIDGE).execute()
+        assert bridges[0]['ports'] == [ports[0]['_uuid']]
+        assert server.requests.count('transact') == 1
+
+    def test_read_own_writes_in_transaction(self, ovs):
+        add_br = ovs.add_br(TEST_BRIDGE)
+        list_bridge_info = ovs.list_bridge_info()
+        with ovs.transaction() as t:
+            t.add(add_br)
+            t.add(list_bridge_info)
+
+        bridges = list_bridge_info.result
+        assert len(bridges) == 1
+        assert bridges[0]['name'] == TEST_BRIDGE
+        assert isinstance(bridges[0]['_uuid'], UUID)
+        assert ovs.list_bridge_info().execute() == bridges
+
+    def test_queries_do_not_transact(self, ovs, server, bridge):
+        requests = len(server.requests)
+        for _ in range(10):
+            with ovs.transaction() as t:
+                t.add(ovs.list_bridge_info())
+                t.add(ovs.list_port_info())
+                t.add(ovs.list_interface_info())
+
+        assert len(server.requests) == requests
+
+    def test_del_bridge_collects_ports(self, ovs, server, bridge):
+        ovs.add_port(bridge, 'eth0').execute()
+        ovs.del_br(bridge).execute()
+
+        assert ovs.list_br().execute() == []
+        assert ovs.list_port_info().execute() == []
+        assert ovs.list_interface_info().execute() == []
+        assert server.db['Port'] == {}
+
+    def test_del_missing_bridge(self, ovs):
+        with pytest.raises(ConfigNetworkError):
+            ovs.del_br(TEST_BRIDGE).execute()
+        ovs.del_br(TEST_BRIDGE, if_exists=True).execute()
+
+    def test_add_existing_bridge(self, ovs, bridge):
+        with pytest.raises(ConfigNetworkError):
+            ovs.add_br(bridge).execute()
+        ovs.add_br(bridge, may_exist=True).execute()
+
+    def test_failed_command_is_not_sent(self, ovs, server, bridge):
+        requests = len(server.requests)
+        with pytest.raises(ConfigNetworkError):
+            with ovs.transaction() as t:
+                t.add(ovs.add_port(bridge, 'eth0'))
+                t.add(ovs.del_port('eth1'))
+
+        assert len(server.requests) == requests
+        assert ovs.list_ports(bridge).execute() == []
+
+    def test_fake_bridges(self, ovs, bridge):
+        with ovs.transaction() as t:
+            t.add(ovs.add_vlan(bridge, 100))
+            t.add(ovs.add_vlan(bridge, 101))
+        ovs.add_port('vlan100', 'eth0').execute()
+
+        assert len(ovs.list_br().execute()) == 3
+        assert ovs.list_ports('vlan100').execute() == ['eth0']
+        assert ovs.list_ports(bridge).execute() == []
+        assert ovs.list_port_info('eth0').execute()[0]['tag'] == 100
+
+        with ovs.transaction() as t:
+            t.add(ovs.del_vlan(101))
+            t.add(ovs.del_vlan(100))
+
+        assert ovs.list_br().execute() == [bridge]
+        ports = ovs.list_port_info().execute()
+        assert [port['name'] for port in ports] == [bridge]
+
+    def test_bond_slaves(self, ovs, bridge):
+        ovs.add_bond(bridge, TEST_BOND, ['eth0', 'eth1']).execute()
+        assert ovs.list_ports(bridge).execute() == [TEST_BOND]
+
+        with ovs.transaction() as t:
+            t.add(*ovs.attach_bond_slave(TEST_BOND, 'eth2'))
+        bond = ovs.list_port_info(TEST_BOND).execute()[0]
+        assert len(bond['interfaces']) == 3
+
+        with ovs.transaction() as t:
+            t.add(*ovs.detach_bond_slave(TEST_BOND, 'eth0'))
+        bond = ovs.list_port_info(TEST_BOND).execute()[0]
+        assert len(bond['interfaces']) == 2
+        assert len(ovs.list_interface_info().execute()) == 3
+
+        ovs.del_port(TEST_BOND, bridge=bridge).execute()
+        assert ovs.list_ports(bridge).execute() == []
+
+    def test_mirror(self, ovs, bridge):
+        ovs.add_port(bridge, 'eth0').execute()
+        ovs.add_port(bridge, 'eth1').execute()
+        with ovs.transaction() as t:
+            t.add(*ovs.add_mirror(bridge, 'm0', 'eth0'))
+
+        mirror = ovs.list_mirror_info().execute()[0]
+        port_id = ovs.list_port_info('eth1').execute()[0]['_uuid']
+        assert mirror['output_port'] == (
+            ovs.list_port_info('eth0').execute()[0]['_uuid'])
+
+        ovs.set_mirror_attr(
+            str(mirror['_uuid']), 'select-dst-port', str(port_id)).execute()
+        mirror = ovs.list_mirror_info().execute()[0]
+        assert mirror['select_dst_port'] == port_id
+
+        with ovs.transaction() as t:
+            t.add(*ovs.del_mirror(bridge, 'm0'))
+        assert ovs.list_mirror_info().execute() == []
+        assert ovs.list_bridge_info(bridge).execute()[0]['mirrors'] == []
+
+    def test_set_attributes(self, ovs, bridge):
+        with ovs.transaction() as t:
+            t.add(ovs.add_port(bridge, 'net'))
+            t.add(ovs.set_port_attr('net', 'other_config:vdsm_level',
+                                    'northbound'))
+            t.add(ovs.set_port_attr('net', 'tag', 10))
+            t.add(ovs.set_interface_attr('net', 'type', 'internal'))
+            t.add(ovs.set_interface_attr('net', 'mtu_request', 9000))
+            t.add(ovs.set_bridge_attr(
+                bridge, 'other-config:hwaddr', '02:00:00:00:00:01'))
+            t.add(ovs.set_db_entry(
+                'open', '.', 'external-ids:ovn-bridge-mappings',
+                'net:' + bridge))
+
+        port = ovs.list_port_info('net').execute()[0]
+        assert port['other_config'] == {'vdsm_level': 'northbound'}
+        assert port['tag'] == 10
+        iface = ovs.list_interface_info('net').execute()[0]
+        assert iface['type'] == 'internal'
+        assert iface['mtu_request'] == 9000
+        br = ovs.list_bridge_info(bridge).execute()[0]
+        assert br['other_config'] == {'hwaddr': '02:00:00:00:00:01'}
+
+        ovs.set_port_attr('net', 'other_config:vdsm_level',
+                          'southbound').execute()
+        port = ovs.list_port_info('net').execute()[0]
+        assert port['other_config'] == {'vdsm_level': 'southbound'}
+
+    def test_replica_follows_other_clients(self, ovs, server, bridge):
+        bridge_uuid = str(ovs.list_bridge_info(bridge).execute()[0]['_uuid'])
+        server.transact([{
+            'op': 'update',
+            'table': 'Bridge',
+            'where': [['_uuid', '==', ['uuid', bridge_uuid]]],
+            'row': {'stp_enable': True},
+        }])
+
+        ovsdb._connection.wait_for(
+            lambda replica: replica['Bridge'][bridge_uuid]['stp_enable'],
+            timeout=5)
+        assert ovs.list_bridge_info(bridge).execute()[0]['stp_enable']
+
+    def test_concurrent_changes_are_kept(self, ovs, server, bridge):
+        # Take a snapshot before another client adds a port, the mutation
+        # sent by the driver must not drop it.
+        t = ovs.transaction()
+        t.add(ovs.add_port(bridge, 'eth0'))
+        view = ovsdb._View(ovsdb._connection.schema,
+                           ovsdb._connection.snapshot())
+        ovs.add_port(bridge, 'eth1').execute()
+        for command in t.commands:
+            command.run(view)
+        operations, _ = view.operations()
+        ovsdb._connection.transact(operations)
+        ovsdb._connection.wait_for(
+            lambda replica: len(replica['Port']) == 3, timeout=5)
+
+        ports = {port['name'] for port in ovs.list_port_info().execute()}
+        assert ports == {bridge, 'eth0', 'eth1'}
+
+    def test_reconnect(self, ovs, bridge):
+        connection = ovsdb._connection
+        connection.close()
+        _wait_until(lambda: not connection.connected)
+
+        assert ovs.list_br().execute() == [bridge]
+
+    def test_no_server(self, tmpdir, monkeypatch):
+        connection = idl.Connection(str(tmpdir.join('missing.sock')))
+        monkeypatch.setattr(ovsdb, '_connection', connection)
+        with pytest.raises(OvsDBConnectionError):
+            ovsdb.Ovs().list_br().execute()
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
@@ -0,0 +1,226 @@
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import errno
+import socket
+import struct
+import timeit
+
+import pytest
+
+from vdsm.network import tc
+from vdsm.network.tc import _netlink
+from vdsm.network.tc import TrafficControlException
+
+RTM_NEWQDISC = 36
+RTM_NEWTCLASS = 40
+RTM_NEWTFILTER = 44
+
+IFINDEX = 7
+DEV = 'eth7'
+
+
+class TestHandles(object):
+
+    @pytest.mark.parametrize('text,value', [
+        ('1:', 0x10000),
+        ('1:a8', 0x100a8),
+        ('ffff:fff1', 0xfffffff1),
+        (':1', 0x1),
+        ('root', 0xffffffff),
+    ])
+    def test_parse_and_format(self, text, value):
+        assert _netlink.parse_handle(text) == value
+        assert _netlink.format_handle(value) == text
+
+
+class TestDecode(object):
+
+    def test_classes_as_text_parser(self):
+        hfsc_classes = [(0x10000, 0xffffffff, 0, {})]
+        text = ['class hfsc 1: root']
+        for minor in range(0x10, 0x14):
+            rate = minor * 1000
+            hfsc_classes.append((0x10000 | minor, 0x10000, minor << 16, {
+                _netlink.TCA_HFSC_RSC: (0, 0, rate),
+                _netlink.TCA_HFSC_FSC: (100, 80, rate),
+                _netlink.TCA_HFSC_USC: (0, 0, 2 * rate),
+            }))
+            text.append(
+                'class hfsc 1:%x parent 1: leaf %x: rt m1 0bit d 0us '
+                'm2 %dbit ls m1 800bit d 80us m2 %dbit ul m1 0bit d 0us '
+                'm2 %dbit' % (minor, minor, rate * 8, rate * 8, rate * 16))
+
+        decoded = _decode(_classes(hfsc_classes), _netlink._decode_class)
+        for record in decoded:
+            assert record.pop('stats') == _netlink.Stats(1, 2, 3, 4, 5, 6, 7)
+        assert decoded == list(tc.classes(None, out='\n'.join(text)))
+
+    def test_qdiscs(self):
+        messages = _message(RTM_NEWQDISC, 0x10000, 0xffffffff, 2, [
+            _attr(_netlink.TCA_KIND, b'hfsc\0'),
+            _attr(_netlink.TCA_OPTIONS, struct.pack('=Hxx', 0x5000)),
+        ]) + _message(RTM_NEWQDISC, 0xffff0000, 0xfffffff1, 1, [
+            _attr(_netlink.TCA_KIND, b'ingress\0'),
+        ]) + _message(RTM_NEWQDISC, 0, 0xffffffff, 2, [
+            _attr(_netlink.TCA_KIND, b'noqueue\0'),
+        ])
+
+        decoded = _decode(messages, _netlink._decode_qdisc,
+                          names={IFINDEX: DEV})
+
+        assert decoded == [
+            {'kind': 'hfsc', 'handle': '1:', 'dev': DEV, 'root': True,
+             'refcnt': 2, 'hfsc': {'default': 0x5000},
+             'stats': _netlink.Stats(0, 0, 0, 0, 0, 0, 0)},
+            {'kind': 'ingress', 'handle': 'ffff:', 'dev': DEV,
+             'parent': 'ffff:fff1',
+             'stats': _netlink.Stats(0, 0, 0, 0, 0, 0, 0)},
+        ]
+
+    def test_dump_qdiscs_of_device(self, monkeypatch):
+        other_ifindex = IFINDEX + 1
+        messages = _message(RTM_NEWQDISC, 0x10000, 0xffffffff, 2, [
+            _attr(_netlink.TCA_KIND, b'hfsc\0'),
+        ]) + _message(RTM_NEWQDISC, 0x20000, 0xffffffff, 2, [
+            _attr(_netlink.TCA_KIND, b'sfq\0'),
+        ], ifindex=other_ifindex)
+        monkeypatch.setattr(_netlink, '_dump', lambda *args: _split(messages))
+        monkeypatch.setattr(_netlink, '_ifindex',
+                            {DEV: IFINDEX, 'eth8': other_ifindex}.get)
+
+        assert [q['handle'] for q in _netlink.dump_qdiscs(DEV)] == ['1:']
+        assert [q['handle'] for q in _netlink.dump_qdiscs('eth8')] == ['2:']
+
+    def test_u32_mirred_filter(self):
+        mirred = struct.pack('=IIiiiiI', 18, 0, 3, 1, 1, 2, 9)
+        action = _attr(1, b''.join([
+            _attr(_netlink.TCA_ACT_KIND, b'mirred\0'),
+            _attr(_netlink.TCA_ACT_OPTIONS,
+                  _attr(_netlink.TCA_MIRRED_PARMS, mirred)),
+        ]))
+        selector = (struct.pack('=BBBxHHhhI', 1, 0, 1, 0, 0, 0, 0, 0) +
+                    struct.pack('>II', 0xff, 0x1e) + struct.pack('=ii', -4, 0))
+        options = b''.join([
+            _attr(_netlink.TCA_U32_HASH, struct.pack('=I', 0x80300000)),
+            _attr(_netlink.TCA_U32_SEL, selector),
+            _attr(_netlink.TCA_U32_ACT, action),
+        ])
+        info = (49149 << 16) | socket.htons(0x0003)
+        messages = _message(RTM_NEWTFILTER, 0x80300800, 0xffff0000, info, [
+            _attr(_netlink.TCA_KIND, b'u32\0'),
+            _attr(_netlink.TCA_OPTIONS, options),
+        ])
+
+        filt, = _decode(messages, _netlink._decode_filter,
+                        names={9: 'tap1'}, show_parent=False)
+
+        assert filt == {
+            'protocol': 'all', 'pref': 49149, 'kind': 'u32', 'u32': {
+                'fh': '803::800', 'order': 2048, 'key_ht': 0x803,
+                'key_bkt': 0, 'terminal': True,
+                'match': {'value': 0x1e, 'mask': 0xff, 'offset': -4},
+                'actions': [
+                    {'order': 1, 'kind': 'mirred', 'action': 'egress_mirror',
+                     'target': 'tap1', 'op': 'pipe', 'index': 18, 'ref': 1,
+                     'bind': 1}]}}
+
+    def test_error(self):
+        error = struct.pack('=IHHII', 36, 2, 0, 1, 0) + struct.pack(
+            '=i', -errno.ENODEV) + b'\0' * 16
+        with pytest.raises(TrafficControlException) as e:
+            _netlink._split(error, [])
+        assert e.value.errCode == errno.ENODEV
+
+
+@pytest.mark.slow
+def test_benchmark_500_classes():
+    count = 500
+    hfsc_classes = [
+        (0x10000 | minor, 0x10000, minor << 16, {
+            _netlink.TCA_HFSC_FSC: (0, 0, 1000 * minor),
+            _netlink.TCA_HFSC_USC: (0, 0, 10 ** 9)})
+        for minor in range(1, count + 1)]
+    data = _classes(hfsc_classes)
+    text = '\n'.join(
+        'class hfsc 1:%x parent 1: leaf %x: ls m1 0bit d 0us m2 %dKbit '
+        'ul m1 0bit d 0us m2 8Gbit\n'
+        ' Sent 0 bytes 0 pkt (dropped 0, overlimits 0 requeues 0)\n'
+        ' backlog 0b 0p requeues 0\n'
+        ' period 0 level 0' % (minor, minor, 8 * minor)
+        for minor in range(1, count + 1))
+
+    assert len(list(tc.classes(None, out=text))) == count
+    assert len(_decode(data, _netlink._decode_class)) == count
+
+    number = 10
+    text_time = timeit.timeit(
+        lambda: list(tc.classes(None, out=text)), number=number) / number
+    netlink_time = timeit.timeit(
+        lambda: _decode(data, _netlink._decode_class), number=number) / number
+    print('%d classes: text parser %.6f seconds, netlink decoder %.6f '
+          'seconds (%.1fx)' % (count, text_time, netlink_time,
+                               text_time / netlink_time))
+
+
+def _decode(data, decode, names=None, **kwargs):
+    return _netlink._decode_all(_split(data), decode, names, **kwargs)
+
+
+def _split(data):
+    messages = []
+    assert _netlink._split(data + _done(), messages)
+    return messages
+
+
+def _classes(hfsc_classes):
+    stats = _attr(_netlink.TCA_STATS2, b''.join([
+        _attr(_netlink.TCA_STATS_BASIC, struct.pack('=QIxxxx', 1, 2)),
+        _attr(_netlink.TCA_STATS_QUEUE, struct.pack('=IIIII', 3, 4, 5, 6, 7)),
+    ]))
+    messages = []
+    for handle, parent, leaf, curves in hfsc_classes:
+        options = b''.join(_attr(kind, struct.pack('=III', *curve))
+                           for kind, curve in sorted(curves.items()))
+        messages.append(_message(RTM_NEWTCLASS, handle, parent, leaf, [
+            _attr(_netlink.TCA_KIND, b'hfsc\0'),
+            _attr(_netlink.TCA_OPTIONS, options),
+            stats,
+        ]))
+    return b''.join(messages)
+
+
+def _message(msg_type, handle, parent, info, attrs, ifindex=IFINDEX):
+    payload = struct.pack('=BxxxiIII', 0, ifindex, handle, parent, info)
+    payload += b''.join(attrs)
+    return struct.pack('=IHHII', 16 + len(payload), msg_type, 2, 1,
+                       0) + payload
+
+
+def _done():
+    return struct.pack('=IHHII', 20, _netlink.NLMSG_DONE, 2, 1, 0) + (
+        b'\0' * 4)
+
+
+def _attr(kind, payload):
+    length = 4 + len(payload)
+    return struct.pack('=HH', length, kind) + payload + b'\0' * (-length % 4)
@@ -1,5 +1,5 @@
 #
-# Copyright 2015-2017 Red Hat, Inc.
+# Copyright 2015-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -48,6 +48,9 @@ class FakeConnection(object):
     def send_raw(self, msg):
         self._client.queue_frame(msg)
 
+    def send_event(self, msg, key=None):
+        self._client.queue_frame(msg)
+
     def close(self):
         self.closed = True
 
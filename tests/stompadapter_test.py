@@ -1,5 +1,5 @@
 #
-# Copyright 2015-2017 Red Hat, Inc.
+# Copyright 2015-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -19,18 +19,25 @@
 #
 from __future__ import absolute_import
 from __future__ import division
+from __future__ import print_function
 from collections import defaultdict
+import timeit
+
+from vdsm.common.compat import json
 
 from testlib import VdsmTestCase as TestCaseBase
+from testValidation import slowtest
 from yajsonrpc import JsonRpcRequest
 from yajsonrpc.betterAsyncore import Reactor
 from yajsonrpc.stomp import \
     Command, \
     Frame, \
     Headers, \
-    SUBSCRIPTION_ID_REQUEST
+    SUBSCRIPTION_ID_REQUEST, \
+    SUBSCRIPTION_ID_RESPONSE
 from yajsonrpc.stomp import AsyncDispatcher
-from yajsonrpc.stompserver import StompAdapterImpl
+from yajsonrpc import stompserver
+from yajsonrpc.stompserver import StompAdapterImpl, StompServer
 from stomp_test_utils import (
     FakeAsyncClient,
     FakeAsyncDispatcher,
@@ -460,3 +467,183 @@ class ServerTimeoutTests(TestCaseBase):
 
         self.assertEqual(len(adapter._sub_ids), 0)
         self.assertEqual(len(destinations), 0)
+
+
+class ServerSendTests(TestCaseBase):
+
+    def setUp(self):
+        self.sub_map = defaultdict(list)
+        self.req_dest = {}
+        self.server = StompServer(Reactor(), self.sub_map)
+        self.server._req_dest = self.req_dest
+
+    def subscribe(self, destination, sub_id):
+        client = FakeAsyncClient()
+        subscription = FakeSubscription(destination, sub_id)
+        subscription.set_client(client)
+        self.sub_map[destination].append(subscription)
+        return client
+
+    def test_reply_to_request_destination(self):
+        response_client = self.subscribe(SUBSCRIPTION_ID_RESPONSE, "sub-1")
+        reply_client = self.subscribe("jms.topic.reply", "sub-2")
+        self.req_dest["req-1"] = "jms.topic.reply"
+
+        message = b'{"jsonrpc":"2.0","id":"req-1","result":true}'
+        self.server.send(message, response_ids=["req-1"])
+
+        self.assertTrue(response_client.empty())
+        frame = reply_client.pop_message()
+        self.assertEqual(frame.headers[Headers.DESTINATION], "jms.topic.reply")
+        self.assertEqual(frame.headers[Headers.SUBSCRIPTION], "sub-2")
+        self.assertEqual(frame.body, message)
+        self.assertEqual(self.req_dest, {})
+
+    def test_reply_batch(self):
+        reply_client = self.subscribe("jms.topic.reply", "sub-1")
+        self.req_dest["req-1"] = "jms.topic.reply"
+        self.req_dest["req-2"] = "jms.topic.reply"
+
+        message = (b'[{"jsonrpc":"2.0","id":"req-1","result":true},'
+                   b'{"jsonrpc":"2.0","id":"req-2","result":true}]')
+        self.server.send(message, response_ids=["req-1", "req-2"])
+
+        self.assertEqual(reply_client.pop_message().body, message)
+        self.assertEqual(self.req_dest, {})
+
+    def test_reply_without_reply_to(self):
+        response_client = self.subscribe(SUBSCRIPTION_ID_RESPONSE, "sub-1")
+
+        message = b'{"jsonrpc":"2.0","id":"req-1","result":true}'
+        self.server.send(message, response_ids=["req-1"])
+
+        self.assertEqual(response_client.pop_message().body, message)
+
+    def test_event(self):
+        event_client = self.subscribe("jms.queue.events", "sub-1")
+        self.req_dest["req-1"] = "jms.topic.reply"
+
+        message = b'{"jsonrpc":"2.0","method":"event","params":{}}'
+        self.server.send(message, "jms.queue.events")
+
+        self.assertEqual(event_client.pop_message().body, message)
+        self.assertEqual(self.req_dest, {"req-1": "jms.topic.reply"})
+
+    def test_event_shares_body(self):
+        clients = [self.subscribe("jms.queue.events", "sub-%d" % i)
+                   for i in range(3)]
+
+        self.server.send(u'{"jsonrpc":"2.0","method":"event"}',
+                         "jms.queue.events")
+
+        frames = [client.pop_message() for client in clients]
+        self.assertEqual(frames[0].body, b'{"jsonrpc":"2.0","method":"event"}')
+        self.assertTrue(all(f.body is frames[0].body for f in frames))
+        self.assertEqual([f.headers[Headers.SUBSCRIPTION] for f in frames],
+                         ["sub-0", "sub-1", "sub-2"])
+
+    @slowtest
+    def test_benchmark(self):
+        client = self.subscribe("jms.topic.reply", "sub-1")
+        vms = [{"vmId": "vm-%d" % i, "status": "Up", "cpuUser": "1.5",
+                "network": {"vnet%d" % i: {"rxErrors": "0", "txDropped": "0"}},
+                "disks": {"vda": {"readRate": "0.0", "writeRate": "0.0"}}}
+               for i in range(2000)]
+        message = json.dumps({"jsonrpc": "2.0", "id": "req-1",
+                              "result": vms}).encode("utf-8")
+        size_mb = len(message) / 1024**2
+
+        def send_parsing():
+            # What send() did before: decode the message to find its id.
+            response_id = json.loads(message)["id"]
+            self.req_dest[response_id] = "jms.topic.reply"
+            self.server.send(message, response_ids=[response_id])
+            client.pop_message()
+
+        def send_with_ids():
+            self.req_dest["req-1"] = "jms.topic.reply"
+            self.server.send(message, response_ids=["req-1"])
+            client.pop_message()
+
+        number = 20
+        parsing = timeit.timeit(send_parsing, number=number) / number
+        with_ids = timeit.timeit(send_with_ids, number=number) / number
+        print("%.2f MiB reply: parsing %.6f seconds/MiB, with ids %.6f "
+              "seconds/MiB" % (size_mb, parsing / size_mb, with_ids / size_mb))
+
+
+class EventQueueTests(TestCaseBase):
+
+    def setUp(self):
+        self.adapter = StompAdapterImpl(Reactor(), defaultdict(list), {})
+        self.adapter._max_events = 3
+
+    def event(self, body):
+        return Frame(Command.MESSAGE,
+                     {Headers.DESTINATION: "jms.queue.events"}, body)
+
+    def bodies(self):
+        res = []
+        while self.adapter.has_outgoing_messages:
+            res.append(self.adapter.pop_message().body)
+        return res
+
+    def test_replies_before_events(self):
+        self.adapter.queue_event(self.event(b"event-1"))
+        self.adapter.queue_frame(Frame(Command.MESSAGE, {}, b"reply-1"))
+        self.adapter.queue_event(self.event(b"event-2"))
+
+        self.assertEqual(self.bodies(), [b"reply-1", b"event-1", b"event-2"])
+
+    def test_peek_keeps_frame(self):
+        self.adapter.queue_event(self.event(b"event-1"))
+        frame = self.adapter.peek_message()
+        self.adapter.queue_frame(Frame(Command.MESSAGE, {}, b"reply-1"))
+
+        # The frame being sent must not change until it is popped.
+        self.assertIs(self.adapter.peek_message(), frame)
+        self.assertIs(self.adapter.pop_message(), frame)
+        self.assertEqual(self.bodies(), [b"reply-1"])
+
+    def test_peek_empty(self):
+        with self.assertRaises(IndexError):
+            self.adapter.peek_message()
+        self.assertFalse(self.adapter.has_outgoing_messages)
+
+    def test_coalesce(self):
+        before = stompserver.stats()
+        self.adapter.queue_event(self.event(b"vm-1 Up"), key="vm-1")
+        self.adapter.queue_event(self.event(b"vm-2 Up"), key="vm-2")
+        self.adapter.queue_event(self.event(b"vm-1 Down"), key="vm-1")
+
+        self.assertEqual(self.adapter.queued_events, 2)
+        after = stompserver.stats()
+        self.assertEqual(
+            after["coalesced_events"] - before["coalesced_events"], 1)
+        self.assertEqual(self.bodies(), [b"vm-2 Up", b"vm-1 Down"])
+
+    def test_drop_oldest(self):
+        before = stompserver.stats()
+        for i in range(5):
+            self.adapter.queue_event(self.event(b"event-%d" % i))
+
+        after = stompserver.stats()
+        self.assertEqual(after["dropped_events"] - before["dropped_events"], 2)
+        self.assertEqual(self.bodies(), [b"event-2", b"event-3", b"event-4"])
+
+    def test_replies_never_dropped(self):
+        for i in range(5):
+            self.adapter.queue_frame(Frame(Command.MESSAGE, {}, b"%d" % i))
+        self.adapter.queue_event(self.event(b"event"))
+
+        self.assertEqual(self.bodies(),
+                         [b"0", b"1", b"2", b"3", b"4", b"event"])
+
+    def test_stats_queued(self):
+        before = stompserver.stats()["queued_events"]
+        self.adapter.queue_event(self.event(b"event-1"))
+        self.adapter.queue_event(self.event(b"event-2"))
+
+        self.assertEqual(stompserver.stats()["queued_events"] - before, 2)
+        self.bodies()
+        self.assertEqual(stompserver.stats()["queued_events"], before)
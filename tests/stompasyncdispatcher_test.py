@@ -1,5 +1,5 @@
 #
-# Copyright 2015-2017 Red Hat, Inc.
+# Copyright 2015-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -30,12 +30,28 @@ from stomp_test_utils import (
 from yajsonrpc.stomp import (
     AsyncDispatcher,
     Command,
+    COPY_BODY_SIZE,
     Frame,
     Headers,
     DEFAULT_INTERVAL
 )
 
 
+class PartialSendDispatcher(object):
+    """
+    Accepts at most max_send bytes per send() call.
+    """
+
+    def __init__(self, max_send):
+        self.max_send = max_send
+        self.sent = []
+
+    def send(self, data):
+        data = bytes(data[:self.max_send])
+        self.sent.append(data)
+        return len(data)
+
+
 class AsyncDispatcherTest(TestCaseBase):
 
     def test_handle_connect(self):
@@ -143,3 +159,77 @@ class AsyncDispatcherTest(TestCaseBase):
         dispatcher.handle_close(None)
 
         self.assertTrue(connection.closed)
+
+    def test_handle_write_partial(self):
+        body = "x" * (COPY_BODY_SIZE + 1)
+        headers = {Headers.DESTINATION: 'jms.topic.vdsm_responses'}
+        frame = Frame(command=Command.MESSAGE, headers=headers, body=body)
+        frame_handler = FakeFrameHandler()
+        frame_handler.handle_frame(None, frame)
+        dispatcher = AsyncDispatcher(FakeConnection(), frame_handler)
+
+        sock = PartialSendDispatcher(4096)
+        while dispatcher.writable(None):
+            dispatcher.handle_write(sock)
+
+        self.assertFalse(frame_handler.has_outgoing_messages)
+        self.assertEqual(''.join(sock.sent), frame.encode())
+
+    def test_handle_write_multiple_frames(self):
+        frame_handler = FakeFrameHandler()
+        frames = [Frame(command=Command.MESSAGE, body="x" * size)
+                  for size in (10, COPY_BODY_SIZE * 2, 20)]
+        for frame in frames:
+            frame_handler.handle_frame(None, frame)
+        dispatcher = AsyncDispatcher(FakeConnection(), frame_handler)
+
+        sock = PartialSendDispatcher(COPY_BODY_SIZE)
+        while dispatcher.writable(None):
+            dispatcher.handle_write(sock)
+
+        self.assertFalse(frame_handler.has_outgoing_messages)
+        self.assertEqual(''.join(sock.sent),
+                         ''.join(frame.encode() for frame in frames))
+
+
+class FrameEncodeTest(TestCaseBase):
+
+    def test_small_body_single_buffer(self):
+        frame = Frame(command=Command.MESSAGE, body="body")
+        buffers = frame.encode_buffers()
+        self.assertEqual(len(buffers), 1)
+        self.assertEqual(buffers[0],
+                         "MESSAGE\ncontent-length:4\n\nbody\0")
+
+    def test_large_body_not_copied(self):
+        body = "x" * (COPY_BODY_SIZE + 1)
+        frame = Frame(command=Command.MESSAGE, body=body)
+        header, sent_body, end = frame.encode_buffers()
+        self.assertIs(sent_body, body)
+        self.assertEqual(end, "\0")
+        self.assertEqual(header, "MESSAGE\ncontent-length:%d\n\n" %
+                         len(body))
+
+    def test_small_chunked_body_single_buffer(self):
+        frame = Frame(command=Command.MESSAGE, body=["bo", "dy"])
+        self.assertEqual(frame.encode_buffers(),
+                         ["MESSAGE\ncontent-length:4\n\nbody\0"])
+
+    def test_large_chunked_body_not_copied(self):
+        body = ["x" * COPY_BODY_SIZE, "y"]
+        frame = Frame(command=Command.MESSAGE, body=body)
+        header, first, second, end = frame.encode_buffers()
+        self.assertIs(first, body[0])
+        self.assertIs(second, body[1])
+        self.assertEqual(end, "\0")
+        self.assertEqual(header, "MESSAGE\ncontent-length:%d\n\n" %
+                         (COPY_BODY_SIZE + 1))
+
+    def test_no_body(self):
+        frame = Frame(command=Command.RECEIPT, headers={"receipt-id": "1"})
+        self.assertEqual(frame.encode_buffers(),
+                         ["RECEIPT\nreceipt-id:1\n\n\0"])
+
+    def test_escape_headers(self):
+        frame = Frame(command=Command.SEND, headers={"a:b": "c\nd"})
+        self.assertEqual(frame.encode(), "SEND\na\\cb:c\\nd\n\n\0")
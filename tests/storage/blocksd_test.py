@@ -21,19 +21,26 @@
 
 from __future__ import absolute_import
 from __future__ import division
+from __future__ import print_function
 
 import os
+import timeit
 
 from monkeypatch import MonkeyPatch
 
 import pytest
 
 from storage.storagefakelib import fake_vg
+from storage.storagetestlib import fake_block_env
 from testValidation import xfail
 from testlib import VdsmTestCase
+from testlib import make_uuid
 from vdsm.storage import blockSD
+from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
 from vdsm.storage import lvm
+from vdsm.storage import misc
+from vdsm.storage import volumemetadata
 from vdsm import constants
 
 
@@ -163,3 +170,45 @@ def test_meta_size_max_val(monkeypatch):
         free=str(1024 * constants.MEGAB)))
     meta_size = blockSD.BlockStorageDomain.metaSize('sd-uuid')
     assert meta_size == 513
+
+
+def test_read_volumes_metadata():
+    with fake_block_env() as env:
+        img_id = make_uuid()
+        vol_ids = [make_uuid() for i in range(3)]
+        for vol_id in vol_ids:
+            env.make_volume(constants.MEGAB, img_id, vol_id)
+
+        volumes_md = env.sd_manifest.read_volumes_metadata()
+
+        assert sorted(volumes_md) == sorted(vol_ids)
+        for vol_id in vol_ids:
+            vol = env.sd_manifest.produceVolume(img_id, vol_id)
+            md = volumemetadata.VolumeMetadata.from_lines(volumes_md[vol_id])
+            assert md.legacy_info() == vol.getMetadata()
+
+
+@pytest.mark.slow
+def test_read_volumes_metadata_benchmark():
+    count = 500
+    with fake_block_env() as env:
+        img_id = make_uuid()
+        vol_ids = [make_uuid() for i in range(count)]
+        for vol_id in vol_ids:
+            env.make_volume(constants.MEGAB, img_id, vol_id)
+        md_path = env.sd_manifest.metadata_volume_path()
+        slots = [env.sd_manifest.produceVolume(img_id, vol_id).getMetaOffset()
+                 for vol_id in vol_ids]
+
+        def read_each_volume():
+            for slot in slots:
+                misc.readblock(md_path, slot * sc.METADATA_SIZE,
+                               sc.METADATA_SIZE)
+
+        number = 5
+        each_time = timeit.timeit(read_each_volume, number=number) / number
+        bulk_time = timeit.timeit(env.sd_manifest.read_volumes_metadata,
+                                  number=number) / number
+        print("%d volumes: per volume %.6f seconds, bulk %.6f seconds "
+              "(%.1fx)" % (count, each_time, bulk_time,
+                           each_time / bulk_time))
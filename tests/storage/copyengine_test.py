@@ -0,0 +1,156 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.common import exception
+from vdsm.storage import copyengine
+
+
+class Error(Exception):
+    """ Raised to simulate copy errors """
+
+
+class FakeOperation(object):
+
+    def __init__(self, error=None, block=False):
+        self.error = error
+        self.block = block
+        self.progress = 0.0
+        self.started = threading.Event()
+        self.aborted = threading.Event()
+        self.ran = False
+
+    def run(self):
+        self.started.set()
+        if self.aborted.is_set():
+            raise exception.ActionStopped()
+        if self.block:
+            self.aborted.wait(5)
+            raise exception.ActionStopped()
+        if self.error:
+            raise self.error
+        self.ran = True
+        self.progress = 100.0
+
+    def abort(self):
+        self.aborted.set()
+
+
+def make_copies(*operations):
+    return [copyengine.Copy("vol-%d" % i, op, 1024)
+            for i, op in enumerate(operations)]
+
+
+@pytest.mark.parametrize("parallel", [1, 2, 4])
+def test_run(parallel):
+    operations = [FakeOperation() for i in range(4)]
+    engine = copyengine.CopyEngine(make_copies(*operations),
+                                   parallel=parallel)
+    engine.run()
+    assert all(op.ran for op in operations)
+    assert engine.progress == 100.0
+
+
+def test_run_empty():
+    engine = copyengine.CopyEngine([], parallel=2)
+    engine.run()
+    assert engine.progress == 100.0
+
+
+def test_run_concurrently():
+    blocked = FakeOperation(block=True)
+    other = FakeOperation()
+    engine = copyengine.CopyEngine(make_copies(blocked, other), parallel=2)
+    t = concurrent.thread(engine.run)
+    t.start()
+    try:
+        # The second copy completes while the first is running.
+        assert blocked.started.wait(1)
+        assert other.started.wait(1)
+    finally:
+        engine.abort()
+        t.join()
+    assert other.ran
+
+
+def test_error_aborts_other_copies():
+    blocked = FakeOperation(block=True)
+    failing = FakeOperation(error=Error())
+    pending = FakeOperation()
+    engine = copyengine.CopyEngine(
+        make_copies(blocked, failing, pending), parallel=2)
+    with pytest.raises(Error):
+        engine.run()
+    assert blocked.aborted.is_set()
+    assert not pending.started.is_set()
+
+
+def test_abort():
+    blocked = FakeOperation(block=True)
+    pending = FakeOperation()
+    engine = copyengine.CopyEngine(make_copies(blocked, pending), parallel=1)
+
+    def abort():
+        blocked.started.wait(1)
+        engine.abort()
+
+    t = concurrent.thread(abort)
+    t.start()
+    with pytest.raises(exception.ActionStopped):
+        engine.run()
+    t.join()
+    assert not pending.started.is_set()
+
+
+def test_progress_weighted_by_size():
+    small = FakeOperation()
+    large = FakeOperation()
+    copies = [copyengine.Copy("small", small, 1),
+              copyengine.Copy("large", large, 3)]
+    engine = copyengine.CopyEngine(copies)
+    assert engine.progress == 0.0
+    large.progress = 50.0
+    assert engine.progress == pytest.approx(37.5)
+    copies[0].done = True
+    assert engine.progress == pytest.approx(62.5)
+
+
+@pytest.mark.parametrize("parallel", [1, 2])
+def test_log_progress(parallel, monkeypatch):
+    blocked = FakeOperation(block=True)
+    engine = copyengine.CopyEngine(make_copies(blocked), parallel=parallel,
+                                   progress_interval=0.01)
+    logged = threading.Event()
+
+    def log_progress():
+        logged.set()
+        engine.abort()
+
+    monkeypatch.setattr(engine, "_log_progress", log_progress)
+    with pytest.raises(exception.ActionStopped):
+        engine.run()
+    assert logged.is_set()
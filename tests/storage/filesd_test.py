@@ -1,5 +1,5 @@
 #
-# Copyright 2014-2017 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -43,10 +43,13 @@ from vdsm.storage import sd
 
 class FileStorageDomainManifest(fileSD.FileStorageDomainManifest):
 
-    def __init__(self, domainpath, oop):
+    def __init__(self, domainpath, oop, clock):
         self.mountpoint = os.path.dirname(domainpath)
         self.sdUUID = os.path.basename(domainpath)
         self._oop = oop
+        self._volumes_index = fileSD.VolumesIndex(
+            os.path.join(domainpath, sd.DOMAIN_IMAGES), oop,
+            list_mtimes=oop.list_mtimes, clock=clock)
 
     @property
     def oop(self):
@@ -57,24 +60,50 @@ class FileStorageDomain(fileSD.FileStorageDomain):
 
     stat = None  # Accessed in __del__
 
-    def __init__(self, uuid, mountpoint, oop):
+    def __init__(self, uuid, mountpoint, oop, clock=lambda: 0.0):
         domainpath = os.path.join(mountpoint, uuid)
-        self._manifest = FileStorageDomainManifest(domainpath, oop)
+        self._manifest = FileStorageDomainManifest(domainpath, oop, clock)
 
 
 class FakeGlob(object):
 
     def __init__(self, files):
-        self.files = files
+        # Directory path: names of files and directories in it
+        self.dirs = collections.defaultdict(set)
+        for path in files:
+            self.add(path)
+
+    def add(self, path):
+        while path != "/":
+            path, name = os.path.split(path)
+            self.dirs[path].add(name)
+
+    def remove(self, path):
+        dirname, name = os.path.split(path)
+        self.dirs[dirname].discard(name)
 
     def glob(self, pattern):
-        return fnmatch.filter(self.files, pattern)
+        # Supports only magic characters in the last component.
+        dirname, basename = os.path.split(pattern)
+        return [os.path.join(dirname, name)
+                for name in fnmatch.filter(self.dirs.get(dirname, ()),
+                                           basename)]
 
 
 class FakeOOP(object):
 
     def __init__(self, glob=None):
         self.glob = glob
+        # Server time, reported as the mtime of the images directory.
+        self.server_time = 10.0
+        self.mtimes = {}
+        self.list_mtimes_calls = 0
+
+    def list_mtimes(self, path):
+        self.list_mtimes_calls += 1
+        entries = dict((name, self.mtimes.get(os.path.join(path, name), 1.0))
+                       for name in self.glob.dirs.get(path, ()))
+        return self.server_time, entries
 
 
 class TestGetAllVolumes(VdsmTestCase):
@@ -175,6 +204,119 @@ class TestGetAllVolumes(VdsmTestCase):
         # on overloaded jenkins slave.
         self.assertTrue(elapsed < 1.0, "Elapsed time: %f seconds" % elapsed)
 
+    def test_refresh_modified_images(self):
+        glob = FakeGlob([
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
+            os.path.join(self.IMAGES_DIR, "image-2", "volume-2.meta"),
+        ])
+        oop = FakeOOP(glob)
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
+        dom.getAllVolumes()
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 2)
+
+        # A volume created by another host changes the image mtime.
+        glob.add(os.path.join(self.IMAGES_DIR, "image-2", "volume-3.meta"))
+        oop.mtimes[os.path.join(self.IMAGES_DIR, "image-2")] = 2.0
+        res = dom.getAllVolumes()
+
+        self.assertEqual(res["volume-3"], (("image-2",), None))
+        stats = dom.manifest.volumes_index_stats()
+        self.assertEqual(stats["rescanned"], 1)
+        self.assertEqual(stats["volumes"], 3)
+
+    def test_unmodified_images_are_cached(self):
+        glob = FakeGlob([
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
+        ])
+        oop = FakeOOP(glob)
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
+        dom.getAllVolumes()
+
+        # The mtime did not change, the image is not scanned again.
+        glob.add(os.path.join(self.IMAGES_DIR, "image-1", "volume-2.meta"))
+        self.assertNotIn("volume-2", dom.getAllVolumes())
+
+        # But volumes created by this host are added to the index.
+        dom.manifest.volume_added("image-1", "volume-2")
+        self.assertIn("volume-2", dom.getAllVolumes())
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 0)
+
+    def test_removed_image(self):
+        path = os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta")
+        glob = FakeGlob([path])
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, FakeOOP(glob))
+        dom.getAllVolumes()
+
+        glob.remove(os.path.dirname(path))
+
+        self.assertEqual(dom.getAllVolumes(), {})
+
+    def test_refresh_uses_single_listing(self):
+        glob = FakeGlob([
+            os.path.join(self.IMAGES_DIR, "image-1", "volume-1.meta"),
+            os.path.join(self.IMAGES_DIR, "image-2", "volume-2.meta"),
+            os.path.join(self.IMAGES_DIR, "image-3", "volume-3.meta"),
+        ])
+        oop = FakeOOP(glob)
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
+        dom.getAllVolumes()
+        dom.getAllVolumes()
+        self.assertEqual(oop.list_mtimes_calls, 2)
+
+    def test_racy_image_rescanned_until_server_time_advances(self):
+        image_dir = os.path.join(self.IMAGES_DIR, "image-1")
+        glob = FakeGlob([os.path.join(image_dir, "volume-1.meta")])
+        oop = FakeOOP(glob)
+        # The image was modified just before it was scanned, using the
+        # server clock. The clock of this host does not matter.
+        oop.mtimes[image_dir] = oop.server_time
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop)
+        dom.getAllVolumes()
+
+        # Modified again within the same mtime.
+        glob.add(os.path.join(image_dir, "volume-2.meta"))
+        self.assertIn("volume-2", dom.getAllVolumes())
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 1)
+
+        # The server time advanced; the last scan was racy, so the image is
+        # scanned once more, and then cached.
+        oop.server_time += fileSD._MTIME_RACY_WINDOW
+        dom.getAllVolumes()
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 1)
+        dom.getAllVolumes()
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 0)
+
+    def test_newest_image_cached_after_racy_window(self):
+        # The newest image is not modified again; its mtime is always the
+        # newest mtime on the server.
+        image_dir = os.path.join(self.IMAGES_DIR, "image-1")
+        glob = FakeGlob([os.path.join(image_dir, "volume-1.meta")])
+        oop = FakeOOP(glob)
+        oop.mtimes[image_dir] = oop.server_time
+        clock = FakeClock()
+        dom = FileStorageDomain(self.SD_UUID, self.MOUNTPOINT, oop,
+                                clock=clock)
+        dom.getAllVolumes()
+        dom.getAllVolumes()
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 1)
+
+        # The server clock advanced as the local clock, so the last scan is
+        # not racy, and the image is not scanned again.
+        clock.now += fileSD._MTIME_RACY_WINDOW
+        dom.getAllVolumes()
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 1)
+        dom.getAllVolumes()
+        self.assertEqual(dom.manifest.volumes_index_stats()["rescanned"], 0)
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
 
 SDInfo = collections.namedtuple("SDInfo",
                                 "uuid, remote_path, mountpoint, dom_dir")
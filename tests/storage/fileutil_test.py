@@ -1,5 +1,5 @@
 #
-# Copyright 2012 Red Hat, Inc.
+# Copyright 2012-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -224,3 +224,22 @@ def test_pad_to_block_size(tmpdir, orig_size, expected_size):
     fileUtils.padToBlockSize(path)
     padded_size = os.stat(path).st_size
     assert padded_size == expected_size
+
+
+def test_list_mtimes(tmpdir):
+    tmpdir.mkdir("image-1")
+    tmpdir.join("file").write("")
+    os.utime(str(tmpdir.join("image-1")), (1000.5, 1000.5))
+    os.utime(str(tmpdir.join("file")), (2000.0, 2000.0))
+    os.utime(str(tmpdir), (3000.0, 3000.0))
+
+    mtime, entries = fileUtils.list_mtimes(str(tmpdir))
+
+    assert mtime == 3000.0
+    assert entries == {"image-1": 1000.5, "file": 2000.0}
+
+
+def test_list_mtimes_empty(tmpdir):
+    mtime, entries = fileUtils.list_mtimes(str(tmpdir))
+    assert mtime == os.stat(str(tmpdir)).st_mtime
+    assert entries == {}
@@ -1,5 +1,5 @@
 #
-# Copyright 2012 Red Hat, Inc.
+# Copyright 2012-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -22,6 +22,10 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import timeit
+
+import pytest
+
 from testlib import VdsmTestCase
 
 import vdsm.storage.lvm as lvm
@@ -40,3 +44,143 @@ class TestLvm(VdsmTestCase):
                           "\\\\x22\\\\x28|\', \'r|.*|\' ]"
                           )
         self.assertEqual(expectedFilter, filter)
+
+
+LVS_OUTPUT = [
+    "  lv-uuid-1|lv-1|vg-1|-wi-a-----|134217728|0|/dev/mapper/a(0)|"
+    "IU_img-1,MD_1,PU_00000000-0000-0000-0000-000000000000",
+    "  lv-uuid-1|lv-1|vg-1|-wi-a-----|134217728|512|/dev/mapper/b(0)|"
+    "IU_img-1,MD_1,PU_00000000-0000-0000-0000-000000000000",
+    "  lv-uuid-2|lv-2|vg-1|-wi-ao----|268435456|0|/dev/mapper/a(1)|",
+]
+
+PVS_OUTPUT = [
+    "  pv-uuid-1|/dev/mapper/a|107105746944|vg-1|vg-uuid-1|135266304|798|"
+    "4|2|107374182400|2",
+]
+
+VGS_OUTPUT = [
+    "  vg-uuid-1|vg-1|wz--n-|107105746944|105226698752|134217728|798|784|"
+    "RHAT_storage_domain|134217728|67097088|3|2|/dev/mapper/a",
+    "  vg-uuid-1|vg-1|wz--n-|107105746944|105226698752|134217728|798|784|"
+    "RHAT_storage_domain|134217728|67097088|3|2|/dev/mapper/b",
+    "  vg-uuid-2|vg-2|wz-pn-|107105746944|105226698752|134217728|798|784|"
+    "|134217728|67097088|3|2|[unknown]",
+]
+
+
+def test_parse_lvs():
+    lvs = lvm._parse_lvs(LVS_OUTPUT)
+    # Only the first segment of every lv is reported.
+    assert lvs == [
+        lvm.makeLV(*LVS_OUTPUT[0].strip().split(lvm.SEPARATOR)),
+        lvm.makeLV(*LVS_OUTPUT[2].strip().split(lvm.SEPARATOR)),
+    ]
+    assert lvs[0].tags == (
+        "IU_img-1", "MD_1", "PU_00000000-0000-0000-0000-000000000000")
+    assert lvs[1].tags == ()
+    assert lvs[0].active and not lvs[0].opened
+    assert lvs[1].active and lvs[1].opened
+
+
+def test_parse_lvs_share_attrs():
+    lines = [
+        "  lv-uuid-%d|lv-%d|vg-1|-wi-a-----|134217728|0|/dev/mapper/a(%d)|"
+        % (i, i, i) for i in range(3)
+    ]
+    lvs = lvm._parse_lvs(lines)
+    assert lvs[0].attr is lvs[1].attr is lvs[2].attr
+    assert lvs[0].vg_name is lvs[1].vg_name is lvs[2].vg_name
+
+
+def test_parse_pvs():
+    pvs = lvm._parse_pvs(PVS_OUTPUT)
+    assert pvs == [lvm.makePV(*PVS_OUTPUT[0].strip().split(lvm.SEPARATOR))]
+    assert pvs[0].guid == "a"
+
+
+def test_parse_vgs():
+    vgs = lvm._parse_vgs(VGS_OUTPUT)
+    assert len(vgs) == 1
+    vg = vgs[0]
+    assert vg.name == "vg-1"
+    assert vg.pv_name == ("/dev/mapper/a", "/dev/mapper/b")
+    assert vg.tags == ("RHAT_storage_domain",)
+    assert vg.writeable
+    assert vg.partial == lvm.VG_OK
+
+
+class FakeLVMCache(lvm.LVMCache):
+
+    def __init__(self, out):
+        super(FakeLVMCache, self).__init__()
+        self.out = out
+        self.rc = 0
+
+    def cmd(self, cmd, devices=tuple()):
+        return self.rc, self.out, []
+
+
+def test_reload_lvs_removes_stale():
+    cache = FakeLVMCache(LVS_OUTPUT)
+    cache._reloadlvs("vg-1")
+    assert sorted(cache._lvs) == [("vg-1", "lv-1"), ("vg-1", "lv-2")]
+
+    cache.out = LVS_OUTPUT[2:]
+    updated = cache._reloadlvs("vg-1")
+    assert list(updated) == [("vg-1", "lv-2")]
+    assert list(cache._lvs) == [("vg-1", "lv-2")]
+
+
+def test_reload_vgs_removes_stale():
+    cache = FakeLVMCache(VGS_OUTPUT)
+    cache._vgs["vg-3"] = lvm.Stub("vg-3", True)
+    vgs = cache._reloadvgs()
+    assert list(vgs) == ["vg-1"]
+    assert list(cache._vgs) == ["vg-1"]
+    assert not cache._stalevg
+
+
+def test_reload_vgs_failed():
+    # vgs fails when a vg is missing, but reports the other vgs.
+    cache = FakeLVMCache(VGS_OUTPUT)
+    cache.rc = 5
+    cache._vgs["vg-3"] = lvm.Stub("vg-3", True)
+    vgs = cache._reloadvgs()
+    assert list(vgs) == ["vg-1"]
+    # The report is incomplete, so vgs missing from it are kept.
+    assert sorted(cache._vgs) == ["vg-1", "vg-3"]
+    assert isinstance(cache._vgs["vg-3"], lvm.Unreadable)
+    assert cache._stalevg
+
+
+def test_reload_all_lvs():
+    cache = FakeLVMCache(LVS_OUTPUT)
+    cache._lvs[("vg-2", "lv-3")] = lvm.Stub("lv-3", True)
+    lvs = cache._reloadAllLvs()
+    assert sorted(lvs) == [("vg-1", "lv-1"), ("vg-1", "lv-2")]
+    assert not cache._stalelv
+
+
+@pytest.mark.slow
+def test_parse_lvs_benchmark():
+    count = 5000
+    lines = [
+        "  lv-uuid-%d|lv-%d|vg-1|-wi-------|134217728|0|/dev/mapper/a(%d)|"
+        "IU_img-%d,MD_%d,PU_00000000-0000-0000-0000-000000000000"
+        % (i, i, i, i, i) for i in range(count)
+    ]
+
+    def parse_each_line():
+        for line in lines:
+            fields = [field.strip() for field in line.split(lvm.SEPARATOR)]
+            lvm.makeLV(*fields)
+
+    def parse_bulk():
+        lvm._parse_lvs(lines)
+
+    number = 10
+    each_time = timeit.timeit(parse_each_line, number=number) / number
+    bulk_time = timeit.timeit(parse_bulk, number=number) / number
+    print("%d lvs: per line %.6f seconds, bulk %.6f seconds (%.1fx)"
+          % (count, each_time, bulk_time, each_time / bulk_time))
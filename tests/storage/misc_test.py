@@ -663,6 +663,23 @@ class TestReadBlock(VdsmTestCase):
 
         os.unlink(path)
 
+    @MonkeyPatch(misc, "DIRECT_READ_CHUNK", 1024)
+    def testReadDirectMultipleChunks(self):
+        """
+        Make sure that reads larger than the chunk size return all the data.
+        """
+        data = b"".join(b"%07d\n" % i for i in range(1024))
+        path = self._createTempFile(len(data), data)
+        try:
+            self.assertEqual(misc.read_direct(path, 512, 4608),
+                             data[512:512 + 4608])
+        finally:
+            os.unlink(path)
+
+    def testReadDirectMissingFile(self):
+        self.assertRaises(misc.se.MiscBlockReadException, misc.read_direct,
+                          "/no/such/file", 0, 512)
+
 
 class TestCleanUpDir(VdsmTestCase):
 
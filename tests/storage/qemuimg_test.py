@@ -1,5 +1,5 @@
 #
-# Copyright 2014-2017 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -364,6 +364,16 @@ class ConvertTests(TestCaseBase):
             qemuimg.convert('src', 'dst', dstFormat='qcow2',
                             backing='bak', backingFormat='qcow2')
 
+    def test_coroutines(self):
+        def convert(cmd, **kw):
+            expected = [QEMU_IMG, 'convert', '-p', '-t', 'none', '-T', 'none',
+                        'src', '-O', 'raw', '-m', '16', '-W', 'dst']
+            self.assertEqual(cmd, expected)
+
+        with MonkeyPatchScope([(qemuimg, 'ProgressCommand', convert)]):
+            qemuimg.convert('src', 'dst', dstFormat='raw', coroutines=16,
+                            unordered_writes=True)
+
     def test_qcow2_compat_invalid(self):
         with self.assertRaises(ValueError):
             qemuimg.convert('image', 'dst', dstFormat='qcow2',
@@ -32,6 +32,7 @@ from resource import getrlimit, RLIMIT_NPROC
 
 import pytest
 
+from vdsm.common import concurrent
 from vdsm.storage import resourceManager as rm
 
 from monkeypatch import MonkeyPatch
@@ -118,6 +119,26 @@ class FailAfterSwitchFactory(rm.SimpleResourceFactory):
         return s
 
 
+class BlockingResourceFactory(rm.SimpleResourceFactory):
+    """
+    Blocks the creation of one resource until resumed, and optionally fails
+    it. Used to test requests registered while a resource is created.
+    """
+    def __init__(self, blocked, fail=False):
+        self.blocked = blocked
+        self.fail = fail
+        self.creating = threading.Event()
+        self.resume = threading.Event()
+
+    def createResource(self, name, lockType):
+        if name == self.blocked and not self.resume.is_set():
+            self.creating.set()
+            self.resume.wait()
+            if self.fail:
+                raise Exception("Creation failed")
+        return None
+
+
 def manager():
     """
     Create fresh _ResourceManager instance for testing.
@@ -570,6 +591,114 @@ class TestResourceManager(VdsmTestCase):
         self.assertTrue(exclusiveReq3.granted())
         resources.pop().release()  # exclusiveReq 3
 
+    @MonkeyPatch(rm, "_manager", manager())
+    def testCreateResourceOutsideNamespaceLock(self):
+        factory = BlockingResourceFactory("slow")
+        rm.registerNamespace("blocking", factory)
+        resources = []
+
+        def callback(req, res):
+            resources.append(res)
+
+        creator = concurrent.thread(
+            rm._registerResource,
+            args=("blocking", "slow", rm.SHARED, callback))
+        creator.start()
+        try:
+            self.assertTrue(factory.creating.wait(1))
+
+            # Other resources in the namespace are not blocked.
+            res = rm.acquireResource(
+                "blocking", "fast", rm.EXCLUSIVE, timeout=1)
+            res.release()
+
+            # Requests for the resource wait until it is created.
+            sharedReq = rm._registerResource(
+                "blocking", "slow", rm.SHARED, callback)
+            self.assertFalse(sharedReq.granted())
+            self.assertEqual(rm._getResourceStatus("blocking", "slow"),
+                             rm.LockState.shared)
+        finally:
+            factory.resume.set()
+            creator.join()
+
+        self.assertTrue(sharedReq.granted())
+        self.assertEqual(len(resources), 2)
+        for res in resources:
+            res.release()
+        self.assertEqual(rm._getResourceStatus("blocking", "slow"),
+                         rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testErrorInFactoryRetriesForWaitingRequest(self):
+        factory = BlockingResourceFactory("resource", fail=True)
+        rm.registerNamespace("blocking", factory)
+        resources = []
+
+        def callback(req, res):
+            resources.append(res)
+
+        creator = concurrent.thread(
+            rm._registerResource,
+            args=("blocking", "resource", rm.EXCLUSIVE, callback))
+        creator.start()
+        try:
+            self.assertTrue(factory.creating.wait(1))
+            waitingReq = rm._registerResource(
+                "blocking", "resource", rm.EXCLUSIVE, callback)
+        finally:
+            factory.resume.set()
+            creator.join()
+
+        # The first creation failed, the second one succeeded.
+        self.assertEqual(resources[0], None)
+        self.assertTrue(waitingReq.granted())
+        resources[1].release()
+        self.assertEqual(rm._getResourceStatus("blocking", "resource"),
+                         rm.LockState.free)
+
+    @MonkeyPatch(rm, "_manager", manager())
+    def testLockStats(self):
+        resources = []
+
+        def callback(req, res):
+            resources.append(res)
+
+        exclusiveReq1 = rm._registerResource(
+            "storage", "resource", rm.EXCLUSIVE, callback)
+        exclusiveReq2 = rm._registerResource(
+            "storage", "resource", rm.EXCLUSIVE, callback)
+        sharedReq = rm._registerResource(
+            "storage", "other", rm.SHARED, callback)
+        self.assertTrue(exclusiveReq1.granted())
+        self.assertTrue(sharedReq.granted())
+        self.assertFalse(exclusiveReq2.granted())
+
+        stats = rm.lock_stats()
+        contended, = stats["contended"]
+        self.assertEqual(contended["name"], "storage.resource")
+        self.assertEqual(contended["lockType"], rm.EXCLUSIVE)
+        self.assertEqual(contended["activeUsers"], 1)
+        self.assertEqual(contended["waiting"], 1)
+        self.assertGreaterEqual(contended["maxWait"], 0)
+        storage = stats["namespaces"]["storage"]
+        self.assertEqual(storage["resources"], 2)
+        self.assertEqual(storage["waitTime"]["count"], 2)
+        self.assertEqual(storage["holdTime"]["count"], 0)
+
+        resources.pop(0).release()  # exclusiveReq 1
+        self.assertTrue(exclusiveReq2.granted())
+        resources.pop().release()  # exclusiveReq 2
+        resources.pop().release()  # sharedReq
+
+        stats = rm.lock_stats()
+        self.assertEqual(stats["contended"], [])
+        storage = stats["namespaces"]["storage"]
+        self.assertEqual(storage["resources"], 0)
+        self.assertEqual(storage["waitTime"]["count"], 3)
+        self.assertEqual(storage["holdTime"]["count"], 3)
+        self.assertEqual(sum(storage["holdTime"]["buckets"]), 3)
+
     @MonkeyPatch(rm, "_manager", manager())
     @pytest.mark.slow
     @pytest.mark.stress
@@ -1,4 +1,4 @@
-# Copyright 2015-2017 Red Hat, Inc.
+# Copyright 2015-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -57,6 +57,124 @@ class ManifestMixin(object):
                 with self.assertRaises(RuntimeError):
                     env.sd_manifest.initDomainLock()
 
+    def test_volumes_snapshot_chain(self):
+        with self.env() as env:
+            img_id = make_uuid()
+            base, internal, leaf = make_uuid(), make_uuid(), make_uuid()
+            env.make_volume(VOLSIZE, img_id, base, vol_type=sc.INTERNAL_VOL)
+            env.make_volume(VOLSIZE, img_id, internal, parent_vol_id=base,
+                            vol_format=sc.COW_FORMAT,
+                            vol_type=sc.INTERNAL_VOL)
+            env.make_volume(VOLSIZE, img_id, leaf, parent_vol_id=internal,
+                            vol_format=sc.COW_FORMAT)
+
+            snapshot = env.sd_manifest.volumes_snapshot()
+
+            self.assertEqual([base, internal, leaf], snapshot.chain(img_id))
+            self.assertEqual([base, internal],
+                             snapshot.chain(img_id, internal))
+            self.assertEqual(leaf, snapshot.leaf(img_id))
+            self.assertEqual(internal, snapshot.parent(leaf))
+            self.assertEqual([internal], snapshot.children(base))
+
+    def test_volumes_snapshot_invalidated(self):
+        with self.env() as env:
+            img_id = make_uuid()
+            vol_id = make_uuid()
+            snapshot = env.sd_manifest.volumes_snapshot()
+            self.assertIs(snapshot, env.sd_manifest.volumes_snapshot())
+
+            env.make_volume(VOLSIZE, img_id, vol_id)
+
+            snapshot = env.sd_manifest.volumes_snapshot()
+            self.assertEqual([vol_id], snapshot.chain(img_id))
+
+    def test_list_image_volumes(self):
+        with self.env() as env:
+            img_id = make_uuid()
+            base, leaf = make_uuid(), make_uuid()
+            env.make_volume(VOLSIZE, img_id, base, vol_type=sc.INTERNAL_VOL)
+            env.make_volume(VOLSIZE, img_id, leaf, parent_vol_id=base,
+                            vol_format=sc.COW_FORMAT)
+
+            snapshot = env.sd_manifest.volumes_snapshot()
+            volumes = env.sd_manifest.list_image_volumes(img_id)
+            self.assertEqual(sorted(snapshot.image_volumes(img_id)),
+                             sorted(volumes))
+            self.assertEqual([], env.sd_manifest.list_image_volumes(
+                make_uuid()))
+
+    def test_invalidate_image(self):
+        with self.env() as env:
+            img_id, other_img_id = make_uuid(), make_uuid()
+            base, leaf, other = make_uuid(), make_uuid(), make_uuid()
+            env.make_volume(VOLSIZE, img_id, base, vol_type=sc.INTERNAL_VOL)
+            env.make_volume(VOLSIZE, other_img_id, other)
+            snapshot = env.sd_manifest.volumes_snapshot()
+
+            reloaded = []
+            read_volumes_info = env.sd_manifest.read_volumes_info
+
+            def record(img_id, vol_ids):
+                reloaded.append(img_id)
+                return read_volumes_info(img_id, vol_ids)
+
+            with MonkeyPatchScope([
+                (env.sd_manifest, 'read_volumes_info', record),
+            ]):
+                env.make_volume(VOLSIZE, img_id, leaf, parent_vol_id=base,
+                                vol_format=sc.COW_FORMAT)
+                new_snapshot = env.sd_manifest.volumes_snapshot()
+
+            # Only the changed image was reloaded.
+            self.assertEqual([img_id], reloaded)
+            self.assertEqual([base, leaf], new_snapshot.chain(img_id))
+            self.assertIs(snapshot.volume(other), new_snapshot.volume(other))
+
+    def test_image_chain_detects_new_volume(self):
+        with self.env() as env:
+            img_id = make_uuid()
+            base, leaf = make_uuid(), make_uuid()
+            env.make_volume(VOLSIZE, img_id, base)
+            stale = env.sd_manifest.volumes_snapshot()
+
+            # Simulate another host adding a volume, without invalidating
+            # the snapshot on this host.
+            env.make_volume(VOLSIZE, img_id, leaf, parent_vol_id=base,
+                            vol_format=sc.COW_FORMAT)
+            env.sd_manifest.produceVolume(img_id, base).setInternal()
+            self.use_stale_snapshot(env, stale)
+
+            self.assertEqual([base, leaf],
+                             env.sd_manifest.image_chain(img_id))
+
+    def test_image_chain_detects_parent_change(self):
+        with self.env() as env:
+            img_id = make_uuid()
+            base, internal, leaf = make_uuid(), make_uuid(), make_uuid()
+            env.make_volume(VOLSIZE, img_id, base, vol_type=sc.INTERNAL_VOL)
+            env.make_volume(VOLSIZE, img_id, internal, parent_vol_id=base,
+                            vol_format=sc.COW_FORMAT,
+                            vol_type=sc.INTERNAL_VOL)
+            env.make_volume(VOLSIZE, img_id, leaf, parent_vol_id=internal,
+                            vol_format=sc.COW_FORMAT)
+            stale = env.sd_manifest.volumes_snapshot()
+
+            # Simulate another host removing internal from the chain after
+            # a live merge, before the volume is deleted.
+            self.set_parent(env.sd_manifest.produceVolume(img_id, leaf), base)
+            self.use_stale_snapshot(env, stale)
+
+            self.assertEqual([base, leaf],
+                             env.sd_manifest.image_chain(img_id))
+
+    def use_stale_snapshot(self, env, snapshot):
+        env.sd_manifest._volumes_snapshot = snapshot
+        env.sd_manifest._stale_images.clear()
+
+    def set_parent(self, vol, parent_vol_id):
+        vol.setMetaParam(sc.PUUID, parent_vol_id)
+
 
 class TestFileManifest(ManifestMixin, VdsmTestCase):
     env = fake_file_env
@@ -129,6 +247,10 @@ class TestFileManifest(ManifestMixin, VdsmTestCase):
 class TestBlockManifest(ManifestMixin, VdsmTestCase):
     env = fake_block_env
 
+    def set_parent(self, vol, parent_vol_id):
+        vol.setParentTag(parent_vol_id)
+        vol.setParentMeta(parent_vol_id)
+
     def test_get_monitoring_path(self):
         with self.env() as env:
             md_lv_path = env.lvm.lvPath(env.sd_manifest.sdUUID, sd.METADATA)
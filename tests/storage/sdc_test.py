@@ -0,0 +1,304 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+import time
+
+import pytest
+
+from vdsm.storage import blockSD
+from vdsm.storage import exception as se
+from vdsm.storage import glusterSD
+from vdsm.storage import localFsSD
+from vdsm.storage import lvm
+from vdsm.storage import multipath
+from vdsm.storage import nfsSD
+from vdsm.storage import sdc
+
+
+class FakeDomain(object):
+
+    def __init__(self, sdUUID):
+        self.sdUUID = sdUUID
+
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    calls = []
+    monkeypatch.setattr(multipath, "rescan", lambda: calls.append("rescan"))
+    monkeypatch.setattr(multipath, "resize_devices", lambda: None)
+    monkeypatch.setattr(lvm, "invalidateCache", lambda: None)
+    return calls
+
+
+@pytest.fixture
+def finder(monkeypatch):
+    """
+    Make all backends fail to find domains, except the domains added to
+    the returned dict.
+    """
+    domains = {}
+    lookups = []
+
+    def find(sdUUID):
+        lookups.append(sdUUID)
+        if sdUUID not in domains:
+            raise se.StorageDomainDoesNotExist(sdUUID)
+        return domains[sdUUID]
+
+    monkeypatch.setattr(sdc.StorageDomainCache, "_findUnfetchedDomain",
+                        lambda self, sdUUID: find(sdUUID))
+    return domains, lookups
+
+
+def test_produce_cached(refreshes, finder):
+    domains, lookups = finder
+    domains["sd-1"] = FakeDomain("sd-1")
+    cache = sdc.StorageDomainCache("/repo", miss_ttl=10)
+
+    assert cache.produce("sd-1").sdUUID == "sd-1"
+    assert cache.produce("sd-1").sdUUID == "sd-1"
+
+    assert lookups == ["sd-1"]
+    assert refreshes == ["rescan"]
+    stats = cache.stats()
+    assert stats["lookups"] == 1
+    assert stats["not_found"] == 0
+    assert stats["refreshes"] == 1
+    # produce() looks up the domain, and the proxy looks it up again.
+    assert stats["hits"] == 3
+
+
+def test_negative_cache(refreshes, finder):
+    domains, lookups = finder
+    cache = sdc.StorageDomainCache("/repo", miss_ttl=10)
+
+    for i in range(3):
+        with pytest.raises(se.StorageDomainDoesNotExist):
+            cache.produce("sd-1")
+
+    assert lookups == ["sd-1"]
+    stats = cache.stats()
+    assert stats["lookups"] == 1
+    assert stats["not_found"] == 1
+    assert stats["negative_hits"] == 2
+
+
+def test_negative_cache_expires(refreshes, finder, monkeypatch):
+    domains, lookups = finder
+    now = [100.0]
+    monkeypatch.setattr(sdc, "monotonic_time", lambda: now[0])
+    cache = sdc.StorageDomainCache("/repo", miss_ttl=10)
+
+    with pytest.raises(se.StorageDomainDoesNotExist):
+        cache.produce("sd-1")
+
+    domains["sd-1"] = FakeDomain("sd-1")
+    with pytest.raises(se.StorageDomainDoesNotExist):
+        cache.produce("sd-1")
+
+    now[0] += 10
+    assert cache.produce("sd-1").sdUUID == "sd-1"
+    assert lookups == ["sd-1", "sd-1"]
+
+
+def test_negative_cache_disabled(refreshes, finder):
+    domains, lookups = finder
+    cache = sdc.StorageDomainCache("/repo", miss_ttl=0)
+
+    for i in range(2):
+        with pytest.raises(se.StorageDomainDoesNotExist):
+            cache.produce("sd-1")
+
+    assert lookups == ["sd-1", "sd-1"]
+
+
+@pytest.mark.parametrize("forget", [
+    lambda cache: cache.invalidateStorage(),
+    lambda cache: cache.refresh(),
+    lambda cache: cache.manuallyAddDomain(FakeDomain("sd-1")),
+])
+def test_negative_cache_forget(refreshes, finder, forget):
+    domains, lookups = finder
+    cache = sdc.StorageDomainCache("/repo", miss_ttl=10)
+
+    with pytest.raises(se.StorageDomainDoesNotExist):
+        cache.produce("sd-1")
+
+    domains["sd-1"] = FakeDomain("sd-1")
+    forget(cache)
+    assert cache.produce("sd-1").sdUUID == "sd-1"
+
+
+def test_invalidate_storage_refreshes(refreshes, finder):
+    domains, lookups = finder
+    cache = sdc.StorageDomainCache("/repo", miss_ttl=10)
+
+    with pytest.raises(se.StorageDomainDoesNotExist):
+        cache.produce("sd-1")
+    cache.invalidateStorage()
+    with pytest.raises(se.StorageDomainDoesNotExist):
+        cache.produce("sd-2")
+
+    assert refreshes == ["rescan", "rescan"]
+
+
+def test_prefetch(refreshes, finder):
+    domains, lookups = finder
+    uuids = ["sd-%d" % i for i in range(10)]
+    for sdUUID in uuids[:8]:
+        domains[sdUUID] = FakeDomain(sdUUID)
+    cache = sdc.StorageDomainCache("/repo", miss_ttl=10)
+
+    cache.prefetch(uuids)
+
+    assert sorted(lookups) == sorted(uuids)
+    # Found domains are cached, missing domains are remembered.
+    for sdUUID in uuids[:8]:
+        assert cache.produce(sdUUID).sdUUID == sdUUID
+    for sdUUID in uuids[8:]:
+        with pytest.raises(se.StorageDomainDoesNotExist):
+            cache.produce(sdUUID)
+    assert sorted(lookups) == sorted(uuids)
+    # The storage is refreshed once for all the lookups.
+    assert refreshes == ["rescan"]
+
+
+def test_prefetch_timeout(refreshes, finder, monkeypatch):
+    domains, lookups = finder
+    domains["sd-1"] = FakeDomain("sd-1")
+    domains["sd-2"] = FakeDomain("sd-2")
+    release = threading.Event()
+    find = sdc.StorageDomainCache._findUnfetchedDomain
+
+    def blocked(self, sdUUID):
+        if sdUUID == "sd-2":
+            release.wait(5)
+        return find(self, sdUUID)
+
+    monkeypatch.setattr(sdc.StorageDomainCache, "_findUnfetchedDomain",
+                        blocked)
+    cache = sdc.StorageDomainCache("/repo")
+    try:
+        cache.prefetch(["sd-1", "sd-2"], timeout=0.1)
+        assert lookups == ["sd-1"]
+
+        # The blocked lookup is not started again.
+        cache.prefetch(["sd-1", "sd-2"], timeout=0.1)
+        assert lookups == ["sd-1"]
+    finally:
+        release.set()
+
+    # produce() waits for the running lookup.
+    assert cache.produce("sd-2").sdUUID == "sd-2"
+    assert sorted(lookups) == ["sd-1", "sd-2"]
+
+
+class TestFindUnfetchedDomain:
+
+    def test_found_by_one_backend(self, monkeypatch):
+        self.patch_backends(monkeypatch, found=(nfsSD,))
+        cache = sdc.StorageDomainCache("/repo")
+        assert cache._findUnfetchedDomain("sd-1") == ("nfsSD", "sd-1")
+
+    def test_first_backend_wins(self, monkeypatch):
+        self.patch_backends(monkeypatch, found=(localFsSD, glusterSD))
+        cache = sdc.StorageDomainCache("/repo")
+        assert cache._findUnfetchedDomain("sd-1") == ("glusterSD", "sd-1")
+
+    def test_not_found(self, monkeypatch):
+        self.patch_backends(monkeypatch, found=())
+        cache = sdc.StorageDomainCache("/repo")
+        with pytest.raises(se.StorageDomainDoesNotExist):
+            cache._findUnfetchedDomain("sd-1")
+
+    def test_backend_error(self, monkeypatch):
+        def fail(sdUUID):
+            raise RuntimeError("backend failed")
+
+        self.patch_backends(monkeypatch, found=(nfsSD,))
+        monkeypatch.setattr(blockSD, "findDomain", fail)
+        cache = sdc.StorageDomainCache("/repo")
+        assert cache._findUnfetchedDomain("sd-1") == ("nfsSD", "sd-1")
+
+    def test_concurrent(self, monkeypatch):
+        # A blocked backend does not delay finding the domain in a
+        # preferred backend.
+        release = threading.Event()
+
+        def blocked(sdUUID):
+            release.wait(5)
+            raise se.StorageDomainDoesNotExist(sdUUID)
+
+        self.patch_backends(monkeypatch, found=(blockSD,))
+        monkeypatch.setattr(nfsSD, "findDomain", blocked)
+        cache = sdc.StorageDomainCache("/repo")
+        try:
+            assert cache._findUnfetchedDomain("sd-1") == ("blockSD", "sd-1")
+        finally:
+            release.set()
+
+    def test_blocked_backend_threads(self, monkeypatch):
+        # Lookups waiting for a blocked backend do not start more threads.
+        release = threading.Event()
+        started = []
+
+        def blocked(sdUUID):
+            started.append(sdUUID)
+            release.wait(5)
+            raise se.StorageDomainDoesNotExist(sdUUID)
+
+        self.patch_backends(monkeypatch, found=(blockSD,))
+        monkeypatch.setattr(nfsSD, "findDomain", blocked)
+        cache = sdc.StorageDomainCache("/repo")
+        uuids = ["sd-%d" % i for i in range(sdc.FIND_THREADS + 2)]
+        try:
+            for sdUUID in uuids:
+                assert cache._findUnfetchedDomain(sdUUID) == ("blockSD",
+                                                              sdUUID)
+            nfs_finder = cache._backend_finders()[3]
+            assert nfs_finder._threads == sdc.FIND_THREADS
+        finally:
+            release.set()
+
+        # The queued lookups are served by the same threads.
+        for _ in range(50):
+            if nfs_finder._threads == 0:
+                break
+            time.sleep(0.1)
+        assert nfs_finder._threads == 0
+        assert sorted(started) == sorted(uuids)
+
+    def patch_backends(self, monkeypatch, found):
+        for mod in (blockSD, glusterSD, localFsSD, nfsSD):
+            monkeypatch.setattr(mod, "findDomain", self.finder(mod, found))
+
+    def finder(self, mod, found):
+        name = mod.__name__.rsplit(".", 1)[1]
+
+        def find(sdUUID):
+            if mod not in found:
+                raise se.StorageDomainDoesNotExist(sdUUID)
+            return (name, sdUUID)
+
+        return find
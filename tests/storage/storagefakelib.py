@@ -1,4 +1,4 @@
-# Copyright 2015-2017 Red Hat, Inc.
+# Copyright 2015-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -217,6 +217,9 @@ class FakeLVM(object):
         tags -= set(delTags)
         lv_md['tags'] = tuple(tags)
 
+    def replaceLVTag(self, vg, lv, deltag, addtag):
+        self.changeLVTags(vg, lv, delTags=(deltag,), addTags=(addtag,))
+
     def lvsByTag(self, vgName, tag):
         return [lv for lv in self.getLV(vgName) if tag in lv.tags]
 
@@ -0,0 +1,48 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+from vdsm.storage import task
+
+
+class FakeOperation(object):
+
+    def __init__(self):
+        self.progress = 0.0
+
+
+def test_progress_not_reported():
+    t = task.Task(id=None, name="copy")
+    assert t.progress is None
+    assert "progress" not in t.getDetails()
+    assert "progress" not in t.deprecated_getStatus()
+
+
+def test_progress_source():
+    t = task.Task(id=None, name="copy")
+    operation = FakeOperation()
+    with t.progress_source(operation):
+        operation.progress = 42.7
+        assert t.progress == 42
+        assert t.getDetails()["progress"] == 42
+        assert t.deprecated_getStatus()["progress"] == 42
+    assert t.progress is None
@@ -0,0 +1,310 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import glob
+import io
+import os
+import threading
+
+import pytest
+
+from vdsm.common import concurrent
+from vdsm.storage import task
+from vdsm.storage import taskManager
+from vdsm.storage import taskjournal
+
+from testlib import make_config
+
+RECORD = {
+    "task": {"id": "task-1", "state": "running", "name": u"\u05d0"},
+    "jobs": [{"name": "job", "runcmd": "cmd"}],
+    "recoveries": [],
+}
+
+
+class FakeOOP(object):
+    """
+    Do the I/O of the journal in this process.
+    """
+
+    def __init__(self):
+        self.glob = glob
+        self.os = os
+        self.fileUtils = self
+        self.fsyncs = 0
+
+    def readFile(self, path):
+        with io.open(path, "rb") as f:
+            return f.read()
+
+    def writeFile(self, path, data):
+        with io.open(path, "wb") as f:
+            f.write(data)
+
+    def fsyncPath(self, path):
+        self.fsyncs += 1
+
+
+@pytest.fixture
+def oop(monkeypatch):
+    fake = FakeOOP()
+    monkeypatch.setattr(taskjournal, "getProcPool", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def store(tmpdir, oop):
+    return str(tmpdir)
+
+
+def segments(store):
+    return glob.glob(os.path.join(store, taskjournal.JOURNAL + ".*"))
+
+
+def test_load_missing(store):
+    journal = taskjournal.open_journal(store)
+    assert journal.load() == {}
+
+
+def test_write_load(store):
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    journal.write("task-1", RECORD)
+    journal.write("task-2", dict(RECORD, jobs=[]))
+
+    records = taskjournal.open_journal(store).load()
+    assert records == {"task-1": RECORD, "task-2": dict(RECORD, jobs=[])}
+
+
+def test_last_record_wins(store):
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    journal.write("task-1", RECORD)
+    finished = dict(RECORD, result={"code": "0"})
+    journal.write("task-1", finished)
+
+    assert taskjournal.open_journal(store).load() == {"task-1": finished}
+
+
+def test_remove(store):
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    journal.write("task-1", RECORD)
+    journal.write("task-2", RECORD)
+    journal.remove("task-1")
+
+    assert taskjournal.open_journal(store).load() == {"task-2": RECORD}
+
+
+def test_skip_bad_records(store):
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    journal.write("task-1", RECORD)
+    with io.open(segments(store)[0], "ab") as f:
+        f.write(b"00000000 {\"id\": \"task-2\"}\n")  # Bad checksum.
+        f.write(b"not a record\n")
+        f.write(b"1234")  # Torn write.
+
+    # The next write must not be corrupted by the torn write.
+    journal = taskjournal.open_journal(store)
+    assert journal.load() == {"task-1": RECORD}
+    journal.write("task-3", RECORD)
+
+    records = taskjournal.open_journal(store).load()
+    assert records == {"task-1": RECORD, "task-3": RECORD}
+
+
+def test_write_error(store):
+    journal = taskjournal.open_journal(os.path.join(store, "missing"))
+    journal.load()
+    with pytest.raises(taskjournal.Error):
+        journal.write("task-1", RECORD)
+
+
+def test_concurrent_writes_batched(store, monkeypatch):
+    journal = taskjournal.open_journal(store, flush_interval=0.1)
+    journal.load()
+    writes = []
+    write = journal._write
+
+    def counting_write(seq, data):
+        writes.append(data)
+        write(seq, data)
+
+    monkeypatch.setattr(journal, "_write", counting_write)
+
+    # Make the next flush wait for the flush interval.
+    journal.write("task-0", RECORD)
+    del writes[:]
+
+    count = 20
+    start = threading.Event()
+
+    def writer(n):
+        start.wait()
+        journal.write("task-%d" % n, RECORD)
+
+    threads = [concurrent.thread(writer, args=(n,)) for n in range(count)]
+    for t in threads:
+        t.start()
+    start.set()
+    for t in threads:
+        t.join()
+
+    assert len(writes) < count
+    records = taskjournal.open_journal(store).load()
+    assert sorted(records) == sorted("task-%d" % n for n in range(count))
+
+
+def test_write_segment(store, oop):
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    journal.write("task-1", RECORD)
+
+    assert len(segments(store)) == 1
+    # The new segment and the store directory.
+    assert oop.fsyncs == 2
+
+
+def test_compact(store, monkeypatch):
+    monkeypatch.setattr(taskjournal, "COMPACT_MIN_SIZE", 4096)
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    for n in range(100):
+        journal.write("task-%d" % (n % 5), dict(RECORD, jobs=[], seq=n))
+    journal.remove("task-0")
+
+    size = sum(os.path.getsize(path) for path in segments(store))
+    assert size < 4096 * 2
+
+    records = taskjournal.open_journal(store).load()
+    assert records == {
+        "task-%d" % n: dict(RECORD, jobs=[], seq=95 + n) for n in range(1, 5)
+    }
+
+
+def test_compact_segments(store, monkeypatch):
+    monkeypatch.setattr(taskjournal, "COMPACT_MAX_SEGMENTS", 10)
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    for n in range(30):
+        journal.write("task-1", dict(RECORD, seq=n))
+
+    assert len(segments(store)) <= 10
+    records = taskjournal.open_journal(store).load()
+    assert records == {"task-1": dict(RECORD, seq=29)}
+
+
+def test_compact_error_backoff(store, oop, monkeypatch):
+    monkeypatch.setattr(taskjournal, "COMPACT_MAX_SEGMENTS", 2)
+    journal = taskjournal.open_journal(store)
+    journal.load()
+    unlinks = []
+
+    def fail_unlink(path):
+        unlinks.append(path)
+        raise OSError("injected error")
+
+    monkeypatch.setattr(oop, "os", FakeOS(fail_unlink))
+    for n in range(10):
+        journal.write("task-%d" % n, RECORD)
+
+    # Compaction failed once, and is not retried on every flush.
+    assert len(unlinks) == 1
+
+    # The journal is still valid.
+    records = taskjournal.open_journal(store).load()
+    assert sorted(records) == ["task-%d" % n for n in range(10)]
+
+
+class FakeOS(object):
+
+    def __init__(self, unlink):
+        self.unlink = unlink
+
+
+def test_get_journal_reuses_instance(store):
+    journal = taskjournal.get_journal(store)
+    assert taskjournal.get_journal(store) is journal
+    assert taskjournal.open_journal(store) is not journal
+
+
+@pytest.fixture
+def use_journal(monkeypatch):
+    cfg = make_config([
+        ("irs", "task_journal", "true"),
+        ("irs", "task_journal_flush_interval", "0"),
+    ])
+    monkeypatch.setattr(task, "config", cfg)
+    monkeypatch.setattr(taskManager, "config", cfg)
+
+
+def test_task_round_trip(store, use_journal):
+    t = task.Task(id=None, name=u"copy \u05d0")
+    t.setPersistence(store, cleanPolicy=task.TaskCleanType.manual)
+    job = task.Job("job", None)
+    job.setOwnerTask(t)
+    t.jobs.append(job)
+    t.state.moveto(task.State.finished, force=True)
+    t._updateResult(0, "OK", "result")
+    t.persist()
+
+    # Load the task from the journal, like vdsm does after a restart.
+    tm = taskManager.TaskManager()
+    tm.loadDumpedTasks(store)
+    loaded, = tm._unqueuedTasks
+    assert loaded.id == t.id
+    assert loaded.name == t.name
+    assert loaded.store == store
+    assert loaded.state == task.State.finished
+    assert loaded.cleanPolicy == task.TaskCleanType.manual
+    assert loaded.result.message == "OK"
+    assert loaded.result.result == "result"
+    assert [j.name for j in loaded.jobs] == ["job"]
+    assert loaded.jobs[0].runcmd == job.runcmd
+
+    # No task directory is created when using the journal.
+    assert os.listdir(store) == [os.path.basename(p) for p in segments(store)]
+
+    loaded.clean()
+    tm = taskManager.TaskManager()
+    tm.loadDumpedTasks(store)
+    assert tm._unqueuedTasks == []
+
+
+def test_task_load_record_twice(use_journal):
+    t = task.Task(id=None)
+    t.state.moveto(task.State.finished, force=True)
+    record = t._record()
+    loaded = task.Task.loadRecord("/store", t.id, record)
+    assert loaded.state == task.State.finished
+    with pytest.raises(task.se.TaskMetaDataLoadError):
+        loaded._loadRecord(record)
+
+
+def test_task_load_record_wrong_id(use_journal):
+    t = task.Task(id=None)
+    record = t._record()
+    other = task.Task(id=None)
+    with pytest.raises(task.se.TaskMetaDataLoadError):
+        other._loadRecord(record)
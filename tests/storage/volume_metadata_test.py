@@ -31,6 +31,8 @@ from vdsm.storage import constants as sc
 from vdsm.storage import exception as se
 from vdsm.storage import image
 from vdsm.storage import volume
+from vdsm.storage.volumemetadata import VolumeInfo
+from vdsm.storage.volumemetadata import VolumesSnapshot
 
 
 MB = 1024 ** 2
@@ -194,3 +196,82 @@ class TestVolumeMetadata(VdsmTestCase):
         lines = make_lines(GEN=None)
         md = volume.VolumeMetadata.from_lines(lines)
         self.assertEqual(sc.DEFAULT_GENERATION, md.generation)
+
+
+LEAF = sc.type2name(sc.LEAF_VOL)
+INTERNAL = sc.type2name(sc.INTERNAL_VOL)
+SHARED = sc.type2name(sc.SHARED_VOL)
+
+
+class TestVolumesSnapshot(VdsmTestCase):
+
+    def setUp(self):
+        # A template image, and an image with a chain based on the template.
+        self.volumes = {
+            "template": VolumeInfo("template-img", sc.BLANK_UUID, SHARED),
+            "base": VolumeInfo("img", "template", INTERNAL),
+            "top": VolumeInfo("img", "base", LEAF),
+        }
+        self.images = {
+            "template-img": ["template"],
+            "img": ["top", "base"],
+        }
+        self.snapshot = VolumesSnapshot("sd", self.volumes, self.images)
+
+    def test_chain(self):
+        self.assertEqual(["base", "top"], self.snapshot.chain("img"))
+
+    def test_chain_from_volume(self):
+        self.assertEqual(["base"], self.snapshot.chain("img", "base"))
+
+    def test_template_chain(self):
+        self.assertEqual(["template"], self.snapshot.chain("template-img"))
+        self.assertEqual(["template"],
+                         self.snapshot.chain("img", "template"))
+
+    def test_children(self):
+        self.assertEqual(["base"], self.snapshot.children("template"))
+        self.assertEqual([], self.snapshot.children("top"))
+
+    def test_missing_image(self):
+        with self.assertRaises(se.ImageDoesNotExistInSD):
+            self.snapshot.chain("no-such-img")
+
+    def test_missing_volume(self):
+        with self.assertRaises(se.VolumeDoesNotExist):
+            self.snapshot.chain("img", "no-such-vol")
+
+    def test_no_leaf(self):
+        self.volumes["top"] = VolumeInfo("img", "base", INTERNAL)
+        snapshot = VolumesSnapshot("sd", self.volumes, self.images)
+        with self.assertRaises(se.ImageIsNotLegalChain):
+            snapshot.chain("img")
+
+    def test_parent_loop(self):
+        self.volumes["base"] = VolumeInfo("img", "top", INTERNAL)
+        snapshot = VolumesSnapshot("sd", self.volumes, self.images)
+        with self.assertRaises(se.ImageIsNotLegalChain):
+            snapshot.chain("img")
+
+    def test_replace_images(self):
+        # "base" was merged into "top"; the template is kept although it was
+        # listed in the image.
+        images = {
+            "img": {
+                "template": self.volumes["template"],
+                "top": VolumeInfo("img", "template", LEAF),
+            },
+        }
+        snapshot = self.snapshot.replace_images(images)
+        self.assertEqual(["top"], snapshot.chain("img"))
+        self.assertNotIn("base", snapshot)
+        self.assertEqual(["template"], snapshot.chain("template-img"))
+        # The original snapshot is not modified.
+        self.assertEqual(["base", "top"], self.snapshot.chain("img"))
+
+    def test_replace_removed_image(self):
+        snapshot = self.snapshot.replace_images({"img": {}})
+        with self.assertRaises(se.ImageDoesNotExistInSD):
+            snapshot.chain("img")
+        self.assertNotIn("top", snapshot)
+        self.assertIn("template", snapshot)
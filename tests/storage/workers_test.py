@@ -0,0 +1,111 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+
+from __future__ import absolute_import
+from __future__ import division
+
+import threading
+
+import pytest
+
+from vdsm.storage import workers
+
+from testlib import make_config
+
+TIMEOUT = 5
+
+
+@pytest.fixture
+def storage_workers(monkeypatch):
+    cfg = make_config([("irs", "thread_pool_size", "2")])
+    monkeypatch.setattr(workers, "config", cfg)
+    monkeypatch.setattr(workers, "_executor", None)
+    yield workers
+    workers.stop()
+
+
+class Blocker(object):
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        self.release.wait(TIMEOUT)
+
+
+def test_reserved_extend_workers(storage_workers):
+    tasks = [Blocker() for i in range(3)]
+    for blocker in tasks:
+        storage_workers.dispatch(blocker, storage_workers.TASK)
+
+    # Only thread_pool_size tasks may run.
+    for blocker in tasks[:2]:
+        assert blocker.started.wait(TIMEOUT)
+    assert not tasks[2].started.wait(0.2)
+
+    # thread_pool_size / 2 workers are reserved for each mailbox.
+    extends = [Blocker() for i in range(2)]
+    for blocker in extends:
+        storage_workers.dispatch(blocker, storage_workers.EXTEND)
+    for blocker in extends:
+        assert blocker.started.wait(TIMEOUT)
+
+    stats = storage_workers.stats()
+    assert stats[storage_workers.TASK]["running"] == 2
+    assert stats[storage_workers.TASK]["queued"] == 1
+    assert stats[storage_workers.EXTEND]["running"] == 2
+
+    for blocker in tasks + extends:
+        blocker.release.set()
+    assert tasks[2].started.wait(TIMEOUT)
+
+
+def test_extend_runs_before_waiting_tasks(storage_workers):
+    blockers = [Blocker() for i in range(4)]
+    for blocker in blockers:
+        storage_workers.dispatch(blocker, storage_workers.EXTEND)
+    for blocker in blockers:
+        assert blocker.started.wait(TIMEOUT)
+
+    # All workers are busy; the extend request queued after the task must
+    # run first.
+    order = []
+    storage_workers.dispatch(lambda: order.append("task"),
+                             storage_workers.TASK)
+    done = threading.Event()
+
+    def extend():
+        order.append("extend")
+        done.set()
+
+    storage_workers.dispatch(extend, storage_workers.EXTEND)
+
+    blockers[0].release.set()
+    assert done.wait(TIMEOUT)
+    for blocker in blockers[1:]:
+        blocker.release.set()
+
+    assert order[0] == "extend"
+
+
+def test_stats_not_started(storage_workers):
+    assert storage_workers.stats() == {}
@@ -1,5 +1,5 @@
 #
-# Copyright 2016 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -64,6 +64,17 @@ class FailingWriter(xlease.DirectFile):
         raise WriteError
 
 
+class CountingWriter(xlease.DirectFile):
+
+    def __init__(self, path):
+        super(CountingWriter, self).__init__(path)
+        self.writes = []
+
+    def pwrite(self, offset, buf):
+        self.writes.append((offset, len(buf)))
+        return super(CountingWriter, self).pwrite(offset, buf)
+
+
 class TestIndex(VdsmTestCase):
 
     @MonkeyPatch(time, 'time', lambda: 123456789)
@@ -310,6 +321,124 @@ class TestIndex(VdsmTestCase):
             self.assertEqual(leases[uuids[2]]["offset"],
                              xlease.USER_RESOURCE_BASE + xlease.SLOT_SIZE * 2)
 
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(3)]
+            leases = vol.add_many(lease_ids)
+            self.assertEqual([info.resource for info in leases], lease_ids)
+            for lease in leases:
+                self.assertEqual(vol.lookup(lease.resource), lease)
+                res = xlease.sanlock.read_resource(lease.path, lease.offset)
+                self.assertEqual(res["resource"], lease.resource)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many_exists(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(3)]
+            vol.add(lease_ids[1])
+            with self.assertRaises(xlease.LeaseExists):
+                vol.add_many(lease_ids)
+            # Nothing was added.
+            self.assertEqual(list(vol.leases()), [lease_ids[1]])
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many_sanlock_failure(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(3)]
+            sanlock = xlease.sanlock
+            write_resource = sanlock.write_resource
+
+            def failing_write_resource(lockspace, resource, disks):
+                if resource == lease_ids[1]:
+                    raise sanlock.SanlockException
+                write_resource(lockspace, resource, disks)
+
+            sanlock.write_resource = failing_write_resource
+            with self.assertRaises(sanlock.SanlockException):
+                vol.add_many(lease_ids)
+            leases = vol.leases()
+            # Leases created before the failure were added.
+            self.assertFalse(leases[lease_ids[0]]["updating"])
+            self.assertTrue(leases[lease_ids[1]]["updating"])
+            self.assertTrue(leases[lease_ids[2]]["updating"])
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_remove_many(self):
+        with make_volume() as vol:
+            lease_ids = [make_uuid() for i in range(4)]
+            vol.add_many(lease_ids)
+            vol.remove_many(lease_ids[1:3])
+            self.assertEqual(sorted(vol.leases()),
+                             sorted([lease_ids[0], lease_ids[3]]))
+            for lease_id in lease_ids[1:3]:
+                with self.assertRaises(xlease.NoSuchLease):
+                    vol.lookup(lease_id)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_remove_many_missing(self):
+        with make_volume() as vol:
+            lease_id = make_uuid()
+            vol.add(lease_id)
+            with self.assertRaises(xlease.NoSuchLease):
+                vol.remove_many([lease_id, make_uuid()])
+            # Nothing was removed.
+            self.assertIn(lease_id, vol.leases())
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_add_many_writes_once(self):
+        with make_volume() as base:
+            file = CountingWriter(base.path)
+            with utils.closing(file):
+                vol = xlease.LeasesVolume(file)
+                with utils.closing(vol):
+                    # Spans 2 index blocks.
+                    vol.add_many([make_uuid() for i in range(10)])
+                    # One write marking the records as updating, and one
+                    # write completing them.
+                    self.assertEqual(len(file.writes), 2)
+                    for offset, size in file.writes:
+                        self.assertEqual(offset % xlease.BLOCK_SIZE, 0)
+                        self.assertEqual(size, 2 * xlease.BLOCK_SIZE)
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_remove_many_writes_changed_blocks(self):
+        records_per_block = xlease.BLOCK_SIZE // xlease.RECORD_SIZE
+        with make_volume() as base:
+            lease_ids = [make_uuid() for i in range(3 * records_per_block)]
+            base.add_many(lease_ids)
+            file = CountingWriter(base.path)
+            with utils.closing(file):
+                vol = xlease.LeasesVolume(file)
+                with utils.closing(vol):
+                    # In the first and the last block; the middle block is
+                    # not modified.
+                    vol.remove_many([lease_ids[0], lease_ids[-1]])
+                    self.assertEqual(len(file.writes), 4)
+                    for offset, size in file.writes:
+                        self.assertEqual(offset % xlease.BLOCK_SIZE, 0)
+                        self.assertEqual(size, xlease.BLOCK_SIZE)
+                    self.assertEqual(sorted(vol.leases()),
+                                     sorted(lease_ids[1:-1]))
+
+    @MonkeyPatch(xlease, "sanlock", FakeSanlock())
+    def test_index_loaded(self):
+        with make_volume() as base:
+            lease_ids = [make_uuid() for i in range(3)]
+            leases = base.add_many(lease_ids)
+            base.remove(lease_ids[0])
+            file = xlease.DirectFile(base.path)
+            with utils.closing(file):
+                vol = xlease.LeasesVolume(file)
+                with utils.closing(vol):
+                    for lease in leases[1:]:
+                        self.assertEqual(vol.lookup(lease.resource), lease)
+                    with self.assertRaises(xlease.NoSuchLease):
+                        vol.lookup(lease_ids[0])
+                    # The free record is reused.
+                    lease = vol.add(make_uuid())
+                    self.assertEqual(lease.offset, leases[0].offset)
+
     @pytest.mark.slow
     def test_time_lookup(self):
         setup = """
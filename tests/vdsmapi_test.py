@@ -1,5 +1,5 @@
 #
-# Copyright 2016-2017 Red Hat, Inc.
+# Copyright 2016-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -20,17 +20,24 @@
 from __future__ import absolute_import
 from __future__ import division
 
+import io
 import json
 import os
 import shutil
 import tempfile
+import threading
+import timeit
 
 from nose.plugins.attrib import attr
+from vdsm.api import schema_to_pickle
 from vdsm.api import vdsmapi
+from vdsm.common.compat import pickle
 from yajsonrpc.exception import JsonRpcErrorBase
 
 from monkeypatch import MonkeyPatch
 from testlib import VdsmTestCase as TestCaseBase
+from testlib import namedTemporaryDir
+from testValidation import slowtest
 
 try:
     import vdsm.gluster.apiwrapper as gapi
@@ -663,4 +670,164 @@ class SchemaTypeTest(TestCaseBase):
         self.assertEqual(vdsmapi.SchemaType.VDSM_API.path(), expected_path)
 
 
+SCHEMA_YAML = b"""
+types:
+    Shared: &Shared
+        name: Shared
+        type: object
+        properties:
+        -   name: value
+            type: string
+
+    Wrapper: &Wrapper
+        name: Wrapper
+        type: object
+        properties:
+        -   name: shared
+            type: *Shared
+
+Test.method:
+    params:
+    -   name: first
+        type: *Shared
+    -   name: second
+        type: *Wrapper
+    return:
+        type: *Shared
+"""
+
+
+@attr(type='unit')
+class SchemaFileTest(TestCaseBase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        yml = os.path.join(self.tmpdir, "test.yml")
+        with io.open(yml, "wb") as f:
+            f.write(SCHEMA_YAML)
+        self.path = os.path.join(self.tmpdir, "test.pickle")
+        schema_to_pickle._dump_pickled_schema(yml, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_names(self):
+        schema_file = vdsmapi._SchemaFile(self.path)
+        self.assertEqual(set(schema_file.method_index), {"Test.method"})
+        self.assertEqual(set(schema_file.type_index), {"Shared", "Wrapper"})
+
+    def test_load_method(self):
+        schema_file = vdsmapi._SchemaFile(self.path)
+        method = schema_file.get_method("Test.method")
+        self.assertEqual(method["params"][0]["name"], "first")
+        self.assertEqual(method["params"][0]["type"]["name"], "Shared")
+        self.assertEqual(method["return"]["type"]["name"], "Shared")
+
+    def test_shared_types(self):
+        # Types are loaded once, and shared by all entries, like the types
+        # loaded from yaml.
+        schema_file = vdsmapi._SchemaFile(self.path)
+        method = schema_file.get_method("Test.method")
+        shared = schema_file.get_type("Shared")
+        wrapper = schema_file.get_type("Wrapper")
+        self.assertIs(method["params"][0]["type"], shared)
+        self.assertIs(method["params"][1]["type"], wrapper)
+        self.assertIs(method["return"]["type"], shared)
+        self.assertIs(wrapper["properties"][0]["type"], shared)
+
+    def test_method_cached(self):
+        schema_file = vdsmapi._SchemaFile(self.path)
+        self.assertIs(schema_file.get_method("Test.method"),
+                      schema_file.get_method("Test.method"))
+
+    def test_type_published_after_loading(self):
+        # Other threads must not see a type before it is loaded.
+        schema_file = vdsmapi._SchemaFile(self.path)
+        load = schema_file._load
+        threads = []
+        result = []
+
+        def get_wrapper():
+            result.append(dict(schema_file.get_type("Wrapper")))
+
+        def racing_load(entry):
+            if entry == schema_file.type_index["Wrapper"] and not threads:
+                t = threading.Thread(target=get_wrapper)
+                t.start()
+                threads.append(t)
+                t.join(0.1)
+            return load(entry)
+
+        schema_file._load = racing_load
+        wrapper = schema_file.get_type("Wrapper")
+        threads[0].join()
+        self.assertEqual(result, [wrapper])
+
+    def test_unpickled_schema(self):
+        # Schema files pickled as one object are loaded eagerly.
+        schema_file = vdsmapi._SchemaFile(self.path)
+        schema = {"types": {"Shared": schema_file.get_type("Shared"),
+                            "Wrapper": schema_file.get_type("Wrapper")},
+                  "Test.method": schema_file.get_method("Test.method")}
+        old_path = os.path.join(self.tmpdir, "old.pickle")
+        with io.open(old_path, "wb") as f:
+            pickle.dump(schema, f, pickle.HIGHEST_PROTOCOL)
+
+        old_file = vdsmapi._SchemaFile(old_path)
+        self.assertEqual(set(old_file.method_index), {"Test.method"})
+        self.assertEqual(old_file.get_method("Test.method"),
+                         schema["Test.method"])
+        self.assertEqual(old_file.get_type("Wrapper"),
+                         schema["types"]["Wrapper"])
+
+
+@attr(type='unit')
+class SchemaLoadingTest(TestCaseBase):
+
+    def test_names(self):
+        schema = vdsmapi.Schema.vdsm_api(strict_mode=True)
+        self.assertIn("Host.getCapabilities", schema.method_names)
+        self.assertIn("BalloonInfo", schema.type_names)
+
+    def test_get_methods(self):
+        schema = vdsmapi.Schema.vdsm_api(strict_mode=True)
+        methods = schema.get_methods
+        self.assertEqual(set(methods), set(schema.method_names))
+        self.assertEqual(
+            methods["Host.getCapabilities"],
+            schema.get_method(vdsmapi.MethodRep("Host", "getCapabilities")))
+
+    def test_get_types(self):
+        schema = vdsmapi.Schema.vdsm_events(strict_mode=True)
+        types = schema.get_types
+        self.assertEqual(set(types), set(schema.type_names))
+
+    @slowtest
+    def test_startup_benchmark(self):
+        path = vdsmapi.SchemaType.VDSM_API.path()
+
+        with namedTemporaryDir() as tmpdir:
+            # The schema pickled as one object, loaded when creating the
+            # schema.
+            schema_file = vdsmapi._SchemaFile(path)
+            eager_schema = {name: schema_file.get_method(name)
+                            for name in schema_file.method_index}
+            eager_schema["types"] = {name: schema_file.get_type(name)
+                                     for name in schema_file.type_index}
+            eager_path = os.path.join(tmpdir, "vdsm-api.pickle")
+            with io.open(eager_path, "wb") as f:
+                pickle.dump(eager_schema, f, pickle.HIGHEST_PROTOCOL)
+
+            def load(path):
+                def run():
+                    vdsmapi._SchemaFile(path).get_method("Host.ping")
+                return min(timeit.repeat(run, number=10, repeat=3)) / 10
+
+            eager = load(eager_path)
+            lazy = load(path)
+
+        print("Schema load time: eager %.6f seconds, lazy %.6f seconds"
+              % (eager, lazy))
+
+
 shutil.rmtree(basedir)
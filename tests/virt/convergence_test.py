@@ -0,0 +1,318 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+
+from vdsm.common.define import Mbytes
+from vdsm.virt import convergence
+
+from testlib import VdsmTestCase as TestCaseBase
+from testValidation import slowtest
+
+GiB = 1024 * Mbytes
+PAGE_SIZE = 4096
+
+FakeProgress = collections.namedtuple("FakeProgress", [
+    "time_elapsed", "data_processed", "data_remaining", "mem_bps",
+    "dirty_rate", "mem_iteration", "mem_page_size"
+])
+
+
+def precopy_trace(memory, bandwidth, dirty_rate, duration=600,
+                  report_rates=True):
+    """
+    Return progress samples taken every second of a pre-copy migration
+    sending memory bytes at bandwidth bytes/s, while the guest dirties
+    dirty_rate bytes/s.
+
+    Like qemu, pages dirtied during an iteration are added to the remaining
+    data when the next iteration starts, and the dirty rate is reported
+    after the first iteration. If report_rates is False, the samples look
+    like samples from libvirt < 1.3.
+    """
+    samples = []
+    remaining = memory
+    dirty = 0
+    processed = 0
+    iteration = 1
+    step = 0.1
+    for i in range(int(duration / step)):
+        sent = min(remaining, bandwidth * step)
+        remaining -= sent
+        processed += sent
+        dirty = min(memory, dirty + dirty_rate * step)
+        if remaining == 0:
+            remaining, dirty = dirty, 0
+            iteration += 1
+        if (i + 1) % 10 == 0:
+            if report_rates:
+                reported_dirty_rate = dirty_rate // PAGE_SIZE \
+                    if iteration > 1 else 0
+            samples.append(FakeProgress(
+                time_elapsed=(i + 1) * step * 1000,
+                data_processed=processed,
+                data_remaining=remaining,
+                mem_bps=bandwidth if report_rates else 0,
+                dirty_rate=reported_dirty_rate if report_rates else -1,
+                mem_iteration=iteration if report_rates else -1,
+                mem_page_size=PAGE_SIZE if report_rates else 0))
+    return samples
+
+
+def stalled_trace(memory, dirty_rate, duration=10):
+    """
+    Return progress samples taken every second of a migration which does
+    not transfer any data, after the first iteration.
+    """
+    return [FakeProgress(time_elapsed=(i + 1) * 1000,
+                         data_processed=0,
+                         data_remaining=memory,
+                         mem_bps=0,
+                         dirty_rate=dirty_rate // PAGE_SIZE,
+                         mem_iteration=2,
+                         mem_page_size=PAGE_SIZE)
+            for i in range(duration)]
+
+
+class EstimatorTests(TestCaseBase):
+
+    def test_reported_rates(self):
+        estimator = convergence.Estimator()
+        for progress in precopy_trace(GiB, 100 * Mbytes, 20 * Mbytes, 20):
+            estimator.update(progress)
+        self.assertTrue(estimator.ready)
+        self.assertEqual(estimator.transfer_rate, 100 * Mbytes)
+        self.assertEqual(estimator.dirty_rate, 20 * Mbytes)
+
+    def test_not_ready_before_first_iteration(self):
+        estimator = convergence.Estimator()
+        for progress in precopy_trace(GiB, 100 * Mbytes, 20 * Mbytes, 10):
+            estimator.update(progress)
+        self.assertFalse(estimator.ready)
+
+    def test_not_ready_before_first_iteration_computed(self):
+        estimator = convergence.Estimator()
+        for progress in precopy_trace(GiB, 100 * Mbytes, 20 * Mbytes, 10,
+                                      report_rates=False):
+            estimator.update(progress)
+        self.assertFalse(estimator.ready)
+
+    def test_not_ready_without_transfer(self):
+        estimator = convergence.Estimator()
+        for progress in stalled_trace(GiB, 20 * Mbytes):
+            estimator.update(progress)
+        self.assertEqual(estimator.transfer_rate, 0)
+        self.assertFalse(estimator.ready)
+
+    def test_computed_rates(self):
+        estimator = convergence.Estimator()
+        for progress in precopy_trace(GiB, 100 * Mbytes, 50 * Mbytes, 20,
+                                      report_rates=False):
+            estimator.update(progress)
+        self.assertTrue(estimator.ready)
+        self.assertAlmostEqual(estimator.transfer_rate, 100 * Mbytes,
+                               delta=Mbytes)
+        self.assertAlmostEqual(estimator.dirty_rate, 50 * Mbytes,
+                               delta=10 * Mbytes)
+
+    def test_time_to_converge(self):
+        estimator = convergence.Estimator()
+        estimator.transfer_rate = 100 * Mbytes
+        estimator.dirty_rate = 50 * Mbytes
+        # Can send 50 MiB now with 500 ms downtime.
+        self.assertEqual(estimator.time_to_converge(50 * Mbytes, 500), 0)
+        # Need to send 1000 MiB more at 50 MiB/s.
+        self.assertEqual(estimator.time_to_converge(1050 * Mbytes, 500), 20)
+
+    def test_never_converge(self):
+        estimator = convergence.Estimator()
+        estimator.transfer_rate = 100 * Mbytes
+        estimator.dirty_rate = 150 * Mbytes
+        self.assertIsNone(estimator.time_to_converge(1050 * Mbytes, 500))
+
+    def test_required_downtime(self):
+        estimator = convergence.Estimator()
+        estimator.transfer_rate = 100 * Mbytes
+        estimator.dirty_rate = 50 * Mbytes
+        self.assertEqual(estimator.required_downtime(1000 * Mbytes), 0)
+        self.assertEqual(estimator.required_downtime(1000 * Mbytes, 10), 5000)
+        self.assertEqual(estimator.required_downtime(1000 * Mbytes, 30), 0)
+
+    def test_required_downtime_not_converging(self):
+        estimator = convergence.Estimator()
+        estimator.transfer_rate = 100 * Mbytes
+        estimator.dirty_rate = 150 * Mbytes
+        self.assertEqual(estimator.required_downtime(50 * Mbytes), 500)
+        self.assertEqual(estimator.required_downtime(50 * Mbytes, 30), 500)
+
+
+class ControllerTests(TestCaseBase):
+
+    def run_controller(self, controller, samples):
+        actions = []
+        for progress in samples:
+            actions.extend(controller.step(progress))
+        return actions
+
+    def test_initial_actions(self):
+        controller = convergence.Controller(100, 500)
+        self.assertEqual(controller.initial_actions(),
+                         [{"name": convergence.SET_DOWNTIME,
+                           "params": [100]}])
+
+    def test_converging(self):
+        controller = convergence.Controller(100, 500)
+        samples = precopy_trace(GiB, 100 * Mbytes, 20 * Mbytes, 30)
+        self.assertEqual(self.run_controller(controller, samples), [])
+
+    def test_increase_downtime(self):
+        # Converges too slowly to finish in time with 100 ms downtime.
+        controller = convergence.Controller(100, 1000, max_time=20)
+        samples = precopy_trace(GiB, 100 * Mbytes, 50 * Mbytes, 20)
+        actions = self.run_controller(controller, samples)
+        self.assertTrue(actions)
+        downtimes = [a["params"][0] for a in actions]
+        self.assertEqual(downtimes, sorted(downtimes))
+        self.assertTrue(all(a["name"] == convergence.SET_DOWNTIME
+                            for a in actions))
+        self.assertLessEqual(controller.downtime, 1000)
+
+    def test_abort_early(self):
+        controller = convergence.Controller(100, 500, max_time=120)
+        samples = precopy_trace(4 * GiB, 100 * Mbytes, 200 * Mbytes, 120)
+        actions = self.run_controller(controller, samples)
+        self.assertEqual(actions[-1]["name"], convergence.ABORT)
+        self.assertEqual(controller.downtime, 500)
+
+    def test_no_abort_without_max_time(self):
+        controller = convergence.Controller(100, 500)
+        samples = precopy_trace(4 * GiB, 100 * Mbytes, 200 * Mbytes, 120)
+        actions = self.run_controller(controller, samples)
+        self.assertEqual([a["name"] for a in actions],
+                         [convergence.SET_DOWNTIME])
+
+    def test_post_copy(self):
+        controller = convergence.Controller(100, 500, post_copy=True)
+        samples = precopy_trace(4 * GiB, 100 * Mbytes, 200 * Mbytes, 120)
+        actions = []
+        for progress in samples:
+            actions.extend(controller.step(progress))
+            if actions and actions[-1]["name"] == convergence.POST_COPY:
+                # No more steps after switching to post-copy.
+                break
+        self.assertEqual(actions[-1]["name"], convergence.POST_COPY)
+        self.assertNotIn(convergence.ABORT, [a["name"] for a in actions])
+
+    def test_post_copy_failed(self):
+        # Steps after requesting post-copy mean that the migration is still
+        # in pre-copy.
+        controller = convergence.Controller(100, 500, post_copy=True)
+        samples = precopy_trace(4 * GiB, 100 * Mbytes, 200 * Mbytes, 120)
+        names = [a["name"] for a in self.run_controller(controller, samples)]
+        post_copy = names.index(convergence.POST_COPY)
+        self.assertEqual(names[post_copy + 1:], [convergence.ABORT])
+
+    def test_stalled(self):
+        controller = convergence.Controller(100, 500, max_time=5)
+        actions = self.run_controller(controller,
+                                      stalled_trace(GiB, 20 * Mbytes))
+        self.assertEqual(actions, [])
+
+    def test_patience(self):
+        controller = convergence.Controller(100, 500, post_copy=True,
+                                            patience=1000)
+        samples = precopy_trace(4 * GiB, 100 * Mbytes, 200 * Mbytes, 120)
+        actions = self.run_controller(controller, samples)
+        self.assertNotIn(convergence.POST_COPY, [a["name"] for a in actions])
+
+
+class ReplayTests(TestCaseBase):
+
+    def test_completed(self):
+        samples = precopy_trace(GiB, 100 * Mbytes, 20 * Mbytes)
+        result = convergence.replay(samples,
+                                    convergence.Controller(500, 500))
+        self.assertEqual(result.outcome, convergence.COMPLETED)
+        self.assertLessEqual(result.downtime, 500)
+        # The first iteration takes about 10 seconds.
+        self.assertGreater(result.time, 10)
+        self.assertLess(result.time, 20)
+
+    def test_downtime_increased(self):
+        samples = precopy_trace(GiB, 100 * Mbytes, 50 * Mbytes, 15)
+        fixed = convergence.replay(samples, convergence.Controller(100, 100))
+        self.assertEqual(fixed.outcome, convergence.UNFINISHED)
+
+        model = convergence.replay(
+            samples, convergence.Controller(100, 5000, max_time=15))
+        self.assertEqual(model.outcome, convergence.COMPLETED)
+        self.assertLessEqual(model.downtime, 5000)
+
+    def test_aborted(self):
+        samples = precopy_trace(4 * GiB, 100 * Mbytes, 200 * Mbytes)
+        result = convergence.replay(
+            samples, convergence.Controller(100, 500, max_time=300))
+        self.assertEqual(result.outcome, convergence.ABORTED)
+        self.assertLess(result.time, 300)
+
+    def test_post_copy(self):
+        samples = precopy_trace(4 * GiB, 100 * Mbytes, 200 * Mbytes)
+        result = convergence.replay(
+            samples, convergence.Controller(100, 500, post_copy=True))
+        self.assertEqual(result.outcome, convergence.POST_COPY_COMPLETED)
+
+    def test_stalled(self):
+        result = convergence.replay(stalled_trace(GiB, 20 * Mbytes),
+                                    convergence.Controller(100, 500))
+        self.assertEqual(result.outcome, convergence.UNFINISHED)
+
+    def test_unfinished(self):
+        result = convergence.replay([], convergence.Controller(100, 500))
+        self.assertEqual(result.outcome, convergence.UNFINISHED)
+
+    @slowtest
+    def test_benchmark(self):
+        # Migrations of 4 GiB VMs at 100 MiB/s, with a limit of 256 seconds
+        # (migration_max_time_per_gib_mem), and downtime up to 500 ms. The
+        # fixed policy uses 500 ms downtime from the start, and does not
+        # abort early.
+        max_time = 256
+        policies = [
+            ("fixed", lambda: convergence.Controller(500, 500)),
+            ("model", lambda: convergence.Controller(100, 500,
+                                                     max_time=max_time)),
+        ]
+        for name, controller in policies:
+            outcomes = collections.Counter()
+            total_time = 0
+            downtimes = []
+            for dirty_mb in range(0, 200, 10):
+                samples = precopy_trace(4 * GiB, 100 * Mbytes,
+                                        dirty_mb * Mbytes, max_time)
+                result = convergence.replay(samples, controller())
+                outcomes[result.outcome] += 1
+                total_time += result.time
+                if result.outcome == convergence.COMPLETED:
+                    downtimes.append(result.downtime)
+            print("%s: %s, total time %.0f seconds, average downtime %.0f ms"
+                  % (name, dict(outcomes), total_time,
+                     sum(downtimes) / len(downtimes)))
@@ -0,0 +1,487 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+import random
+import threading
+
+from vdsm.common import concurrent
+from vdsm.virt import migrationqueue
+
+from testlib import VdsmTestCase as TestCaseBase
+from testValidation import slowtest
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class FakeJob(object):
+
+    def __init__(self, vm_id, mem_size, max_bandwidth=100, dirty_rate=None,
+                 hibernating=False):
+        self.vm_id = vm_id
+        self.mem_size = mem_size
+        self.max_bandwidth = max_bandwidth
+        self.dirty_rate = dirty_rate
+        self.hibernating = hibernating
+        self.remaining = None
+        self.fail = False
+
+    def set_max_bandwidth(self, bandwidth):
+        if self.fail:
+            raise RuntimeError("Migration finished")
+        self.max_bandwidth = bandwidth
+
+
+class AdmissionTests(TestCaseBase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def scheduler(self, bound=1, bandwidth=0):
+        return migrationqueue.Scheduler(bound=bound, bandwidth=bandwidth,
+                                        clock=self.clock)
+
+    def run_all(self, sched, count):
+        """
+        Run count queued jobs, releasing each job after it was admitted,
+        and return the ids of the admitted jobs.
+        """
+        sched.admit()
+        order = []
+        for _ in range(count):
+            running = sched.info()["running"]
+            self.assertEqual(len(running), 1)
+            order.append(running[0]["vmId"])
+            job, = [j for j in self.jobs if j.vm_id == order[-1]]
+            sched.release(job)
+        return order
+
+    def test_shortest_first(self):
+        sched = self.scheduler()
+        self.jobs = [FakeJob("large", 8192), FakeJob("small", 1024),
+                     FakeJob("medium", 4096)]
+        for job in self.jobs:
+            sched.enqueue(job)
+        self.assertEqual(self.run_all(sched, 3), ["small", "medium", "large"])
+
+    def test_dirty_rate(self):
+        # Sending 2048 MiB at 100 MiB/s takes less time than sending 1024 MiB
+        # at 100 MiB/s when the VM dirties 90 MiB/s.
+        sched = self.scheduler()
+        busy = FakeJob("busy", 1024, dirty_rate=90)
+        idle = FakeJob("idle", 2048, dirty_rate=0)
+        sched.enqueue(busy)
+        sched.enqueue(idle)
+        self.assertEqual(sched.admit(), [idle])
+
+    def test_dirty_rate_remembered(self):
+        sched = self.scheduler()
+        busy = FakeJob("busy", 1024, dirty_rate=90)
+        sched.enqueue(busy)
+        sched.admit()
+        sched.release(busy)
+
+        # Migrating the same VM again, before its dirty rate is known.
+        busy = FakeJob("busy", 1024)
+        idle = FakeJob("idle", 2048)
+        sched.enqueue(busy)
+        sched.enqueue(idle)
+        self.assertEqual(sched.admit(), [idle])
+
+    def test_not_converging_last(self):
+        sched = self.scheduler()
+        busy = FakeJob("busy", 1024, dirty_rate=200)
+        large = FakeJob("large", 16384)
+        sched.enqueue(busy)
+        sched.enqueue(large)
+        self.assertEqual(sched.admit(), [large])
+
+    def test_unlimited_bandwidth_smaller_first(self):
+        sched = self.scheduler()
+        large = FakeJob("large", 2048, max_bandwidth=0)
+        small = FakeJob("small", 1024, max_bandwidth=0)
+        sched.enqueue(large)
+        sched.enqueue(small)
+        self.assertEqual(sched.admit(), [small])
+
+    def test_arrival_order(self):
+        sched = self.scheduler()
+        self.jobs = [FakeJob(str(i), 1024) for i in range(3)]
+        for job in self.jobs:
+            sched.enqueue(job)
+        self.assertEqual(self.run_all(sched, 3), ["0", "1", "2"])
+
+    def test_aging(self):
+        sched = self.scheduler()
+        running = FakeJob("running", 1024)
+        sched.enqueue(running)
+        sched.admit()
+        large = FakeJob("large", 8192)
+        sched.enqueue(large)
+        # After waiting longer than the difference between the estimated
+        # times, the large job is not delayed by new smaller jobs.
+        self.clock.time = 80
+        sched.enqueue(FakeJob("small", 1024))
+        sched.release(running)
+        self.assertEqual(sched.info()["running"][0]["vmId"], "large")
+
+    def test_aging_not_converging(self):
+        sched = self.scheduler()
+        running = FakeJob("running", 1024)
+        sched.enqueue(running)
+        sched.admit()
+        busy = FakeJob("busy", 1024, dirty_rate=200)
+        sched.enqueue(busy)
+        # A job which cannot converge is not delayed forever by new jobs.
+        self.clock.time = migrationqueue.Scheduler._MAX_ESTIMATE
+        sched.enqueue(FakeJob("small", 1024))
+        sched.release(running)
+        self.assertEqual(sched.info()["running"][0]["vmId"], "busy")
+
+    def test_bound(self):
+        sched = self.scheduler(bound=2)
+        jobs = [FakeJob(str(i), 1024) for i in range(3)]
+        for job in jobs:
+            sched.enqueue(job)
+        self.assertEqual(sched.admit(), jobs[:2])
+        self.assertEqual(sched.admit(), [])
+        sched.release(jobs[0])
+        self.assertEqual(len(sched.info()["running"]), 2)
+
+    def test_increase_bound(self):
+        sched = self.scheduler(bound=1)
+        jobs = [FakeJob(str(i), 1024) for i in range(3)]
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        sched.bound = 3
+        self.assertEqual(len(sched.info()["running"]), 3)
+
+    def test_decrease_bound(self):
+        sched = self.scheduler(bound=2)
+        jobs = [FakeJob(str(i), 1024) for i in range(3)]
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        sched.bound = 1
+        sched.release(jobs[0])
+        self.assertEqual(len(sched.info()["running"]), 1)
+        sched.release(jobs[1])
+        self.assertEqual(sched.info()["running"][0]["vmId"], "2")
+
+    def test_schedule_waits(self):
+        sched = migrationqueue.Scheduler(bound=1)
+        first = FakeJob("first", 1024)
+        second = FakeJob("second", 1024)
+        admitted = threading.Event()
+
+        def migrate():
+            with sched.schedule(second):
+                admitted.set()
+
+        with sched.schedule(first):
+            t = concurrent.thread(migrate)
+            t.start()
+            self.assertFalse(admitted.wait(0.2))
+        self.assertTrue(admitted.wait(2))
+        t.join()
+        info = sched.info()
+        self.assertEqual(info["running"], [])
+        self.assertEqual(info["waiting"], [])
+
+    def test_info(self):
+        sched = self.scheduler(bound=1, bandwidth=100)
+        running = FakeJob("running", 1024, dirty_rate=20)
+        running.remaining = 800
+        waiting = FakeJob("waiting", 2048)
+        sched.enqueue(running)
+        sched.admit()
+        sched.enqueue(waiting)
+        self.clock.time = 10
+        self.assertEqual(sched.info(), {
+            "limit": 1,
+            "bandwidth": 100,
+            "running": [{
+                "vmId": "running",
+                "memSize": 1024,
+                "maxBandwidth": 100,
+                "dirtyRate": 20,
+                "runTime": 10,
+                "estimatedTime": 10,
+            }],
+            "waiting": [{
+                "vmId": "waiting",
+                "memSize": 2048,
+                "maxBandwidth": 100,
+                "waitTime": 10,
+                "estimatedTime": 20,
+            }],
+        })
+
+    def test_info_unknown_time(self):
+        sched = self.scheduler(bound=0)
+        sched.enqueue(FakeJob("busy", 1024, dirty_rate=200))
+        waiting = sched.info()["waiting"]
+        self.assertEqual(waiting[0]["estimatedTime"], migrationqueue.UNKNOWN)
+
+
+class BandwidthTests(TestCaseBase):
+
+    def test_disabled(self):
+        sched = migrationqueue.Scheduler(bound=2)
+        jobs = [FakeJob(str(i), 1024, max_bandwidth=52) for i in range(2)]
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        self.assertEqual([j.max_bandwidth for j in jobs], [52, 52])
+
+    def test_single_job_uses_all(self):
+        sched = migrationqueue.Scheduler(bound=2, bandwidth=1000)
+        job = FakeJob("job", 1024, max_bandwidth=52)
+        sched.enqueue(job)
+        sched.admit()
+        self.assertEqual(job.max_bandwidth, 1000)
+
+    def test_equal_shares(self):
+        sched = migrationqueue.Scheduler(bound=4, bandwidth=1000)
+        jobs = [FakeJob(str(i), 1024) for i in range(4)]
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        self.assertEqual([j.max_bandwidth for j in jobs], [250] * 4)
+
+    def test_dirty_rate_shares(self):
+        sched = migrationqueue.Scheduler(bound=2, bandwidth=1000)
+        busy = FakeJob("busy", 1024)
+        idle = FakeJob("idle", 1024)
+        sched.enqueue(busy)
+        sched.enqueue(idle)
+        sched.admit()
+        busy.dirty_rate = 400
+        idle.dirty_rate = 0
+        sched.update()
+        self.assertEqual(busy.max_bandwidth, 700)
+        self.assertEqual(idle.max_bandwidth, 300)
+
+    def test_oversubscribed(self):
+        sched = migrationqueue.Scheduler(bound=2, bandwidth=100)
+        jobs = [FakeJob(str(i), 1024) for i in range(2)]
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        jobs[0].dirty_rate = 150
+        jobs[1].dirty_rate = 50
+        sched.update()
+        self.assertEqual([j.max_bandwidth for j in jobs], [75, 25])
+
+    def test_release_redistributes(self):
+        sched = migrationqueue.Scheduler(bound=2, bandwidth=1000)
+        jobs = [FakeJob(str(i), 1024) for i in range(2)]
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        sched.release(jobs[0])
+        self.assertEqual(jobs[1].max_bandwidth, 1000)
+
+    def test_changed_bandwidth_kept(self):
+        sched = migrationqueue.Scheduler(bound=2, bandwidth=1000)
+        jobs = [FakeJob(str(i), 1024) for i in range(2)]
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        # Changed by Engine.
+        jobs[0].set_max_bandwidth(100)
+        sched.update()
+        self.assertEqual([j.max_bandwidth for j in jobs], [100, 900])
+
+    def test_hibernation_not_managed(self):
+        sched = migrationqueue.Scheduler(bound=2, bandwidth=1000)
+        migration = FakeJob("migration", 1024)
+        hibernation = FakeJob("hibernation", 1024, max_bandwidth=52,
+                              hibernating=True)
+        sched.enqueue(migration)
+        sched.enqueue(hibernation)
+        sched.admit()
+        self.assertEqual(migration.max_bandwidth, 1000)
+        self.assertEqual(hibernation.max_bandwidth, 52)
+
+    def test_set_bandwidth_failure(self):
+        sched = migrationqueue.Scheduler(bound=2, bandwidth=1000)
+        jobs = [FakeJob(str(i), 1024) for i in range(2)]
+        jobs[0].fail = True
+        for job in jobs:
+            sched.enqueue(job)
+        sched.admit()
+        self.assertEqual(jobs[1].max_bandwidth, 500)
+        jobs[0].fail = False
+        sched.update()
+        self.assertEqual(jobs[0].max_bandwidth, 500)
+
+
+# Evacuation simulation.
+
+DOWNTIME = 0.5  # seconds
+MAX_TIME_PER_GIB = 64  # seconds
+
+
+class SimulatedJob(FakeJob):
+
+    def __init__(self, vm_id, mem_size, max_bandwidth, dirty_rate):
+        super(SimulatedJob, self).__init__(vm_id, mem_size, max_bandwidth)
+        self.actual_dirty_rate = dirty_rate
+        self.sent = 0
+        self.time = 0
+
+    def step(self, dt):
+        """
+        Migrate for dt seconds, and return True if the migration has
+        finished.
+        """
+        if self.remaining is None:
+            self.remaining = self.mem_size
+        self.time += dt
+        self.sent += self.max_bandwidth * dt
+        self.remaining += (self.actual_dirty_rate - self.max_bandwidth) * dt
+        self.remaining = min(max(0, self.remaining), self.mem_size)
+        # Reported after the first iteration.
+        if self.sent >= self.mem_size:
+            self.dirty_rate = self.actual_dirty_rate
+        return self.remaining <= self.max_bandwidth * DOWNTIME
+
+    @property
+    def timed_out(self):
+        return self.time > MAX_TIME_PER_GIB * self.mem_size / 1024
+
+
+class FifoQueue(object):
+    """
+    Outgoing migrations before the scheduler: arrival order, each migration
+    using its own maximum bandwidth.
+    """
+
+    def __init__(self, bound):
+        self._bound = bound
+        self._waiting = collections.deque()
+        self._running = []
+
+    def enqueue(self, job):
+        self._waiting.append(job)
+
+    def admit(self):
+        admitted = []
+        while self._waiting and len(self._running) < self._bound:
+            job = self._waiting.popleft()
+            self._running.append(job)
+            admitted.append(job)
+        return admitted
+
+    def release(self, job):
+        self._running.remove(job)
+        self.admit()
+
+    def update(self):
+        pass
+
+    def info(self):
+        return {"running": [{"vmId": job.vm_id} for job in self._running]}
+
+
+def evacuate(queue, jobs, clock, dt=0.5):
+    """
+    Return the time to migrate jobs using queue, the number of failed
+    migrations and the average migration completion time.
+    """
+    jobs_by_id = {job.vm_id: job for job in jobs}
+    now = 0
+    failed = 0
+    completion = []
+    for job in jobs:
+        queue.enqueue(job)
+    queue.admit()
+    while True:
+        running = [jobs_by_id[entry["vmId"]]
+                   for entry in queue.info()["running"]]
+        if not running:
+            break
+        now += dt
+        clock.time = now
+        for job in running:
+            done = job.step(dt)
+            if done or job.timed_out:
+                if not done:
+                    failed += 1
+                completion.append(now)
+                queue.release(job)
+        queue.update()
+    return now, failed, sum(completion) / len(completion)
+
+
+class EvacuationTests(TestCaseBase):
+
+    BOUND = 4
+    BANDWIDTH = 1000
+
+    def vms(self, count):
+        rand = random.Random(42)
+        return [(rand.choice([1024, 2048, 4096, 8192, 16384]),
+                 rand.choice([0, 10, 50, 100, 200, 300]))
+                for _ in range(count)]
+
+    def run_fifo(self, vms):
+        jobs = [SimulatedJob(str(i), mem, self.BANDWIDTH // self.BOUND, dirty)
+                for i, (mem, dirty) in enumerate(vms)]
+        return evacuate(FifoQueue(self.BOUND), jobs, FakeClock())
+
+    def run_scheduler(self, vms):
+        jobs = [SimulatedJob(str(i), mem, self.BANDWIDTH // self.BOUND, dirty)
+                for i, (mem, dirty) in enumerate(vms)]
+        clock = FakeClock()
+        sched = migrationqueue.Scheduler(bound=self.BOUND,
+                                         bandwidth=self.BANDWIDTH,
+                                         clock=clock)
+        return evacuate(sched, jobs, clock)
+
+    def test_evacuation(self):
+        vms = self.vms(10)
+        fifo_time, fifo_failed, _ = self.run_fifo(vms)
+        sched_time, sched_failed, _ = self.run_scheduler(vms)
+        self.assertLessEqual(sched_failed, fifo_failed)
+        self.assertLess(sched_time, fifo_time)
+
+    @slowtest
+    def test_benchmark(self):
+        # Evacuating 100 VMs with 4 concurrent migrations, over 1000 MiB/s.
+        # Before the scheduler, Engine gives each migration 1/4 of the
+        # bandwidth.
+        vms = self.vms(100)
+        for name, run in (("fifo", self.run_fifo),
+                          ("scheduler", self.run_scheduler)):
+            total, failed, average = run(vms)
+            print("%s: evacuation time %.0f seconds, %d failed, average "
+                  "completion %.0f seconds" % (name, total, failed, average))
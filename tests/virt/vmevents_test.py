@@ -0,0 +1,164 @@
+#
+# Copyright 2018 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+# Refer to the README and COPYING files for full details of the license
+#
+from __future__ import absolute_import
+from __future__ import division
+
+import collections
+
+from vdsm.virt import vmevents
+
+from fakelib import FakeNotifier
+from fakelib import FakeScheduler
+from testlib import VdsmTestCase as TestCaseBase
+
+
+class AggregatorTests(TestCaseBase):
+
+    def setUp(self):
+        self.notifier = FakeNotifier()
+        self.scheduler = FakeScheduler()
+        self.aggregator = vmevents.Aggregator(
+            self.notifier.notify, self.scheduler, 0.5)
+
+    def run_scheduled(self):
+        calls = self.scheduler.calls
+        self.scheduler.calls = []
+        for delay, func in calls:
+            func()
+
+    def test_send_immediately(self):
+        aggregator = vmevents.Aggregator(self.notifier.notify, None, 0.5)
+        aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+
+        self.assertEqual(self.notifier.calls, [
+            ('|virt|VM_status|vm-1', {'vm-1': {'status': 'Up'}}),
+        ])
+
+    def test_window_disabled(self):
+        aggregator = vmevents.Aggregator(
+            self.notifier.notify, self.scheduler, 0)
+        aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+
+        self.assertEqual(self.scheduler.calls, [])
+        self.assertEqual(len(self.notifier.calls), 1)
+
+    def test_latest_wins(self):
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Powering up'})
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+        self.assertEqual(self.notifier.calls, [])
+
+        self.run_scheduled()
+        self.assertEqual(self.notifier.calls, [
+            ('|virt|VM_status|vm-1', {'vm-1': {'status': 'Up'}}),
+        ])
+
+    def test_merge_fields(self):
+        # A status event holds only the fields sent by the caller; the pause
+        # reason sent before must not be lost.
+        self.aggregator.send('VM_status', 'vm-1',
+                             {'status': 'Paused', 'pauseCode': 'EIO'})
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Paused'})
+        self.run_scheduled()
+
+        self.assertEqual(self.notifier.calls, [
+            ('|virt|VM_status|vm-1', {'vm-1': {'status': 'Paused',
+                                               'pauseCode': 'EIO'}}),
+        ])
+
+    def test_batch_vms(self):
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Paused'})
+        self.aggregator.send('VM_status', 'vm-2', {'status': 'Paused'})
+        self.aggregator.send('VM_migration_status', 'vm-3', {'progress': 10})
+
+        # One flush is scheduled for the window.
+        self.assertEqual([delay for delay, _ in self.scheduler.calls], [0.5])
+
+        self.run_scheduled()
+        self.assertEqual(self.notifier.calls, [
+            ('|virt|VM_status|vm-1', {'vm-1': {'status': 'Paused'},
+                                      'vm-2': {'status': 'Paused'}}),
+            ('|virt|VM_migration_status|vm-3', {'vm-3': {'progress': 10}}),
+        ])
+
+    def test_new_window_after_flush(self):
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+        self.run_scheduled()
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Down'})
+        self.run_scheduled()
+
+        self.assertEqual(self.notifier.calls, [
+            ('|virt|VM_status|vm-1', {'vm-1': {'status': 'Up'}}),
+            ('|virt|VM_status|vm-1', {'vm-1': {'status': 'Down'}}),
+        ])
+
+    def test_flush(self):
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+        self.aggregator.flush()
+        self.assertEqual(len(self.notifier.calls), 1)
+
+        # The scheduled flush was cancelled.
+        self.run_scheduled()
+        self.assertEqual(len(self.notifier.calls), 1)
+
+    def test_coalesce_single_vm_only(self):
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+        self.run_scheduled()
+        self.aggregator.send('VM_status', 'vm-1', {'status': 'Paused'})
+        self.aggregator.send('VM_status', 'vm-2', {'status': 'Paused'})
+        self.run_scheduled()
+
+        self.assertEqual(self.notifier.coalesce, [True, False])
+
+    def test_batches_with_same_first_vm(self):
+        # Simulate the client event queue, replacing queued events with the
+        # same key.
+        queue = collections.OrderedDict()
+
+        def notify(event_id, params, coalesce=True):
+            key = event_id if coalesce else object()
+            queue.pop(key, None)
+            queue[key] = params
+
+        aggregator = vmevents.Aggregator(notify, self.scheduler, 0.5)
+        aggregator.send('VM_status', 'vm-1', {'status': 'Paused'})
+        aggregator.send('VM_status', 'vm-2', {'status': 'Paused'})
+        self.run_scheduled()
+        aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+        aggregator.send('VM_status', 'vm-3', {'status': 'Up'})
+        self.run_scheduled()
+
+        # The second batch must not replace the first one; the update of
+        # vm-2 would be lost.
+        self.assertEqual(list(queue.values()), [
+            {'vm-1': {'status': 'Paused'}, 'vm-2': {'status': 'Paused'}},
+            {'vm-1': {'status': 'Up'}, 'vm-3': {'status': 'Up'}},
+        ])
+
+    def test_notify_error(self):
+        def notify(event_id, params, coalesce=True):
+            raise RuntimeError("No connection")
+
+        aggregator = vmevents.Aggregator(notify, self.scheduler, 0.5)
+        aggregator.send('VM_status', 'vm-1', {'status': 'Up'})
+        self.run_scheduled()
+
+        # Events sent after the failure use a new window.
+        aggregator.send('VM_status', 'vm-1', {'status': 'Down'})
+        self.assertEqual(len(self.scheduler.calls), 1)
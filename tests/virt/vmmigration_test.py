@@ -1,5 +1,5 @@
 #
-# Copyright 2014-2017 Red Hat, Inc.
+# Copyright 2014-2018 Red Hat, Inc.
 #
 # This program is free software; you can redistribute it and/or modify
 # it under the terms of the GNU General Public License as published by
@@ -34,6 +34,7 @@ from six.moves import zip
 from vdsm.common import exception
 from vdsm.common import response
 from vdsm.config import config
+from vdsm.virt import convergence
 from vdsm.virt import migration
 from vdsm.virt import vmstatus
 
@@ -376,12 +377,14 @@ class FakeProgress(object):
 
     def __init__(self):
         self.percentage = 0
+        self.data_remaining = 0
 
 
 class FakeMonitorThread(object):
 
     def __init__(self, prog):
         self.progress = prog
+        self.estimator = convergence.Estimator()
 
 
 def make_env(mode=migration.MODE_REMOTE):
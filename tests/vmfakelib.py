@@ -72,9 +72,11 @@ class IRS(object):
 class _Server(object):
     def __init__(self, notifications):
         self.notifications = notifications
+        self.keys = []
 
-    def send(self, message, address):
+    def send(self, message, address, key=None):
         self.notifications.append((message, address))
+        self.keys.append(key)
 
 
 class _Reactor(object):